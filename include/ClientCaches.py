@@ -10,11 +10,14 @@ import HydrusFileHandling
 import HydrusImageHandling
 import HydrusPaths
 import HydrusSessions
+import HydrusThreading
+import bisect
 import itertools
 import os
 import random
 import Queue
 import shutil
+import string
 import threading
 import time
 import urllib
@@ -28,6 +31,8 @@ import HydrusTags
 import itertools
 import traceback
 
+FILE_MAINTENANCE_BATCH_SIZE = 256
+
 # important thing here, and reason why it is recursive, is because we want to preserve the parent-grandparent interleaving
 def BuildServiceKeysToChildrenToParents( service_keys_to_simple_children_to_parents ):
     
@@ -195,11 +200,367 @@ class ClientFilesManager( object ):
         
         self._prefixes_to_locations = {}
         
+        self._prefixes_to_thumbnail_packs = {}
+        
+        # filled in as files are added and found, so a hash we have seen before does not need every possible extension checked
+        self._hashes_to_mimes = {}
+        
+        self._thumbnail_prefixes_checked_for_migration = set()
+        self._thumbnail_prefixes_checked_for_packing = None
+        
         self._bad_error_occured = False
         
+        self._file_maintenance_throttle = ClientThreading.FileMaintenanceThrottle( controller )
+        self._file_maintenance_jobs_running = set()
+        
         self._Reinit()
         
     
+    def _CheckFileIntegrity( self, row, mode, move_location, job_key ):
+        
+        ( hash_id, hash, mime ) = row
+        
+        try:
+            
+            path = self.GetFilePath( hash, mime )
+            
+        except HydrusExceptions.FileMissingException:
+            
+            HydrusData.Print( 'Could not find the file for ' + hash.encode( 'hex' ) + '!' )
+            
+            return 'missing'
+            
+        
+        if mode == 'thorough':
+            
+            actual_hash = HydrusFileHandling.GetHashFromPath( path )
+            
+            self._file_maintenance_throttle.Consume( os.path.getsize( path ), job_key )
+            
+            if actual_hash != hash:
+                
+                if move_location is not None:
+                    
+                    move_filename = 'believed ' + hash.encode( 'hex' ) + ' actually ' + actual_hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ]
+                    
+                    move_path = os.path.join( move_location, move_filename )
+                    
+                    shutil.move( path, move_path )
+                    
+                
+                return 'incorrect'
+                
+            
+        
+        return 'ok'
+        
+    
+    def _CloseThumbnailPacks( self ):
+        
+        for pack in self._prefixes_to_thumbnail_packs.values():
+            
+            if pack is not None:
+                
+                pack.Close()
+                
+            
+        
+        self._prefixes_to_thumbnail_packs = {}
+        
+    
+    def _DeleteResizedThumbnail( self, hash ):
+        
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        
+        HydrusPaths.DeletePath( resized_path )
+        
+        pack = self._GetThumbnailPack( self._GetResizedThumbnailPrefix( hash ) )
+        
+        if pack is not None:
+            
+            pack.DeleteThumbnail( hash )
+            
+        
+    
+    def _DoFileIntegrityCheck( self, checkpoint, is_new = False ):
+        
+        if not self._StartFileMaintenanceJob( 'file_integrity' ):
+            
+            return
+            
+        
+        try:
+            
+            if is_new:
+                
+                # only once we own the job, or we could stomp on the checkpoint of one already running
+                
+                self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', checkpoint )
+                
+            
+            prefix_string = 'checking file integrity: '
+            
+            mode = checkpoint[ 'mode' ]
+            move_location = checkpoint[ 'move_location' ]
+            
+            job_key = ClientThreading.JobKey( pausable = True, cancellable = True )
+            
+            job_key.SetVariable( 'popup_text_1', prefix_string + 'preparing' )
+            
+            self._controller.pub( 'message', job_key )
+            
+            num_to_do = checkpoint[ 'num_done' ] + self._controller.Read( 'file_integrity_count', checkpoint[ 'last_hash_id' ] )
+            
+            while True:
+                
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    break
+                    
+                
+                job_key.SetVariable( 'popup_text_1', prefix_string + HydrusData.ConvertValueRangeToPrettyString( checkpoint[ 'num_done' ], num_to_do ) )
+                job_key.SetVariable( 'popup_gauge_1', ( checkpoint[ 'num_done' ], num_to_do ) )
+                
+                rows = self._controller.Read( 'file_integrity_batch', checkpoint[ 'last_hash_id' ], FILE_MAINTENANCE_BATCH_SIZE )
+                
+                if len( rows ) == 0:
+                    
+                    break
+                    
+                
+                results = self._DoFileMaintenanceWork( lambda row: self._CheckFileIntegrity( row, mode, move_location, job_key ), rows, job_key )
+                
+                if HydrusThreading.IsThreadShuttingDown():
+                    
+                    # the checkpoint is left as it is, so this batch will be checked again next time
+                    
+                    return
+                    
+                
+                deletee_hash_ids = [ hash_id for ( ( hash_id, hash, mime ), result ) in zip( rows, results ) if result in ( 'missing', 'incorrect' ) ]
+                
+                if len( deletee_hash_ids ) > 0:
+                    
+                    self._controller.WriteSynchronous( 'delete_file_records', deletee_hash_ids )
+                    
+                
+                checkpoint[ 'num_missing' ] += results.count( 'missing' )
+                checkpoint[ 'num_incorrect' ] += results.count( 'incorrect' )
+                
+                if job_key.IsCancelled():
+                    
+                    break
+                    
+                
+                # a file that could not be read is not ok, and is exactly what the user wants to hear about if their drive is failing
+                
+                error_hashes = [ hash for ( ( hash_id, hash, mime ), result ) in zip( rows, results ) if result is None ]
+                
+                if len( error_hashes ) > 0:
+                    
+                    HydrusData.Print( 'These files could not be checked for integrity:' + os.linesep + os.linesep.join( ( hash.encode( 'hex' ) for hash in error_hashes ) ) )
+                    
+                    checkpoint[ 'num_errors' ] += len( error_hashes )
+                    
+                
+                checkpoint[ 'last_hash_id' ] = rows[ -1 ][ 0 ]
+                checkpoint[ 'num_done' ] += len( rows )
+                
+                self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', checkpoint )
+                
+            
+            if HydrusThreading.IsThreadShuttingDown():
+                
+                return
+                
+            
+            self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', None )
+            
+            job_key.DeleteVariable( 'popup_gauge_1' )
+            
+            num_missing = checkpoint[ 'num_missing' ]
+            num_incorrect = checkpoint[ 'num_incorrect' ]
+            num_errors = checkpoint[ 'num_errors' ]
+            
+            if job_key.IsCancelled():
+                
+                final_text = 'cancelled! '
+                
+            else:
+                
+                final_text = 'done! '
+                
+            
+            if num_missing + num_incorrect + num_errors == 0:
+                
+                final_text += 'all files ok!'
+                
+            else:
+                
+                final_text += HydrusData.ConvertIntToPrettyString( num_missing ) + ' files were missing!'
+                
+                if mode == 'thorough':
+                    
+                    final_text += ' ' + HydrusData.ConvertIntToPrettyString( num_incorrect ) + ' files were incorrect and thus '
+                    
+                    if move_location is None:
+                        
+                        final_text += 'deleted!'
+                        
+                    else:
+                        
+                        final_text += 'moved!'
+                        
+                    
+                
+                if num_errors > 0:
+                    
+                    final_text += ' ' + HydrusData.ConvertIntToPrettyString( num_errors ) + ' files caused errors, which have been written to the log.'
+                    
+                
+            
+            job_key.SetVariable( 'popup_text_1', prefix_string + final_text )
+            
+            HydrusData.Print( job_key.ToString() )
+            
+            job_key.Finish()
+            
+        finally:
+            
+            self._FinishFileMaintenanceJob( 'file_integrity' )
+            
+        
+    
+    def _DoFileMaintenanceWork( self, work_callable, items, job_key ):
+        
+        # like hard drive imports, the work is spread over several threads--hashing and thumbnailing spend most of their time outside the GIL
+        # results come back in the same order as the items, and anything not done because of a cancel or an error is None
+        
+        new_options = self._controller.GetNewOptions()
+        
+        num_threads = new_options.GetInteger( 'num_file_maintenance_worker_threads' )
+        
+        num_threads = max( 1, min( num_threads, len( items ) ) )
+        
+        work_queue = Queue.Queue()
+        
+        for ( i, item ) in enumerate( items ):
+            
+            work_queue.put( ( i, item ) )
+            
+        
+        results = [ None for item in items ]
+        
+        threads = [ threading.Thread( target = self._THREADDoFileMaintenanceWork, args = ( work_queue, work_callable, results, job_key ) ) for i in range( num_threads ) ]
+        
+        for thread in threads:
+            
+            thread.start()
+            
+        
+        for thread in threads:
+            
+            thread.join()
+            
+        
+        return results
+        
+    
+    def _DoThumbnailRegeneration( self, checkpoint, is_new = False ):
+        
+        if not self._StartFileMaintenanceJob( 'thumbnail_regeneration' ):
+            
+            return
+            
+        
+        try:
+            
+            if is_new:
+                
+                self._controller.WriteSynchronous( 'serialisable_simple', 'thumbnail_regeneration_checkpoint', checkpoint )
+                
+            
+            only_do_missing = checkpoint[ 'only_do_missing' ]
+            
+            job_key = ClientThreading.JobKey( pausable = True, cancellable = True )
+            
+            job_key.SetVariable( 'popup_title', 'regenerating thumbnails' )
+            job_key.SetVariable( 'popup_text_1', 'preparing' )
+            
+            self._controller.pub( 'message', job_key )
+            
+            for hashes in self._IterateFileHashBatches( checkpoint[ 'last_hash' ].decode( 'hex' ) ):
+                
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    break
+                    
+                
+                job_key.SetVariable( 'popup_text_1', HydrusData.ConvertIntToPrettyString( checkpoint[ 'num_done' ] ) + ' done' )
+                
+                results = self._DoFileMaintenanceWork( lambda hash: self._RegenerateThumbnail( hash, only_do_missing, job_key ), hashes, job_key )
+                
+                if HydrusThreading.IsThreadShuttingDown():
+                    
+                    return
+                    
+                
+                if job_key.IsCancelled():
+                    
+                    break
+                    
+                
+                checkpoint[ 'last_hash' ] = hashes[ -1 ].encode( 'hex' )
+                checkpoint[ 'num_done' ] += len( hashes )
+                checkpoint[ 'num_broken' ] += results.count( False )
+                
+                self._controller.WriteSynchronous( 'serialisable_simple', 'thumbnail_regeneration_checkpoint', checkpoint )
+                
+            
+            if HydrusThreading.IsThreadShuttingDown():
+                
+                return
+                
+            
+            self._controller.WriteSynchronous( 'serialisable_simple', 'thumbnail_regeneration_checkpoint', None )
+            
+            num_broken = checkpoint[ 'num_broken' ]
+            
+            if job_key.IsCancelled():
+                
+                job_key.SetVariable( 'popup_text_1', 'cancelled' )
+                
+            elif num_broken > 0:
+                
+                job_key.SetVariable( 'popup_text_1', 'done! ' + HydrusData.ConvertIntToPrettyString( num_broken ) + ' files caused errors, which have been written to the log.' )
+                
+            else:
+                
+                job_key.SetVariable( 'popup_text_1', 'done!' )
+                
+            
+            HydrusData.Print( job_key.ToString() )
+            
+            job_key.Finish()
+            
+        finally:
+            
+            self._FinishFileMaintenanceJob( 'thumbnail_regeneration' )
+            
+        
+    
+    def _FinishFileMaintenanceJob( self, name ):
+        
+        with self._lock:
+            
+            self._file_maintenance_jobs_running.discard( name )
+            
+        
+    
     def _GenerateExpectedFilePath( self, hash, mime ):
         
         hash_encoded = hash.encode( 'hex' )
@@ -306,14 +667,9 @@ class ClientFilesManager( object ):
             thumbnail_resized = HydrusFileHandling.GenerateThumbnail( full_size_path, thumbnail_dimensions )
             
         
-        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
-        
         try:
             
-            with open( resized_path, 'wb' ) as f:
-                
-                f.write( thumbnail_resized )
-                
+            self._SaveResizedThumbnail( hash, thumbnail_resized )
             
         except Exception as e:
             
@@ -322,6 +678,8 @@ class ClientFilesManager( object ):
             raise HydrusExceptions.FileMissingException( 'The thumbnail for file ' + hash.encode( 'hex' ) + ' was found, but the resized version would not save to disk. This event suggests that hydrus does not have permission to write to its thumbnail folder. Please check everything is ok.' )
             
         
+        return thumbnail_resized
+        
     
     def _GetRecoverTuple( self ):
         
@@ -470,50 +828,205 @@ class ClientFilesManager( object ):
         return None
         
     
-    def _IterateAllFilePaths( self ):
+    def _GetResizedThumbnail( self, hash ):
         
-        for ( prefix, location ) in self._prefixes_to_locations.items():
+        pack = self._GetThumbnailPack( self._GetResizedThumbnailPrefix( hash ) )
+        
+        if pack is not None and pack.HasThumbnail( hash ):
             
-            if prefix.startswith( 'f' ):
-                
-                dir = os.path.join( location, prefix )
-                
-                filenames = os.listdir( dir )
-                
-                for filename in filenames:
-                    
-                    yield os.path.join( dir, filename )
-                    
-                
+            return pack.GetThumbnail( hash )
             
         
-    
-    def _IterateAllThumbnailPaths( self ):
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
         
-        for ( prefix, location ) in self._prefixes_to_locations.items():
+        if os.path.exists( resized_path ):
             
-            if prefix.startswith( 't' ) or prefix.startswith( 'r' ):
+            with open( resized_path, 'rb' ) as f:
                 
-                dir = os.path.join( location, prefix )
+                return f.read()
+                
+            
+        
+        return self._GenerateResizedThumbnail( hash )
+        
+    
+    def _GetResizedThumbnailPrefix( self, hash ):
+        
+        return 'r' + hash.encode( 'hex' )[:2]
+        
+    
+    def _GetThumbnailMigrationPrefix( self ):
+        
+        # the user may have switched resized thumbnail storage since these folders were written, so find one that is stored the other way
+        
+        pack_resized_thumbnails = self._PackResizedThumbnails()
+        
+        if pack_resized_thumbnails != self._thumbnail_prefixes_checked_for_packing:
+            
+            self._thumbnail_prefixes_checked_for_migration = set()
+            self._thumbnail_prefixes_checked_for_packing = pack_resized_thumbnails
+            
+        
+        for hex_prefix in HydrusData.IterateHexPrefixes():
+            
+            prefix = 'r' + hex_prefix
+            
+            if prefix in self._thumbnail_prefixes_checked_for_migration:
+                
+                continue
+                
+            
+            self._thumbnail_prefixes_checked_for_migration.add( prefix )
+            
+            dir = os.path.join( self._prefixes_to_locations[ prefix ], prefix )
+            
+            if pack_resized_thumbnails:
+                
+                needs_migration = True in ( filename.endswith( '.thumbnail.resized' ) for filename in os.listdir( dir ) )
+                
+            else:
+                
+                needs_migration = os.path.exists( os.path.join( dir, ClientFiles.THUMBNAIL_PACK_FILENAME ) )
+                
+            
+            if needs_migration:
+                
+                return prefix
+                
+            
+        
+        return None
+        
+    
+    def _GetThumbnailPack( self, prefix, create = False ):
+        
+        # we remember when a folder has no pack, so the normal lookup does not have to check the disk every time
+        
+        if prefix not in self._prefixes_to_thumbnail_packs or ( create and self._prefixes_to_thumbnail_packs[ prefix ] is None ):
+            
+            dir = os.path.join( self._prefixes_to_locations[ prefix ], prefix )
+            
+            if create or os.path.exists( os.path.join( dir, ClientFiles.THUMBNAIL_PACK_FILENAME ) ):
+                
+                self._prefixes_to_thumbnail_packs[ prefix ] = ClientFiles.ThumbnailPack( dir )
+                
+            else:
+                
+                self._prefixes_to_thumbnail_packs[ prefix ] = None
+                
+            
+        
+        return self._prefixes_to_thumbnail_packs[ prefix ]
+        
+    
+    def _IterateAllFilePaths( self ):
+        
+        for ( prefix, location ) in self._prefixes_to_locations.items():
+            
+            if prefix.startswith( 'f' ):
+                
+                dir = os.path.join( location, prefix )
+                
+                filenames = os.listdir( dir )
+                
+                for filename in filenames:
+                    
+                    yield os.path.join( dir, filename )
+                    
+                
+            
+        
+    
+    def _IterateAllThumbnailPaths( self ):
+        
+        for ( prefix, location ) in self._prefixes_to_locations.items():
+            
+            if prefix.startswith( 't' ) or prefix.startswith( 'r' ):
+                
+                dir = os.path.join( location, prefix )
                 
                 filenames = os.listdir( dir )
                 
                 for filename in filenames:
                     
+                    if filename.startswith( ClientFiles.THUMBNAIL_PACK_FILENAME ):
+                        
+                        continue
+                        
+                    
                     yield os.path.join( dir, filename )
                     
                 
             
         
     
+    def _IterateFileHashBatches( self, last_hash ):
+        
+        # everything goes in hash order, so a job can pick up again after the last hash it finished
+        
+        with self._lock:
+            
+            prefixes_and_locations = sorted( ( ( prefix, location ) for ( prefix, location ) in self._prefixes_to_locations.items() if prefix.startswith( 'f' ) ) )
+            
+        
+        last_hash_encoded = last_hash.encode( 'hex' )
+        
+        for ( prefix, location ) in prefixes_and_locations:
+            
+            if prefix[1:] < last_hash_encoded[:2]:
+                
+                continue
+                
+            
+            dir = os.path.join( location, prefix )
+            
+            hashes_encoded = []
+            
+            for filename in os.listdir( dir ):
+                
+                hash_encoded = filename.split( '.', 1 )[0]
+                
+                # the os or the user may have put other things in here, like Thumbs.db or desktop.ini
+                
+                if len( hash_encoded ) == 64 and all( ( c in string.hexdigits for c in hash_encoded ) ):
+                    
+                    hashes_encoded.append( hash_encoded )
+                    
+                
+            
+            hashes_encoded.sort()
+            
+            hashes = [ hash_encoded.decode( 'hex' ) for hash_encoded in hashes_encoded if hash_encoded > last_hash_encoded ]
+            
+            for i in range( 0, len( hashes ), FILE_MAINTENANCE_BATCH_SIZE ):
+                
+                yield hashes[ i : i + FILE_MAINTENANCE_BATCH_SIZE ]
+                
+            
+        
+    
     def _LookForFilePath( self, hash ):
         
+        if hash in self._hashes_to_mimes:
+            
+            path = self._GenerateExpectedFilePath( hash, self._hashes_to_mimes[ hash ] )
+            
+            if os.path.exists( path ):
+                
+                return path
+                
+            
+            del self._hashes_to_mimes[ hash ]
+            
+        
         for potential_mime in HC.ALLOWED_MIMES:
             
             potential_path = self._GenerateExpectedFilePath( hash, potential_mime )
             
             if os.path.exists( potential_path ):
                 
+                self._hashes_to_mimes[ hash ] = potential_mime
+                
                 return potential_path
                 
             
@@ -521,8 +1034,141 @@ class ClientFilesManager( object ):
         raise HydrusExceptions.FileMissingException( 'File for ' + hash.encode( 'hex' ) + ' not found!' )
         
     
+    def _MergeThumbnailPacks( self, source_dir, dest_dir ):
+        
+        if not os.path.exists( os.path.join( source_dir, ClientFiles.THUMBNAIL_PACK_FILENAME ) ):
+            
+            return
+            
+        
+        self._CloseThumbnailPacks()
+        
+        source_pack = ClientFiles.ThumbnailPack( source_dir )
+        dest_pack = ClientFiles.ThumbnailPack( dest_dir )
+        
+        for hash in source_pack.GetHashes():
+            
+            if not dest_pack.HasThumbnail( hash ):
+                
+                dest_pack.AddThumbnail( hash, source_pack.GetThumbnail( hash ) )
+                
+            
+        
+        source_pack.Close()
+        dest_pack.Close()
+        
+        HydrusPaths.DeletePath( os.path.join( source_dir, ClientFiles.THUMBNAIL_PACK_FILENAME ) )
+        
+    
+    def _MigrateResizedThumbnails( self, prefix ):
+        
+        dir = os.path.join( self._prefixes_to_locations[ prefix ], prefix )
+        
+        if self._PackResizedThumbnails():
+            
+            pack = self._GetThumbnailPack( prefix, create = True )
+            
+            for filename in os.listdir( dir ):
+                
+                if filename.endswith( '.thumbnail.resized' ):
+                    
+                    hash = filename[:64].decode( 'hex' )
+                    
+                    path = os.path.join( dir, filename )
+                    
+                    with open( path, 'rb' ) as f:
+                        
+                        thumbnail = f.read()
+                        
+                    
+                    pack.AddThumbnail( hash, thumbnail )
+                    
+                    HydrusPaths.DeletePath( path )
+                    
+                
+            
+            pack.Compact()
+            
+        else:
+            
+            pack = self._GetThumbnailPack( prefix )
+            
+            if pack is not None:
+                
+                for hash in pack.GetHashes():
+                    
+                    with open( self._GenerateExpectedResizedThumbnailPath( hash ), 'wb' ) as f:
+                        
+                        f.write( pack.GetThumbnail( hash ) )
+                        
+                    
+                
+                pack.Close()
+                
+                self._prefixes_to_thumbnail_packs[ prefix ] = None
+                
+                HydrusPaths.DeletePath( os.path.join( dir, ClientFiles.THUMBNAIL_PACK_FILENAME ) )
+                
+            
+        
+    
+    def _PackResizedThumbnails( self ):
+        
+        return self._controller.GetNewOptions().GetBoolean( 'pack_resized_thumbnails' )
+        
+    
+    def _RegenerateThumbnail( self, hash, only_do_missing, job_key ):
+        
+        with self._lock:
+            
+            full_size_path = self._GenerateExpectedFullSizeThumbnailPath( hash )
+            
+        
+        if only_do_missing and os.path.exists( full_size_path ):
+            
+            return None
+            
+        
+        try:
+            
+            path = self.GetFilePath( hash )
+            
+            mime = HydrusFileHandling.GetMime( path )
+            
+            if mime in HC.MIMES_WITH_THUMBNAILS:
+                
+                thumbnail = HydrusFileHandling.GenerateThumbnail( path )
+                
+                with self._lock:
+                    
+                    full_size_path = self._GenerateExpectedFullSizeThumbnailPath( hash )
+                    
+                    with open( full_size_path, 'wb' ) as f:
+                        
+                        f.write( thumbnail )
+                        
+                    
+                    self._DeleteResizedThumbnail( hash )
+                    
+                
+            
+            self._file_maintenance_throttle.Consume( os.path.getsize( path ), job_key )
+            
+        except:
+            
+            HydrusData.Print( hash.encode( 'hex' ) )
+            HydrusData.Print( traceback.format_exc() )
+            
+            return False
+            
+        
+        return True
+        
+    
     def _Reinit( self ):
         
+        self._CloseThumbnailPacks()
+        
         self._prefixes_to_locations = self._controller.Read( 'client_files_locations' )
         
         missing = set()
@@ -561,7 +1207,78 @@ class ClientFilesManager( object ):
             
         
     
-    def AddFile( self, hash, mime, source_path ):
+    def _SaveResizedThumbnail( self, hash, thumbnail ):
+        
+        # there should only ever be one copy, so clear out any in the other storage
+        
+        resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
+        
+        if self._PackResizedThumbnails():
+            
+            pack = self._GetThumbnailPack( self._GetResizedThumbnailPrefix( hash ), create = True )
+            
+            pack.AddThumbnail( hash, thumbnail )
+            
+            HydrusPaths.DeletePath( resized_path )
+            
+        else:
+            
+            with open( resized_path, 'wb' ) as f:
+                
+                f.write( thumbnail )
+                
+            
+            pack = self._GetThumbnailPack( self._GetResizedThumbnailPrefix( hash ) )
+            
+            if pack is not None:
+                
+                pack.DeleteThumbnail( hash )
+                
+            
+        
+    
+    def _StartFileMaintenanceJob( self, name ):
+        
+        with self._lock:
+            
+            if name in self._file_maintenance_jobs_running:
+                
+                HydrusData.ShowText( 'That job is already running!' )
+                
+                return False
+                
+            
+            self._file_maintenance_jobs_running.add( name )
+            
+            return True
+            
+        
+    
+    def _THREADDoFileMaintenanceWork( self, work_queue, work_callable, results, job_key ):
+        
+        while not job_key.IsCancelled():
+            
+            try:
+                
+                ( i, item ) = work_queue.get_nowait()
+                
+            except Queue.Empty:
+                
+                return
+                
+            
+            try:
+                
+                results[ i ] = work_callable( item )
+                
+            except:
+                
+                HydrusData.Print( traceback.format_exc() )
+                
+            
+        
+    
+    def AddFile( self, hash, mime, source_path, move = False ):
         
         with self._lock:
             
@@ -569,9 +1286,32 @@ class ClientFilesManager( object ):
             
             if not os.path.exists( dest_path ):
                 
-                shutil.copy2( source_path, dest_path )
+                moved = False
+                
+                if move:
+                    
+                    # a rename only works on the same device, and windows will not rename a file that still has an open handle, so copy if it fails
+                    
+                    try:
+                        
+                        os.rename( source_path, dest_path )
+                        
+                        moved = True
+                        
+                    except OSError:
+                        
+                        pass
+                        
+                    
+                
+                if not moved:
+                    
+                    shutil.copy2( source_path, dest_path )
+                    
                 
             
+            self._hashes_to_mimes[ hash ] = mime
+            
             return dest_path
             
         
@@ -591,6 +1331,13 @@ class ClientFilesManager( object ):
         self._controller.pub( 'new_thumbnails', { hash } )
         
     
+    def CheckFileIntegrity( self, mode, move_location = None ):
+        
+        checkpoint = { 'mode' : mode, 'move_location' : move_location, 'last_hash_id' : -1, 'num_done' : 0, 'num_missing' : 0, 'num_incorrect' : 0, 'num_errors' : 0 }
+        
+        self._DoFileIntegrityCheck( checkpoint, is_new = True )
+        
+    
     def ClearOrphans( self, move_location = None ):
         
         job_key = ClientThreading.JobKey( cancellable = True )
@@ -683,6 +1430,43 @@ class ClientFilesManager( object ):
                 
             
         
+        orphan_packed_thumbnails = []
+        
+        with self._lock:
+            
+            prefixes_to_packed_hashes = {}
+            
+            for hex_prefix in HydrusData.IterateHexPrefixes():
+                
+                prefix = 'r' + hex_prefix
+                
+                pack = self._GetThumbnailPack( prefix )
+                
+                if pack is not None:
+                    
+                    prefixes_to_packed_hashes[ prefix ] = pack.GetHashes()
+                    
+                
+            
+        
+        for ( prefix, hashes ) in prefixes_to_packed_hashes.items():
+            
+            for hash in hashes:
+                
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    return
+                    
+                
+                if HydrusGlobals.client_controller.Read( 'is_an_orphan', 'thumbnail', hash ):
+                    
+                    orphan_packed_thumbnails.append( ( prefix, hash ) )
+                    
+                
+            
+        
         time.sleep( 2 )
         
         if len( orphan_paths ) > 0:
@@ -774,13 +1558,45 @@ class ClientFilesManager( object ):
                 
             
         
-        if len( orphan_paths ) == 0 and len( orphan_thumbnails ) == 0:
+        if len( orphan_packed_thumbnails ) > 0:
+            
+            status = 'found ' + HydrusData.ConvertIntToPrettyString( len( orphan_packed_thumbnails ) ) + ' orphan packed thumbnails, now deleting'
+            
+            job_key.SetVariable( 'popup_text_1', status )
+            
+            with self._lock:
+                
+                for ( prefix, hash ) in orphan_packed_thumbnails:
+                    
+                    pack = self._GetThumbnailPack( prefix )
+                    
+                    if pack is not None:
+                        
+                        HydrusData.Print( 'Deleting the orphan packed thumbnail ' + hash.encode( 'hex' ) )
+                        
+                        pack.DeleteThumbnail( hash )
+                        
+                    
+                
+                for pack in self._prefixes_to_thumbnail_packs.values():
+                    
+                    if pack is not None and pack.NeedsCompaction():
+                        
+                        pack.Compact()
+                        
+                    
+                
+            
+        
+        num_orphan_thumbnails = len( orphan_thumbnails ) + len( orphan_packed_thumbnails )
+        
+        if len( orphan_paths ) == 0 and num_orphan_thumbnails == 0:
             
             final_text = 'no orphans found!'
             
         else:
             
-            final_text = HydrusData.ConvertIntToPrettyString( len( orphan_paths ) ) + ' orphan files and ' + HydrusData.ConvertIntToPrettyString( len( orphan_thumbnails ) ) + ' orphan thumbnails cleared!'
+            final_text = HydrusData.ConvertIntToPrettyString( len( orphan_paths ) ) + ' orphan files and ' + HydrusData.ConvertIntToPrettyString( num_orphan_thumbnails ) + ' orphan thumbnails cleared!'
             
         
         job_key.SetVariable( 'popup_text_1', final_text )
@@ -807,6 +1623,8 @@ class ClientFilesManager( object ):
                 
                 ClientData.DeletePath( path )
                 
+                del self._hashes_to_mimes[ hash ]
+                
             
     
     def DeleteThumbnails( self, hashes ):
@@ -816,35 +1634,52 @@ class ClientFilesManager( object ):
             for hash in hashes:
                 
                 path = self._GenerateExpectedFullSizeThumbnailPath( hash )
-                resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
                 
                 HydrusPaths.DeletePath( path )
-                HydrusPaths.DeletePath( resized_path )
+                
+                self._DeleteResizedThumbnail( hash )
                 
             
         
     
     def GetFilePath( self, hash, mime = None ):
         
+        # the lock only covers working out the path, so a slow drive does not hold up everyone else
+        
         with self._lock:
             
             if mime is None:
                 
-                path = self._LookForFilePath( hash )
+                if hash in self._hashes_to_mimes:
+                    
+                    path = self._GenerateExpectedFilePath( hash, self._hashes_to_mimes[ hash ] )
+                    
+                else:
+                    
+                    path = None
+                    
                 
             else:
                 
                 path = self._GenerateExpectedFilePath( hash, mime )
                 
             
-            if not os.path.exists( path ):
-                
-                raise HydrusExceptions.FileMissingException( 'No file found at path + ' + path + '!' )
-                
+        
+        if path is not None and os.path.exists( path ):
             
             return path
             
         
+        if mime is not None:
+            
+            raise HydrusExceptions.FileMissingException( 'No file found at path + ' + path + '!' )
+            
+        
+        with self._lock:
+            
+            return self._LookForFilePath( hash )
+            
+        
     
     def GetFullSizeThumbnailPath( self, hash ):
         
@@ -868,18 +1703,11 @@ class ClientFilesManager( object ):
             
         
     
-    def GetResizedThumbnailPath( self, hash ):
+    def GetResizedThumbnail( self, hash ):
         
         with self._lock:
             
-            path = self._GenerateExpectedResizedThumbnailPath( hash )
-            
-            if not os.path.exists( path ):
-                
-                self._GenerateResizedThumbnail( hash )
-                
-            
-            return path
+            return self._GetResizedThumbnail( hash )
             
         
     
@@ -893,6 +1721,20 @@ class ClientFilesManager( object ):
             
         
     
+    def ImportFile( self, file_import_job, override_deleted = False, url = None ):
+        
+        # hashing, file copy, thumbnail and phash are all done here in the caller's thread, so the db only has to insert rows
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        if file_import_job.IsNewToDB( override_deleted = override_deleted ):
+            
+            file_import_job.GenerateInfo()
+            
+        
+        return self._controller.WriteSynchronous( 'import_file', file_import_job, override_deleted = override_deleted, url = url )
+        
+    
     def Rebalance( self, partial = True, stop_time = None ):
         
         if self._bad_error_occured:
@@ -920,6 +1762,8 @@ class ClientFilesManager( object ):
                     HydrusData.ShowText( text )
                     
                 
+                self._CloseThumbnailPacks()
+                
                 # these two lines can cause a deadlock because the db sometimes calls stuff in here.
                 self._controller.Write( 'relocate_client_files', prefix, overweight_location, underweight_location )
                 
@@ -959,6 +1803,11 @@ class ClientFilesManager( object ):
                 recoverable_path = os.path.join( recoverable_location, prefix )
                 correct_path = os.path.join( correct_location, prefix )
                 
+                if prefix.startswith( 'r' ):
+                    
+                    self._MergeThumbnailPacks( recoverable_path, correct_path )
+                    
+                
                 HydrusPaths.MoveAndMergeTree( recoverable_path, correct_path )
                 
                 if partial:
@@ -974,6 +1823,51 @@ class ClientFilesManager( object ):
                 recover_tuple = self._GetRecoverTuple()
                 
             
+            migration_prefix = self._GetThumbnailMigrationPrefix()
+            
+            while migration_prefix is not None:
+                
+                if self._PackResizedThumbnails(): text = 'Packing resized thumbnails in \'' + migration_prefix + '\''
+                else: text = 'Unpacking resized thumbnails in \'' + migration_prefix + '\''
+                
+                if partial:
+                    
+                    HydrusData.Print( text )
+                    
+                else:
+                    
+                    self._controller.pub( 'splash_set_status_text', text )
+                    HydrusData.ShowText( text )
+                    
+                
+                self._MigrateResizedThumbnails( migration_prefix )
+                
+                if partial:
+                    
+                    break
+                    
+                
+                if stop_time is not None and HydrusData.TimeHasPassed( stop_time ):
+                    
+                    return
+                    
+                
+                migration_prefix = self._GetThumbnailMigrationPrefix()
+                
+            
+            for pack in self._prefixes_to_thumbnail_packs.values():
+                
+                if pack is not None and pack.NeedsCompaction():
+                    
+                    pack.Compact()
+                    
+                    if partial:
+                        
+                        break
+                        
+                    
+                
+            
         
         if not partial:
             
@@ -991,100 +1885,50 @@ class ClientFilesManager( object ):
     
     def RegenerateThumbnails( self, only_do_missing = False ):
         
-        with self._lock:
-            
-            job_key = ClientThreading.JobKey( cancellable = True )
-            
-            job_key.SetVariable( 'popup_title', 'regenerating thumbnails' )
-            job_key.SetVariable( 'popup_text_1', 'creating directories' )
-            
-            self._controller.pub( 'message', job_key )
-            
-            num_broken = 0
-            
-            for ( i, path ) in enumerate( self._IterateAllFilePaths() ):
-                
-                try:
-                    
-                    while job_key.IsPaused() or job_key.IsCancelled():
-                        
-                        time.sleep( 0.1 )
-                        
-                        if job_key.IsCancelled():
-                            
-                            job_key.SetVariable( 'popup_text_1', 'cancelled' )
-                            
-                            HydrusData.Print( job_key.ToString() )
-                            
-                            return
-                            
-                        
-                    
-                    job_key.SetVariable( 'popup_text_1', HydrusData.ConvertIntToPrettyString( i ) + ' done' )
-                    
-                    ( base, filename ) = os.path.split( path )
-                    
-                    ( hash_encoded, ext ) = filename.split( '.', 1 )
-                    
-                    hash = hash_encoded.decode( 'hex' )
-                    
-                    full_size_path = self._GenerateExpectedFullSizeThumbnailPath( hash )
-                    
-                    if only_do_missing and os.path.exists( full_size_path ):
-                        
-                        continue
-                        
-                    
-                    mime = HydrusFileHandling.GetMime( path )
-                    
-                    if mime in HC.MIMES_WITH_THUMBNAILS:
-                        
-                        self._GenerateFullSizeThumbnail( hash )
-                        
-                        thumbnail_resized_path = self._GenerateExpectedResizedThumbnailPath( hash )
-                        
-                        if os.path.exists( thumbnail_resized_path ):
-                            
-                            HydrusPaths.DeletePath( thumbnail_resized_path )
-                            
-                        
-                    
-                except:
-                    
-                    HydrusData.Print( path )
-                    HydrusData.Print( traceback.format_exc() )
-                    
-                    num_broken += 1
-                    
-                
+        checkpoint = { 'only_do_missing' : only_do_missing, 'last_hash' : '', 'num_done' : 0, 'num_broken' : 0 }
+        
+        self._DoThumbnailRegeneration( checkpoint, is_new = True )
+        
+    
+    def ResumeFileMaintenance( self ):
+        
+        # a file integrity check or thumbnail regeneration that was running when the client last closed picks up where it left off
+        
+        checkpoint = self._controller.Read( 'serialisable_simple', 'file_integrity_checkpoint' )
+        
+        if checkpoint is not None:
             
-            if num_broken > 0:
-                
-                job_key.SetVariable( 'popup_text_1', 'done! ' + HydrusData.ConvertIntToPrettyString( num_broken ) + ' files caused errors, which have been written to the log.' )
-                
-            else:
-                
-                job_key.SetVariable( 'popup_text_1', 'done!' )
-                
+            self._DoFileIntegrityCheck( checkpoint )
             
-            HydrusData.Print( job_key.ToString() )
+        
+        checkpoint = self._controller.Read( 'serialisable_simple', 'thumbnail_regeneration_checkpoint' )
+        
+        if checkpoint is not None:
             
-            job_key.Finish()
+            self._DoThumbnailRegeneration( checkpoint )
             
         
     
 class DataCache( object ):
     
-    def __init__( self, controller, cache_size_key ):
+    def __init__( self, controller, cache_size_key, max_item_fraction = None ):
         
         self._controller = controller
         self._cache_size_key = cache_size_key
+        self._max_item_fraction = max_item_fraction
         
-        self._keys_to_data = {}
-        self._keys_fifo = []
+        # key -> ( data, estimated_memory_footprint, last_access_time ), oldest access first
+        # the footprint is remembered from when the data was added, so we don't have to ask every item again
+        
+        self._keys_to_data = collections.OrderedDict()
         
         self._total_estimated_memory_footprint = 0
         
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        self._num_rejections = 0
+        
         self._lock = threading.Lock()
         
         wx.CallLater( 60 * 1000, self.MaintainCache )
@@ -1092,41 +1936,27 @@ class DataCache( object ):
     
     def _DeleteItem( self ):
         
-        ( deletee_key, last_access_time ) = self._keys_fifo.pop( 0 )
+        ( deletee_key, ( deletee_data, deletee_footprint, last_access_time ) ) = self._keys_to_data.popitem( last = False )
         
-        deletee_data = self._keys_to_data[ deletee_key ]
+        self._total_estimated_memory_footprint -= deletee_footprint
         
-        del self._keys_to_data[ deletee_key ]
-        
-        self._RecalcMemoryUsage()
+        self._num_evictions += 1
         
     
-    def _RecalcMemoryUsage( self ):
+    def _TouchKey( self, key ):
         
-        self._total_estimated_memory_footprint = sum( ( data.GetEstimatedMemoryFootprint() for data in self._keys_to_data.values() ) )
+        ( data, footprint, last_access_time ) = self._keys_to_data.pop( key )
         
-    
-    def _TouchKey( self, key ):
-    
-        for ( i, ( fifo_key, last_access_time ) ) in enumerate( self._keys_fifo ):
-            
-            if fifo_key == key:
-                
-                del self._keys_fifo[ i ]
-                
-                break
-                
-            
+        self._keys_to_data[ key ] = ( data, footprint, HydrusData.GetNow() )
         
-        self._keys_fifo.append( ( key, HydrusData.GetNow() ) )
+        return data
         
     
     def Clear( self ):
         
         with self._lock:
             
-            self._keys_to_data = {}
-            self._keys_fifo = []
+            self._keys_to_data = collections.OrderedDict()
             
             self._total_estimated_memory_footprint = 0
             
@@ -1140,16 +1970,27 @@ class DataCache( object ):
                 
                 options = self._controller.GetOptions()
                 
-                while self._total_estimated_memory_footprint > options[ self._cache_size_key ]:
+                cache_size = options[ self._cache_size_key ]
+                
+                footprint = data.GetEstimatedMemoryFootprint()
+                
+                if self._max_item_fraction is not None and footprint > cache_size * self._max_item_fraction:
                     
-                    self._DeleteItem()
+                    # caching this would flush out too much else for one item, so the caller can just use it and let it go
+                    
+                    self._num_rejections += 1
+                    
+                    return
                     
                 
-                self._keys_to_data[ key ] = data
+                while len( self._keys_to_data ) > 0 and self._total_estimated_memory_footprint + footprint > cache_size:
+                    
+                    self._DeleteItem()
+                    
                 
-                self._keys_fifo.append( ( key, HydrusData.GetNow() ) )
+                self._keys_to_data[ key ] = ( data, footprint, HydrusData.GetNow() )
                 
-                self._RecalcMemoryUsage()
+                self._total_estimated_memory_footprint += footprint
                 
             
         
@@ -1160,12 +2001,14 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
+                self._num_misses += 1
+                
                 raise Exception( 'Cache error! Looking for ' + HydrusData.ToUnicode( key ) + ', but it was missing.' )
                 
             
-            self._TouchKey( key )
+            self._num_hits += 1
             
-            return self._keys_to_data[ key ]
+            return self._TouchKey( key )
             
         
     
@@ -1175,17 +2018,39 @@ class DataCache( object ):
             
             if key in self._keys_to_data:
                 
-                self._TouchKey( key )
+                self._num_hits += 1
                 
-                return self._keys_to_data[ key ]
+                return self._TouchKey( key )
                 
             else:
                 
+                self._num_misses += 1
+                
                 return None
                 
             
         
     
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            options = self._controller.GetOptions()
+            
+            stats = {}
+            
+            stats[ 'num_items' ] = len( self._keys_to_data )
+            stats[ 'estimated_memory_footprint' ] = self._total_estimated_memory_footprint
+            stats[ 'cache_size' ] = options[ self._cache_size_key ]
+            stats[ 'num_hits' ] = self._num_hits
+            stats[ 'num_misses' ] = self._num_misses
+            stats[ 'num_evictions' ] = self._num_evictions
+            stats[ 'num_rejections' ] = self._num_rejections
+            
+            return stats
+            
+        
+    
     def HasData( self, key ):
         
         with self._lock:
@@ -1198,24 +2063,17 @@ class DataCache( object ):
         
         with self._lock:
             
-            while True:
+            while len( self._keys_to_data ) > 0:
                 
-                if len( self._keys_fifo ) == 0:
+                ( key, ( data, footprint, last_access_time ) ) = next( self._keys_to_data.iteritems() )
+                
+                if HydrusData.TimeHasPassed( last_access_time + 1200 ):
                     
-                    break
+                    self._DeleteItem()
                     
                 else:
                     
-                    ( key, last_access_time ) = self._keys_fifo[ 0 ]
-                    
-                    if HydrusData.TimeHasPassed( last_access_time + 1200 ):
-                        
-                        self._DeleteItem()
-                        
-                    else:
-                        
-                        break
-                        
+                    break
                     
                 
             
@@ -1530,12 +2388,16 @@ class RenderedImageCache( object ):
         self._controller = controller
         self._type = cache_type
         
-        if self._type == 'fullscreen': self._data_cache = DataCache( self._controller, 'fullscreen_cache_size' )
-        elif self._type == 'preview': self._data_cache = DataCache( self._controller, 'preview_cache_size' )
+        # an image bigger than the whole cache would only flush everything else out and then be flushed itself
+        
+        if self._type == 'fullscreen': self._data_cache = DataCache( self._controller, 'fullscreen_cache_size', max_item_fraction = 1.0 )
+        elif self._type == 'preview': self._data_cache = DataCache( self._controller, 'preview_cache_size', max_item_fraction = 1.0 )
         
     
     def Clear( self ): self._data_cache.Clear()
     
+    def GetStats( self ): return self._data_cache.GetStats()
+    
     def GetImage( self, media, target_resolution = None ):
         
         hash = media.GetHash()
@@ -1606,6 +2468,22 @@ class ThumbnailCache( object ):
         self._controller.sub( self, 'Clear', 'thumbnail_resize' )
         
     
+    def _GenerateHydrusBitmap( self, hash, full_size ):
+        
+        if full_size:
+            
+            path = self._client_files_manager.GetFullSizeThumbnailPath( hash )
+            
+            return ClientRendering.GenerateHydrusBitmap( path )
+            
+        else:
+            
+            thumbnail = self._client_files_manager.GetResizedThumbnail( hash )
+            
+            return ClientRendering.GenerateHydrusBitmapFromData( thumbnail )
+            
+        
+    
     def _GetResizedHydrusBitmapFromHardDrive( self, display_media ):
         
         options = self._controller.GetOptions()
@@ -1625,48 +2503,18 @@ class ThumbnailCache( object ):
         
         locations_manager = display_media.GetLocationsManager()
         
-        if locations_manager.HasLocal():
+        try:
             
-            try:
-                
-                if full_size:
-                    
-                    path = self._client_files_manager.GetFullSizeThumbnailPath( hash )
-                    
-                else:
-                    
-                    path = self._client_files_manager.GetResizedThumbnailPath( hash )
-                    
-                
-            except HydrusExceptions.FileMissingException as e:
-                
-                HydrusData.ShowException( e )
-                
-                return self._special_thumbs[ 'hydrus' ]
-                
+            hydrus_bitmap = self._GenerateHydrusBitmap( hash, full_size )
             
-        else:
+        except HydrusExceptions.FileMissingException as e:
             
-            try:
-                
-                if full_size:
-                    
-                    path = self._client_files_manager.GetFullSizeThumbnailPath( hash )
-                    
-                else:
-                    
-                    path = self._client_files_manager.GetResizedThumbnailPath( hash )
-                    
-                
-            except HydrusExceptions.FileMissingException:
+            if locations_manager.HasLocal():
                 
-                return self._special_thumbs[ 'hydrus' ]
+                HydrusData.ShowException( e )
                 
             
-        
-        try:
-            
-            hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path )
+            return self._special_thumbs[ 'hydrus' ]
             
         except Exception as e:
             
@@ -1678,7 +2526,7 @@ class ThumbnailCache( object ):
                 
                 try:
                     
-                    hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path )
+                    hydrus_bitmap = self._GenerateHydrusBitmap( hash, full_size )
                     
                 except Exception as e:
                     
@@ -1711,7 +2559,7 @@ class ThumbnailCache( object ):
             
             self._client_files_manager.RegenerateResizedThumbnail( hash )
             
-            hydrus_bitmap = ClientRendering.GenerateHydrusBitmap( path )
+            hydrus_bitmap = self._GenerateHydrusBitmap( hash, full_size )
             
         
         return hydrus_bitmap
@@ -1770,6 +2618,8 @@ class ThumbnailCache( object ):
             
         
     
+    def GetStats( self ): return self._data_cache.GetStats()
+    
     def GetThumbnail( self, media ):
         
         display_media = media.GetDisplayMedia()
@@ -2239,6 +3089,9 @@ class TagSiblingsManager( object ):
         
         self._controller = controller
         
+        self._autocomplete_index = []
+        self._autocomplete_indexed_tags = set()
+        
         self._RefreshSiblings()
         
         self._lock = threading.Lock()
@@ -2251,6 +3104,77 @@ class TagSiblingsManager( object ):
         return { self._siblings[ tag ] if tag in self._siblings else tag for tag in tags }
         
     
+    def _GetAutocompleteCandidates( self, search_text ):
+        
+        prefix = ClientSearch.GetSearchEntryPrefix( search_text )
+        
+        if prefix == '':
+            
+            return self._autocomplete_indexed_tags
+            
+        
+        candidates = set()
+        
+        i = bisect.bisect_left( self._autocomplete_index, ( prefix, ) )
+        
+        while i < len( self._autocomplete_index ):
+            
+            ( suffix, tag ) = self._autocomplete_index[ i ]
+            
+            if not suffix.startswith( prefix ):
+                
+                break
+                
+            
+            candidates.add( tag )
+            
+            i += 1
+            
+        
+        return candidates
+        
+    
+    def _RefreshAutocompleteIndex( self ):
+        
+        # the index is a sorted list of ( suffix, tag ) over both sides of the sibling map, so a prefix is a bisect away
+        
+        tags = set( self._siblings.keys() )
+        
+        tags.update( self._reverse_lookup.keys() )
+        
+        removees = self._autocomplete_indexed_tags.difference( tags )
+        addees = tags.difference( self._autocomplete_indexed_tags )
+        
+        if len( removees ) + len( addees ) > 1000:
+            
+            # a big change is quicker to sort from scratch
+            
+            self._autocomplete_index = sorted( ( ( suffix, tag ) for tag in tags for suffix in ClientSearch.GetTagSearchSuffixes( tag ) ) )
+            
+        else:
+            
+            for tag in removees:
+                
+                for suffix in ClientSearch.GetTagSearchSuffixes( tag ):
+                    
+                    i = bisect.bisect_left( self._autocomplete_index, ( suffix, tag ) )
+                    
+                    del self._autocomplete_index[ i ]
+                    
+                
+            
+            for tag in addees:
+                
+                for suffix in ClientSearch.GetTagSearchSuffixes( tag ):
+                    
+                    bisect.insort( self._autocomplete_index, ( suffix, tag ) )
+                    
+                
+            
+        
+        self._autocomplete_indexed_tags = tags
+        
+    
     def _RefreshSiblings( self ):
         
         service_keys_to_statuses_to_pairs = self._controller.Read( 'tag_siblings' )
@@ -2259,6 +3183,8 @@ class TagSiblingsManager( object ):
         
         ( self._siblings, self._reverse_lookup ) = CollapseTagSiblingChains( processed_siblings )
         
+        self._RefreshAutocompleteIndex()
+        
         self._controller.pub( 'new_siblings_gui' )
         
     
@@ -2279,15 +3205,22 @@ class TagSiblingsManager( object ):
                     key_based_matching_values = set()
                     
                 
-                value_based_matching_values = { value for value in self._siblings.values() if value == search_text }
+                if search_text in self._reverse_lookup:
+                    
+                    value_based_matching_values = { search_text }
+                    
+                else:
+                    
+                    value_based_matching_values = set()
+                    
                 
             else:
                 
-                matching_keys = ClientSearch.FilterTagsBySearchEntry( search_text, self._siblings.keys(), search_siblings = False )
+                matching_tags = ClientSearch.FilterTagsBySearchEntry( search_text, self._GetAutocompleteCandidates( search_text ), search_siblings = False )
                 
-                key_based_matching_values = { self._siblings[ key ] for key in matching_keys }
+                key_based_matching_values = { self._siblings[ tag ] for tag in matching_tags if tag in self._siblings }
                 
-                value_based_matching_values = ClientSearch.FilterTagsBySearchEntry( search_text, self._siblings.values(), search_siblings = False )
+                value_based_matching_values = { tag for tag in matching_tags if tag in self._reverse_lookup }
                 
             
             matching_values = key_based_matching_values.union( value_based_matching_values )
@@ -473,10 +473,10 @@ class Controller( HydrusController.HydrusController ):
         return self._client_session_manager
         
     
-    def GetDB( self ): return self._db
-    
     def GetGUI( self ): return self._gui
     
+    def GetHTTP( self ): return self._http
+    
     def GetOptions( self ):
         
         return self._options
@@ -505,6 +505,8 @@ class Controller( HydrusController.HydrusController ):
         
         HC.options = self._options
         
+        self._http.SetMaxConnectionsPerHost( self._new_options.GetInteger( 'max_connections_per_host' ) )
+        
         self._services_manager = ClientCaches.ServicesManager( self )
         
         self._client_files_manager = ClientCaches.ClientFilesManager( self )
@@ -539,6 +541,7 @@ class Controller( HydrusController.HydrusController ):
         self.sub( self, 'Clipboard', 'clipboard' )
         self.sub( self, 'RestartServer', 'restart_server' )
         self.sub( self, 'RestartBooru', 'restart_booru' )
+        self.sub( self, 'NotifyNewOptions', 'notify_new_options' )
         
     
     def InitView( self ):
@@ -604,6 +607,8 @@ class Controller( HydrusController.HydrusController ):
             
             self._daemons.append( HydrusThreading.DAEMONQueue( self, 'FlushRepositoryUpdates', ClientDaemons.DAEMONFlushServiceUpdates, 'service_updates_delayed', period = 5 ) )
             
+            self.CallToThread( self._client_files_manager.ResumeFileMaintenance )
+            
         
         if HydrusGlobals.is_first_start: wx.CallAfter( self._gui.DoFirstStart )
         if HydrusGlobals.is_db_updated: wx.CallLater( 1, HydrusData.ShowText, 'The client has updated to version ' + str( HC.SOFTWARE_VERSION ) + '!' )
@@ -632,6 +637,11 @@ class Controller( HydrusController.HydrusController ):
         
         self.WriteInterruptable( 'analyze', stop_time = stop_time )
         
+        if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
+            
+            self.WriteInterruptable( 'maintain_similar_files_tree', stop_time = stop_time )
+            
+        
         if stop_time is None or not HydrusData.TimeHasPassed( stop_time ):
             
             if HydrusData.TimeHasPassed( self._timestamps[ 'last_service_info_cache_fatten' ] + ( 60 * 20 ) ):
@@ -673,6 +683,11 @@ class Controller( HydrusController.HydrusController ):
         return self._menu_open
         
     
+    def NotifyNewOptions( self ):
+        
+        self._http.SetMaxConnectionsPerHost( self._new_options.GetInteger( 'max_connections_per_host' ) )
+        
+    
     def NotifyPubSubs( self ):
         
         wx.CallAfter( self.ProcessPubSub )
@@ -1020,27 +1035,44 @@ class Controller( HydrusController.HydrusController ):
     
     def THREADDoFileQuery( self, query_key, search_context ):
         
-        query_hash_ids = self.Read( 'file_query_ids', search_context )
+        query_hash_ids = list( self.Read( 'file_query_ids', search_context ) )
         
-        media_results = []
+        # the first screenful goes up as soon as it is loaded, and the rest is added to it in bigger chunks
         
-        for sub_query_hash_ids in HydrusData.SplitListIntoChunks( query_hash_ids, 256 ):
-            
-            if query_key.IsCancelled(): return
+        first_page_hash_ids = query_hash_ids[ : 256 ]
+        remaining_hash_ids = query_hash_ids[ 256 : ]
+        
+        if query_key.IsCancelled(): return
+        
+        media_results = self.Read( 'media_results_from_ids', first_page_hash_ids )
+        
+        self.pub( 'set_num_query_results', len( media_results ), len( query_hash_ids ) )
+        
+        if len( remaining_hash_ids ) == 0:
             
-            more_media_results = self.Read( 'media_results_from_ids', sub_query_hash_ids )
+            search_context.SetComplete()
             
-            media_results.extend( more_media_results )
+        
+        self.pub( 'file_query_done', query_key, media_results )
+        
+        self.WaitUntilPubSubsEmpty()
+        
+        if len( remaining_hash_ids ) > 0:
             
-            self.pub( 'set_num_query_results', len( media_results ), len( query_hash_ids ) )
+            for sub_query_hash_ids in HydrusData.SplitListIntoChunks( remaining_hash_ids, 2048 ):
+                
+                if query_key.IsCancelled(): return
+                
+                more_media_results = self.Read( 'media_results_from_ids', sub_query_hash_ids )
+                
+                self.pub( 'add_media_results_from_query', query_key, more_media_results )
+                
+                self.WaitUntilPubSubsEmpty()
+                
             
-            self.WaitUntilPubSubsEmpty()
+            search_context.SetComplete()
             
         
-        search_context.SetComplete()
-        
-        self.pub( 'file_query_done', query_key, media_results )
-        
     
     def THREADBootEverything( self ):
         
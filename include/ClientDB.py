@@ -5,6 +5,7 @@ import ClientImporting
 import ClientMedia
 import ClientRatings
 import ClientThreading
+import ClientVPTree
 import collections
 import hashlib
 import httplib
@@ -30,6 +31,7 @@ import os
 import psutil
 import Queue
 import random
+import re
 import shutil
 import sqlite3
 import stat
@@ -997,6 +999,10 @@ def GenerateCombinedFilesMappingsCacheTableName( service_id ):
     
     return 'external_caches.combined_files_ac_cache_' + str( service_id )
     
+def GenerateCombinedFilesTagCountsCacheTableName( service_id ):
+    
+    return 'external_caches.combined_files_tag_counts_cache_' + str( service_id )
+    
 def GenerateMappingsTableNames( service_id ):
     
     suffix = str( service_id )
@@ -1025,8 +1031,107 @@ def GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id ):
     
     return ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name )
     
+def GenerateTrigrams( text ):
+    
+    # the leading space gives the start of the text, and every word start after it, a trigram of its own
+    
+    text = ' ' + text
+    
+    return { text[ i : i + 3 ] for i in range( len( text ) - 2 ) }
+    
+def GenerateTrigramsFromLikePattern( like_pattern ):
+    
+    # every trigram here will be in anything that matches 'LIKE like_pattern' or 'LIKE "% " + like_pattern'
+    # if this comes back empty, the pattern is too vague for the trigram index
+    
+    if not like_pattern.startswith( '%' ):
+        
+        like_pattern = ' ' + like_pattern
+        
+    
+    trigrams = set()
+    
+    for fragment in re.split( '[%_]', like_pattern.lower() ):
+        
+        trigrams.update( ( fragment[ i : i + 3 ] for i in range( len( fragment ) - 2 ) ) )
+        
+    
+    return trigrams
+    
+class FileQueryClause( object ):
+    
+    def __init__( self, description, include, exists_phrase, estimate = None, select_statements = None, hash_ids = None ):
+        
+        # exists_phrase tests a row of mem.temp_file_query_hash_ids, and is true if the file matches the clause
+        # a clause can only start a query if we can fetch its matching files directly, either with select_statements or as hash_ids
+        
+        self._description = description
+        self._include = include
+        self._exists_phrase = exists_phrase
+        self._estimate = estimate
+        self._select_statements = select_statements
+        self._hash_ids = hash_ids
+        
+    
+    def CanStart( self ):
+        
+        return self._include and ( self._select_statements is not None or self._hash_ids is not None )
+        
+    
+    def GetDescription( self ):
+        
+        if self._include:
+            
+            return 'files ' + self._description
+            
+        else:
+            
+            return 'files not ' + self._description
+            
+        
+    
+    def GetEstimate( self ):
+        
+        return self._estimate
+        
+    
+    def GetExistsPhrase( self ):
+        
+        return self._exists_phrase
+        
+    
+    def GetHashIds( self ):
+        
+        return self._hash_ids
+        
+    
+    def GetSelectStatements( self ):
+        
+        return self._select_statements
+        
+    
+    def GetSortKey( self ):
+        
+        # clauses we cannot estimate go after the ones we can
+        
+        if self._estimate is None:
+            
+            return ( 1, 0 )
+            
+        else:
+            
+            return ( 0, self._estimate )
+            
+        
+    
+    def IsInclude( self ):
+        
+        return self._include
+        
+    
 class DB( HydrusDB.HydrusDB ):
     
+    GROUP_COMMIT_ACTIONS = [ 'content_updates', 'hydrus_session', 'serialisable', 'serialisable_simple', 'service_updates', 'web_session' ]
     READ_WRITE_ACTIONS = [ 'service_info', 'system_predicates' ]
     
     def _AddFilesInfo( self, rows, overwrite = False ):
@@ -1339,6 +1444,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._inbox_hash_ids.difference_update( valid_hash_ids )
             
+            self._InvalidateCommittedCaches()
+            
         
     
     def _Backup( self, path ):
@@ -1412,6 +1519,10 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE ' + ac_cache_table_name + ';' )
         
+        tag_counts_cache_table_name = GenerateCombinedFilesTagCountsCacheTableName( service_id )
+        
+        self._c.execute( 'DROP TABLE ' + tag_counts_cache_table_name + ';' )
+        
     
     def _CacheCombinedFilesMappingsGenerate( self, service_id ):
         
@@ -1486,6 +1597,28 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
+        self._CacheCombinedFilesMappingsGenerateTagCounts( service_id )
+        
+    
+    def _CacheCombinedFilesMappingsGenerateTagCounts( self, service_id ):
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( service_id )
+        
+        tag_counts_cache_table_name = GenerateCombinedFilesTagCountsCacheTableName( service_id )
+        
+        tag_counts_cache_table_simple_name = tag_counts_cache_table_name.split( '.' )[1]
+        
+        self._c.execute( 'CREATE TABLE ' + tag_counts_cache_table_name + ' ( hash_id INTEGER PRIMARY KEY, current_count INTEGER, pending_count INTEGER, total_count INTEGER );' )
+        
+        self._c.execute( 'INSERT INTO ' + tag_counts_cache_table_name + ' ( hash_id, current_count, pending_count, total_count ) SELECT hash_id, COUNT( * ), 0, COUNT( * ) FROM ' + current_mappings_table_name + ' GROUP BY hash_id;' )
+        
+        tag_count_ids = [ ( hash_id, 0, count ) for ( hash_id, count ) in self._c.execute( 'SELECT hash_id, COUNT( * ) FROM ' + pending_mappings_table_name + ' GROUP BY hash_id;' ) ]
+        
+        self._CacheCombinedFilesMappingsUpdateTagCounts( service_id, tag_count_ids )
+        
+        self._c.execute( 'CREATE INDEX ' + tag_counts_cache_table_name + '_current_count_index ON ' + tag_counts_cache_table_simple_name + ' ( current_count );' )
+        self._c.execute( 'CREATE INDEX ' + tag_counts_cache_table_name + '_total_count_index ON ' + tag_counts_cache_table_simple_name + ' ( total_count );' )
+        
     
     def _CacheCombinedFilesMappingsGetAutocompleteCounts( self, service_id, namespace_ids_to_tag_ids ):
         
@@ -1512,177 +1645,562 @@ class DB( HydrusDB.HydrusDB ):
         self._c.executemany( 'DELETE FROM ' + ac_cache_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND current_count = ? AND pending_count = ?;', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, current_delta, pending_delta ) in count_ids ) )
         
     
-    def _CacheSpecificMappingsAddFiles( self, file_service_id, tag_service_id, hash_ids ):
+    def _CacheCombinedFilesMappingsUpdateTagCounts( self, service_id, tag_count_ids ):
         
-        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        tag_counts_cache_table_name = GenerateCombinedFilesTagCountsCacheTableName( service_id )
         
-        self._c.executemany( 'INSERT OR IGNORE INTO ' + files_table_name + ' VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
+        self._c.executemany( 'INSERT OR IGNORE INTO ' + tag_counts_cache_table_name + ' ( hash_id, current_count, pending_count, total_count ) VALUES ( ?, ?, ?, ? );', ( ( hash_id, 0, 0, 0 ) for ( hash_id, current_delta, pending_delta ) in tag_count_ids ) )
         
-        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+        self._c.executemany( 'UPDATE ' + tag_counts_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count + ?, total_count = total_count + ? WHERE hash_id = ?;', ( ( current_delta, pending_delta, current_delta + pending_delta, hash_id ) for ( hash_id, current_delta, pending_delta ) in tag_count_ids ) )
         
-        ac_cache_changes = []
+        self._c.executemany( 'DELETE FROM ' + tag_counts_cache_table_name + ' WHERE hash_id = ? AND total_count = ?;', ( ( hash_id, 0 ) for ( hash_id, current_delta, pending_delta ) in tag_count_ids ) )
         
-        for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
-            
-            splayed_group_of_hash_ids = HydrusData.SplayListForDB( group_of_hash_ids )
-            
-            current_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + current_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+    
+    def _CacheSimilarFilesAddLeaf( self, phash ):
+        
+        result = self._c.execute( 'SELECT phash FROM shape_vptree WHERE parent_phash IS NULL;' ).fetchone()
+        
+        parent_phash = None
+        
+        if result is not None:
             
-            current_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in current_mapping_ids_raw ] )
+            ( root_phash, ) = result
             
-            pending_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + pending_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+            ancestors_we_are_inside = []
+            ancestors_we_are_outside = []
             
-            pending_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in pending_mapping_ids_raw ] )
+            an_ancestor_is_unbalanced = False
             
-            all_ids_seen = set( current_mapping_ids_dict.keys() )
-            all_ids_seen.update( pending_mapping_ids_dict.keys() )
+            next_ancestor_phash = root_phash
             
-            for ( namespace_id, tag_id ) in all_ids_seen:
+            while next_ancestor_phash is not None:
                 
-                current_hash_ids = current_mapping_ids_dict[ ( namespace_id, tag_id ) ]
+                ancestor_phash = next_ancestor_phash
                 
-                num_current = len( current_hash_ids )
+                ( ancestor_radius, ancestor_inner_phash, ancestor_inner_population, ancestor_outer_phash, ancestor_outer_population ) = self._c.execute( 'SELECT radius, inner_phash, inner_population, outer_phash, outer_population FROM shape_vptree WHERE phash = ?;', ( sqlite3.Binary( ancestor_phash ), ) ).fetchone()
                 
-                if num_current > 0:
+                distance_to_ancestor = HydrusData.GetHammingDistance( phash, ancestor_phash )
+                
+                if ancestor_radius is None or distance_to_ancestor <= ancestor_radius:
                     
-                    self._c.executemany( 'INSERT OR IGNORE INTO ' + current_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) VALUES ( ?, ?, ? );', ( ( hash_id, namespace_id, tag_id ) for hash_id in current_hash_ids ) )
+                    ancestors_we_are_inside.append( ancestor_phash )
+                    ancestor_inner_population += 1
+                    next_ancestor_phash = ancestor_inner_phash
                     
-                
-                pending_hash_ids = pending_mapping_ids_dict[ ( namespace_id, tag_id ) ]
-                
-                num_pending = len( pending_hash_ids )
-                
-                if num_pending > 0:
+                    if ancestor_inner_phash is None:
+                        
+                        if ancestor_radius is None:
+                            
+                            ancestor_radius = distance_to_ancestor
+                            
+                        
+                        self._c.execute( 'UPDATE shape_vptree SET inner_phash = ?, radius = ? WHERE phash = ?;', ( sqlite3.Binary( phash ), ancestor_radius, sqlite3.Binary( ancestor_phash ) ) )
+                        
+                        parent_phash = ancestor_phash
+                        
                     
-                    self._c.executemany( 'INSERT OR IGNORE INTO ' + pending_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) VALUES ( ?, ?, ? );', ( ( hash_id, namespace_id, tag_id ) for hash_id in pending_hash_ids ) )
+                else:
+                    
+                    ancestors_we_are_outside.append( ancestor_phash )
+                    ancestor_outer_population += 1
+                    next_ancestor_phash = ancestor_outer_phash
+                    
+                    if ancestor_outer_phash is None:
+                        
+                        self._c.execute( 'UPDATE shape_vptree SET outer_phash = ? WHERE phash = ?;', ( sqlite3.Binary( phash ), sqlite3.Binary( ancestor_phash ) ) )
+                        
+                        parent_phash = ancestor_phash
+                        
                     
                 
-                if num_current > 0 or num_pending > 0:
+                if not an_ancestor_is_unbalanced and ancestor_inner_population + ancestor_outer_population > 16:
                     
-                    ac_cache_changes.append( ( namespace_id, tag_id, num_current, num_pending ) )
+                    larger = float( max( ancestor_inner_population, ancestor_outer_population ) )
+                    smaller = float( min( ancestor_inner_population, ancestor_outer_population ) )
+                    
+                    if smaller / larger < 0.5:
+                        
+                        # only the top unbalanced branch needs to be queued, as regenerating it will rebalance everything beneath
+                        
+                        self._c.execute( 'INSERT OR IGNORE INTO shape_maintenance_branch_regen ( phash ) VALUES ( ? );', ( sqlite3.Binary( ancestor_phash ), ) )
+                        
+                        an_ancestor_is_unbalanced = True
+                        
                     
                 
             
+            self._c.executemany( 'UPDATE shape_vptree SET inner_population = inner_population + 1 WHERE phash = ?;', ( ( sqlite3.Binary( ancestor_phash ), ) for ancestor_phash in ancestors_we_are_inside ) )
+            self._c.executemany( 'UPDATE shape_vptree SET outer_population = outer_population + 1 WHERE phash = ?;', ( ( sqlite3.Binary( ancestor_phash ), ) for ancestor_phash in ancestors_we_are_outside ) )
+            
         
-        if len( ac_cache_changes ) > 0:
+        self._CacheSimilarFilesInsertNodes( [ ( phash, parent_phash, None, None, 0, None, 0 ) ] )
+        
+    
+    def _CacheSimilarFilesAssociatePHash( self, hash_id, phash ):
+        
+        result = self._c.execute( 'SELECT phash FROM perceptual_hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
+        
+        if result is not None:
             
-            self._c.executemany( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( namespace_id, tag_id, current_count, pending_count ) VALUES ( ?, ?, ?, ? );', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            ( existing_phash, ) = result
             
-            self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count + ? WHERE namespace_id = ? AND tag_id = ?;', ( ( num_current, num_pending, namespace_id, tag_id ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            if existing_phash == phash:
+                
+                return
+                
+            
+            self._CacheSimilarFilesDisassociatePHashes( ( hash_id, ) )
+            
+        
+        self._c.execute( 'INSERT OR REPLACE INTO perceptual_hashes ( hash_id, phash ) VALUES ( ?, ? );', ( hash_id, sqlite3.Binary( phash ) ) )
+        
+        result = self._c.execute( 'SELECT 1 FROM shape_vptree WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ).fetchone()
+        
+        if result is None:
+            
+            self._CacheSimilarFilesAddLeaf( phash )
             
         
     
-    def _CacheSpecificMappingsAddMappings( self, file_service_id, tag_service_id, mappings_ids ):
+    def _CacheSimilarFilesDisassociatePHashes( self, hash_ids ):
         
-        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
         
-        for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
+        phashes = { phash for ( phash, ) in self._c.execute( 'SELECT phash FROM perceptual_hashes WHERE hash_id IN ' + splayed_hash_ids + ';' ) }
+        
+        self._c.execute( 'DELETE FROM perceptual_hashes WHERE hash_id IN ' + splayed_hash_ids + ';' )
+        
+        for phash in phashes:
             
-            hash_ids = self._CacheSpecificMappingsFilterHashIds( file_service_id, tag_service_id, hash_ids )
+            result = self._c.execute( 'SELECT 1 FROM perceptual_hashes WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ).fetchone()
             
-            if len( hash_ids ) > 0:
-                
-                self._c.executemany( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE hash_id = ? AND namespace_id = ? AND tag_id = ?;', ( ( hash_id, namespace_id, tag_id ) for hash_id in hash_ids ) )
-                
-                num_pending_rescinded = self._GetRowCount()
+            if result is None:
                 
-                #
+                # the node no longer maps to any file, so searches will skip it. maintenance will prune it from the tree
                 
-                self._c.executemany( 'INSERT OR IGNORE INTO ' + current_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) VALUES ( ?, ?, ? );', ( ( hash_id, namespace_id, tag_id ) for hash_id in hash_ids ) )
+                self._c.execute( 'INSERT OR IGNORE INTO shape_maintenance_branch_regen ( phash ) VALUES ( ? );', ( sqlite3.Binary( phash ), ) )
                 
-                num_added = self._GetRowCount()
+            
+        
+    
+    def _CacheSimilarFilesGenerateTree( self ):
+        
+        self._c.execute( 'DELETE FROM shape_vptree;' )
+        self._c.execute( 'DELETE FROM shape_maintenance_branch_regen;' )
+        
+        all_phashes = { phash for ( phash, ) in self._c.execute( 'SELECT phash FROM perceptual_hashes;' ) }
+        
+        ( root_phash, rows ) = ClientVPTree.GenerateVPTreeRows( all_phashes )
+        
+        self._CacheSimilarFilesInsertNodes( rows )
+        
+    
+    def _CacheSimilarFilesInsertNodes( self, rows ):
+        
+        def b( phash ):
+            
+            if phash is None:
                 
-                if num_pending_rescinded > 0:
-                    
-                    self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count - ? WHERE namespace_id = ? AND tag_id = ?;', ( num_added, num_pending_rescinded, namespace_id, tag_id ) )
-                    
-                elif num_added > 0:
-                    
-                    self._c.execute( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( namespace_id, tag_id, current_count, pending_count ) VALUES ( ?, ?, ?, ? );', ( namespace_id, tag_id, 0, 0 ) )
-                    
-                    self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ? WHERE namespace_id = ? AND tag_id = ?;', ( num_added, namespace_id, tag_id ) )
-                    
+                return None
                 
             
+            return sqlite3.Binary( phash )
+            
+        
+        self._c.executemany( 'INSERT OR REPLACE INTO shape_vptree ( phash, parent_phash, radius, inner_phash, inner_population, outer_phash, outer_population ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( ( b( phash ), b( parent_phash ), radius, b( inner_phash ), inner_population, b( outer_phash ), outer_population ) for ( phash, parent_phash, radius, inner_phash, inner_population, outer_phash, outer_population ) in rows ) )
         
     
-    def _CacheSpecificMappingsDrop( self, file_service_id, tag_service_id ):
+    def _CacheSimilarFilesMaintainTree( self, stop_time = None ):
         
-        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        phashes_to_regen = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_maintenance_branch_regen;' ) ]
         
-        self._c.execute( 'DROP TABLE ' + files_table_name + ';' )
+        if len( phashes_to_regen ) == 0:
+            
+            return
+            
         
-        self._c.execute( 'DROP TABLE ' + current_mappings_table_name + ';' )
+        job_key = ClientThreading.JobKey()
         
-        self._c.execute( 'DROP TABLE ' + pending_mappings_table_name + ';' )
+        job_key.SetVariable( 'popup_title', 'database maintenance - similar files tree' )
         
-        self._c.execute( 'DROP TABLE ' + ac_cache_table_name + ';' )
+        self._controller.pub( 'message', job_key )
         
-    
-    def _CacheSpecificMappingsDeleteFiles( self, file_service_id, tag_service_id, hash_ids ):
+        for ( i, phash ) in enumerate( phashes_to_regen ):
+            
+            if stop_time is not None and HydrusData.TimeHasPassed( stop_time ):
+                
+                break
+                
+            
+            text = 'rebalancing similar file metadata: ' + HydrusData.ConvertValueRangeToPrettyString( i + 1, len( phashes_to_regen ) )
+            
+            self._controller.pub( 'splash_set_status_text', text )
+            job_key.SetVariable( 'popup_text_1', text )
+            
+            self._CacheSimilarFilesRegenerateBranch( phash )
+            
         
-        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        job_key.SetVariable( 'popup_text_1', 'done!' )
         
-        self._c.executemany( 'DELETE FROM ' + files_table_name + ' WHERE hash_id = ?;', ( ( hash_id, ) for hash_id in hash_ids ) )
+        HydrusData.Print( job_key.ToString() )
         
-        ac_cache_changes = []
+        wx.CallLater( 1000 * 30, job_key.Delete )
         
-        for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
+    
+    def _CacheSimilarFilesRegenerateBranch( self, phash ):
+        
+        result = self._c.execute( 'SELECT parent_phash FROM shape_vptree WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ).fetchone()
+        
+        if result is None:
             
-            splayed_group_of_hash_ids = HydrusData.SplayListForDB( group_of_hash_ids )
+            # this node was already cleared out by an earlier regen of a larger branch
             
-            current_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + current_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+            self._c.execute( 'DELETE FROM shape_maintenance_branch_regen WHERE phash = ?;', ( sqlite3.Binary( phash ), ) )
             
-            current_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in current_mapping_ids_raw ] )
+            return
             
-            pending_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + pending_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+        
+        ( parent_phash, ) = result
+        
+        branch_phashes = set()
+        
+        next_phashes = [ phash ]
+        
+        while len( next_phashes ) > 0:
             
-            pending_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in pending_mapping_ids_raw ] )
+            branch_phashes.update( next_phashes )
             
-            all_ids_seen = set( current_mapping_ids_dict.keys() )
-            all_ids_seen.update( pending_mapping_ids_dict.keys() )
+            children = []
             
-            for ( namespace_id, tag_id ) in all_ids_seen:
-                
-                current_hash_ids = current_mapping_ids_dict[ ( namespace_id, tag_id ) ]
-                
-                num_current = len( current_hash_ids )
-                
-                if num_current > 0:
-                    
-                    self._c.executemany( 'DELETE FROM ' + current_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id = ?;', ( ( namespace_id, tag_id, hash_id ) for hash_id in current_hash_ids ) )
-                    
-                
-                pending_hash_ids = pending_mapping_ids_dict[ ( namespace_id, tag_id ) ]
+            for group in HydrusData.SplitListIntoChunks( next_phashes, 256 ):
                 
-                num_pending = len( pending_hash_ids )
+                select_statement = 'SELECT inner_phash, outer_phash FROM shape_vptree WHERE phash IN ( ' + ', '.join( '?' * len( group ) ) + ' );'
                 
-                if num_pending > 0:
+                for ( inner_phash, outer_phash ) in self._c.execute( select_statement, [ sqlite3.Binary( p ) for p in group ] ):
                     
-                    self._c.executemany( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id = ?;', ( ( namespace_id, tag_id, hash_id ) for hash_id in pending_hash_ids ) )
+                    if inner_phash is not None: children.append( inner_phash )
+                    if outer_phash is not None: children.append( outer_phash )
                     
                 
-                ac_cache_changes.append( ( namespace_id, tag_id, num_current, num_pending ) )
-                
-            
-        
-        if len( ac_cache_changes ) > 0:
             
-            self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count - ?, pending_count = pending_count - ? WHERE namespace_id = ? AND tag_id = ?;', ( ( num_current, num_pending, namespace_id, tag_id ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
-            
-            self._c.executemany( 'DELETE FROM ' + ac_cache_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND current_count = ? AND pending_count = ?;', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            next_phashes = children
             
         
-    
-    def _CacheSpecificMappingsDeleteMappings( self, file_service_id, tag_service_id, mappings_ids ):
+        useful_phashes = [ p for p in branch_phashes if self._c.execute( 'SELECT 1 FROM perceptual_hashes WHERE phash = ?;', ( sqlite3.Binary( p ), ) ).fetchone() is not None ]
         
-        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        num_removed = len( branch_phashes ) - len( useful_phashes )
         
-        for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
+        self._c.executemany( 'DELETE FROM shape_vptree WHERE phash = ?;', ( ( sqlite3.Binary( p ), ) for p in branch_phashes ) )
+        self._c.executemany( 'DELETE FROM shape_maintenance_branch_regen WHERE phash = ?;', ( ( sqlite3.Binary( p ), ) for p in branch_phashes ) )
+        
+        ( new_branch_root_phash, rows ) = ClientVPTree.GenerateVPTreeRows( useful_phashes, parent_phash )
+        
+        self._CacheSimilarFilesInsertNodes( rows )
+        
+        if parent_phash is not None:
             
-            hash_ids = self._CacheSpecificMappingsFilterHashIds( file_service_id, tag_service_id, hash_ids )
+            # point the parent at the new branch and correct the ancestors' populations for any nodes we pruned
             
-            if len( hash_ids ) > 0:
+            child_phash = phash
+            ancestor_phash = parent_phash
+            
+            while ancestor_phash is not None:
+                
+                ( ancestor_parent_phash, ancestor_inner_phash ) = self._c.execute( 'SELECT parent_phash, inner_phash FROM shape_vptree WHERE phash = ?;', ( sqlite3.Binary( ancestor_phash ), ) ).fetchone()
+                
+                child_is_inner = ancestor_inner_phash == child_phash
+                
+                if ancestor_phash == parent_phash:
+                    
+                    if new_branch_root_phash is None:
+                        
+                        new_child = None
+                        
+                    else:
+                        
+                        new_child = sqlite3.Binary( new_branch_root_phash )
+                        
+                    
+                    if child_is_inner:
+                        
+                        self._c.execute( 'UPDATE shape_vptree SET inner_phash = ? WHERE phash = ?;', ( new_child, sqlite3.Binary( ancestor_phash ) ) )
+                        
+                    else:
+                        
+                        self._c.execute( 'UPDATE shape_vptree SET outer_phash = ? WHERE phash = ?;', ( new_child, sqlite3.Binary( ancestor_phash ) ) )
+                        
+                    
+                
+                if num_removed > 0:
+                    
+                    if child_is_inner:
+                        
+                        self._c.execute( 'UPDATE shape_vptree SET inner_population = inner_population - ? WHERE phash = ?;', ( num_removed, sqlite3.Binary( ancestor_phash ) ) )
+                        
+                    else:
+                        
+                        self._c.execute( 'UPDATE shape_vptree SET outer_population = outer_population - ? WHERE phash = ?;', ( num_removed, sqlite3.Binary( ancestor_phash ) ) )
+                        
+                    
+                else:
+                    
+                    break
+                    
+                
+                child_phash = ancestor_phash
+                ancestor_phash = ancestor_parent_phash
+                
+            
+        
+    
+    def _CacheSimilarFilesRegenerateTree( self ):
+        
+        job_key = ClientThreading.JobKey()
+        
+        job_key.SetVariable( 'popup_title', 'regenerating similar files tree' )
+        job_key.SetVariable( 'popup_text_1', 'generating' )
+        
+        self._controller.pub( 'message', job_key )
+        
+        self._CacheSimilarFilesGenerateTree()
+        
+        job_key.SetVariable( 'popup_text_1', 'done!' )
+        
+    
+    def _CacheSimilarFilesSearch( self, search_phash, max_hamming ):
+        
+        result = self._c.execute( 'SELECT phash FROM shape_vptree WHERE parent_phash IS NULL;' ).fetchone()
+        
+        if result is None:
+            
+            return set()
+            
+        
+        ( root_phash, ) = result
+        
+        similar_phashes = []
+        
+        next_potentials = [ root_phash ]
+        
+        while len( next_potentials ) > 0:
+            
+            current_potentials = next_potentials
+            next_potentials = []
+            
+            for group in HydrusData.SplitListIntoChunks( current_potentials, 256 ):
+                
+                select_statement = 'SELECT phash, radius, inner_phash, outer_phash FROM shape_vptree WHERE phash IN ( ' + ', '.join( '?' * len( group ) ) + ' );'
+                
+                nodes = self._c.execute( select_statement, [ sqlite3.Binary( p ) for p in group ] ).fetchall()
+                
+                node_hamming_distances = HydrusData.GetHammingDistances( search_phash, HydrusData.ConvertPHashesToNumPyArray( [ node_phash for ( node_phash, node_radius, inner_phash, outer_phash ) in nodes ] ) )
+                
+                for ( ( node_phash, node_radius, inner_phash, outer_phash ), node_hamming_distance ) in zip( nodes, node_hamming_distances ):
+                    
+                    if node_hamming_distance <= max_hamming:
+                        
+                        similar_phashes.append( node_phash )
+                        
+                    
+                    if node_radius is not None:
+                        
+                        # inner holds everything within radius of this node, outer everything beyond it
+                        
+                        if inner_phash is not None and node_hamming_distance <= node_radius + max_hamming:
+                            
+                            next_potentials.append( inner_phash )
+                            
+                        
+                        if outer_phash is not None and node_hamming_distance + max_hamming > node_radius:
+                            
+                            next_potentials.append( outer_phash )
+                            
+                        
+                    
+                
+            
+        
+        similar_hash_ids = set()
+        
+        for phash in similar_phashes:
+            
+            similar_hash_ids.update( ( hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM perceptual_hashes WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ) ) )
+            
+        
+        return similar_hash_ids
+        
+    
+    def _CacheSpecificMappingsAddFiles( self, file_service_id, tag_service_id, hash_ids ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO ' + files_table_name + ' VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
+        
+        ac_cache_changes = []
+        
+        for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
+            
+            splayed_group_of_hash_ids = HydrusData.SplayListForDB( group_of_hash_ids )
+            
+            current_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + current_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+            
+            current_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in current_mapping_ids_raw ] )
+            
+            pending_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + pending_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+            
+            pending_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in pending_mapping_ids_raw ] )
+            
+            all_ids_seen = set( current_mapping_ids_dict.keys() )
+            all_ids_seen.update( pending_mapping_ids_dict.keys() )
+            
+            for ( namespace_id, tag_id ) in all_ids_seen:
+                
+                current_hash_ids = current_mapping_ids_dict[ ( namespace_id, tag_id ) ]
+                
+                num_current = len( current_hash_ids )
+                
+                if num_current > 0:
+                    
+                    self._c.executemany( 'INSERT OR IGNORE INTO ' + current_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) VALUES ( ?, ?, ? );', ( ( hash_id, namespace_id, tag_id ) for hash_id in current_hash_ids ) )
+                    
+                
+                pending_hash_ids = pending_mapping_ids_dict[ ( namespace_id, tag_id ) ]
+                
+                num_pending = len( pending_hash_ids )
+                
+                if num_pending > 0:
+                    
+                    self._c.executemany( 'INSERT OR IGNORE INTO ' + pending_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) VALUES ( ?, ?, ? );', ( ( hash_id, namespace_id, tag_id ) for hash_id in pending_hash_ids ) )
+                    
+                
+                if num_current > 0 or num_pending > 0:
+                    
+                    ac_cache_changes.append( ( namespace_id, tag_id, num_current, num_pending ) )
+                    
+                
+            
+        
+        if len( ac_cache_changes ) > 0:
+            
+            self._c.executemany( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( namespace_id, tag_id, current_count, pending_count ) VALUES ( ?, ?, ?, ? );', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            
+            self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count + ? WHERE namespace_id = ? AND tag_id = ?;', ( ( num_current, num_pending, namespace_id, tag_id ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            
+        
+    
+    def _CacheSpecificMappingsAddMappings( self, file_service_id, tag_service_id, mappings_ids ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
+            
+            hash_ids = self._CacheSpecificMappingsFilterHashIds( file_service_id, tag_service_id, hash_ids )
+            
+            if len( hash_ids ) > 0:
+                
+                self._c.executemany( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE hash_id = ? AND namespace_id = ? AND tag_id = ?;', ( ( hash_id, namespace_id, tag_id ) for hash_id in hash_ids ) )
+                
+                num_pending_rescinded = self._GetRowCount()
+                
+                #
+                
+                self._c.executemany( 'INSERT OR IGNORE INTO ' + current_mappings_table_name + ' ( hash_id, namespace_id, tag_id ) VALUES ( ?, ?, ? );', ( ( hash_id, namespace_id, tag_id ) for hash_id in hash_ids ) )
+                
+                num_added = self._GetRowCount()
+                
+                if num_pending_rescinded > 0:
+                    
+                    self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count - ? WHERE namespace_id = ? AND tag_id = ?;', ( num_added, num_pending_rescinded, namespace_id, tag_id ) )
+                    
+                elif num_added > 0:
+                    
+                    self._c.execute( 'INSERT OR IGNORE INTO ' + ac_cache_table_name + ' ( namespace_id, tag_id, current_count, pending_count ) VALUES ( ?, ?, ?, ? );', ( namespace_id, tag_id, 0, 0 ) )
+                    
+                    self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ? WHERE namespace_id = ? AND tag_id = ?;', ( num_added, namespace_id, tag_id ) )
+                    
+                
+            
+        
+    
+    def _CacheSpecificMappingsDrop( self, file_service_id, tag_service_id ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._c.execute( 'DROP TABLE ' + files_table_name + ';' )
+        
+        self._c.execute( 'DROP TABLE ' + current_mappings_table_name + ';' )
+        
+        self._c.execute( 'DROP TABLE ' + pending_mappings_table_name + ';' )
+        
+        self._c.execute( 'DROP TABLE ' + ac_cache_table_name + ';' )
+        
+    
+    def _CacheSpecificMappingsDeleteFiles( self, file_service_id, tag_service_id, hash_ids ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        self._c.executemany( 'DELETE FROM ' + files_table_name + ' WHERE hash_id = ?;', ( ( hash_id, ) for hash_id in hash_ids ) )
+        
+        ac_cache_changes = []
+        
+        for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
+            
+            splayed_group_of_hash_ids = HydrusData.SplayListForDB( group_of_hash_ids )
+            
+            current_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + current_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+            
+            current_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in current_mapping_ids_raw ] )
+            
+            pending_mapping_ids_raw = self._c.execute( 'SELECT namespace_id, tag_id, hash_id FROM ' + pending_mappings_table_name + ' WHERE hash_id IN ' + splayed_group_of_hash_ids + ';' ).fetchall()
+            
+            pending_mapping_ids_dict = HydrusData.BuildKeyToSetDict( [ ( ( namespace_id, tag_id ), hash_id ) for ( namespace_id, tag_id, hash_id ) in pending_mapping_ids_raw ] )
+            
+            all_ids_seen = set( current_mapping_ids_dict.keys() )
+            all_ids_seen.update( pending_mapping_ids_dict.keys() )
+            
+            for ( namespace_id, tag_id ) in all_ids_seen:
+                
+                current_hash_ids = current_mapping_ids_dict[ ( namespace_id, tag_id ) ]
+                
+                num_current = len( current_hash_ids )
+                
+                if num_current > 0:
+                    
+                    self._c.executemany( 'DELETE FROM ' + current_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id = ?;', ( ( namespace_id, tag_id, hash_id ) for hash_id in current_hash_ids ) )
+                    
+                
+                pending_hash_ids = pending_mapping_ids_dict[ ( namespace_id, tag_id ) ]
+                
+                num_pending = len( pending_hash_ids )
+                
+                if num_pending > 0:
+                    
+                    self._c.executemany( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id = ?;', ( ( namespace_id, tag_id, hash_id ) for hash_id in pending_hash_ids ) )
+                    
+                
+                ac_cache_changes.append( ( namespace_id, tag_id, num_current, num_pending ) )
+                
+            
+        
+        if len( ac_cache_changes ) > 0:
+            
+            self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count - ?, pending_count = pending_count - ? WHERE namespace_id = ? AND tag_id = ?;', ( ( num_current, num_pending, namespace_id, tag_id ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            
+            self._c.executemany( 'DELETE FROM ' + ac_cache_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND current_count = ? AND pending_count = ?;', ( ( namespace_id, tag_id, 0, 0 ) for ( namespace_id, tag_id, num_current, num_pending ) in ac_cache_changes ) )
+            
+        
+    
+    def _CacheSpecificMappingsDeleteMappings( self, file_service_id, tag_service_id, mappings_ids ):
+        
+        ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, tag_service_id )
+        
+        for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
+            
+            hash_ids = self._CacheSpecificMappingsFilterHashIds( file_service_id, tag_service_id, hash_ids )
+            
+            if len( hash_ids ) > 0:
                 
                 self._c.executemany( 'DELETE FROM ' + current_mappings_table_name + ' WHERE hash_id = ? AND namespace_id = ? AND tag_id = ?;', ( ( hash_id, namespace_id, tag_id ) for hash_id in hash_ids ) )
                 
@@ -1845,114 +2363,10 @@ class DB( HydrusDB.HydrusDB ):
         job_key.Finish()
         
     
-    def _CheckFileIntegrity( self, mode, move_location = None ):
+    def _CleanUpCaches( self ):
         
-        prefix_string = 'checking file integrity: '
-        
-        job_key = ClientThreading.JobKey( cancellable = True )
-        
-        job_key.SetVariable( 'popup_text_1', prefix_string + 'preparing' )
-        
-        self._controller.pub( 'message', job_key )
-        
-        info = self._c.execute( 'SELECT hash_id, mime FROM current_files, files_info USING ( hash_id ) WHERE service_id IN ( ?, ? );', ( self._local_file_service_id, self._trash_service_id ) ).fetchall()
-        
-        missing_count = 0
-        deletee_hash_ids = []
-        
-        client_files_manager = self._controller.GetClientFilesManager()
-        
-        for ( i, ( hash_id, mime ) ) in enumerate( info ):
-            
-            ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-            
-            if should_quit:
-                
-                return
-                
-            
-            job_key.SetVariable( 'popup_text_1', prefix_string + HydrusData.ConvertValueRangeToPrettyString( i, len( info ) ) )
-            job_key.SetVariable( 'popup_gauge_1', ( i, len( info ) ) )
-            
-            hash = self._GetHash( hash_id )
-            
-            try:
-                
-                path = client_files_manager.GetFilePath( hash, mime )
-                
-            except HydrusExceptions.FileMissingException:
-                
-                print( 'Could not find the file for ' + hash.encode( 'hex' ) + '!' )
-                
-                deletee_hash_ids.append( hash_id )
-                
-                missing_count += 1
-                
-                continue
-                
-            
-            if mode == 'thorough':
-                
-                actual_hash = HydrusFileHandling.GetHashFromPath( path )
-                
-                if actual_hash != hash:
-                    
-                    deletee_hash_ids.append( hash_id )
-                    
-                    if move_location is not None:
-                        
-                        move_filename = 'believed ' + hash.encode( 'hex' ) + ' actually ' + actual_hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ]
-                        
-                        move_path = os.path.join( move_location, move_filename )
-                        
-                        shutil.move( path, move_path )
-                        
-                    
-                
-            
-        
-        job_key.DeleteVariable( 'popup_gauge_1' )
-        job_key.SetVariable( 'popup_text_1', prefix_string + 'deleting the incorrect records' )
-        
-        self._DeleteFiles( self._local_file_service_id, deletee_hash_ids )
-        self._DeleteFiles( self._trash_service_id, deletee_hash_ids )
-        
-        final_text = 'done! '
-        
-        if len( deletee_hash_ids ) == 0:
-            
-            final_text += 'all files ok!'
-            
-        else:
-            
-            final_text += HydrusData.ConvertIntToPrettyString( missing_count ) + ' files were missing!'
-            
-            if mode == 'thorough':
-                
-                final_text += ' ' + HydrusData.ConvertIntToPrettyString( len( deletee_hash_ids ) - missing_count ) + ' files were incorrect and thus '
-                
-                if move_location is None:
-                    
-                    final_text += 'deleted!'
-                    
-                else:
-                    
-                    final_text += 'moved!'
-                    
-                
-            
-        
-        job_key.SetVariable( 'popup_text_1', prefix_string + final_text )
-        
-        HydrusData.Print( job_key.ToString() )
-        
-        job_key.Finish()
-        
-    
-    def _CleanUpCaches( self ):
-        
-        self._subscriptions_cache = {}
-        self._service_cache = {}
+        self._subscriptions_cache = {}
+        self._service_cache = {}
         
     
     def _CreateDB( self ):
@@ -2076,6 +2490,7 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'CREATE TABLE options ( options TEXT_YAML );', )
         
         self._c.execute( 'CREATE TABLE perceptual_hashes ( hash_id INTEGER PRIMARY KEY, phash BLOB_BYTES );' )
+        self._c.execute( 'CREATE INDEX perceptual_hashes_phash_index ON perceptual_hashes ( phash );' )
         
         self._c.execute( 'CREATE TABLE remote_ratings ( service_id INTEGER REFERENCES services ON DELETE CASCADE, hash_id INTEGER, count INTEGER, rating REAL, score REAL, PRIMARY KEY( service_id, hash_id ) );' )
         self._c.execute( 'CREATE INDEX remote_ratings_hash_id_index ON remote_ratings ( hash_id );' )
@@ -2122,12 +2537,23 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.namespaces ( namespace_id INTEGER PRIMARY KEY, namespace TEXT UNIQUE );' )
         
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.namespaces_trigrams ( trigram TEXT, namespace_id INTEGER, PRIMARY KEY ( trigram, namespace_id ) ) WITHOUT ROWID;' )
+        
         self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.tags ( tag_id INTEGER PRIMARY KEY, tag TEXT UNIQUE );' )
         
         self._c.execute( 'CREATE VIRTUAL TABLE IF NOT EXISTS external_master.tags_fts4 USING fts4( tag );' )
         
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.tags_trigrams ( trigram TEXT, tag_id INTEGER, PRIMARY KEY ( trigram, tag_id ) ) WITHOUT ROWID;' )
+        
         self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.texts ( text_id INTEGER PRIMARY KEY, text TEXT UNIQUE );' )
         
+        # caches
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.shape_vptree ( phash BLOB_BYTES PRIMARY KEY, parent_phash BLOB_BYTES, radius INTEGER, inner_phash BLOB_BYTES, inner_population INTEGER, outer_phash BLOB_BYTES, outer_population INTEGER );' )
+        self._c.execute( 'CREATE INDEX IF NOT EXISTS external_caches.shape_vptree_parent_phash_index ON shape_vptree ( parent_phash );' )
+        
+        self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.shape_maintenance_branch_regen ( phash BLOB_BYTES PRIMARY KEY );' )
+        
         # inserts
         
         location = HydrusPaths.ConvertAbsPathToPortablePath( client_files_default )
@@ -2172,6 +2598,16 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'COMMIT;' )
         
     
+    def _DeleteFileRecords( self, hash_ids ):
+        
+        # the file integrity check found these missing or incorrect, so they can no longer be in the local file services
+        
+        self._DeleteFiles( self._local_file_service_id, hash_ids )
+        self._DeleteFiles( self._trash_service_id, hash_ids )
+        
+        self._NotifyMediaResultsChanged( hash_ids )
+        
+    
     def _DeleteFiles( self, service_id, hash_ids, files_being_undeleted = False ):
         
         splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
@@ -2322,6 +2758,8 @@ class DB( HydrusDB.HydrusDB ):
             
             client_files_manager.DeleteFiles( file_hashes )
             
+            self._CacheSimilarFilesDisassociatePHashes( deletable_file_hash_ids )
+            
         
         useful_thumbnail_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id != ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';', ( self._trash_service_id, ) ) }
         
@@ -2667,7 +3105,7 @@ class DB( HydrusDB.HydrusDB ):
                 
                 # the issue is that the tokenizer for fts4 doesn't like weird characters
                 # a search for '[s' actually only does 's'
-                # so, let's do the old and slower LIKE instead of MATCH in weird cases
+                # so, let's do a LIKE instead of MATCH in weird cases, narrowed down by the trigram index
                 
                 # note that queries with '*' are also passed to LIKE, because MATCH only supports appended wildcards 'gun*', and not complex stuff like '*gun*'
                 
@@ -2688,7 +3126,7 @@ class DB( HydrusDB.HydrusDB ):
                         possible_tag_ids_half_complete_tag += '%'
                         
                     
-                    return [ tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag LIKE ? OR tag LIKE ?;', ( possible_tag_ids_half_complete_tag, '% ' + possible_tag_ids_half_complete_tag ) ) ]
+                    return self._GetTagIdsFromLikePattern( possible_tag_ids_half_complete_tag )
                     
                 
             
@@ -2706,7 +3144,7 @@ class DB( HydrusDB.HydrusDB ):
                         
                         wildcard_namespace = namespace.replace( '*', '%' )
                 
-                        possible_namespace_ids = [ namespace_id for ( namespace_id, ) in self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace LIKE ?;', ( wildcard_namespace, ) ) ]
+                        possible_namespace_ids = self._GetNamespaceIdsFromLikePattern( wildcard_namespace )
                         
                         predicates_phrase_1 = 'namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids )
                         
@@ -2791,6 +3229,11 @@ class DB( HydrusDB.HydrusDB ):
         return predicates
         
     
+    def _GetCommittedCaches( self ):
+        
+        return { 'inbox_hash_ids' : frozenset( self._inbox_hash_ids ) }
+        
+    
     def _GetClientFilesLocations( self ):
         
         result = { prefix : HydrusPaths.ConvertPortablePathToAbsPath( location ) for ( prefix, location ) in self._c.execute( 'SELECT prefix, location FROM client_files_locations;' ) }
@@ -2840,6 +3283,236 @@ class DB( HydrusDB.HydrusDB ):
         return desired_hashes
         
     
+    def _GetFileQueryClause( self, description, include, from_phrase, hash_id_column, predicates, estimate ):
+        
+        select_statement = 'SELECT ' + hash_id_column + ' FROM ' + from_phrase
+        
+        if len( predicates ) > 0:
+            
+            select_statement += ' WHERE ' + ' AND '.join( predicates )
+            
+        
+        exists_phrase = 'EXISTS ( SELECT 1 FROM ' + from_phrase + ' WHERE ' + ' AND '.join( [ hash_id_column + ' = temp_file_query_hash_ids.hash_id' ] + predicates ) + ' )'
+        
+        return FileQueryClause( description, include, exists_phrase, estimate = estimate, select_statements = [ select_statement ] )
+        
+    
+    def _GetFileQueryHasTagsClause( self, include, search_tag_service_ids, include_current_tags, include_pending_tags ):
+        
+        estimate = 0
+        
+        for search_tag_service_id in search_tag_service_ids:
+            
+            num_files = self._GetServiceInfoEstimate( search_tag_service_id, HC.SERVICE_INFO_NUM_FILES )
+            
+            if num_files is None:
+                
+                estimate = None
+                
+                break
+                
+            
+            estimate += num_files
+            
+        
+        if include_current_tags and include_pending_tags:
+            
+            predicates = []
+            
+        elif include_current_tags:
+            
+            predicates = [ 'current_count > 0' ]
+            
+        elif include_pending_tags:
+            
+            predicates = [ 'pending_count > 0' ]
+            
+        else:
+            
+            return FileQueryClause( 'with tags', include, '0', estimate = 0, select_statements = [] )
+            
+        
+        select_statements = []
+        exists_phrases = []
+        
+        for search_tag_service_id in search_tag_service_ids:
+            
+            tag_counts_cache_table_name = GenerateCombinedFilesTagCountsCacheTableName( search_tag_service_id )
+            
+            select_statement = 'SELECT hash_id FROM ' + tag_counts_cache_table_name
+            
+            if len( predicates ) > 0:
+                
+                select_statement += ' WHERE ' + ' AND '.join( predicates )
+                
+            
+            select_statements.append( select_statement )
+            exists_phrases.append( 'EXISTS ( SELECT 1 FROM ' + tag_counts_cache_table_name + ' WHERE ' + ' AND '.join( [ 'hash_id = temp_file_query_hash_ids.hash_id' ] + predicates ) + ' )' )
+            
+        
+        return FileQueryClause( 'with tags', include, ' OR '.join( exists_phrases ), estimate = estimate, select_statements = select_statements )
+        
+    
+    def _GetFileQueryMappingsClause( self, description, include, mappings_table_names, phrases, estimate = None ):
+        
+        # a phrase of None matches any mapping at all
+        
+        select_statements = []
+        exists_phrases = []
+        
+        for mappings_table_name in mappings_table_names:
+            
+            for phrase in phrases:
+                
+                if phrase is None:
+                    
+                    select_statements.append( 'SELECT DISTINCT hash_id FROM ' + mappings_table_name )
+                    exists_phrases.append( 'EXISTS ( SELECT 1 FROM ' + mappings_table_name + ' WHERE hash_id = temp_file_query_hash_ids.hash_id )' )
+                    
+                else:
+                    
+                    select_statements.append( 'SELECT hash_id FROM ' + mappings_table_name + ' WHERE ' + phrase )
+                    exists_phrases.append( 'EXISTS ( SELECT 1 FROM ' + mappings_table_name + ' WHERE hash_id = temp_file_query_hash_ids.hash_id AND ' + phrase + ' )' )
+                    
+                
+            
+        
+        if len( exists_phrases ) == 0:
+            
+            exists_phrase = '0'
+            
+        else:
+            
+            exists_phrase = ' OR '.join( exists_phrases )
+            
+        
+        return FileQueryClause( description, include, exists_phrase, estimate = estimate, select_statements = select_statements )
+        
+    
+    def _GetFileQueryPlan( self, search_context ):
+        
+        plan_lines = []
+        
+        self._GetHashIdsFromQuery( search_context, plan_lines = plan_lines )
+        
+        return plan_lines
+        
+    
+    def _GetFileQueryTagClause( self, include, tag, file_service_id, file_service_type, search_tag_service_ids, mappings_table_names, include_current_tags, include_pending_tags ):
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        phrases = []
+        ac_phrases = []
+        
+        for sibling_tag in siblings_manager.GetAllSiblings( tag ):
+            
+            if not self._TagExists( sibling_tag ):
+                
+                continue
+                
+            
+            try: ( namespace_id, tag_id ) = self._GetNamespaceIdTagId( sibling_tag )
+            except HydrusExceptions.SizeException: continue
+            
+            if ':' in sibling_tag:
+                
+                phrase = 'namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id )
+                
+                phrases.append( phrase )
+                ac_phrases.append( phrase )
+                
+            else:
+                
+                phrases.append( 'tag_id = ' + str( tag_id ) )
+                ac_phrases.append( 'namespace_id IN ( SELECT namespace_id FROM namespaces ) AND tag_id = ' + str( tag_id ) )
+                
+            
+        
+        # the autocomplete counts are cheap to get and will overcount a little if a file has more than one sibling, which is fine for an estimate
+        
+        estimate = 0
+        
+        for search_tag_service_id in search_tag_service_ids:
+            
+            if file_service_type in ( HC.LOCAL_FILE, HC.FILE_REPOSITORY ):
+                
+                ( files_table_name, current_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
+                
+            else:
+                
+                ac_cache_table_name = GenerateCombinedFilesMappingsCacheTableName( search_tag_service_id )
+                
+            
+            for ac_phrase in ac_phrases:
+                
+                ( current_count, pending_count ) = self._c.execute( 'SELECT SUM( current_count ), SUM( pending_count ) FROM ' + ac_cache_table_name + ' WHERE ' + ac_phrase + ';' ).fetchone()
+                
+                if include_current_tags and current_count is not None:
+                    
+                    estimate += current_count
+                    
+                
+                if include_pending_tags and pending_count is not None:
+                    
+                    estimate += pending_count
+                    
+                
+            
+        
+        return self._GetFileQueryMappingsClause( 'tagged "' + tag + '"', include, mappings_table_names, phrases, estimate = estimate )
+        
+    
+    def _GetFileQueryTagCountClause( self, search_tag_service_ids, include_current_tags, include_pending_tags, count_predicates ):
+        
+        if include_current_tags and include_pending_tags:
+            
+            count_column = 'total_count'
+            
+        elif include_current_tags:
+            
+            count_column = 'current_count'
+            
+        else:
+            
+            count_column = 'pending_count'
+            
+        
+        description = 'with ' + ' AND '.join( ( 'num_tags ' + operator + ' ' + str( value ) for ( operator, value ) in count_predicates ) )
+        
+        # files with no tags are not in the count tables, so a missing row counts as zero
+        
+        tag_counts_cache_table_names = [ GenerateCombinedFilesTagCountsCacheTableName( search_tag_service_id ) for search_tag_service_id in search_tag_service_ids ]
+        
+        count_phrase = ' + '.join( ( 'IFNULL( ( SELECT ' + count_column + ' FROM ' + tag_counts_cache_table_name + ' WHERE hash_id = temp_file_query_hash_ids.hash_id ), 0 )' for tag_counts_cache_table_name in tag_counts_cache_table_names ) )
+        
+        if not ( include_current_tags or include_pending_tags ) or len( tag_counts_cache_table_names ) == 0:
+            
+            count_phrase = '0'
+            
+        
+        exists_phrase = ' AND '.join( ( '( ' + count_phrase + ' ) ' + operator + ' ' + str( value ) for ( operator, value ) in count_predicates ) )
+        
+        # if zero tags would not pass, we can start from an index range scan of the count table
+        
+        zero_passes = False not in ( operator == '<' for ( operator, value ) in count_predicates )
+        
+        if len( tag_counts_cache_table_names ) == 1 and ( include_current_tags or include_pending_tags ) and not zero_passes:
+            
+            ( tag_counts_cache_table_name, ) = tag_counts_cache_table_names
+            
+            where_phrase = ' WHERE ' + ' AND '.join( ( count_column + ' ' + operator + ' ' + str( value ) for ( operator, value ) in count_predicates ) )
+            
+            ( estimate, ) = self._c.execute( 'SELECT COUNT( * ) FROM ' + tag_counts_cache_table_name + where_phrase + ';' ).fetchone()
+            
+            return FileQueryClause( description, True, exists_phrase, estimate = estimate, select_statements = [ 'SELECT hash_id FROM ' + tag_counts_cache_table_name + where_phrase ] )
+            
+        else:
+            
+            return FileQueryClause( description, True, exists_phrase )
+            
+        
+    
     def _GetFileSystemPredicates( self, service_key ):
         
         service_id = self._GetServiceId( service_key )
@@ -2913,6 +3586,22 @@ class DB( HydrusDB.HydrusDB ):
         return predicates
         
     
+    def _GetGroupCommitWindow( self ):
+        
+        new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+        
+        group_commit_window_ms = new_options.GetNoneableInteger( 'db_group_commit_window_ms' )
+        
+        if group_commit_window_ms is None:
+            
+            return None
+            
+        else:
+            
+            return group_commit_window_ms / 1000.0
+            
+        
+    
     def _GetHash( self, hash_id ):
         
         result = self._c.execute( 'SELECT hash FROM hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
@@ -2985,65 +3674,135 @@ class DB( HydrusDB.HydrusDB ):
         return hash_ids
         
     
-    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ):
-        
-        file_service_id = self._GetServiceId( file_service_key )
-        tag_service_id = self._GetServiceId( tag_service_key )
-        namespace_id = self._GetNamespaceId( namespace )
+    def _GetHashIdsFromFileQueryClauses( self, clauses, plan_lines ):
         
-        current_selects = []
-        pending_selects = []
-        
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
-            
-        else:
-            
-            search_tag_service_ids = [ tag_service_id ]
+        def ConvertEstimateToString( estimate ):
             
-        
-        for search_tag_service_id in search_tag_service_ids:
-            
-            ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-            
-            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+            if estimate is None:
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ';' )
+                return 'unknown'
                 
             else:
                 
-                current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ';' )
-                pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ';' )
+                return HydrusData.ConvertIntToPrettyString( estimate )
                 
             
         
-        hash_ids = set()
-        
-        if include_current_tags:
+        def Explain( statement ):
             
-            for current_select in current_selects:
+            if plan_lines is not None:
                 
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
+                plan_lines.extend( ( '    ' + row[-1] for row in self._c.execute( 'EXPLAIN QUERY PLAN ' + statement ) ) )
                 
             
         
-        if include_pending_tags:
-            
-            for pending_select in pending_selects:
+        # start from the clause that will give us the fewest files, then whittle them down with the most selective clauses first
+        
+        start_clause = min( ( clause for clause in clauses if clause.CanStart() ), key = lambda clause: clause.GetSortKey() )
+        
+        include_clauses = [ clause for clause in clauses if clause.IsInclude() and clause != start_clause ]
+        exclude_clauses = [ clause for clause in clauses if not clause.IsInclude() ]
+        
+        include_clauses.sort( key = lambda clause: clause.GetSortKey() )
+        exclude_clauses.sort( key = lambda clause: clause.GetSortKey() )
+        
+        self._c.execute( 'CREATE TABLE mem.temp_file_query_hash_ids ( hash_id INTEGER PRIMARY KEY );' )
+        
+        try:
+            
+            if plan_lines is not None:
+                
+                plan_lines.append( 'start with ' + start_clause.GetDescription() + ' (estimated ' + ConvertEstimateToString( start_clause.GetEstimate() ) + ')' )
+                
+            
+            hash_ids = start_clause.GetHashIds()
+            
+            if hash_ids is None:
+                
+                for select_statement in start_clause.GetSelectStatements():
+                    
+                    statement = 'INSERT OR IGNORE INTO mem.temp_file_query_hash_ids ( hash_id ) ' + select_statement + ';'
+                    
+                    Explain( statement )
+                    
+                    self._c.execute( statement )
+                    
+                
+            else:
+                
+                self._c.executemany( 'INSERT OR IGNORE INTO mem.temp_file_query_hash_ids ( hash_id ) VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
+                
+            
+            ( num_hash_ids, ) = self._c.execute( 'SELECT COUNT( * ) FROM mem.temp_file_query_hash_ids;' ).fetchone()
+            
+            if plan_lines is not None:
+                
+                plan_lines.append( '  ' + HydrusData.ConvertIntToPrettyString( num_hash_ids ) + ' files' )
+                
+            
+            for clause in include_clauses + exclude_clauses:
+                
+                if clause.IsInclude():
+                    
+                    step_text = 'keep only ' + clause.GetDescription()
+                    
+                    statement = 'DELETE FROM mem.temp_file_query_hash_ids WHERE NOT ( ' + clause.GetExistsPhrase() + ' );'
+                    
+                else:
+                    
+                    step_text = 'remove ' + clause.GetDescription()
+                    
+                    statement = 'DELETE FROM mem.temp_file_query_hash_ids WHERE ' + clause.GetExistsPhrase() + ';'
+                    
+                
+                if num_hash_ids == 0:
+                    
+                    if plan_lines is not None:
+                        
+                        plan_lines.append( 'skip ' + step_text + ', as there is nothing left' )
+                        
+                    
+                    continue
+                    
                 
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
+                if plan_lines is not None:
+                    
+                    plan_lines.append( step_text + ' (estimated ' + ConvertEstimateToString( clause.GetEstimate() ) + ')' )
+                    
+                
+                Explain( statement )
+                
+                self._c.execute( statement )
+                
+                num_hash_ids -= self._c.rowcount
                 
+                if plan_lines is not None:
+                    
+                    plan_lines.append( '  ' + HydrusData.ConvertIntToPrettyString( num_hash_ids ) + ' files' )
+                    
+                
+            
+            query_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM mem.temp_file_query_hash_ids;' ) }
+            
+        finally:
+            
+            self._c.execute( 'DROP TABLE mem.temp_file_query_hash_ids;' )
             
         
-        return hash_ids
+        return query_hash_ids
         
     
-    def _GetHashIdsFromQuery( self, search_context ):
+    def _GetHashIdsFromQuery( self, search_context, plan_lines = None ):
         
         self._controller.ResetIdleTimer()
         
+        report_plan = plan_lines is None and HydrusGlobals.query_planner_mode
+        
+        if report_plan:
+            
+            plan_lines = []
+            
+        
         system_predicates = search_context.GetSystemPredicates()
         
         file_service_key = search_context.GetFileServiceKey()
@@ -3162,58 +3921,76 @@ class DB( HydrusDB.HydrusDB ):
             else: files_info_predicates.append( '( duration < ' + str( max_duration ) + ' OR duration IS NULL )' )
             
         
-        if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
+        #
+        
+        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+            
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            search_tag_service_ids = [ tag_service_id ]
+            
+        
+        mappings_table_names = []
+        
+        for search_tag_service_id in search_tag_service_ids:
             
-            query_hash_ids = None
+            ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
             
-            if len( tags_to_include ) > 0:
+            if include_current_tags:
                 
-                query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_include ) )
+                mappings_table_names.append( current_mappings_table_name )
                 
             
-            if len( namespaces_to_include ) > 0:
-                
-                namespace_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) for namespace in namespaces_to_include ) )
+            if include_pending_tags:
                 
-                if query_hash_ids is None: query_hash_ids = namespace_query_hash_ids
-                else: query_hash_ids.intersection_update( namespace_query_hash_ids )
+                mappings_table_names.append( pending_mappings_table_name )
                 
             
-            if len( wildcards_to_include ) > 0:
-                
-                wildcard_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) for wildcard in wildcards_to_include ) )
+        
+        clauses = []
+        
+        if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+            
+            if len( tags_to_include ) == 0 and len( namespaces_to_include ) == 0 and len( wildcards_to_include ) == 0:
                 
-                if query_hash_ids is None: query_hash_ids = wildcard_query_hash_ids
-                else: query_hash_ids.intersection_update( wildcard_query_hash_ids )
+                clauses.append( self._GetFileQueryHasTagsClause( True, search_tag_service_ids, include_current_tags, include_pending_tags ) )
                 
             
             if len( files_info_predicates ) > 0:
                 
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                    
-                    query_hash_ids.intersection_update( [ id for ( id, ) in self._c.execute( 'SELECT hash_id FROM files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ] )
-                    
-                else:
-                    
-                    files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
-                    
-                    query_hash_ids.intersection_update( [ id for ( id, ) in self._c.execute( 'SELECT hash_id FROM current_files, files_info USING ( hash_id ) WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) ] )
-                    
+                clauses.append( self._GetFileQueryClause( 'with ' + ' AND '.join( files_info_predicates ), True, 'files_info', 'files_info.hash_id', files_info_predicates, self._GetTableRowCountEstimate( 'files_info' ) ) )
                 
             
         else:
             
-            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+            description = 'in ' + file_service.GetName()
+            
+            if len( files_info_predicates ) > 0:
                 
-                query_hash_ids = self._GetHashIdsThatHaveTags( tag_service_key, include_current_tags, include_pending_tags )
+                description += ' with ' + ' AND '.join( files_info_predicates )
                 
-            else:
+                from_phrase = 'current_files, files_info USING ( hash_id )'
                 
-                files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
+            else:
                 
-                query_hash_ids = { id for ( id, ) in self._c.execute( 'SELECT hash_id FROM current_files, files_info USING ( hash_id ) WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) }
+                from_phrase = 'current_files'
                 
             
+            predicates = [ 'current_files.service_id = ' + str( file_service_id ) ] + files_info_predicates
+            
+            clauses.append( self._GetFileQueryClause( description, True, from_phrase, 'current_files.hash_id', predicates, self._GetServiceInfoEstimate( file_service_id, HC.SERVICE_INFO_NUM_FILES ) ) )
+            
+        
+        for tag in tags_to_include: clauses.append( self._GetFileQueryTagClause( True, tag, file_service_id, file_service_type, search_tag_service_ids, mappings_table_names, include_current_tags, include_pending_tags ) )
+        for tag in tags_to_exclude: clauses.append( self._GetFileQueryTagClause( False, tag, file_service_id, file_service_type, search_tag_service_ids, mappings_table_names, include_current_tags, include_pending_tags ) )
+        
+        for namespace in namespaces_to_include: clauses.append( self._GetFileQueryMappingsClause( 'with a "' + namespace + ':" tag', True, mappings_table_names, [ 'namespace_id = ' + str( self._GetNamespaceId( namespace ) ) ] ) )
+        for namespace in namespaces_to_exclude: clauses.append( self._GetFileQueryMappingsClause( 'with a "' + namespace + ':" tag', False, mappings_table_names, [ 'namespace_id = ' + str( self._GetNamespaceId( namespace ) ) ] ) )
+        
+        for wildcard in wildcards_to_include: clauses.append( self._GetFileQueryMappingsClause( 'tagged "' + wildcard + '"', True, mappings_table_names, [ self._GetMappingsPhraseFromWildcard( wildcard ) ] ) )
+        for wildcard in wildcards_to_exclude: clauses.append( self._GetFileQueryMappingsClause( 'tagged "' + wildcard + '"', False, mappings_table_names, [ self._GetMappingsPhraseFromWildcard( wildcard ) ] ) )
         
         #
         
@@ -3221,30 +3998,30 @@ class DB( HydrusDB.HydrusDB ):
             
             ( search_hash, search_hash_type ) = simple_preds[ 'hash' ]
             
+            description = 'with ' + search_hash_type + ' hash ' + search_hash.encode( 'hex' )
+            
             if search_hash_type != 'sha256':
                 
                 result = self._GetFileHashes( [ search_hash ], search_hash_type, 'sha256' )
                 
                 if len( result ) == 0:
                     
-                    query_hash_ids = {}
+                    hash_ids = set()
                     
                 else:
                     
                     ( search_hash, ) = result
                     
-                    hash_id = self._GetHashId( search_hash )
-                    
-                    query_hash_ids.intersection_update( { hash_id } )
+                    hash_ids = { self._GetHashId( search_hash ) }
                     
                 
             else:
                 
-                hash_id = self._GetHashId( search_hash )
-                
-                query_hash_ids.intersection_update( { hash_id } )
+                hash_ids = { self._GetHashId( search_hash ) }
                 
             
+            clauses.append( FileQueryClause( description, True, 'temp_file_query_hash_ids.hash_id IN ' + HydrusData.SplayListForDB( hash_ids ), estimate = len( hash_ids ), hash_ids = hash_ids ) )
+            
         
         #
         
@@ -3252,455 +4029,189 @@ class DB( HydrusDB.HydrusDB ):
             
             ( similar_to_hash, max_hamming ) = system_predicates.GetSimilarTo()
             
+            description = 'similar to ' + similar_to_hash.encode( 'hex' ) + ' (max distance ' + str( max_hamming ) + ')'
+            
             hash_id = self._GetHashId( similar_to_hash )
             
             result = self._c.execute( 'SELECT phash FROM perceptual_hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
             
             if result is None:
                 
-                query_hash_ids = set()
+                similar_hash_ids = set()
                 
             else:
                 
                 ( phash, ) = result
                 
-                similar_hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM perceptual_hashes WHERE hydrus_hamming( phash, ? ) <= ?;', ( sqlite3.Binary( phash ), max_hamming ) ) ]
+                similar_hash_ids = set( self._CacheSimilarFilesSearch( phash, max_hamming ) )
                 
-                query_hash_ids.intersection_update( similar_hash_ids )
-                
-            
-        
-        #
-        
-        exclude_query_hash_ids = set()
-        
-        for tag in tags_to_exclude: exclude_query_hash_ids.update( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) )
-        
-        for namespace in namespaces_to_exclude: exclude_query_hash_ids.update( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) )
-        
-        for wildcard in wildcards_to_exclude: exclude_query_hash_ids.update( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) )
-        
-        query_hash_ids.difference_update( exclude_query_hash_ids )
-        
-        #
-        
-        ( file_services_to_include_current, file_services_to_include_pending, file_services_to_exclude_current, file_services_to_exclude_pending ) = system_predicates.GetFileServiceInfo()
-        
-        for service_key in file_services_to_include_current:
-            
-            service_id = self._GetServiceId( service_key )
             
-            query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ] )
-            
-        
-        for service_key in file_services_to_include_pending:
-            
-            service_id = self._GetServiceId( service_key )
-            
-            query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_transfers WHERE service_id = ?;', ( service_id, ) ) ] )
-            
-        
-        for service_key in file_services_to_exclude_current:
-            
-            service_id = self._GetServiceId( service_key )
-            
-            query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( service_id, ) ) ] )
-            
-        
-        for service_key in file_services_to_exclude_pending:
-            
-            service_id = self._GetServiceId( service_key )
-            
-            query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_transfers WHERE service_id = ?;', ( service_id, ) ) ] )
-            
-        
-        for ( operator, value, service_key ) in system_predicates.GetRatingsPredicates():
-            
-            service_id = self._GetServiceId( service_key )
-            
-            if value == 'rated': query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ?;', ( service_id, ) ) ] )
-            elif value == 'not rated': query_hash_ids.difference_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ?;', ( service_id, ) ) ] )
-            else:
-                
-                if operator == u'\u2248': predicate = str( value * 0.95 ) + ' < rating AND rating < ' + str( value * 1.05 )
-                else: predicate = 'rating ' + operator + ' ' + str( value )
-                
-                query_hash_ids.intersection_update( [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM local_ratings WHERE service_id = ? AND ' + predicate + ';', ( service_id, ) ) ] )
-                
+            clauses.append( FileQueryClause( description, True, 'temp_file_query_hash_ids.hash_id IN ' + HydrusData.SplayListForDB( similar_hash_ids ), estimate = len( similar_hash_ids ), hash_ids = similar_hash_ids ) )
             
         
         #
         
-        must_be_local = system_predicates.MustBeLocal() or system_predicates.MustBeArchive()
-        must_not_be_local = system_predicates.MustNotBeLocal()
-        must_be_inbox = system_predicates.MustBeInbox()
-        must_be_archive = system_predicates.MustBeArchive()
-        
-        if file_service_type == HC.LOCAL_FILE:
-            
-            if must_not_be_local:
-                
-                query_hash_ids = set()
-                
-            
-        elif must_be_local or must_not_be_local:
-            
-            local_hash_ids = [ id for ( id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ?;', ( self._local_file_service_id, ) ) ]
-            
-            if must_be_local:
-                
-                query_hash_ids.intersection_update( local_hash_ids )
-                
-            elif must_not_be_local:
-                
-                query_hash_ids.difference_update( local_hash_ids )
-                
-            
-        
-        if must_be_inbox:
-            
-            query_hash_ids.intersection_update( self._inbox_hash_ids )
-            
-        elif must_be_archive:
-            
-            query_hash_ids.difference_update( self._inbox_hash_ids )
-            
-        
-        #
-        
-        num_tags_zero = False
-        num_tags_nonzero = False
-        max_num_tags_exists = False
-        
-        tag_predicates = []
-        
-        if 'min_num_tags' in simple_preds:
-            
-            min_num_tags = simple_preds[ 'min_num_tags' ]
-            
-            if min_num_tags == 0:
-                
-                num_tags_nonzero = True
-                
-            else:
-                
-                tag_predicates.append( lambda x: x > min_num_tags )
-                
-            
-        
-        if 'num_tags' in simple_preds:
-            
-            num_tags = simple_preds[ 'num_tags' ]
-            
-            if num_tags == 0:
-                
-                num_tags_zero = True
-                
-            else:
-                
-                tag_predicates.append( lambda x: x == num_tags )
-                
-            
-        
-        if 'max_num_tags' in simple_preds:
-            
-            max_num_tags = simple_preds[ 'max_num_tags' ]
-            
-            if max_num_tags == 1:
-                
-                num_tags_zero = True
-                
-            else:
-                
-                tag_predicates.append( lambda x: x < max_num_tags )
-                
-            
-        
-        tag_predicates_care_about_zero_counts = len( tag_predicates ) > 0 and False not in ( pred( 0 ) for pred in tag_predicates )
-        
-        if num_tags_zero or num_tags_nonzero or tag_predicates_care_about_zero_counts:
-            
-            nonzero_tag_query_hash_ids = self._GetHashIdsThatHaveTags( tag_service_key, include_current_tags, include_pending_tags )
-            
-            if num_tags_zero:
-                
-                query_hash_ids.difference_update( nonzero_tag_query_hash_ids )
-                
-            elif num_tags_nonzero:
-                
-                query_hash_ids.intersection_update( nonzero_tag_query_hash_ids )
-                
-            
-        
-        if len( tag_predicates ) > 0:
-            
-            hash_id_tag_counts = self._GetHashIdsTagCounts( tag_service_key, include_current_tags, include_pending_tags )
-            
-            good_tag_count_hash_ids = { id for ( id, count ) in hash_id_tag_counts if False not in ( pred( count ) for pred in tag_predicates ) }
-            
-            if tag_predicates_care_about_zero_counts:
-                
-                zero_hash_ids = query_hash_ids.difference( nonzero_tag_query_hash_ids )
-                
-                good_tag_count_hash_ids.update( zero_hash_ids )
-                
-            
-            query_hash_ids.intersection_update( good_tag_count_hash_ids )
-            
-        
-        #
-        
-        limit = system_predicates.GetLimit()
-        
-        if limit is not None and limit <= len( query_hash_ids ):
-            
-            query_hash_ids = random.sample( query_hash_ids, limit )
-            
-        else:
-            
-            query_hash_ids = list( query_hash_ids )
-            
-        
-        return query_hash_ids
-        
-    
-    def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
-        
-        siblings_manager = self._controller.GetManager( 'tag_siblings' )
-        
-        tags = siblings_manager.GetAllSiblings( tag )
-        
-        file_service_id = self._GetServiceId( file_service_key )
-        
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
-            
-        else:
-            
-            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
-            
-        
-        hash_ids = set()
-        
-        for tag in tags:
-            
-            if not self._TagExists( tag ):
-                
-                continue
-                
-            
-            current_selects = []
-            pending_selects = []
-            
-            try: ( namespace_id, tag_id ) = self._GetNamespaceIdTagId( tag )
-            except HydrusExceptions.SizeException: continue
-            
-            if ':' in tag:
-                
-                for search_tag_service_id in search_tag_service_ids:
-                    
-                    ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                    
-                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        
-                    else:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id = ' + str( namespace_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        
-                    
-                
-            else:
-                
-                for search_tag_service_id in search_tag_service_ids:
-                    
-                    ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-                    
-                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE tag_id = ' + str( tag_id ) + ';' )
-                        
-                    else:
-                        
-                        current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id = ' + str( tag_id ) + ';' )
-                        
-                    
-                
-            
-            if include_current_tags:
-                
-                for current_select in current_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                    
-                
-            
-            if include_pending_tags:
-                
-                for pending_select in pending_selects:
-                    
-                    hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                    
-                
-            
-        
-        return hash_ids
-        
-    
-    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ):
-        
-        def GetNamespaceIdsFromWildcard( w ):
-            
-            if '*' in w:
-                
-                w = w.replace( '*', '%' )
-                
-                return { namespace_id for ( namespace_id, ) in self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace LIKE ?;', ( w, ) ) }
+        ( file_services_to_include_current, file_services_to_include_pending, file_services_to_exclude_current, file_services_to_exclude_pending ) = system_predicates.GetFileServiceInfo()
+        
+        for ( include, service_keys ) in ( ( True, file_services_to_include_current ), ( False, file_services_to_exclude_current ) ):
+            
+            for service_key in service_keys:
                 
-            else:
+                service_id = self._GetServiceId( service_key )
                 
-                namespace_id = self._GetNamespaceId( w )
+                description = 'in ' + self._GetService( service_id ).GetName()
                 
-                return [ namespace_id ]
+                clauses.append( self._GetFileQueryClause( description, include, 'current_files', 'current_files.hash_id', [ 'current_files.service_id = ' + str( service_id ) ], self._GetServiceInfoEstimate( service_id, HC.SERVICE_INFO_NUM_FILES ) ) )
                 
             
         
-        def GetTagIdsFromWildcard( w ):
+        for ( include, service_keys ) in ( ( True, file_services_to_include_pending ), ( False, file_services_to_exclude_pending ) ):
             
-            if '*' in w:
+            for service_key in service_keys:
                 
-                w = w.replace( '*', '%' )
+                service_id = self._GetServiceId( service_key )
+                
+                description = 'pending to ' + self._GetService( service_id ).GetName()
                 
-                return { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag LIKE ? or tag LIKE ?;', ( w, '% ' + w ) ) }
+                clauses.append( self._GetFileQueryClause( description, include, 'file_transfers', 'file_transfers.hash_id', [ 'file_transfers.service_id = ' + str( service_id ) ], self._GetTableRowCountEstimate( 'file_transfers' ) ) )
                 
+            
+        
+        for ( operator, value, service_key ) in system_predicates.GetRatingsPredicates():
+            
+            service_id = self._GetServiceId( service_key )
+            
+            service_name = self._GetService( service_id ).GetName()
+            
+            predicates = [ 'local_ratings.service_id = ' + str( service_id ) ]
+            
+            ratings_estimate = self._GetTableRowCountEstimate( 'local_ratings' )
+            
+            if value == 'rated': clauses.append( self._GetFileQueryClause( 'rated on ' + service_name, True, 'local_ratings', 'local_ratings.hash_id', predicates, ratings_estimate ) )
+            elif value == 'not rated': clauses.append( self._GetFileQueryClause( 'rated on ' + service_name, False, 'local_ratings', 'local_ratings.hash_id', predicates, ratings_estimate ) )
             else:
                 
-                ( namespace_id, tag_id ) = self._GetNamespaceIdTagId( w )
+                if operator == u'\u2248': predicate = str( value * 0.95 ) + ' < rating AND rating < ' + str( value * 1.05 )
+                else: predicate = 'rating ' + operator + ' ' + str( value )
                 
-                return [ tag_id ]
+                predicates.append( predicate )
+                
+                clauses.append( self._GetFileQueryClause( 'rated ' + operator + ' ' + str( value ) + ' on ' + service_name, True, 'local_ratings', 'local_ratings.hash_id', predicates, ratings_estimate ) )
                 
             
         
-        file_service_id = self._GetServiceId( file_service_key )
+        #
         
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+        must_be_local = system_predicates.MustBeLocal() or system_predicates.MustBeArchive()
+        must_not_be_local = system_predicates.MustNotBeLocal()
+        must_be_inbox = system_predicates.MustBeInbox()
+        must_be_archive = system_predicates.MustBeArchive()
+        
+        if file_service_type == HC.LOCAL_FILE:
             
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            if must_not_be_local:
+                
+                clauses.append( FileQueryClause( 'not local', True, '0', estimate = 0, hash_ids = set() ) )
+                
             
-        else:
+        elif must_be_local or must_not_be_local:
             
-            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
+            description = 'in ' + self._GetService( self._local_file_service_id ).GetName()
+            
+            clauses.append( self._GetFileQueryClause( description, must_be_local, 'current_files', 'current_files.hash_id', [ 'current_files.service_id = ' + str( self._local_file_service_id ) ], self._GetServiceInfoEstimate( self._local_file_service_id, HC.SERVICE_INFO_NUM_FILES ) ) )
             
         
-        current_selects = []
-        pending_selects = []
-        
-        if ':' in wildcard:
+        if must_be_inbox or must_be_archive:
             
-            ( namespace_wildcard, tag_wildcard ) = wildcard.split( ':', 1 )
+            clauses.append( self._GetFileQueryClause( 'in the inbox', must_be_inbox, 'file_inbox', 'file_inbox.hash_id', [], len( self._GetInboxHashIds() ) ) )
             
-            possible_namespace_ids = GetNamespaceIdsFromWildcard( namespace_wildcard )
-            possible_tag_ids = GetTagIdsFromWildcard( tag_wildcard )
+        
+        #
+        
+        num_tags_zero = False
+        num_tags_nonzero = False
+        
+        tag_count_predicates = []
+        
+        if 'min_num_tags' in simple_preds:
             
-            for search_tag_service_id in search_tag_service_ids:
+            min_num_tags = simple_preds[ 'min_num_tags' ]
+            
+            if min_num_tags == 0:
                 
-                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                num_tags_nonzero = True
                 
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
-                else:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
+            else:
+                
+                tag_count_predicates.append( ( '>', min_num_tags ) )
                 
             
-        else:
+        
+        if 'num_tags' in simple_preds:
             
-            possible_tag_ids = GetTagIdsFromWildcard( wildcard )
+            num_tags = simple_preds[ 'num_tags' ]
             
-            for search_tag_service_id in search_tag_service_ids:
+            if num_tags == 0:
                 
-                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                num_tags_zero = True
                 
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
-                else:
-                    
-                    current_selects.append( 'SELECT hash_id FROM ' + current_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    pending_selects.append( 'SELECT hash_id FROM ' + pending_mappings_table_name + ', current_files USING ( hash_id ) WHERE current_files.service_id = ' + str( file_service_id ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids ) + ';' )
-                    
+            else:
+                
+                tag_count_predicates.append( ( '=', num_tags ) )
                 
             
         
-        hash_ids = set()
-        
-        if include_current_tags:
+        if 'max_num_tags' in simple_preds:
+            
+            max_num_tags = simple_preds[ 'max_num_tags' ]
             
-            for current_select in current_selects:
+            if max_num_tags == 1:
+                
+                num_tags_zero = True
+                
+            else:
                 
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
+                tag_count_predicates.append( ( '<', max_num_tags ) )
                 
             
         
-        if include_pending_tags:
+        if num_tags_zero:
             
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
+            clauses.append( self._GetFileQueryHasTagsClause( False, search_tag_service_ids, include_current_tags, include_pending_tags ) )
+            
+        elif num_tags_nonzero:
+            
+            clauses.append( self._GetFileQueryHasTagsClause( True, search_tag_service_ids, include_current_tags, include_pending_tags ) )
             
         
-        return hash_ids
+        if len( tag_count_predicates ) > 0:
+            
+            clauses.append( self._GetFileQueryTagCountClause( search_tag_service_ids, include_current_tags, include_pending_tags, tag_count_predicates ) )
+            
         
-    
-    def _GetHashIdsTagCounts( self, tag_service_key, include_current, include_pending ):
+        #
         
-        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+        query_hash_ids = self._GetHashIdsFromFileQueryClauses( clauses, plan_lines )
+        
+        #
+        
+        limit = system_predicates.GetLimit()
+        
+        if limit is not None and limit <= len( query_hash_ids ):
             
-            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            query_hash_ids = random.sample( query_hash_ids, limit )
             
         else:
             
-            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
+            query_hash_ids = list( query_hash_ids )
             
         
-        tags_counter = collections.Counter()
-        
-        for search_tag_service_id in search_tag_service_ids:
-            
-            ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
-            
-            if include_current:
-                
-                for ( id, count ) in self._c.execute( 'SELECT hash_id, COUNT( DISTINCT tag_id ) FROM ' + current_mappings_table_name + ' GROUP BY hash_id;' ):
-                    
-                    tags_counter[ id ] += count
-                    
-                
+        if report_plan:
             
-            if include_pending:
-                
-                for ( id, count ) in self._c.execute( 'SELECT hash_id, COUNT( DISTINCT tag_id ) FROM ' + pending_mappings_table_name + ' GROUP BY hash_id;' ):
-                    
-                    tags_counter[ id ] += count
-                    
-                
+            HydrusData.ShowText( os.linesep.join( plan_lines ) )
             
         
-        return tags_counter.items()
+        return query_hash_ids
         
     
     def _GetHashIdsThatHaveTags( self, tag_service_key, include_current, include_pending ):
@@ -3718,25 +4229,41 @@ class DB( HydrusDB.HydrusDB ):
         
         for search_tag_service_id in search_tag_service_ids:
             
-            ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+            tag_counts_cache_table_name = GenerateCombinedFilesTagCountsCacheTableName( search_tag_service_id )
             
             if include_current and include_pending:
                 
-                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id as h FROM hashes WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE hash_id = h ) OR EXISTS ( SELECT 1 FROM ' + pending_mappings_table_name + ' WHERE hash_id = h );' ) ) )
+                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id FROM ' + tag_counts_cache_table_name + ';' ) ) )
                 
             elif include_current:
                 
-                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id as h FROM hashes WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE hash_id = h );' ) ) )
+                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id FROM ' + tag_counts_cache_table_name + ' WHERE current_count > 0;' ) ) )
                 
             elif include_pending:
                 
-                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id as h FROM hashes WHERE EXISTS ( SELECT 1 FROM ' + pending_mappings_table_name + ' WHERE hash_id = h );' ) ) )
+                nonzero_tag_hash_ids.update( ( id for ( id, ) in self._c.execute( 'SELECT hash_id FROM ' + tag_counts_cache_table_name + ' WHERE pending_count > 0;' ) ) )
                 
             
         
         return nonzero_tag_hash_ids
         
     
+    def _GetFileIntegrityBatch( self, last_hash_id, limit ):
+        
+        # the integrity check walks the local files in hash_id order, so it can pick up again from the last hash_id it finished
+        
+        results = self._c.execute( 'SELECT DISTINCT hash_id, hash, mime FROM current_files, files_info USING ( hash_id ), hashes USING ( hash_id ) WHERE service_id IN ( ?, ? ) AND hash_id > ? ORDER BY hash_id ASC LIMIT ?;', ( self._local_file_service_id, self._trash_service_id, last_hash_id, limit ) ).fetchall()
+        
+        return results
+        
+    
+    def _GetFileIntegrityCount( self, last_hash_id ):
+        
+        ( count, ) = self._c.execute( 'SELECT COUNT( DISTINCT hash_id ) FROM current_files WHERE service_id IN ( ?, ? ) AND hash_id > ?;', ( self._local_file_service_id, self._trash_service_id, last_hash_id ) ).fetchone()
+        
+        return count
+        
+    
     def _GetHashIdsToHashes( self, hash_ids ):
         
         # this is actually a bit faster than saying "hash_id IN ( bigass_list )"
@@ -3774,6 +4301,22 @@ class DB( HydrusDB.HydrusDB ):
         return ( CC.STATUS_NEW, None )
         
     
+    def _GetHashStatus( self, hash ):
+        
+        result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+        
+        if result is None:
+            
+            return ( CC.STATUS_NEW, None )
+            
+        else:
+            
+            ( hash_id, ) = result
+            
+            return self._GetHashIdStatus( hash_id )
+            
+        
+    
     def _GetHydrusSessions( self ):
         
         now = HydrusData.GetNow()
@@ -3796,6 +4339,20 @@ class DB( HydrusDB.HydrusDB ):
         return sessions
         
     
+    def _GetInboxHashIds( self ):
+        
+        read_connection_caches = self._GetReadConnectionCaches()
+        
+        if read_connection_caches is None:
+            
+            return self._inbox_hash_ids
+            
+        else:
+            
+            return read_connection_caches[ 'inbox_hash_ids' ]
+            
+        
+    
     def _GetJSONDump( self, dump_type ):
         
         ( version, dump ) = self._c.execute( 'SELECT version, dump FROM json_dumps WHERE dump_type = ?;', ( dump_type, ) ).fetchone()
@@ -3881,70 +4438,143 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _GetMediaResults( self, hash_ids ):
-        
-        splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
-        
-        # get first detailed results
-        
-        hash_ids_to_info = { hash_id : ( size, mime, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT * FROM files_info WHERE hash_id IN ' + splayed_hash_ids + ';' ) }
-        
-        hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
+    def _GetMappingsPhraseFromWildcard( self, wildcard ):
         
-        hash_ids_to_current_file_service_ids_and_timestamps = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, timestamp ) ) for ( hash_id, service_id, timestamp ) in self._c.execute( 'SELECT hash_id, service_id, timestamp FROM current_files WHERE hash_id IN ' + splayed_hash_ids + ';' ) ) )
+        def GetNamespaceIdsFromWildcard( w ):
+            
+            if '*' in w:
+                
+                w = w.replace( '*', '%' )
+                
+                return self._GetNamespaceIdsFromLikePattern( w )
+                
+            else:
+                
+                namespace_id = self._GetNamespaceId( w )
+                
+                return [ namespace_id ]
+                
+            
         
-        hash_ids_to_deleted_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM deleted_files WHERE hash_id IN ' + splayed_hash_ids + ';' ) )
+        def GetTagIdsFromWildcard( w ):
+            
+            if '*' in w:
+                
+                w = w.replace( '*', '%' )
+                
+                return self._GetTagIdsFromLikePattern( w )
+                
+            else:
+                
+                ( namespace_id, tag_id ) = self._GetNamespaceIdTagId( w )
+                
+                return [ tag_id ]
+                
+            
         
-        hash_ids_to_pending_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM file_transfers WHERE hash_id IN ' + splayed_hash_ids + ';' ) )
+        if ':' in wildcard:
+            
+            ( namespace_wildcard, tag_wildcard ) = wildcard.split( ':', 1 )
+            
+            possible_namespace_ids = GetNamespaceIdsFromWildcard( namespace_wildcard )
+            possible_tag_ids = GetTagIdsFromWildcard( tag_wildcard )
+            
+            return 'namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' AND tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids )
+            
+        else:
+            
+            possible_tag_ids = GetTagIdsFromWildcard( wildcard )
+            
+            return 'tag_id IN ' + HydrusData.SplayListForDB( possible_tag_ids )
+            
         
-        hash_ids_to_petitioned_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM file_petitions WHERE hash_id IN ' + splayed_hash_ids + ';' ) )
+    
+    def _GetMediaResults( self, hash_ids ):
         
-        hash_ids_to_urls = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, url FROM urls WHERE hash_id IN ' + splayed_hash_ids + ';' ) )
+        # everything is fetched with a few set-based queries against a temp table of the hash_ids, and then put together in memory
         
-        hash_ids_to_service_ids_and_filenames = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, filename ) ) for ( hash_id, service_id, filename ) in self._c.execute( 'SELECT hash_id, service_id, filename FROM service_filenames WHERE hash_id IN ' + splayed_hash_ids + ';' ) ) )
+        self._c.execute( 'CREATE TABLE mem.temp_media_result_hash_ids ( hash_id INTEGER PRIMARY KEY );' )
         
-        hash_ids_to_local_ratings = HydrusData.BuildKeyToListDict( [ ( hash_id, ( service_id, rating ) ) for ( service_id, hash_id, rating ) in self._c.execute( 'SELECT service_id, hash_id, rating FROM local_ratings WHERE hash_id IN ' + splayed_hash_ids + ';' ) ] )
+        try:
+            
+            self._c.executemany( 'INSERT OR IGNORE INTO mem.temp_media_result_hash_ids ( hash_id ) VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
+            
+            # get first detailed results
+            # the tables that can't look up by hash_id are scanned once and checked against the temp table instead
+            
+            hash_ids_to_info = { hash_id : ( size, mime, width, height, duration, num_frames, num_words ) for ( hash_id, size, mime, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT hash_id, size, mime, width, height, duration, num_frames, num_words FROM mem.temp_media_result_hash_ids CROSS JOIN files_info USING ( hash_id );' ) }
+            
+            hash_ids_to_hashes = { hash_id : hash for ( hash_id, hash ) in self._c.execute( 'SELECT hash_id, hash FROM mem.temp_media_result_hash_ids CROSS JOIN hashes USING ( hash_id );' ) }
+            
+            hash_ids_to_current_file_service_ids_and_timestamps = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, timestamp ) ) for ( hash_id, service_id, timestamp ) in self._c.execute( 'SELECT hash_id, service_id, timestamp FROM current_files WHERE hash_id IN ( SELECT hash_id FROM mem.temp_media_result_hash_ids );' ) ) )
+            
+            hash_ids_to_deleted_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM deleted_files WHERE hash_id IN ( SELECT hash_id FROM mem.temp_media_result_hash_ids );' ) )
+            
+            hash_ids_to_pending_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM mem.temp_media_result_hash_ids CROSS JOIN file_transfers USING ( hash_id );' ) )
+            
+            hash_ids_to_petitioned_file_service_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, service_id FROM mem.temp_media_result_hash_ids CROSS JOIN file_petitions USING ( hash_id );' ) )
+            
+            hash_ids_to_urls = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT hash_id, url FROM mem.temp_media_result_hash_ids CROSS JOIN urls USING ( hash_id );' ) )
+            
+            hash_ids_to_service_ids_and_filenames = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, filename ) ) for ( hash_id, service_id, filename ) in self._c.execute( 'SELECT hash_id, service_id, filename FROM service_filenames WHERE hash_id IN ( SELECT hash_id FROM mem.temp_media_result_hash_ids );' ) ) )
+            
+            hash_ids_to_local_ratings = HydrusData.BuildKeyToListDict( ( ( hash_id, ( service_id, rating ) ) for ( hash_id, service_id, rating ) in self._c.execute( 'SELECT hash_id, service_id, rating FROM mem.temp_media_result_hash_ids CROSS JOIN local_ratings USING ( hash_id );' ) ) )
+            
+            # now the tags, which we fetch as ids and turn into text once per distinct tag
+            
+            tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+            hash_ids_to_raw_tag_ids = collections.defaultdict( list )
+            
+            for tag_service_id in tag_service_ids:
+                
+                mappings_table_names = GenerateMappingsTableNames( tag_service_id )
+                
+                for ( status, mappings_table_name ) in zip( ( HC.CURRENT, HC.DELETED, HC.PENDING, HC.PETITIONED ), mappings_table_names ):
+                    
+                    for ( hash_id, namespace_id, tag_id ) in self._c.execute( 'SELECT hash_id, namespace_id, tag_id FROM mem.temp_media_result_hash_ids CROSS JOIN ' + mappings_table_name + ' USING ( hash_id );' ):
+                        
+                        hash_ids_to_raw_tag_ids[ hash_id ].append( ( tag_service_id, status, namespace_id, tag_id ) )
+                        
+                    
+                
+            
+            namespace_ids_and_tag_ids_to_tags = self._GetNamespaceIdsAndTagIdsToTags( { ( namespace_id, tag_id ) for raw_tag_ids in hash_ids_to_raw_tag_ids.values() for ( tag_service_id, status, namespace_id, tag_id ) in raw_tag_ids } )
+            
+        finally:
+            
+            self._c.execute( 'DROP TABLE mem.temp_media_result_hash_ids;' )
+            
         
         # build it
         
         service_ids_to_service_keys = { service_id : service_key for ( service_id, service_key ) in self._c.execute( 'SELECT service_id, service_key FROM services;' ) }
         
-        tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
-        
         media_results = []
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
         
+        inbox_hash_ids = self._GetInboxHashIds()
+        
         for hash_id in hash_ids:
             
             hash = hash_ids_to_hashes[ hash_id ]
             
             #
             
-            inbox = hash_id in self._inbox_hash_ids
-            
-            #
-            
-            raw_tag_ids = []
-            
-            for tag_service_id in tag_service_ids:
-                
-                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( tag_service_id )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.CURRENT, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + current_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.DELETED, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + deleted_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.PENDING, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + pending_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
-                raw_tag_ids.extend( ( ( tag_service_id, ( HC.PETITIONED, HydrusTags.CombineTag( namespace, tag ) ) ) for ( namespace, tag ) in self._c.execute( 'SELECT namespace, tag FROM namespaces, ( tags, ' + petitioned_mappings_table_name + ' USING ( tag_id ) ) USING ( namespace_id ) WHERE hash_id = ?;', ( hash_id, ) ) ) )
-                
+            inbox = hash_id in inbox_hash_ids
             
-            raw_tag_ids_dict = HydrusData.BuildKeyToListDict( raw_tag_ids )
+            #
             
             service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
             
-            service_keys_to_statuses_to_tags.update( { service_ids_to_service_keys[ service_id ] : HydrusData.BuildKeyToSetDict( tags_info ) for ( service_id, tags_info ) in raw_tag_ids_dict.items() } )
+            if hash_id in hash_ids_to_raw_tag_ids:
+                
+                for ( tag_service_id, status, namespace_id, tag_id ) in hash_ids_to_raw_tag_ids[ hash_id ]:
+                    
+                    service_keys_to_statuses_to_tags[ service_ids_to_service_keys[ tag_service_id ] ][ status ].add( namespace_ids_and_tag_ids_to_tags[ ( namespace_id, tag_id ) ] )
+                    
+                
             
             service_keys_to_statuses_to_tags = tag_censorship_manager.FilterServiceKeysToStatusesToTags( service_keys_to_statuses_to_tags )
             
@@ -3995,9 +4625,43 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetMediaResultsFromHashes( self, hashes ):
         
-        query_hash_ids = set( self._GetHashIds( hashes ) )
+        ( hashes_to_media_results, missing_hashes ) = self._media_result_cache.GetMediaResults( hashes )
+        
+        if len( missing_hashes ) > 0:
+            
+            missing_hash_ids = set( self._GetHashIds( missing_hashes ) )
+            
+            hashes_to_media_results.update( { media_result.GetHash() : media_result for media_result in self._GetMediaResultsUncached( missing_hash_ids ) } )
+            
+        
+        return hashes_to_media_results.values()
+        
+    
+    def _GetMediaResultsFromHashIds( self, hash_ids ):
+        
+        hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
+        
+        ( hashes_to_media_results, missing_hashes ) = self._media_result_cache.GetMediaResults( hash_ids_to_hashes.values() )
+        
+        if len( missing_hashes ) > 0:
+            
+            missing_hash_ids = { hash_id for ( hash_id, hash ) in hash_ids_to_hashes.items() if hash in missing_hashes }
+            
+            hashes_to_media_results.update( { media_result.GetHash() : media_result for media_result in self._GetMediaResultsUncached( missing_hash_ids ) } )
+            
+        
+        return [ hashes_to_media_results[ hash_ids_to_hashes[ hash_id ] ] for hash_id in hash_ids ]
+        
+    
+    def _GetMediaResultsUncached( self, hash_ids ):
+        
+        media_results = self._GetMediaResults( hash_ids )
+        
+        # only what a plain read saw is safe to cache--a write might yet roll back
         
-        return self._GetMediaResults( query_hash_ids )
+        self._media_result_cache.AddMediaResults( media_results, self._GetSnapshotCommitNumber() )
+        
+        return media_results
         
     
     def _GetMime( self, service_id, hash_id ):
@@ -4024,6 +4688,8 @@ class DB( HydrusDB.HydrusDB ):
             
             namespace_id = self._c.lastrowid
             
+            self._c.executemany( 'INSERT OR IGNORE INTO namespaces_trigrams ( trigram, namespace_id ) VALUES ( ?, ? );', ( ( trigram, namespace_id ) for trigram in GenerateTrigrams( namespace ) ) )
+            
         else:
             
             ( namespace_id, ) = result
@@ -4059,6 +4725,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'REPLACE INTO tags_fts4 ( docid, tag ) VALUES ( ?, ? );', ( tag_id, tag ) )
             
+            self._c.executemany( 'INSERT OR IGNORE INTO tags_trigrams ( trigram, tag_id ) VALUES ( ?, ? );', ( ( trigram, tag_id ) for trigram in GenerateTrigrams( tag ) ) )
+            
         else:
             
             ( tag_id, ) = result
@@ -4074,6 +4742,43 @@ class DB( HydrusDB.HydrusDB ):
         return ( namespace_id, tag_id )
         
     
+    def _GetNamespaceIdsFromLikePattern( self, like_pattern ):
+        
+        trigrams = GenerateTrigramsFromLikePattern( like_pattern )
+        
+        if len( trigrams ) == 0:
+            
+            return { namespace_id for ( namespace_id, ) in self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace LIKE ?;', ( like_pattern, ) ) }
+            
+        
+        ( select_statement, trigrams ) = self._GetTrigramsSelectStatement( 'namespaces_trigrams', 'namespace_id', trigrams )
+        
+        return { namespace_id for ( namespace_id, ) in self._c.execute( 'SELECT namespace_id FROM namespaces NATURAL JOIN ( ' + select_statement + ' ) WHERE namespace LIKE ?;', tuple( trigrams ) + ( like_pattern, ) ) }
+        
+    
+    def _GetNamespaceIdsAndTagIdsToTags( self, namespace_ids_and_tag_ids ):
+        
+        namespace_ids = { namespace_id for ( namespace_id, tag_id ) in namespace_ids_and_tag_ids }
+        tag_ids = { tag_id for ( namespace_id, tag_id ) in namespace_ids_and_tag_ids }
+        
+        namespace_ids_to_namespaces = { namespace_id : namespace for ( namespace_id, namespace ) in self._c.execute( 'SELECT namespace_id, namespace FROM namespaces WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ';' ) }
+        
+        self._c.execute( 'CREATE TABLE mem.temp_tag_ids_to_tags ( tag_id INTEGER PRIMARY KEY );' )
+        
+        try:
+            
+            self._c.executemany( 'INSERT INTO mem.temp_tag_ids_to_tags ( tag_id ) VALUES ( ? );', ( ( tag_id, ) for tag_id in tag_ids ) )
+            
+            tag_ids_to_tags = { tag_id : tag for ( tag_id, tag ) in self._c.execute( 'SELECT tag_id, tag FROM mem.temp_tag_ids_to_tags CROSS JOIN tags USING ( tag_id );' ) }
+            
+        finally:
+            
+            self._c.execute( 'DROP TABLE mem.temp_tag_ids_to_tags;' )
+            
+        
+        return { ( namespace_id, tag_id ) : HydrusTags.CombineTag( namespace_ids_to_namespaces[ namespace_id ], tag_ids_to_tags[ tag_id ] ) for ( namespace_id, tag_id ) in namespace_ids_and_tag_ids }
+        
+    
     def _GetNamespaceTag( self, namespace_id, tag_id ):
         
         result = self._c.execute( 'SELECT tag FROM tags WHERE tag_id = ?;', ( tag_id, ) ).fetchone()
@@ -4113,6 +4818,13 @@ class DB( HydrusDB.HydrusDB ):
         return news
         
     
+    def _GetNumReadConnections( self ):
+        
+        new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+        
+        return new_options.GetInteger( 'num_db_read_connections' )
+        
+    
     def _GetNumsPending( self ):
         
         services = self._GetServices( ( HC.TAG_REPOSITORY, HC.FILE_REPOSITORY, HC.IPFS ) )
@@ -4452,7 +5164,12 @@ class DB( HydrusDB.HydrusDB ):
             
             service = ClientData.GenerateService( service_key, service_type, name, info )
             
-            self._service_cache[ service_id ] = service
+            if not self._IsReadConnection():
+                
+                # a read connection's snapshot may be older than the main loop's, so it does not get to populate the cache
+                
+                self._service_cache[ service_id ] = service
+                
             
         
         if service.GetServiceType() == HC.LOCAL_BOORU:
@@ -4599,6 +5316,22 @@ class DB( HydrusDB.HydrusDB ):
         return service_info
         
     
+    def _GetServiceInfoEstimate( self, service_id, info_type ):
+        
+        # unlike _GetServiceInfoSpecific, this never regenerates missing info, so it is quick and safe to call from a read
+        
+        result = self._c.execute( 'SELECT info FROM service_info WHERE service_id = ? AND info_type = ?;', ( service_id, info_type ) ).fetchone()
+        
+        if result is None:
+            
+            return None
+            
+        
+        ( info, ) = result
+        
+        return info
+        
+    
     def _GetServiceInfoSpecific( self, service_id, service_type, info_types ):
         
         results = { info_type : info for ( info_type, info ) in self._c.execute( 'SELECT info_type, info FROM service_info WHERE service_id = ? AND info_type IN ' + HydrusData.SplayListForDB( info_types ) + ';', ( service_id, ) ) }
@@ -4687,6 +5420,22 @@ class DB( HydrusDB.HydrusDB ):
         return results
         
     
+    def _GetSlowJobThreshold( self ):
+        
+        new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+        
+        slow_job_log_ms = new_options.GetNoneableInteger( 'db_slow_job_log_ms' )
+        
+        if slow_job_log_ms is None:
+            
+            return None
+            
+        else:
+            
+            return slow_job_log_ms / 1000.0
+            
+        
+    
     def _GetSiteId( self, name ):
         
         result = self._c.execute( 'SELECT site_id FROM imageboard_sites WHERE name = ?;', ( name, ) ).fetchone()
@@ -4702,6 +5451,27 @@ class DB( HydrusDB.HydrusDB ):
         return site_id
         
     
+    def _GetTableRowCountEstimate( self, table_name ):
+        
+        # the last analyze left a row count for every table it looked at
+        
+        if self._c.execute( 'SELECT 1 FROM sqlite_master WHERE name = ?;', ( 'sqlite_stat1', ) ).fetchone() is None:
+            
+            return None
+            
+        
+        result = self._c.execute( 'SELECT stat FROM sqlite_stat1 WHERE tbl = ?;', ( table_name, ) ).fetchone()
+        
+        if result is None:
+            
+            return None
+            
+        
+        ( stat, ) = result
+        
+        return int( stat.split()[0] )
+        
+    
     def _GetTagCensorship( self, service_key = None ):
         
         if service_key is None:
@@ -4729,6 +5499,20 @@ class DB( HydrusDB.HydrusDB ):
         return result
         
     
+    def _GetTagIdsFromLikePattern( self, like_pattern ):
+        
+        trigrams = GenerateTrigramsFromLikePattern( like_pattern )
+        
+        if len( trigrams ) == 0:
+            
+            return { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags WHERE tag LIKE ? OR tag LIKE ?;', ( like_pattern, '% ' + like_pattern ) ) }
+            
+        
+        ( select_statement, trigrams ) = self._GetTrigramsSelectStatement( 'tags_trigrams', 'tag_id', trigrams )
+        
+        return { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM tags NATURAL JOIN ( ' + select_statement + ' ) WHERE tag LIKE ? OR tag LIKE ?;', tuple( trigrams ) + ( like_pattern, '% ' + like_pattern ) ) }
+        
+    
     def _GetTagParents( self, service_key = None ):
         
         tag_censorship_manager = self._controller.GetManager( 'tag_censorship' )
@@ -4866,6 +5650,34 @@ class DB( HydrusDB.HydrusDB ):
         return self._GetHashes( hash_ids )
         
     
+    def _GetTrigramsSelectStatement( self, trigrams_table_name, id_column_name, trigrams ):
+        
+        # a very common trigram like ' th' has millions of rows, so we drive the select from the rarest trigram and check the others per row
+        # the counts are capped so the probing stays cheap
+        
+        def GetCappedCount( trigram ):
+            
+            ( count, ) = self._c.execute( 'SELECT COUNT( * ) FROM ( SELECT 1 FROM ' + trigrams_table_name + ' WHERE trigram = ? LIMIT 1000 );', ( trigram, ) ).fetchone()
+            
+            return count
+            
+        
+        trigrams = sorted( trigrams, key = GetCappedCount )
+        
+        # the caller checks the results against the full pattern, so the rarest few trigrams are plenty
+        
+        trigrams = trigrams[ : 8 ]
+        
+        select_statement = 'SELECT ' + id_column_name + ' FROM ' + trigrams_table_name + ' AS t0 WHERE trigram = ?'
+        
+        for i in range( 1, len( trigrams ) ):
+            
+            select_statement += ' AND EXISTS ( SELECT 1 FROM ' + trigrams_table_name + ' WHERE trigram = ? AND ' + id_column_name + ' = t0.' + id_column_name + ' )'
+            
+        
+        return ( select_statement, trigrams )
+        
+    
     def _GetURLStatus( self, url ):
         
         result = self._c.execute( 'SELECT hash_id FROM urls WHERE url = ?;', ( url, ) ).fetchone()
@@ -4923,7 +5735,7 @@ class DB( HydrusDB.HydrusDB ):
                 
             else: ( result, ) = result
             
-            if dump_type == YAML_DUMP_ID_SUBSCRIPTION: self._subscriptions_cache[ dump_name ] = result
+            if dump_type == YAML_DUMP_ID_SUBSCRIPTION and not self._IsReadConnection(): self._subscriptions_cache[ dump_name ] = result
             
         
         return result
@@ -4955,18 +5767,16 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _ImportFile( self, path, import_file_options = None, override_deleted = False, url = None ):
+    def _ImportFile( self, file_import_job, override_deleted = False, url = None ):
         
-        if import_file_options is None:
+        ( archive, exclude_deleted_files, min_size, min_resolution ) = file_import_job.GetImportFileOptions().ToTuple()
+        
+        if file_import_job.GetHash() is None:
             
-            import_file_options = ClientDefaults.GetDefaultImportFileOptions()
+            file_import_job.GenerateHash()
             
         
-        ( archive, exclude_deleted_files, min_size, min_resolution ) = import_file_options.ToTuple()
-        
-        HydrusImageHandling.ConvertToPngIfBmp( path )
-        
-        hash = HydrusFileHandling.GetHashFromPath( path )
+        hash = file_import_job.GetHash()
         
         hash_id = self._GetHashId( hash )
         
@@ -4974,6 +5784,11 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'INSERT OR IGNORE INTO urls ( url, hash_id ) VALUES ( ?, ? );', ( url, hash_id ) )
             
+            if self._c.rowcount > 0:
+                
+                self._NotifyMediaResultsChanged( ( hash_id, ) )
+                
+            
         
         ( status, status_hash ) = self._GetHashIdStatus( hash_id )
         
@@ -4996,63 +5811,22 @@ class DB( HydrusDB.HydrusDB ):
             
         elif status == CC.STATUS_NEW:
             
-            mime = HydrusFileHandling.GetMime( path )
-            
-            client_files_manager = self._controller.GetClientFilesManager()
-            
-            dest_path = client_files_manager.AddFile( hash, mime, path )
-            
-            # I moved the file copy up because passing an original filename with unicode chars to getfileinfo
-            # was causing problems in windows.
-            
-            ( size, mime, width, height, duration, num_frames, num_words ) = HydrusFileHandling.GetFileInfo( dest_path )
-            
-            if width is not None and height is not None:
-                
-                if min_resolution is not None:
-                    
-                    ( min_x, min_y ) = min_resolution
-                    
-                    if width < min_x or height < min_y:
-                        
-                        os.remove( dest_path )
-                        
-                        raise Exception( 'Resolution too small' )
-                        
-                    
+            if not file_import_job.HasInfo():
                 
-            
-            if min_size is not None:
+                # the caller did not prepare this job, so we have to do the heavy lifting in the transaction
                 
-                if size < min_size:
-                    
-                    os.remove( dest_path )
-                    
-                    raise Exception( 'File too small' )
-                    
+                file_import_job.GenerateInfo()
                 
             
+            ( size, mime, width, height, duration, num_frames, num_words ) = file_import_job.GetFileInfo()
+            
             timestamp = HydrusData.GetNow()
             
-            if mime in HC.MIMES_WITH_THUMBNAILS:
-                
-                thumbnail = HydrusFileHandling.GenerateThumbnail( dest_path )
-                
-                client_files_manager.AddFullSizeThumbnail( hash, thumbnail )
-                
+            phash = file_import_job.GetPHash()
             
-            if mime in ( HC.IMAGE_JPEG, HC.IMAGE_PNG ):
+            if phash is not None:
                 
-                try:
-                    
-                    phash = ClientImageHandling.GeneratePerceptualHash( dest_path )
-                    
-                    self._c.execute( 'INSERT OR REPLACE INTO perceptual_hashes ( hash_id, phash ) VALUES ( ?, ? );', ( hash_id, sqlite3.Binary( phash ) ) )
-                    
-                except:
-                    
-                    pass
-                    
+                self._CacheSimilarFilesAssociatePHash( hash_id, phash )
                 
             
             self._AddFilesInfo( [ ( hash_id, size, mime, width, height, duration, num_frames, num_words ) ], overwrite = True )
@@ -5063,7 +5837,7 @@ class DB( HydrusDB.HydrusDB ):
             
             self.pub_content_updates_after_commit( { CC.LOCAL_FILE_SERVICE_KEY : [ content_update ] } )
             
-            ( md5, sha1, sha512 ) = HydrusFileHandling.GetExtraHashesFromPath( dest_path )
+            ( md5, sha1, sha512 ) = file_import_job.GetExtraHashes()
             
             self._c.execute( 'INSERT OR IGNORE INTO local_hashes ( hash_id, md5, sha1, sha512 ) VALUES ( ?, ?, ?, ? );', ( hash_id, sqlite3.Binary( md5 ), sqlite3.Binary( sha1 ), sqlite3.Binary( sha512 ) ) )
             
@@ -5076,6 +5850,10 @@ class DB( HydrusDB.HydrusDB ):
                 self._InboxFiles( ( hash_id, ) )
                 
             
+            # the content update does not carry the inbox or any earlier deletion record, so a cached copy of a previously deleted file would be wrong
+            
+            self._NotifyMediaResultsChanged( ( hash_id, ) )
+            
             status = CC.STATUS_SUCCESSFUL
             
         
@@ -5102,6 +5880,11 @@ class DB( HydrusDB.HydrusDB ):
         return ( status, hash )
         
     
+    def _ImportFiles( self, file_import_jobs ):
+        
+        return [ self._ImportFile( file_import_job ) for file_import_job in file_import_jobs ]
+        
+    
     def _InboxFiles( self, hash_ids ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO file_inbox VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
@@ -5118,6 +5901,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._inbox_hash_ids.update( hash_ids )
             
+            self._InvalidateCommittedCaches()
+            
         
     
     def _InitCaches( self ):
@@ -5150,6 +5935,10 @@ class DB( HydrusDB.HydrusDB ):
         
         self._inbox_hash_ids = { id for ( id, ) in self._c.execute( 'SELECT hash_id FROM file_inbox;' ) }
         
+        self._media_result_cache = ClientMedia.MediaResultCache( new_options.GetInteger( 'media_result_cache_size' ) )
+        self._media_result_cache_dirty = False
+        self._media_result_cache_stale_hashes = set()
+        
     
     def _InitExternalDatabases( self ):
         
@@ -5302,6 +6091,15 @@ class DB( HydrusDB.HydrusDB ):
             return True
             
         
+        # similar files
+        
+        result = self._c.execute( 'SELECT 1 FROM shape_maintenance_branch_regen;' ).fetchone()
+        
+        if result is not None:
+            
+            return True
+            
+        
         return False
         
     
@@ -5328,6 +6126,13 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _NotifyMediaResultsChanged( self, hash_ids ):
+        
+        # for writes that do not send out a content update the media result cache can replay, the cached copies just have to go
+        
+        self._media_result_cache_stale_hashes.update( self._GetHashIdsToHashes( hash_ids ).values() )
+        
+    
     def _ProcessContentUpdatePackage( self, service_key, content_update_package, job_key ):
         
         ( previous_journal_mode, ) = self._c.execute( 'PRAGMA journal_mode;' ).fetchone()
@@ -5959,6 +6764,12 @@ class DB( HydrusDB.HydrusDB ):
             
             self.pub_content_updates_after_commit( service_keys_to_content_updates )
             
+        else:
+            
+            # repository processing is too big to send out, so the media result cache has to start again
+            
+            self._media_result_cache_dirty = True
+            
         
     
     def _ProcessServiceUpdates( self, service_keys_to_service_updates ):
@@ -6104,9 +6915,13 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'client_files_locations': result = self._GetClientFilesLocations( *args, **kwargs )
         elif action == 'downloads': result = self._GetDownloads( *args, **kwargs )
         elif action == 'file_hashes': result = self._GetFileHashes( *args, **kwargs )
+        elif action == 'file_integrity_batch': result = self._GetFileIntegrityBatch( *args, **kwargs )
+        elif action == 'file_integrity_count': result = self._GetFileIntegrityCount( *args, **kwargs )
         elif action == 'file_query_ids': result = self._GetHashIdsFromQuery( *args, **kwargs )
+        elif action == 'file_query_plan': result = self._GetFileQueryPlan( *args, **kwargs )
         elif action == 'file_system_predicates': result = self._GetFileSystemPredicates( *args, **kwargs )
         elif action == 'filter_hashes': result = self._FilterHashes( *args, **kwargs )
+        elif action == 'hash_status': result = self._GetHashStatus( *args, **kwargs )
         elif action == 'hydrus_sessions': result = self._GetHydrusSessions( *args, **kwargs )
         elif action == 'imageboards': result = self._GetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'is_an_orphan': result = self._IsAnOrphan( *args, **kwargs )
@@ -6118,7 +6933,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'maintenance_due': result = self._MaintenanceDue( *args, **kwargs )
         elif action == 'md5_status': result = self._GetMD5Status( *args, **kwargs )
         elif action == 'media_results': result = self._GetMediaResultsFromHashes( *args, **kwargs )
-        elif action == 'media_results_from_ids': result = self._GetMediaResults( *args, **kwargs )
+        elif action == 'media_results_from_ids': result = self._GetMediaResultsFromHashIds( *args, **kwargs )
         elif action == 'news': result = self._GetNews( *args, **kwargs )
         elif action == 'nums_pending': result = self._GetNumsPending( *args, **kwargs )
         elif action == 'trash_hashes': result = self._GetTrashHashes( *args, **kwargs )
@@ -6351,7 +7166,7 @@ class DB( HydrusDB.HydrusDB ):
         
         if value is None:
             
-            self._c.execute( 'DELET FROM json_dict WHERE name = ?;', ( name, ) )
+            self._c.execute( 'DELETE FROM json_dict WHERE name = ?;', ( name, ) )
             
         else:
             
@@ -6376,6 +7191,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'REPLACE INTO service_filenames ( service_id, hash_id, filename ) VALUES ( ?, ?, ? );', ( service_id, hash_id, filename ) )
         
+        self._NotifyMediaResultsChanged( ( hash_id, ) )
+        
     
     def _SetServiceDirectory( self, service_id, hash_ids, dirname, note ):
         
@@ -6538,6 +7355,43 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _UpdateCachesAfterCommit( self, pubsubs ):
+        
+        # we keep the media result cache fresh with the same updates the gui gets, but straight after the commit, so the read connections can never see a mix
+        
+        commit_number = self._num_commits
+        
+        if self._media_result_cache_dirty:
+            
+            self._media_result_cache.Clear( commit_number )
+            
+            self._media_result_cache_dirty = False
+            
+        
+        if len( self._media_result_cache_stale_hashes ) > 0:
+            
+            self._media_result_cache.DropMediaResults( commit_number, self._media_result_cache_stale_hashes )
+            
+            self._media_result_cache_stale_hashes = set()
+            
+        
+        for ( topic, args, kwargs ) in pubsubs:
+            
+            if topic == 'content_updates_data':
+                
+                self._media_result_cache.ProcessContentUpdates( commit_number, *args, **kwargs )
+                
+            elif topic == 'service_updates_data':
+                
+                self._media_result_cache.ProcessServiceUpdates( commit_number, *args, **kwargs )
+                
+            elif topic in ( 'notify_new_services_data', 'notify_new_tag_censorship' ):
+                
+                self._media_result_cache.Clear( commit_number )
+                
+            
+        
+    
     def _UpdateDB( self, version ):
         
         self._controller.pub( 'splash_set_title_text', 'updating db to v' + str( version + 1 ) )
@@ -8051,6 +8905,57 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
+        if version == 217:
+            
+            self._controller.pub( 'splash_set_status_text', 'generating similar files tree' )
+            
+            self._c.execute( 'CREATE INDEX perceptual_hashes_phash_index ON perceptual_hashes ( phash );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.shape_vptree ( phash BLOB_BYTES PRIMARY KEY, parent_phash BLOB_BYTES, radius INTEGER, inner_phash BLOB_BYTES, inner_population INTEGER, outer_phash BLOB_BYTES, outer_population INTEGER );' )
+            self._c.execute( 'CREATE INDEX IF NOT EXISTS external_caches.shape_vptree_parent_phash_index ON shape_vptree ( parent_phash );' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_caches.shape_maintenance_branch_regen ( phash BLOB_BYTES PRIMARY KEY );' )
+            
+            self._CacheSimilarFilesGenerateTree()
+            
+            #
+            
+            for tag_service_id in self._GetServiceIds( HC.TAG_SERVICES ):
+                
+                self._controller.pub( 'splash_set_status_text', 'generating tag count cache ' + str( tag_service_id ) )
+                
+                self._CacheCombinedFilesMappingsGenerateTagCounts( tag_service_id )
+                
+            
+            #
+            
+            self._controller.pub( 'splash_set_status_text', 'generating namespace trigrams' )
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.namespaces_trigrams ( trigram TEXT, namespace_id INTEGER, PRIMARY KEY ( trigram, namespace_id ) ) WITHOUT ROWID;' )
+            
+            for ( namespace_id, namespace ) in self._c.execute( 'SELECT namespace_id, namespace FROM namespaces;' ).fetchall():
+                
+                self._c.executemany( 'INSERT OR IGNORE INTO namespaces_trigrams ( trigram, namespace_id ) VALUES ( ?, ? );', ( ( trigram, namespace_id ) for trigram in GenerateTrigrams( namespace ) ) )
+                
+            
+            self._c.execute( 'CREATE TABLE IF NOT EXISTS external_master.tags_trigrams ( trigram TEXT, tag_id INTEGER, PRIMARY KEY ( trigram, tag_id ) ) WITHOUT ROWID;' )
+            
+            ( max_tag_id, ) = self._c.execute( 'SELECT MAX( tag_id ) FROM tags;' ).fetchone()
+            
+            if max_tag_id is not None:
+                
+                for block_start in range( 0, max_tag_id + 1, 10000 ):
+                    
+                    self._controller.pub( 'splash_set_status_text', 'generating tag trigrams: ' + HydrusData.ConvertValueRangeToPrettyString( block_start, max_tag_id ) )
+                    
+                    for ( tag_id, tag ) in self._c.execute( 'SELECT tag_id, tag FROM tags WHERE tag_id BETWEEN ? AND ?;', ( block_start, block_start + 9999 ) ).fetchall():
+                        
+                        self._c.executemany( 'INSERT OR IGNORE INTO tags_trigrams ( trigram, tag_id ) VALUES ( ?, ? );', ( ( trigram, tag_id ) for trigram in GenerateTrigrams( tag ) ) )
+                        
+                    
+                
+            
+        
         self._controller.pub( 'splash_set_title_text', 'updated db to v' + str( version + 1 ) )
         
         self._c.execute( 'UPDATE version SET version = ?;', ( version + 1, ) )
@@ -8175,12 +9080,18 @@ class DB( HydrusDB.HydrusDB ):
         combined_files_current_counter = collections.Counter()
         combined_files_pending_counter = collections.Counter()
         
+        tag_counts_current_counter = collections.Counter()
+        tag_counts_pending_counter = collections.Counter()
+        
         if len( mappings_ids ) > 0:
             
             for ( namespace_id, tag_id, hash_ids ) in mappings_ids:
                 
                 splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
                 
+                existing_current_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) ) }
+                existing_pending_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) ) }
+                
                 self._c.execute( 'DELETE FROM ' + deleted_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) )
                 
                 num_deleted_deleted = self._GetRowCount()
@@ -8200,6 +9111,16 @@ class DB( HydrusDB.HydrusDB ):
                 combined_files_pending_counter[ ( namespace_id, tag_id ) ] -= num_pending_deleted
                 combined_files_current_counter[ ( namespace_id, tag_id ) ] += num_current_inserted
                 
+                for hash_id in existing_pending_hash_ids:
+                    
+                    tag_counts_pending_counter[ hash_id ] -= 1
+                    
+                
+                for hash_id in set( hash_ids ).difference( existing_current_hash_ids ):
+                    
+                    tag_counts_current_counter[ hash_id ] += 1
+                    
+                
             
             for file_service_id in file_service_ids:
                 
@@ -8213,6 +9134,8 @@ class DB( HydrusDB.HydrusDB ):
                 
                 splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
                 
+                existing_current_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) ) }
+                
                 self._c.execute( 'DELETE FROM ' + current_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) )
                 
                 num_current_deleted = self._GetRowCount()
@@ -8231,6 +9154,11 @@ class DB( HydrusDB.HydrusDB ):
                 
                 combined_files_current_counter[ ( namespace_id, tag_id ) ] -= num_current_deleted
                 
+                for hash_id in existing_current_hash_ids:
+                    
+                    tag_counts_current_counter[ hash_id ] -= 1
+                    
+                
             
             for file_service_id in file_service_ids:
                 
@@ -8255,6 +9183,8 @@ class DB( HydrusDB.HydrusDB ):
             
             for ( namespace_id, tag_id, hash_ids ) in pending_mappings_ids:
                 
+                existing_pending_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';', ( namespace_id, tag_id ) ) }
+                
                 self._c.executemany( 'INSERT OR IGNORE INTO ' + pending_mappings_table_name + ' VALUES ( ?, ?, ? );', [ ( namespace_id, tag_id, hash_id ) for hash_id in hash_ids ] )
                 
                 num_pending_inserted = self._GetRowCount()
@@ -8263,6 +9193,11 @@ class DB( HydrusDB.HydrusDB ):
                 
                 combined_files_pending_counter[ ( namespace_id, tag_id ) ] += num_pending_inserted
                 
+                for hash_id in set( hash_ids ).difference( existing_pending_hash_ids ):
+                    
+                    tag_counts_pending_counter[ hash_id ] += 1
+                    
+                
             
             for file_service_id in file_service_ids:
                 
@@ -8274,7 +9209,11 @@ class DB( HydrusDB.HydrusDB ):
             
             for ( namespace_id, tag_id, hash_ids ) in pending_rescinded_mappings_ids:
                 
-                self._c.execute( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';', ( namespace_id, tag_id ) )
+                splayed_hash_ids = HydrusData.SplayListForDB( hash_ids )
+                
+                existing_pending_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) ) }
+                
+                self._c.execute( 'DELETE FROM ' + pending_mappings_table_name + ' WHERE namespace_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( namespace_id, tag_id ) )
                 
                 num_pending_deleted = self._GetRowCount()
                 
@@ -8282,6 +9221,11 @@ class DB( HydrusDB.HydrusDB ):
                 
                 combined_files_pending_counter[ ( namespace_id, tag_id ) ] -= num_pending_deleted
                 
+                for hash_id in existing_pending_hash_ids:
+                    
+                    tag_counts_pending_counter[ hash_id ] -= 1
+                    
+                
             
             for file_service_id in file_service_ids:
                 
@@ -8296,6 +9240,13 @@ class DB( HydrusDB.HydrusDB ):
         
         self._CacheCombinedFilesMappingsUpdate( tag_service_id, combined_files_counts )
         
+        tag_counts_seen_hash_ids = set( ( hash_id for ( hash_id, count ) in tag_counts_current_counter.items() if count != 0 ) )
+        tag_counts_seen_hash_ids.update( ( hash_id for ( hash_id, count ) in tag_counts_pending_counter.items() if count != 0 ) )
+        
+        tag_count_ids = [ ( hash_id, tag_counts_current_counter[ hash_id ], tag_counts_pending_counter[ hash_id ] ) for hash_id in tag_counts_seen_hash_ids ]
+        
+        self._CacheCombinedFilesMappingsUpdateTagCounts( tag_service_id, tag_count_ids )
+        
         # 
         
         post_existing_tag_ids = { tag_id for ( tag_id, ) in self._c.execute( 'SELECT tag_id as t FROM temp_tag_ids WHERE EXISTS ( SELECT 1 FROM ' + current_mappings_table_name + ' WHERE tag_id = t );' ) }
@@ -8686,6 +9637,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'content_update_package':result = self._ProcessContentUpdatePackage( *args, **kwargs )
         elif action == 'content_updates':result = self._ProcessContentUpdates( *args, **kwargs )
         elif action == 'db_integrity': result = self._CheckDBIntegrity( *args, **kwargs )
+        elif action == 'delete_file_records': result = self._DeleteFileRecords( *args, **kwargs )
         elif action == 'delete_hydrus_session_key': result = self._DeleteHydrusSessionKey( *args, **kwargs )
         elif action == 'delete_imageboard': result = self._DeleteYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'delete_local_booru_share': result = self._DeleteYAMLDump( YAML_DUMP_ID_LOCAL_BOORU, *args, **kwargs )
@@ -8694,12 +9646,14 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'delete_serialisable_named': result = self._DeleteJSONDumpNamed( *args, **kwargs )
         elif action == 'delete_service_info': result = self._DeleteServiceInfo( *args, **kwargs )
         elif action == 'export_mappings': result = self._ExportToTagArchive( *args, **kwargs )
-        elif action == 'file_integrity': result = self._CheckFileIntegrity( *args, **kwargs )
         elif action == 'hydrus_session': result = self._AddHydrusSession( *args, **kwargs )
         elif action == 'imageboard': result = self._SetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'import_file': result = self._ImportFile( *args, **kwargs )
+        elif action == 'import_files': result = self._ImportFiles( *args, **kwargs )
         elif action == 'local_booru_share': result = self._SetYAMLDump( YAML_DUMP_ID_LOCAL_BOORU, *args, **kwargs )
+        elif action == 'maintain_similar_files_tree': result = self._CacheSimilarFilesMaintainTree( *args, **kwargs )
         elif action == 'regenerate_ac_cache': result = self._RegenerateACCache( *args, **kwargs )        
+        elif action == 'regenerate_similar_files_tree': result = self._CacheSimilarFilesRegenerateTree( *args, **kwargs )
         elif action == 'relocate_client_files': result = self._RelocateClientFiles( *args, **kwargs )
         elif action == 'remote_booru': result = self._SetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU, *args, **kwargs )
         elif action == 'reset_service': result = self._ResetService( *args, **kwargs )
@@ -8731,6 +9685,11 @@ class DB( HydrusDB.HydrusDB ):
         self.pub_after_commit( 'service_updates_gui', service_keys_to_service_updates )
         
     
+    def GetMediaResultCacheStats( self ):
+        
+        return self._media_result_cache.GetStats()
+        
+    
     def RestoreBackup( self, path ):
         
         for filename in self._db_filenames.values():
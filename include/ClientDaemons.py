@@ -1,5 +1,6 @@
 import ClientDownloading
 import ClientFiles
+import ClientImporting
 import ClientThreading
 import collections
 import hashlib
@@ -125,7 +126,13 @@ def DAEMONDownloadFiles( controller ):
                             
                             controller.WaitUntilPubSubsEmpty()
                             
-                            controller.WriteSynchronous( 'import_file', temp_path, override_deleted = True )
+                            os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+                            
+                            file_import_job = ClientImporting.FileImportJob( temp_path, is_temporary = True )
+                            
+                            client_files_manager = controller.GetClientFilesManager()
+                            
+                            client_files_manager.ImportFile( file_import_job, override_deleted = True )
                             
                             successful_hashes.add( hash )
                             
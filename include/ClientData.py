@@ -12,6 +12,7 @@ import HydrusFileHandling
 import HydrusPaths
 import HydrusSerialisable
 import HydrusTags
+import Queue
 import threading
 import traceback
 import os
@@ -488,6 +489,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'booleans' ][ 'show_related_tags' ] = False
         
+        self._dictionary[ 'booleans' ][ 'pack_resized_thumbnails' ] = False
+        
         #
         
         self._dictionary[ 'noneable_integers' ] = {}
@@ -496,6 +499,9 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'noneable_integers' ][ 'disk_cache_maintenance_mb' ] = 256
         self._dictionary[ 'noneable_integers' ][ 'disk_cache_init_period' ] = 4
+        self._dictionary[ 'noneable_integers' ][ 'db_group_commit_window_ms' ] = 50
+        self._dictionary[ 'noneable_integers' ][ 'db_slow_job_log_ms' ] = None
+        self._dictionary[ 'noneable_integers' ][ 'file_maintenance_throttle_mb' ] = 32
         
         self._dictionary[ 'noneable_integers' ][ 'suggested_tags_width' ] = None
         
@@ -505,6 +511,13 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'integers' ][ 'video_buffer_size_mb' ] = 96
         
+        self._dictionary[ 'integers' ][ 'num_import_worker_threads' ] = 4
+        self._dictionary[ 'integers' ][ 'num_file_maintenance_worker_threads' ] = 4
+        self._dictionary[ 'integers' ][ 'num_update_download_threads' ] = 4
+        self._dictionary[ 'integers' ][ 'max_connections_per_host' ] = 4
+        self._dictionary[ 'integers' ][ 'num_db_read_connections' ] = 2
+        self._dictionary[ 'integers' ][ 'media_result_cache_size' ] = 20000
+        
         self._dictionary[ 'integers' ][ 'related_tags_width' ] = 150
         self._dictionary[ 'integers' ][ 'related_tags_search_1_duration_ms' ] = 250
         self._dictionary[ 'integers' ][ 'related_tags_search_2_duration_ms' ] = 2000
@@ -1309,6 +1322,11 @@ class ServiceRestricted( ServiceRemote ):
                 
                 body = ''
                 
+                if command in ( 'content_update_package', 'immediate_content_update_package' ):
+                    
+                    request_headers[ 'Accept' ] = HC.mime_string_lookup[ HC.APPLICATION_HYDRUS_UPDATE_CONTENT ] + ', ' + HC.mime_string_lookup[ HC.APPLICATION_JSON ]
+                    
+                
             elif method == HC.POST:
                 
                 query = ''
@@ -1321,6 +1339,12 @@ class ServiceRestricted( ServiceRemote ):
                     
                     del request_args[ 'file' ]
                     
+                elif command == 'content_update_package':
+                    
+                    content_type = HC.APPLICATION_HYDRUS_UPDATE_CONTENT
+                    
+                    body = request_args[ 'update' ].DumpToBinaryNetworkString()
+                    
                 else:
                     
                     if isinstance( request_args, HydrusSerialisable.SerialisableDictionary ):
@@ -1420,6 +1444,218 @@ class ServiceRestricted( ServiceRemote ):
     
 class ServiceRepository( ServiceRestricted ):
     
+    def _DownloadContentUpdatePackages( self, job_key, begin, subindex_count, update_index_string, processing_started ):
+        
+        # the raw responses go straight to disk. each subpackage is written to a .partial file and only renamed once it is complete, so an interrupted sync resumes with whatever is missing
+        
+        subindex_queue = Queue.Queue()
+        
+        for subindex in range( subindex_count ):
+            
+            path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex )
+            
+            if os.path.exists( path ):
+                
+                size = os.path.getsize( path )
+                
+                if size == 0:
+                    
+                    os.remove( path )
+                    
+                
+            
+            if not os.path.exists( path ):
+                
+                subindex_queue.put( subindex )
+                
+            
+        
+        num_to_download = subindex_queue.qsize()
+        
+        if num_to_download == 0:
+            
+            return
+            
+        
+        lock = threading.Lock()
+        
+        num_downloaded = [ 0 ]
+        errors = []
+        
+        def THREADDownloadContentUpdatePackages():
+            
+            while len( errors ) == 0 and not job_key.IsCancelled() and not HydrusGlobals.model_shutdown:
+                
+                try:
+                    
+                    subindex = subindex_queue.get_nowait()
+                    
+                except Queue.Empty:
+                    
+                    return
+                    
+                
+                path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex )
+                
+                partial_path = path + '.partial'
+                
+                try:
+                    
+                    self.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex }, temp_path = partial_path )
+                    
+                    os.rename( partial_path, path )
+                    
+                except Exception as e:
+                    
+                    with lock:
+                        
+                        errors.append( e )
+                        
+                    
+                    return
+                    
+                
+                with lock:
+                    
+                    num_downloaded[0] += 1
+                    
+                    if not processing_started.is_set():
+                        
+                        job_key.SetVariable( 'popup_text_1', update_index_string + 'downloaded ' + HydrusData.ConvertValueRangeToPrettyString( num_downloaded[0], num_to_download ) + ' content updates' )
+                        
+                    
+                
+            
+        
+        new_options = HydrusGlobals.client_controller.GetNewOptions()
+        
+        num_threads = min( new_options.GetInteger( 'num_update_download_threads' ), num_to_download )
+        
+        threads = [ threading.Thread( target = THREADDownloadContentUpdatePackages, name = 'Repository Update Download' ) for i in range( num_threads ) ]
+        
+        for thread in threads:
+            
+            thread.start()
+            
+        
+        for thread in threads:
+            
+            thread.join()
+            
+        
+        if len( errors ) > 0:
+            
+            raise errors[0]
+            
+        
+    
+    def _DownloadUpdates( self, job_key, processing_started ):
+        
+        num_updates_downloaded = 0
+        
+        options = HydrusGlobals.client_controller.GetOptions()
+        
+        try:
+            
+            while self.CanDownloadUpdate():
+                
+                if options[ 'pause_repo_sync' ]:
+                    
+                    break
+                    
+                
+                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                
+                if should_quit:
+                    
+                    break
+                    
+                
+                if self._info[ 'first_timestamp' ] is None:
+                    
+                    gauge_range = None
+                    gauge_value = 0
+                    
+                    update_index_string = 'initial update: '
+                    
+                else:
+                    
+                    gauge_range = ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION
+                    gauge_value = ( ( self._info[ 'next_download_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
+                    
+                    update_index_string = 'update ' + HydrusData.ConvertValueRangeToPrettyString( gauge_value, gauge_range ) + ': '
+                    
+                
+                if not processing_started.is_set():
+                    
+                    subupdate_index_string = 'service update: '
+                    
+                    HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
+                    HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'downloading' )
+                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'downloading and parsing' )
+                    job_key.SetVariable( 'popup_gauge_1', ( gauge_value, gauge_range ) )
+                    
+                
+                service_update_package = self.Request( HC.GET, 'service_update_package', { 'begin' : self._info[ 'next_download_timestamp' ] } )
+                
+                begin = service_update_package.GetBegin()
+                
+                subindex_count = service_update_package.GetSubindexCount()
+                
+                self._DownloadContentUpdatePackages( job_key, begin, subindex_count, update_index_string, processing_started )
+                
+                if job_key.IsCancelled():
+                    
+                    break
+                    
+                
+                if not processing_started.is_set():
+                    
+                    job_key.SetVariable( 'popup_text_1', update_index_string + 'committing' )
+                    
+                
+                path = ClientFiles.GetExpectedServiceUpdatePackagePath( self._service_key, begin )
+                
+                obj_string = service_update_package.DumpToNetworkString()
+                
+                with open( path, 'wb' ) as f: f.write( obj_string )
+                
+                service_updates = [ HydrusData.ServiceUpdate( HC.SERVICE_UPDATE_NEXT_DOWNLOAD_TIMESTAMP, service_update_package.GetNextBegin() ) ]
+                
+                service_keys_to_service_updates = { self._service_key : service_updates }
+                
+                self.ProcessServiceUpdates( service_keys_to_service_updates )
+                
+                HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
+                
+                HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
+                
+                num_updates_downloaded += 1
+                
+            
+        except HydrusExceptions.ServerBusyException:
+            
+            job_key.SetVariable( 'popup_text_1', 'Server was too busy to respond for now, will continue with processing.' )
+            
+            time.sleep( 3 )
+            
+        except Exception as e:
+            
+            if 'Could not connect' in str( e ):
+                
+                job_key.SetVariable( 'popup_text_1', 'Could not connect to service, will continue with processing.' )
+                
+                time.sleep( 5 )
+                
+            else:
+                
+                raise
+                
+            
+        
+        return num_updates_downloaded
+        
+    
     def _ProcessServiceUpdate( self, service_update ):
         
         ServiceRestricted._ProcessServiceUpdate( self, service_update )
@@ -1592,120 +1828,36 @@ class ServiceRepository( ServiceRestricted ):
             
             HydrusGlobals.client_controller.pub( 'message', job_key )
             
-            try:
+            # downloading runs ahead on its own thread, and processing starts as soon as the first update is fully on disk
+            
+            processing_started = threading.Event()
+            downloads_finished = threading.Event()
+            
+            download_results = {}
+            
+            def THREADDownloadUpdates():
                 
-                while self.CanDownloadUpdate():
-                    
-                    if options[ 'pause_repo_sync' ]:
-                        
-                        break
-                        
-                    
-                    ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-                    
-                    if should_quit:
-                        
-                        break
-                        
-                    
-                    if self._info[ 'first_timestamp' ] is None:
-                        
-                        gauge_range = None
-                        gauge_value = 0
-                        
-                        update_index_string = 'initial update: '
-                        
-                    else:
-                        
-                        gauge_range = ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION
-                        gauge_value = ( ( self._info[ 'next_download_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
-                        
-                        update_index_string = 'update ' + HydrusData.ConvertValueRangeToPrettyString( gauge_value, gauge_range ) + ': '
-                        
-                    
-                    subupdate_index_string = 'service update: '
-                    
-                    HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                    HydrusGlobals.client_controller.pub( 'splash_set_status_text', 'downloading' )
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'downloading and parsing' )
-                    job_key.SetVariable( 'popup_gauge_1', ( gauge_value, gauge_range ) )
-                    
-                    service_update_package = self.Request( HC.GET, 'service_update_package', { 'begin' : self._info[ 'next_download_timestamp' ] } )
-                    
-                    begin = service_update_package.GetBegin()
-                    
-                    subindex_count = service_update_package.GetSubindexCount()
-                    
-                    for subindex in range( subindex_count ):
-                        
-                        path = ClientFiles.GetExpectedContentUpdatePackagePath( self._service_key, begin, subindex )
-                        
-                        if os.path.exists( path ):
-                            
-                            size = os.path.getsize( path )
-                            
-                            if size == 0:
-                                
-                                os.remove( path )
-                                
-                            
-                        
-                        if not os.path.exists( path ):
-                            
-                            subupdate_index_string = 'content update ' + HydrusData.ConvertValueRangeToPrettyString( subindex + 1, subindex_count ) + ': '
-                            
-                            HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                            job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'downloading and parsing' )
-                            
-                            content_update_package = self.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex } )
-                            
-                            obj_string = content_update_package.DumpToNetworkString()
-                            
-                            job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'saving to disk' )
-                            
-                            with open( path, 'wb' ) as f: f.write( obj_string )
-                            
-                        
-                    
-                    job_key.SetVariable( 'popup_text_1', update_index_string + 'committing' )
-                    
-                    path = ClientFiles.GetExpectedServiceUpdatePackagePath( self._service_key, begin )
-                    
-                    obj_string = service_update_package.DumpToNetworkString()
-                    
-                    with open( path, 'wb' ) as f: f.write( obj_string )
+                try:
                     
-                    service_updates = [ HydrusData.ServiceUpdate( HC.SERVICE_UPDATE_NEXT_DOWNLOAD_TIMESTAMP, service_update_package.GetNextBegin() ) ]
+                    download_results[ 'num_updates_downloaded' ] = self._DownloadUpdates( job_key, processing_started )
                     
-                    service_keys_to_service_updates = { self._service_key : service_updates }
+                except Exception as e:
                     
-                    self.ProcessServiceUpdates( service_keys_to_service_updates )
+                    HydrusData.Print( traceback.format_exc() )
                     
-                    HydrusGlobals.client_controller.Write( 'service_updates', service_keys_to_service_updates )
+                    download_results[ 'error' ] = e
                     
-                    HydrusGlobals.client_controller.WaitUntilPubSubsEmpty()
+                finally:
                     
-                    num_updates_downloaded += 1
+                    downloads_finished.set()
                     
                 
-            except HydrusExceptions.ServerBusyException:
-                
-                job_key.SetVariable( 'popup_text_1', 'Server was too busy to respond for now, will continue with processing.' )
-                
-                time.sleep( 3 )
-                
-            except Exception as e:
+            
+            threading.Thread( target = THREADDownloadUpdates, name = 'Repository Sync Download' ).start()
+            
+            while not downloads_finished.is_set() and not self.CanProcessUpdate():
                 
-                if 'Could not connect' in str( e ):
-                    
-                    job_key.SetVariable( 'popup_text_1', 'Could not connect to service, will continue with processing.' )
-                    
-                    time.sleep( 5 )
-                    
-                else:
-                    
-                    raise
-                    
+                downloads_finished.wait( 1 )
                 
             
             if self._service_type == HC.TAG_REPOSITORY and self.CanProcessUpdate():
@@ -1735,9 +1887,9 @@ class ServiceRepository( ServiceRestricted ):
                     
                 
             
-            while self.CanProcessUpdate():
+            while self.CanProcessUpdate() or not downloads_finished.is_set():
                 
-                if options[ 'pause_repo_sync' ]:
+                if options[ 'pause_repo_sync' ] or 'error' in download_results:
                     
                     break
                     
@@ -1749,6 +1901,19 @@ class ServiceRepository( ServiceRestricted ):
                     break
                     
                 
+                if not self.CanProcessUpdate():
+                    
+                    # processing has caught up, so let the download thread report its progress
+                    
+                    processing_started.clear()
+                    
+                    downloads_finished.wait( 1 )
+                    
+                    continue
+                    
+                
+                processing_started.set()
+                
                 gauge_range = ( ( HydrusData.GetNow() - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION )
                 
                 gauge_value = ( ( self._info[ 'next_processing_timestamp' ] - self._info[ 'first_timestamp' ] ) / HC.UPDATE_DURATION ) + 1
@@ -1826,34 +1991,43 @@ class ServiceRepository( ServiceRestricted ):
                     
                     with open( path, 'rb' ) as f: obj_string = f.read()
                     
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'parsing' )
+                    HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
+                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'processing' )
                     
-                    try:
-                        
-                        content_update_package = HydrusSerialisable.CreateFromNetworkString( obj_string )
+                    # binary packages are parsed and processed a section at a time, so a big one is never all in memory as objects
+                    
+                    content_update_packages = HydrusData.IterateContentUpdatePackagesFromNetworkString( obj_string )
+                    
+                    while True:
                         
-                        if not isinstance( content_update_package, HydrusData.ServerToClientContentUpdatePackage ):
+                        try:
+                            
+                            content_update_package = content_update_packages.next()
+                            
+                        except StopIteration:
+                            
+                            break
                             
-                            raise Exception()
+                        except:
+                            
+                            self._ReportSyncProcessingError( path, 'did not parse' )
+                            
+                            return
                             
                         
-                    except:
+                        ( did_it_all, c_u_p_weight_processed ) = HydrusGlobals.client_controller.WriteSynchronous( 'content_update_package', self._service_key, content_update_package, job_key )
                         
-                        self._ReportSyncProcessingError( path, 'did not parse' )
+                        total_content_weight_processed += c_u_p_weight_processed
                         
-                        return
+                        if not did_it_all:
+                            
+                            processing_went_ok = False
+                            
+                            break
+                            
                         
                     
-                    HydrusGlobals.client_controller.pub( 'splash_set_title_text', self._name + ' - ' + update_index_string + subupdate_index_string )
-                    job_key.SetVariable( 'popup_text_1', update_index_string + subupdate_index_string + 'processing' )
-                    
-                    ( did_it_all, c_u_p_weight_processed ) = HydrusGlobals.client_controller.WriteSynchronous( 'content_update_package', self._service_key, content_update_package, job_key )
-                    
-                    total_content_weight_processed += c_u_p_weight_processed
-                    
-                    if not did_it_all:
-                        
-                        processing_went_ok = False
+                    if not processing_went_ok:
                         
                         break
                         
@@ -1900,6 +2074,17 @@ class ServiceRepository( ServiceRestricted ):
                 time.sleep( 0.1 )
                 
             
+            processing_started.set()
+            
+            downloads_finished.wait()
+            
+            if 'error' in download_results:
+                
+                raise download_results[ 'error' ]
+                
+            
+            num_updates_downloaded = download_results[ 'num_updates_downloaded' ]
+            
             job_key.DeleteVariable( 'popup_gauge_1' )
             job_key.DeleteVariable( 'popup_text_2' )
             job_key.DeleteVariable( 'popup_gauge_2' )
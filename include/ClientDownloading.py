@@ -1,4 +1,5 @@
 import bs4
+import ClientImporting
 import ClientNetworking
 import collections
 import httplib
@@ -262,7 +263,13 @@ def THREADDownloadURL( job_key, url, url_string ):
         job_key.DeleteVariable( 'popup_gauge_1' )
         job_key.SetVariable( 'popup_text_1', 'importing ' + url_string )
         
-        ( result, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', temp_path )
+        os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+        
+        file_import_job = ClientImporting.FileImportJob( temp_path, is_temporary = True )
+        
+        client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+        
+        ( result, hash ) = client_files_manager.ImportFile( file_import_job )
         
     except HydrusExceptions.NetworkException:
         
@@ -360,7 +367,13 @@ def THREADDownloadURLs( job_key, urls, title ):
             
             job_key.SetVariable( 'popup_text_2', 'importing' )
             
-            ( result, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', temp_path )
+            os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+            
+            file_import_job = ClientImporting.FileImportJob( temp_path, is_temporary = True )
+            
+            client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+            
+            ( result, hash ) = client_files_manager.ImportFile( file_import_job )
             
         except HydrusExceptions.NetworkException:
             
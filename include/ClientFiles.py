@@ -9,11 +9,13 @@ import HydrusGlobals
 import HydrusPaths
 import HydrusSerialisable
 import itertools
+import mmap
 import os
 import random
 import re
 import shutil
 import stat
+import struct
 import wx
 
 def GenerateExportFilename( media, terms ):
@@ -372,4 +374,254 @@ class ExportFolder( HydrusSerialisable.SerialisableBaseNamed ):
         self._phrase = phrase
         
     
-HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_EXPORT_FOLDER ] = ExportFolder
\ No newline at end of file
+HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_EXPORT_FOLDER ] = ExportFolder
+
+THUMBNAIL_PACK_FILENAME = 'thumbnails.pack'
+THUMBNAIL_PACK_HEADER_LENGTH = 36
+
+class ThumbnailPack( object ):
+    
+    # an append-only file of [ 32 byte hash ][ 4 byte length ][ thumbnail ] records, so a page of thumbnails can be read from one open file rather than thousands
+    # a zero length record is a deletion. overwritten and deleted records are dead space until the pack is compacted
+    
+    def __init__( self, directory ):
+        
+        self._path = os.path.join( directory, THUMBNAIL_PACK_FILENAME )
+        
+        self._hashes_to_offsets = {}
+        
+        self._size = 0
+        self._num_dead_bytes = 0
+        
+        self._mmap_file = None
+        self._mmap = None
+        self._mmap_size = 0
+        
+        self._Load()
+        
+    
+    def _CloseMMap( self ):
+        
+        if self._mmap is not None:
+            
+            self._mmap.close()
+            
+            self._mmap = None
+            
+        
+        if self._mmap_file is not None:
+            
+            self._mmap_file.close()
+            
+            self._mmap_file = None
+            
+        
+        self._mmap_size = 0
+        
+    
+    def _Load( self ):
+        
+        self._hashes_to_offsets = {}
+        
+        self._size = 0
+        self._num_dead_bytes = 0
+        
+        if not os.path.exists( self._path ):
+            
+            return
+            
+        
+        file_size = os.path.getsize( self._path )
+        
+        with open( self._path, 'rb' ) as f:
+            
+            while self._size + THUMBNAIL_PACK_HEADER_LENGTH <= file_size:
+                
+                header = f.read( THUMBNAIL_PACK_HEADER_LENGTH )
+                
+                hash = header[:32]
+                
+                ( length, ) = struct.unpack( '>I', header[32:] )
+                
+                offset = self._size + THUMBNAIL_PACK_HEADER_LENGTH
+                
+                if offset + length > file_size:
+                    
+                    break
+                    
+                
+                if hash in self._hashes_to_offsets:
+                    
+                    ( old_offset, old_length ) = self._hashes_to_offsets[ hash ]
+                    
+                    self._num_dead_bytes += THUMBNAIL_PACK_HEADER_LENGTH + old_length
+                    
+                
+                if length == 0:
+                    
+                    self._num_dead_bytes += THUMBNAIL_PACK_HEADER_LENGTH
+                    
+                    if hash in self._hashes_to_offsets:
+                        
+                        del self._hashes_to_offsets[ hash ]
+                        
+                    
+                else:
+                    
+                    self._hashes_to_offsets[ hash ] = ( offset, length )
+                    
+                
+                f.seek( length, 1 )
+                
+                self._size = offset + length
+                
+            
+        
+        if self._size < file_size:
+            
+            # the end of a record was never written, probably because of a crash, so chop it off
+            
+            HydrusData.Print( 'Thumbnail pack ' + self._path + ' had a partial record at its end, which has been removed.' )
+            
+            with open( self._path, 'r+b' ) as f:
+                
+                f.truncate( self._size )
+                
+            
+        
+    
+    def _Write( self, hash, thumbnail ):
+        
+        if hash in self._hashes_to_offsets:
+            
+            ( old_offset, old_length ) = self._hashes_to_offsets[ hash ]
+            
+            self._num_dead_bytes += THUMBNAIL_PACK_HEADER_LENGTH + old_length
+            
+        
+        with open( self._path, 'ab' ) as f:
+            
+            f.write( hash + struct.pack( '>I', len( thumbnail ) ) + thumbnail )
+            
+        
+        offset = self._size + THUMBNAIL_PACK_HEADER_LENGTH
+        
+        self._size = offset + len( thumbnail )
+        
+        return offset
+        
+    
+    def AddThumbnail( self, hash, thumbnail ):
+        
+        offset = self._Write( hash, thumbnail )
+        
+        self._hashes_to_offsets[ hash ] = ( offset, len( thumbnail ) )
+        
+    
+    def Close( self ):
+        
+        self._CloseMMap()
+        
+    
+    def Compact( self ):
+        
+        if self._num_dead_bytes == 0:
+            
+            return
+            
+        
+        self._CloseMMap()
+        
+        compact_path = self._path + '.compact'
+        
+        new_hashes_to_offsets = {}
+        
+        size = 0
+        
+        with open( self._path, 'rb' ) as source:
+            
+            with open( compact_path, 'wb' ) as dest:
+                
+                for ( hash, ( offset, length ) ) in sorted( self._hashes_to_offsets.items(), key = lambda ( hash, ( offset, length ) ): offset ):
+                    
+                    source.seek( offset )
+                    
+                    dest.write( hash + struct.pack( '>I', length ) + source.read( length ) )
+                    
+                    new_hashes_to_offsets[ hash ] = ( size + THUMBNAIL_PACK_HEADER_LENGTH, length )
+                    
+                    size += THUMBNAIL_PACK_HEADER_LENGTH + length
+                    
+                
+            
+        
+        if HC.PLATFORM_WINDOWS:
+            
+            os.remove( self._path )
+            
+        
+        os.rename( compact_path, self._path )
+        
+        self._hashes_to_offsets = new_hashes_to_offsets
+        
+        self._size = size
+        self._num_dead_bytes = 0
+        
+    
+    def DeleteThumbnail( self, hash ):
+        
+        if hash in self._hashes_to_offsets:
+            
+            self._Write( hash, '' )
+            
+            self._num_dead_bytes += THUMBNAIL_PACK_HEADER_LENGTH
+            
+            del self._hashes_to_offsets[ hash ]
+            
+        
+    
+    def GetHashes( self ):
+        
+        return self._hashes_to_offsets.keys()
+        
+    
+    def GetThumbnail( self, hash ):
+        
+        if hash not in self._hashes_to_offsets:
+            
+            raise HydrusExceptions.FileMissingException( 'Thumbnail for ' + hash.encode( 'hex' ) + ' was not in the thumbnail pack at ' + self._path + '!' )
+            
+        
+        ( offset, length ) = self._hashes_to_offsets[ hash ]
+        
+        if offset + length > self._mmap_size:
+            
+            # the pack has grown since we last mapped it
+            
+            self._CloseMMap()
+            
+            self._mmap_file = open( self._path, 'rb' )
+            
+            self._mmap = mmap.mmap( self._mmap_file.fileno(), 0, access = mmap.ACCESS_READ )
+            
+            self._mmap_size = len( self._mmap )
+            
+        
+        return self._mmap[ offset : offset + length ]
+        
+    
+    def HasThumbnail( self, hash ):
+        
+        return hash in self._hashes_to_offsets
+        
+    
+    def IsEmpty( self ):
+        
+        return len( self._hashes_to_offsets ) == 0
+        
+    
+    def NeedsCompaction( self ):
+        
+        return self._num_dead_bytes > 1048576 and self._num_dead_bytes > self._size / 4
+        
+    
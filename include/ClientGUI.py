@@ -469,6 +469,88 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             
         
     
+    def _BenchmarkContentUpdatePackages( self ):
+        
+        def do_it():
+            
+            num_files = 50000
+            
+            hash_ids_to_hashes = { hash_id : HydrusData.GenerateKey() for hash_id in range( num_files ) }
+            
+            files_rows = [ ( hash_id, random.randint( 1000, 10000000 ), HC.IMAGE_JPEG, HydrusData.GetNow(), 1280, 720, None, None, None ) for hash_id in range( num_files ) ]
+            mappings_rows = [ ( 'series:benchmark tag ' + str( i ), random.sample( xrange( num_files ), 100 ) ) for i in range( 5000 ) ]
+            
+            content_update_package = HydrusData.ServerToClientContentUpdatePackage()
+            
+            content_update_package.AddContentData( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, files_rows, hash_ids_to_hashes )
+            content_update_package.AddContentData( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, mappings_rows, {} )
+            
+            for ( name, dump_call ) in [ ( 'json', content_update_package.DumpToNetworkString ), ( 'binary', content_update_package.DumpToBinaryNetworkString ) ]:
+                
+                started = HydrusData.GetNowPrecise()
+                
+                network_string = dump_call()
+                
+                dumped = HydrusData.GetNowPrecise()
+                
+                HydrusData.CreateContentUpdatePackageFromNetworkString( network_string )
+                
+                loaded = HydrusData.GetNowPrecise()
+                
+                HydrusData.ShowText( name + ': ' + HydrusData.ConvertIntToBytes( len( network_string ) ) + ', dumped in ' + HydrusData.ConvertTimeDeltaToPrettyString( dumped - started ) + ', loaded in ' + HydrusData.ConvertTimeDeltaToPrettyString( loaded - dumped ) )
+                
+            
+        
+        HydrusData.ShowText( 'Benchmarking content update package formats...' )
+        
+        self._controller.CallToThread( do_it )
+        
+    
+    def _BenchmarkContentUploadPackages( self ):
+        
+        def do_it():
+            
+            for num_rows in ( 10000, 100000, 1000000 ):
+                
+                num_files = min( num_rows, 100000 )
+                
+                hash_ids_to_hashes = { hash_id : HydrusData.GenerateKey() for hash_id in range( num_files ) }
+                
+                content_data = HydrusData.GetEmptyDataDict()
+                
+                content_data[ HC.CONTENT_TYPE_MAPPINGS ][ HC.CONTENT_UPDATE_PEND ] = [ ( 'series:benchmark tag ' + str( i ), random.sample( xrange( num_files ), 100 ) ) for i in range( num_rows / 100 ) ]
+                
+                content_update_package = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+                
+                formats = [ ( 'json', content_update_package.DumpToNetworkString, HydrusData.CreateClientToServerContentUpdatePackageFromNetworkString ), ( 'binary', content_update_package.DumpToBinaryNetworkString, HydrusData.CreateClientToServerContentUpdatePackageFromNetworkString ) ]
+                
+                # yaml takes minutes at the top end
+                
+                if num_rows <= 100000:
+                    
+                    formats.insert( 0, ( 'yaml', lambda: yaml.safe_dump( { 'update' : content_update_package } ), yaml.safe_load ) )
+                    
+                
+                for ( name, dump_call, load_call ) in formats:
+                    
+                    network_string = dump_call()
+                    
+                    started = HydrusData.GetNowPrecise()
+                    
+                    load_call( network_string )
+                    
+                    loaded = HydrusData.GetNowPrecise()
+                    
+                    HydrusData.ShowText( HydrusData.ConvertIntToPrettyString( num_rows ) + ' rows, ' + name + ': ' + HydrusData.ConvertIntToBytes( len( network_string ) ) + ', parsed in ' + HydrusData.ConvertTimeDeltaToPrettyString( loaded - started ) )
+                    
+                
+            
+        
+        HydrusData.ShowText( 'Benchmarking content upload package formats...' )
+        
+        self._controller.CallToThread( do_it )
+        
+    
     def _CheckDBIntegrity( self ):
         
         message = 'This will check the database for missing and invalid entries. It may take several minutes to complete.'
@@ -484,17 +566,21 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
     
     def _CheckFileIntegrity( self ):
         
+        client_files_manager = self._controller.GetClientFilesManager()
+        
         message = 'This will go through all the files the database thinks it has and check that they actually exist. Any files that are missing will be deleted from the internal record.'
         message += os.linesep * 2
         message += 'You can perform a quick existence check, which will only look to see if a file exists, or a thorough content check, which will also make sure existing files are not corrupt or otherwise incorrect.'
         message += os.linesep * 2
         message += 'The thorough check will have to read all of your files\' content, which can take a long time. You should probably only do it if you suspect hard drive corruption and are now working on a safe drive.'
+        message += os.linesep * 2
+        message += 'The check runs in the background, and if you close the client before it is done, it will pick up where it left off the next time you boot.'
         
         with ClientGUIDialogs.DialogYesNo( self, message, title = 'Choose how thorough your integrity check will be.', yes_label = 'quick', no_label = 'thorough' ) as dlg:
             
             result = dlg.ShowModal()
             
-            if result == wx.ID_YES: self._controller.Write( 'file_integrity', 'quick' )
+            if result == wx.ID_YES: self._controller.CallToThread( client_files_manager.CheckFileIntegrity, 'quick' )
             elif result == wx.ID_NO:
                 
                 text = 'If an existing file is found to be corrupt/incorrect, would you like to move it or delete it?'
@@ -511,13 +597,13 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
                                 
                                 path = HydrusData.ToUnicode( dlg_3.GetPath() )
                                 
-                                self._controller.Write( 'file_integrity', 'thorough', path )
+                                self._controller.CallToThread( client_files_manager.CheckFileIntegrity, 'thorough', path )
                                 
                             
                         
                     elif result == wx.ID_NO:
                         
-                        self._controller.Write( 'file_integrity', 'thorough' )
+                        self._controller.CallToThread( client_files_manager.CheckFileIntegrity, 'thorough' )
                         
                     
                 
@@ -937,6 +1023,7 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'analyze_db' ), p( '&Analyze' ), p( 'Reanalyze the Database.' ) )
             submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'rebalance_client_files' ), p( '&Rebalance File Storage' ), p( 'Move your files around your chosen storage directories until they satisfy the weights you have set in the options.' ) )
             submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'regenerate_ac_cache' ), p( '&Regenerate Autocomplete Cache' ), p( 'Delete and recreate the tag autocomplete cache.' ) )
+            submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'regenerate_similar_files_tree' ), p( 'Regenerate &Similar Files Tree' ), p( 'Delete and recreate the similar files search tree.' ) )
             submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'regenerate_thumbnails' ), p( '&Regenerate Thumbnails' ), p( 'Delete all thumbnails and regenerate from original files.' ) )
             submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'check_db_integrity' ), p( 'Check Database Integrity' ) )
             submenu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'file_integrity' ), p( '&Check File Integrity' ), p( 'Review and fix all local file records.' ) )
@@ -1162,6 +1249,7 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             
             db_profile_mode_id = ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'db_profile_mode' )
             pubsub_profile_mode_id = ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'pubsub_profile_mode' )
+            query_planner_mode_id = ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'query_planner_mode' )
             force_idle_mode_id = ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'force_idle_mode' )
             
             debug = wx.Menu()
@@ -1169,12 +1257,20 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             debug.Check( db_profile_mode_id, HydrusGlobals.db_profile_mode )
             debug.AppendCheckItem( pubsub_profile_mode_id, p( '&PubSub Profile Mode' ) )
             debug.Check( pubsub_profile_mode_id, HydrusGlobals.pubsub_profile_mode )
+            debug.AppendCheckItem( query_planner_mode_id, p( '&Query Planner Mode' ) )
+            debug.Check( query_planner_mode_id, HydrusGlobals.query_planner_mode )
             debug.AppendCheckItem( force_idle_mode_id, p( '&Force Idle Mode' ) )
             debug.Check( force_idle_mode_id, HydrusGlobals.force_idle_mode )
             debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'debug_garbage' ), p( 'Garbage' ) )
             debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'clear_caches' ), p( '&Clear Preview/Fullscreen Caches' ) )
+            debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'report_cache_stats' ), p( 'Report Thumbnail/Preview/Fullscreen Cache Stats' ) )
+            debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'report_connection_stats' ), p( 'Report Connection Stats' ) )
+            debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'report_db_commit_stats' ), p( 'Report DB Commit Stats' ) )
+            debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'report_db_job_stats' ), p( 'Report DB Job Stats' ) )
             debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'delete_service_info' ), p( '&Clear DB Service Info Cache' ), p( 'Delete all cached service info, in case it has become desynchronised.' ) )
             debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'load_into_disk_cache' ), p( 'Load whole db into disk cache' ) )
+            debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'benchmark_content_update_packages' ), p( 'Benchmark content update package formats' ) )
+            debug.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'benchmark_content_upload_packages' ), p( 'Benchmark content upload package formats' ) )
             
             menu.AppendMenu( wx.ID_NONE, p( 'Debug' ), debug )
             menu.Append( ClientCaches.MENU_EVENT_ID_TO_ACTION_CACHE.GetPermanentId( 'help_shortcuts' ), p( '&Shortcuts' ) )
@@ -1686,6 +1782,25 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             
         
     
+    def _RegenerateSimilarFilesTree( self ):
+        
+        message = 'This will delete and then recreate the similar files search tree. This is useful if it has somehow become unbalanced and similar files searches are running slow.'
+        message += os.linesep * 2
+        message += 'If you have a lot of files, it can take a little while, during which the gui may hang.'
+        message += os.linesep * 2
+        message += 'If you do not have a specific reason to run this, it is pointless.'
+        
+        with ClientGUIDialogs.DialogYesNo( self, message, yes_label = 'do it', no_label = 'forget it' ) as dlg:
+            
+            result = dlg.ShowModal()
+            
+            if result == wx.ID_YES:
+                
+                self._controller.Write( 'regenerate_similar_files_tree' )
+                
+            
+        
+    
     def _RegenerateThumbnails( self ):
         
         client_files_manager = self._controller.GetClientFilesManager()
@@ -1694,7 +1809,7 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
         text += os.linesep * 2
         text += 'You can choose to only regenerate missing thumbnails, which is useful if you are rebuilding a fractured database, or you can force a complete refresh of all thumbnails, which is useful if some have been corrupted by a faulty hard drive.'
         text += os.linesep * 2
-        text += 'Files and thumbnails will be inaccessible while this occurs, so it is best to leave the client alone until it is done.'
+        text += 'This runs in the background, and if you close the client before it is done, it will pick up where it left off the next time you boot.'
         
         with ClientGUIDialogs.DialogYesNo( self, text, yes_label = 'only do missing', no_label = 'force all' ) as dlg:
             
@@ -1731,6 +1846,121 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             
         
     
+    def _ReportCacheStats( self ):
+        
+        for name in ( 'thumbnail', 'preview', 'fullscreen' ):
+            
+            stats = self._controller.GetCache( name ).GetStats()
+            
+            num_lookups = stats[ 'num_hits' ] + stats[ 'num_misses' ]
+            
+            if num_lookups == 0: hit_rate = 'no lookups yet'
+            else: hit_rate = '%.1f%% hit rate' % ( 100.0 * stats[ 'num_hits' ] / num_lookups )
+            
+            text = name + ' cache: '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_items' ] ) + ' items, '
+            text += HydrusData.ConvertValueRangeToBytes( stats[ 'estimated_memory_footprint' ], stats[ 'cache_size' ] ) + ', '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_hits' ] ) + ' hits, '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_misses' ] ) + ' misses (' + hit_rate + '), '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_evictions' ] ) + ' evictions, '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_rejections' ] ) + ' too big to cache'
+            
+            HydrusData.ShowText( text )
+            
+        
+        stats = self._controller.GetDB().GetMediaResultCacheStats()
+        
+        num_lookups = stats[ 'num_hits' ] + stats[ 'num_misses' ]
+        
+        if num_lookups == 0: hit_rate = 'no lookups yet'
+        else: hit_rate = '%.1f%% hit rate' % ( 100.0 * stats[ 'num_hits' ] / num_lookups )
+        
+        text = 'media result cache: '
+        text += HydrusData.ConvertValueRangeToPrettyString( stats[ 'num_items' ], stats[ 'cache_size' ] ) + ' items, '
+        text += HydrusData.ConvertIntToPrettyString( stats[ 'num_hits' ] ) + ' hits, '
+        text += HydrusData.ConvertIntToPrettyString( stats[ 'num_misses' ] ) + ' misses (' + hit_rate + '), '
+        text += HydrusData.ConvertIntToPrettyString( stats[ 'num_evictions' ] ) + ' evictions, '
+        text += HydrusData.ConvertIntToPrettyString( stats[ 'num_rejections' ] ) + ' not cached because they changed while loading'
+        
+        HydrusData.ShowText( text )
+        
+    
+    def _ReportConnectionStats( self ):
+        
+        locations_to_stats = self._controller.GetHTTP().GetStats()
+        
+        if len( locations_to_stats ) == 0:
+            
+            HydrusData.ShowText( 'No open connections.' )
+            
+            return
+            
+        
+        for ( location, stats ) in locations_to_stats.items():
+            
+            ( scheme, host, port ) = location
+            
+            if port is None: name = scheme + '://' + host
+            else: name = scheme + '://' + host + ':' + str( port )
+            
+            num_requests = stats[ 'num_requests' ]
+            
+            if num_requests == 0: average_wait = 0.0
+            else: average_wait = stats[ 'total_wait_time' ] / num_requests
+            
+            text = name + ': '
+            text += HydrusData.ConvertValueRangeToPrettyString( stats[ 'num_connections' ], stats[ 'max_connections' ] ) + ' connections (' + HydrusData.ConvertIntToPrettyString( stats[ 'num_idle' ] ) + ' idle), '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_in_flight' ] ) + ' requests in flight, '
+            text += HydrusData.ConvertIntToPrettyString( stats[ 'num_waiting' ] ) + ' waiting, '
+            text += HydrusData.ConvertIntToPrettyString( num_requests ) + ' requests over ' + HydrusData.ConvertIntToPrettyString( stats[ 'num_connections_made' ] ) + ' connections, '
+            text += '%.2fs average and %.2fs max wait for a connection, ' % ( average_wait, stats[ 'max_wait_time' ] )
+            text += HydrusData.ConvertIntToBytes( stats[ 'total_bytes' ] ) + ' received'
+            
+            HydrusData.ShowText( text )
+            
+        
+    
+    def _ReportDBCommitStats( self ):
+        
+        stats = self._controller.GetDB().GetCommitStats()
+        
+        num_commits = stats[ 'num_commits' ]
+        num_jobs_committed = stats[ 'num_jobs_committed' ]
+        time_running = max( stats[ 'time_running' ], 1.0 )
+        
+        text = HydrusData.ConvertIntToPrettyString( num_jobs_committed ) + ' db writes in ' + HydrusData.ConvertIntToPrettyString( num_commits ) + ' commits over ' + HydrusData.ConvertTimeDeltaToPrettyString( time_running ) + ': '
+        text += '%.2f writes/s, %.2f commits/s' % ( num_jobs_committed / time_running, num_commits / time_running )
+        
+        if num_commits > 0:
+            
+            text += ', %.2f writes per commit' % ( float( num_jobs_committed ) / num_commits )
+            
+        
+        HydrusData.ShowText( text )
+        
+    
+    def _ReportDBJobStats( self ):
+        
+        db = self._controller.GetDB()
+        
+        HydrusData.Print( db.GetJobStatsReport() )
+        
+        stats = db.GetJobStats()
+        
+        lines = [ 'The full db job stats have been written to the log. The slowest actions were:' ]
+        
+        for action_stats in stats[ 'actions' ][:10]:
+            
+            num_jobs = action_stats[ 'num_jobs' ]
+            
+            total_time = action_stats[ 'execution' ][ 'total' ] + action_stats[ 'commit' ][ 'total' ]
+            
+            lines.append( action_stats[ 'job_type' ] + ' ' + action_stats[ 'action' ] + ': ' + HydrusData.ConvertIntToPrettyString( num_jobs ) + ' jobs, %.1fms avg, %.1fms avg queue wait' % ( total_time / num_jobs, action_stats[ 'queue_wait' ][ 'total' ] / num_jobs ) )
+            
+        
+        HydrusData.ShowText( os.linesep.join( lines ) )
+        
+    
     def _ReviewServices( self ):
         
         frame = ClientGUITopLevelWindows.FrameThatTakesScrollablePanel( self, self._controller.PrepStringForDisplay( 'Review Services' ), 'review_services' )
@@ -2309,6 +2539,8 @@ The password is cleartext here but obscured in the entry dialog. Enter a blank p
             elif command == 'auto_server_setup': self._AutoServerSetup()
             elif command == 'backup_database': self._controller.BackupDatabase()
             elif command == 'backup_service': self._BackupService( data )
+            elif command == 'benchmark_content_update_packages': self._BenchmarkContentUpdatePackages()
+            elif command == 'benchmark_content_upload_packages': self._BenchmarkContentUploadPackages()
             elif command == 'check_db_integrity': self._CheckDBIntegrity()
             elif command == 'clear_caches': self._controller.ClearCaches()
             elif command == 'clear_orphans': self._ClearOrphans()
@@ -2428,6 +2660,10 @@ The password is cleartext here but obscured in the entry dialog. Enter a blank p
                 
                 HydrusGlobals.pubsub_profile_mode = not HydrusGlobals.pubsub_profile_mode
                 
+            elif command == 'query_planner_mode':
+                
+                HydrusGlobals.query_planner_mode = not HydrusGlobals.query_planner_mode
+                
             elif command == 'rebalance_client_files': self._RebalanceClientFiles()
             elif command == 'redo': self._controller.pub( 'redo' )
             elif command == 'refresh':
@@ -2437,7 +2673,12 @@ The password is cleartext here but obscured in the entry dialog. Enter a blank p
                 if page is not None: page.RefreshQuery()
                 
             elif command == 'regenerate_ac_cache': self._RegenerateACCache()
+            elif command == 'regenerate_similar_files_tree': self._RegenerateSimilarFilesTree()
             elif command == 'regenerate_thumbnails': self._RegenerateThumbnails()
+            elif command == 'report_cache_stats': self._ReportCacheStats()
+            elif command == 'report_connection_stats': self._ReportConnectionStats()
+            elif command == 'report_db_commit_stats': self._ReportDBCommitStats()
+            elif command == 'report_db_job_stats': self._ReportDBJobStats()
             elif command == 'restart':
                 
                 self.Exit( restart = True )
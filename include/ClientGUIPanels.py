@@ -199,7 +199,7 @@ class ManageOptionsPanel( ManagePanel ):
         
         self._listbook = ClientGUICommon.ListBook( self )
         
-        self._listbook.AddPage( 'connection', 'connection', self._ConnectionPanel( self._listbook ) )
+        self._listbook.AddPage( 'connection', 'connection', self._ConnectionPanel( self._listbook, self._new_options ) )
         self._listbook.AddPage( 'files and trash', 'files and trash', self._FilesAndTrashPanel( self._listbook ) )
         self._listbook.AddPage( 'speed and memory', 'speed and memory', self._SpeedAndMemoryPanel( self._listbook, self._new_options ) )
         self._listbook.AddPage( 'maintenance and processing', 'maintenance and processing', self._MaintenanceAndProcessingPanel( self._listbook ) )
@@ -246,6 +246,8 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._resized_thumbnails_override = wx.DirPickerCtrl( self, style = wx.DIRP_USE_TEXTCTRL )
             
+            self._pack_resized_thumbnails = wx.CheckBox( self )
+            
             #
             
             self._new_options = HydrusGlobals.client_controller.GetNewOptions()
@@ -262,6 +264,8 @@ class ManageOptionsPanel( ManagePanel ):
                 self._resized_thumbnails_override.SetPath( resized_thumbnail_override )
                 
             
+            self._pack_resized_thumbnails.SetValue( self._new_options.GetBoolean( 'pack_resized_thumbnails' ) )
+            
             #
             
             vbox = wx.BoxSizer( wx.VERTICAL )
@@ -303,6 +307,21 @@ class ManageOptionsPanel( ManagePanel ):
             
             vbox.AddF( hbox, CC.FLAGS_EXPAND_PERPENDICULAR )
             
+            text = 'Resized thumbnails can also be packed into one large file per folder, which makes loading a page of thumbnails much faster on spinning disks and network shares. Your existing resized thumbnails will be converted over time as the client rebalances its files, or immediately if you force a rebalance.'
+            
+            st = wx.StaticText( self, label = text )
+            
+            st.Wrap( 400 )
+            
+            vbox.AddF( st, CC.FLAGS_EXPAND_PERPENDICULAR )
+            
+            hbox = wx.BoxSizer( wx.HORIZONTAL )
+            
+            hbox.AddF( wx.StaticText( self, label = 'pack resized thumbnails: ' ), CC.FLAGS_MIXED )
+            hbox.AddF( self._pack_resized_thumbnails, CC.FLAGS_MIXED )
+            
+            vbox.AddF( hbox, CC.FLAGS_EXPAND_PERPENDICULAR )
+            
             self.SetSizer( vbox )
             
         
@@ -385,6 +404,8 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._new_options.SetClientFilesLocationsToIdealWeights( locations_to_weights, resized_thumbnails_override )
             
+            self._new_options.SetBoolean( 'pack_resized_thumbnails', self._pack_resized_thumbnails.GetValue() )
+            
         
 
     class _ColoursPanel( wx.Panel ):
@@ -527,15 +548,20 @@ class ManageOptionsPanel( ManagePanel ):
     
     class _ConnectionPanel( wx.Panel ):
         
-        def __init__( self, parent ):
+        def __init__( self, parent, new_options ):
             
             wx.Panel.__init__( self, parent )
             
+            self._new_options = new_options
+            
             self.SetBackgroundColour( wx.SystemSettings.GetColour( wx.SYS_COLOUR_BTNFACE ) )
             
             self._external_host = wx.TextCtrl( self )
             self._external_host.SetToolTipString( 'If you have trouble parsing your external ip using UPnP, you can force it to be this.' )
             
+            self._max_connections_per_host = wx.SpinCtrl( self, min = 1, max = 16 )
+            self._max_connections_per_host.SetToolTipString( 'how many requests the client will make to the same website or server at once' + os.linesep + 'downloaders, subscriptions and repository syncs queue up for a free connection beyond this' )
+            
             proxy_panel = ClientGUICommon.StaticBox( self, 'proxy settings' )
             
             self._proxy_type = ClientGUICommon.BetterChoice( proxy_panel )
@@ -553,6 +579,8 @@ class ManageOptionsPanel( ManagePanel ):
                 self._external_host.SetValue( HC.options[ 'external_host' ] )
                 
             
+            self._max_connections_per_host.SetValue( self._new_options.GetInteger( 'max_connections_per_host' ) )
+            
             self._proxy_type.Append( 'http', 'http' )
             self._proxy_type.Append( 'socks4', 'socks4' )
             self._proxy_type.Append( 'socks5', 'socks5' )
@@ -620,6 +648,9 @@ class ManageOptionsPanel( ManagePanel ):
             gridbox.AddF( wx.StaticText( self, label = 'External IP/host override: ' ), CC.FLAGS_MIXED )
             gridbox.AddF( self._external_host, CC.FLAGS_MIXED )
             
+            gridbox.AddF( wx.StaticText( self, label = 'Max connections to one host at once: ' ), CC.FLAGS_MIXED )
+            gridbox.AddF( self._max_connections_per_host, CC.FLAGS_MIXED )
+            
             vbox = wx.BoxSizer( wx.VERTICAL )
             
             vbox.AddF( gridbox, CC.FLAGS_EXPAND_SIZER_PERPENDICULAR )
@@ -657,6 +688,8 @@ class ManageOptionsPanel( ManagePanel ):
             
             HC.options[ 'external_host' ] = external_host
             
+            self._new_options.SetInteger( 'max_connections_per_host', self._max_connections_per_host.GetValue() )
+            
         
     
     class _DownloadingPanel( wx.Panel ):
@@ -1858,6 +1891,15 @@ class ManageOptionsPanel( ManagePanel ):
             self._disk_cache_maintenance_mb = ClientGUICommon.NoneableSpinCtrl( self, 'disk cache maintenance (MB)', none_phrase = 'do not keep db cached', min = 32, max = 65536 )
             self._disk_cache_maintenance_mb.SetToolTipString( 'The client can regularly check the front of its database is cached in memory. This represents how many megabytes it will ensure are cached.' )
             
+            self._db_group_commit_window_ms = ClientGUICommon.NoneableSpinCtrl( self, 'db group commit window (ms)', none_phrase = 'commit every write separately', min = 1, max = 1000 )
+            self._db_group_commit_window_ms.SetToolTipString( 'Small background writes like ratings, archive/inbox changes and tag edits can be saved together in one transaction, which is much faster on slow disks. This is how long the db will wait to gather more of them. Changes take effect on restart.' )
+            
+            self._db_slow_job_log_ms = ClientGUICommon.NoneableSpinCtrl( self, 'log db jobs slower than (ms)', none_phrase = 'do not log slow db jobs', min = 1, max = 600000 )
+            self._db_slow_job_log_ms.SetToolTipString( 'Any db job that takes longer than this will be written to the log, along with the sql it ran. This is useful for tracking down hangs. Changes take effect on restart.' )
+            
+            self._file_maintenance_throttle_mb = ClientGUICommon.NoneableSpinCtrl( self, 'file maintenance read limit while not idle (MB/s)', none_phrase = 'do not limit', min = 1, max = 10000 )
+            self._file_maintenance_throttle_mb.SetToolTipString( 'The file integrity check and thumbnail regeneration read through all your files. While you are using the client, they will read no faster than this, so your drives stay responsive. When the client is idle, they go as fast as they can.' )
+            
             self._thumbnail_width = wx.SpinCtrl( self, min = 20, max = 200 )
             self._thumbnail_width.Bind( wx.EVT_SPINCTRL, self.EventThumbnailsUpdate )
             
@@ -1886,6 +1928,21 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._forced_search_limit = ClientGUICommon.NoneableSpinCtrl( self, '', min = 1, max = 100000 )
             
+            self._num_import_worker_threads = wx.SpinCtrl( self, min = 1, max = 64 )
+            self._num_import_worker_threads.SetToolTipString( 'how many files hard drive imports and import folders will hash and thumbnail at once' + os.linesep + 'set this to about the number of cpu cores you have, or lower it if your drives are slow' )
+            
+            self._num_file_maintenance_worker_threads = wx.SpinCtrl( self, min = 1, max = 64 )
+            self._num_file_maintenance_worker_threads.SetToolTipString( 'how many files the file integrity check and thumbnail regeneration will work on at once' + os.linesep + 'set this to about the number of cpu cores you have, or lower it if your drives are slow' )
+            
+            self._num_update_download_threads = wx.SpinCtrl( self, min = 1, max = 16 )
+            self._num_update_download_threads.SetToolTipString( 'how many content updates repository synchronisation will download from a server at once' )
+            
+            self._num_db_read_connections = wx.SpinCtrl( self, min = 0, max = 8 )
+            self._num_db_read_connections.SetToolTipString( 'how many extra database connections searches and other reads can use while the db is busy writing' + os.linesep + 'set this to 0 to do everything on one connection, as older versions did' + os.linesep + 'changes take effect on restart' )
+            
+            self._media_result_cache_size = wx.SpinCtrl( self, min = 0, max = 1000000 )
+            self._media_result_cache_size.SetToolTipString( 'how many files\' metadata to keep in memory, so opening and refreshing pages with files you have recently seen is faster' + os.linesep + 'changes take effect on restart' )
+            
             self._num_autocomplete_chars = wx.SpinCtrl( self, min = 1, max = 100 )
             self._num_autocomplete_chars.SetToolTipString( 'how many characters you enter before the gui fetches autocomplete results from the db. (otherwise, it will only fetch exact matches)' + os.linesep + 'increase this if you find autocomplete results are slow' )
             
@@ -1905,6 +1962,9 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._disk_cache_init_period.SetValue( self._new_options.GetNoneableInteger( 'disk_cache_init_period' ) )
             self._disk_cache_maintenance_mb.SetValue( self._new_options.GetNoneableInteger( 'disk_cache_maintenance_mb' ) )
+            self._db_group_commit_window_ms.SetValue( self._new_options.GetNoneableInteger( 'db_group_commit_window_ms' ) )
+            self._db_slow_job_log_ms.SetValue( self._new_options.GetNoneableInteger( 'db_slow_job_log_ms' ) )
+            self._file_maintenance_throttle_mb.SetValue( self._new_options.GetNoneableInteger( 'file_maintenance_throttle_mb' ) )
             
             ( thumbnail_width, thumbnail_height ) = HC.options[ 'thumbnail_dimensions' ]
             
@@ -1922,6 +1982,12 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._forced_search_limit.SetValue( self._new_options.GetNoneableInteger( 'forced_search_limit' ) )
             
+            self._num_import_worker_threads.SetValue( self._new_options.GetInteger( 'num_import_worker_threads' ) )
+            self._num_file_maintenance_worker_threads.SetValue( self._new_options.GetInteger( 'num_file_maintenance_worker_threads' ) )
+            self._num_update_download_threads.SetValue( self._new_options.GetInteger( 'num_update_download_threads' ) )
+            self._num_db_read_connections.SetValue( self._new_options.GetInteger( 'num_db_read_connections' ) )
+            self._media_result_cache_size.SetValue( self._new_options.GetInteger( 'media_result_cache_size' ) )
+            
             self._num_autocomplete_chars.SetValue( HC.options[ 'num_autocomplete_chars' ] )
             
             self._fetch_ac_results_automatically.SetValue( HC.options[ 'fetch_ac_results_automatically' ] )
@@ -1960,6 +2026,9 @@ class ManageOptionsPanel( ManagePanel ):
             
             vbox.AddF( self._disk_cache_init_period, CC.FLAGS_EXPAND_PERPENDICULAR )
             vbox.AddF( self._disk_cache_maintenance_mb, CC.FLAGS_EXPAND_PERPENDICULAR )
+            vbox.AddF( self._db_group_commit_window_ms, CC.FLAGS_EXPAND_PERPENDICULAR )
+            vbox.AddF( self._db_slow_job_log_ms, CC.FLAGS_EXPAND_PERPENDICULAR )
+            vbox.AddF( self._file_maintenance_throttle_mb, CC.FLAGS_EXPAND_PERPENDICULAR )
             
             gridbox = wx.FlexGridSizer( 0, 2 )
             
@@ -2012,6 +2081,21 @@ class ManageOptionsPanel( ManagePanel ):
             gridbox.AddF( wx.StaticText( self, label = 'Forced system:limit for all searches: ' ), CC.FLAGS_MIXED )
             gridbox.AddF( self._forced_search_limit, CC.FLAGS_NONE )
             
+            gridbox.AddF( wx.StaticText( self, label = 'Number of files to import at once: ' ), CC.FLAGS_MIXED )
+            gridbox.AddF( self._num_import_worker_threads, CC.FLAGS_MIXED )
+            
+            gridbox.AddF( wx.StaticText( self, label = 'Number of files to check or thumbnail at once: ' ), CC.FLAGS_MIXED )
+            gridbox.AddF( self._num_file_maintenance_worker_threads, CC.FLAGS_MIXED )
+            
+            gridbox.AddF( wx.StaticText( self, label = 'Number of repository updates to download at once: ' ), CC.FLAGS_MIXED )
+            gridbox.AddF( self._num_update_download_threads, CC.FLAGS_MIXED )
+            
+            gridbox.AddF( wx.StaticText( self, label = 'Number of extra db connections for searches (requires restart): ' ), CC.FLAGS_MIXED )
+            gridbox.AddF( self._num_db_read_connections, CC.FLAGS_MIXED )
+            
+            gridbox.AddF( wx.StaticText( self, label = 'Number of files\' metadata to cache (requires restart): ' ), CC.FLAGS_MIXED )
+            gridbox.AddF( self._media_result_cache_size, CC.FLAGS_MIXED )
+            
             vbox.AddF( gridbox, CC.FLAGS_EXPAND_PERPENDICULAR )
             
             text = 'If you disable automatic autocomplete results fetching, use Ctrl+Space to fetch results manually.'
@@ -2102,6 +2186,9 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._new_options.SetNoneableInteger( 'disk_cache_init_period', self._disk_cache_init_period.GetValue() )
             self._new_options.SetNoneableInteger( 'disk_cache_maintenance_mb', self._disk_cache_maintenance_mb.GetValue() )
+            self._new_options.SetNoneableInteger( 'db_group_commit_window_ms', self._db_group_commit_window_ms.GetValue() )
+            self._new_options.SetNoneableInteger( 'db_slow_job_log_ms', self._db_slow_job_log_ms.GetValue() )
+            self._new_options.SetNoneableInteger( 'file_maintenance_throttle_mb', self._file_maintenance_throttle_mb.GetValue() )
             
             new_thumbnail_dimensions = [ self._thumbnail_width.GetValue(), self._thumbnail_height.GetValue() ]
             
@@ -2115,6 +2202,12 @@ class ManageOptionsPanel( ManagePanel ):
             
             self._new_options.SetNoneableInteger( 'forced_search_limit', self._forced_search_limit.GetValue() )
             
+            self._new_options.SetInteger( 'num_import_worker_threads', self._num_import_worker_threads.GetValue() )
+            self._new_options.SetInteger( 'num_file_maintenance_worker_threads', self._num_file_maintenance_worker_threads.GetValue() )
+            self._new_options.SetInteger( 'num_update_download_threads', self._num_update_download_threads.GetValue() )
+            self._new_options.SetInteger( 'num_db_read_connections', self._num_db_read_connections.GetValue() )
+            self._new_options.SetInteger( 'media_result_cache_size', self._media_result_cache_size.GetValue() )
+            
             HC.options[ 'num_autocomplete_chars' ] = self._num_autocomplete_chars.GetValue()
             
             HC.options[ 'fetch_ac_results_automatically' ] = self._fetch_ac_results_automatically.GetValue()
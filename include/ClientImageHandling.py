@@ -43,6 +43,14 @@ def GenerateNumpyImage( path ):
     
     return numpy_image
     
+def GenerateNumpyImageFromData( data ):
+    
+    pil_image = HydrusImageHandling.GeneratePILImageFromData( data )
+    
+    numpy_image = GenerateNumPyImageFromPILImage( pil_image )
+    
+    return numpy_image
+    
 def GenerateNumPyImageFromPILImage( pil_image ):
     
     pil_image = HydrusImageHandling.Dequantize( pil_image )
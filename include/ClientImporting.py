@@ -4,6 +4,7 @@ import ClientData
 import ClientDefaults
 import ClientDownloading
 import ClientFiles
+import ClientImageHandling
 import ClientThreading
 import collections
 import HydrusConstants as HC
@@ -11,11 +12,13 @@ import HydrusData
 import HydrusExceptions
 import HydrusFileHandling
 import HydrusGlobals
+import HydrusImageHandling
 import HydrusPaths
 import HydrusSerialisable
 import HydrusTags
 import json
 import os
+import Queue
 import random
 import shutil
 import threading
@@ -25,6 +28,338 @@ import urlparse
 import wx
 import HydrusThreading
 
+FILE_IMPORT_BATCH_SIZE_PER_THREAD = 4
+
+def ImportFiles( file_import_jobs, num_threads = 1, allowed_mimes = None ):
+    
+    # the heavy preparation of each job is spread over several threads, and then everything that worked goes to the db in one transaction
+    # results come back in the same order as the jobs, as ( status, hash, exception, exception_traceback )
+    
+    job_queue = Queue.Queue()
+    
+    for file_import_job in file_import_jobs:
+        
+        job_queue.put( file_import_job )
+        
+    
+    jobs_to_exceptions = {}
+    
+    num_threads = max( 1, min( num_threads, len( file_import_jobs ) ) )
+    
+    threads = [ threading.Thread( target = THREADPrepareFileImportJobs, args = ( job_queue, jobs_to_exceptions, allowed_mimes ) ) for i in range( num_threads ) ]
+    
+    for thread in threads:
+        
+        thread.start()
+        
+    
+    for thread in threads:
+        
+        thread.join()
+        
+    
+    prepared_jobs = [ file_import_job for file_import_job in file_import_jobs if file_import_job not in jobs_to_exceptions ]
+    
+    jobs_to_results = {}
+    
+    if len( prepared_jobs ) > 0:
+        
+        try:
+            
+            results = HydrusGlobals.client_controller.WriteSynchronous( 'import_files', prepared_jobs )
+            
+            jobs_to_results = dict( zip( prepared_jobs, results ) )
+            
+        except:
+            
+            # one bad job should not sink the whole batch, so try them again one at a time
+            
+            for file_import_job in prepared_jobs:
+                
+                try:
+                    
+                    jobs_to_results[ file_import_job ] = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', file_import_job )
+                    
+                except Exception as e:
+                    
+                    jobs_to_exceptions[ file_import_job ] = ( e, traceback.format_exc() )
+                    
+                
+            
+        
+    
+    results = []
+    
+    for file_import_job in file_import_jobs:
+        
+        if file_import_job in jobs_to_exceptions:
+            
+            ( exception, exception_traceback ) = jobs_to_exceptions[ file_import_job ]
+            
+            results.append( ( None, None, exception, exception_traceback ) )
+            
+        else:
+            
+            ( status, hash ) = jobs_to_results[ file_import_job ]
+            
+            results.append( ( status, hash, None, None ) )
+            
+        
+    
+    return results
+    
+def THREADPrepareFileImportJobs( job_queue, jobs_to_exceptions, allowed_mimes ):
+    
+    while True:
+        
+        try:
+            
+            file_import_job = job_queue.get_nowait()
+            
+        except Queue.Empty:
+            
+            return
+            
+        
+        try:
+            
+            file_import_job.GenerateHash()
+            
+            if allowed_mimes is not None and file_import_job.GetMime() not in allowed_mimes:
+                
+                raise HydrusExceptions.MimeException( 'Filetype is not permitted!' )
+                
+            
+            file_import_job.GenerateHashAndStatus()
+            
+            if file_import_job.IsNewToDB():
+                
+                file_import_job.GenerateInfo()
+                
+            
+        except Exception as e:
+            
+            jobs_to_exceptions[ file_import_job ] = ( e, traceback.format_exc() )
+            
+        
+    
+class FileImportJob( object ):
+    
+    def __init__( self, temp_path, import_file_options = None, is_temporary = False ):
+        
+        if import_file_options is None:
+            
+            import_file_options = ClientDefaults.GetDefaultImportFileOptions()
+            
+        
+        self._temp_path = temp_path
+        self._import_file_options = import_file_options
+        self._is_temporary = is_temporary
+        
+        self._hash = None
+        self._extra_hashes = None
+        self._mime = None
+        self._size = None
+        self._pre_import_status = None
+        
+        self._file_info = None
+        self._phash = None
+        
+    
+    def GetExtraHashes( self ):
+        
+        return self._extra_hashes
+        
+    
+    def GetFileInfo( self ):
+        
+        return self._file_info
+        
+    
+    def GetHash( self ):
+        
+        return self._hash
+        
+    
+    def GetImportFileOptions( self ):
+        
+        return self._import_file_options
+        
+    
+    def GetMime( self ):
+        
+        return self._mime
+        
+    
+    def GetPHash( self ):
+        
+        return self._phash
+        
+    
+    def GetPreImportStatus( self ):
+        
+        return self._pre_import_status
+        
+    
+    def GetSize( self ):
+        
+        return self._size
+        
+    
+    def GetTempPath( self ):
+        
+        return self._temp_path
+        
+    
+    def GenerateHash( self ):
+        
+        HydrusImageHandling.ConvertToPngIfBmp( self._temp_path )
+        
+        ( self._hash, md5, sha1, sha512, self._mime ) = HydrusFileHandling.GetHashesAndMimeFromPath( self._temp_path )
+        
+        self._extra_hashes = ( md5, sha1, sha512 )
+        
+        self._size = os.path.getsize( self._temp_path )
+        
+    
+    def GenerateHashAndStatus( self ):
+        
+        if self._hash is None:
+            
+            self.GenerateHash()
+            
+        
+        ( self._pre_import_status, hash ) = HydrusGlobals.client_controller.Read( 'hash_status', self._hash )
+        
+    
+    def GenerateInfo( self ):
+        
+        # this is the heavy cpu and disk work of an import, so it should happen before the job gets to the db
+        
+        ( archive, exclude_deleted_files, min_size, min_resolution ) = self._import_file_options.ToTuple()
+        
+        mime = self._mime
+        
+        client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+        
+        # a downloaded temp file is thrown away after the import, so it can be moved rather than copied
+        
+        dest_path = client_files_manager.AddFile( self._hash, mime, self._temp_path, move = self._is_temporary )
+        
+        # I moved the file copy up because passing an original filename with unicode chars to getfileinfo
+        # was causing problems in windows.
+        
+        ( size, mime, width, height, duration, num_frames, num_words ) = HydrusFileHandling.GetFileInfo( dest_path, mime = mime )
+        
+        if width is not None and height is not None:
+            
+            if min_resolution is not None:
+                
+                ( min_x, min_y ) = min_resolution
+                
+                if width < min_x or height < min_y:
+                    
+                    os.remove( dest_path )
+                    
+                    raise Exception( 'Resolution too small' )
+                    
+                
+            
+        
+        if min_size is not None:
+            
+            if size < min_size:
+                
+                os.remove( dest_path )
+                
+                raise Exception( 'File too small' )
+                
+            
+        
+        if mime in HC.MIMES_WITH_THUMBNAILS:
+            
+            thumbnail = HydrusFileHandling.GenerateThumbnail( dest_path, mime = mime )
+            
+            client_files_manager.AddFullSizeThumbnail( self._hash, thumbnail )
+            
+        
+        if mime in ( HC.IMAGE_JPEG, HC.IMAGE_PNG ):
+            
+            try:
+                
+                self._phash = ClientImageHandling.GeneratePerceptualHash( dest_path )
+                
+            except:
+                
+                pass
+                
+            
+        
+        self._file_info = ( size, mime, width, height, duration, num_frames, num_words )
+        
+    
+    def HasInfo( self ):
+        
+        return self._file_info is not None
+        
+    
+    def IsNewToDB( self, override_deleted = False ):
+        
+        if self._pre_import_status == CC.STATUS_NEW:
+            
+            return True
+            
+        
+        if self._pre_import_status == CC.STATUS_DELETED:
+            
+            ( archive, exclude_deleted_files, min_size, min_resolution ) = self._import_file_options.ToTuple()
+            
+            if override_deleted or not exclude_deleted_files:
+                
+                return True
+                
+            
+        
+        return False
+        
+    
+class FileImportSpeedTracker( object ):
+    
+    def __init__( self ):
+        
+        self._lock = threading.Lock()
+        
+        self._num_files = 0
+        self._num_bytes = 0
+        self._time_spent = 0.0
+        
+    
+    def AddWork( self, num_files, num_bytes, time_spent ):
+        
+        with self._lock:
+            
+            self._num_files += num_files
+            self._num_bytes += num_bytes
+            self._time_spent += time_spent
+            
+        
+    
+    def GetSpeedText( self ):
+        
+        with self._lock:
+            
+            if self._num_files == 0 or self._time_spent <= 0:
+                
+                return ''
+                
+            
+            files_per_second = self._num_files / self._time_spent
+            bytes_per_second = int( self._num_bytes / self._time_spent )
+            
+            return '%.1f files/s, %s/s' % ( files_per_second, HydrusData.ConvertIntToBytes( bytes_per_second ) )
+            
+        
+    
 class GalleryImport( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_GALLERY_IMPORT
@@ -212,7 +547,13 @@ class GalleryImport( HydrusSerialisable.SerialisableBase ):
                         gallery.GetFile( temp_path, url, report_hooks = [ self._file_download_hook ] )
                         
                     
-                    ( status, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', temp_path, import_file_options = self._import_file_options, url = url )
+                    os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+                    
+                    file_import_job = FileImportJob( temp_path, self._import_file_options, is_temporary = True )
+                    
+                    client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+                    
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job, url = url )
                     
                 finally:
                     
@@ -623,6 +964,8 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
         
         self._seed_cache_status = ( 'initialising', ( 0, 1 ) )
         
+        self._speed_tracker = FileImportSpeedTracker()
+        
         self._lock = threading.Lock()
         
     
@@ -646,7 +989,16 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
     
     def _RegenerateSeedCacheStatus( self, page_key ):
         
-        new_seed_cache_status = self._paths_cache.GetStatus()
+        ( status, ( value, range ) ) = self._paths_cache.GetStatus()
+        
+        speed_text = self._speed_tracker.GetSpeedText()
+        
+        if speed_text != '':
+            
+            status += ' - ' + speed_text
+            
+        
+        new_seed_cache_status = ( status, ( value, range ) )
         
         if self._seed_cache_status != new_seed_cache_status:
             
@@ -657,10 +1009,14 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
         
     
     def _WorkOnFiles( self, page_key ):
-
-        path = self._paths_cache.GetNextSeed( CC.STATUS_UNKNOWN )
         
-        if path is None:
+        new_options = HydrusGlobals.client_controller.GetNewOptions()
+        
+        num_threads = new_options.GetInteger( 'num_import_worker_threads' )
+        
+        paths = self._paths_cache.GetNextSeeds( CC.STATUS_UNKNOWN, num_threads * FILE_IMPORT_BATCH_SIZE_PER_THREAD )
+        
+        if len( paths ) == 0:
             
             time.sleep( 1 )
             
@@ -669,60 +1025,78 @@ class HDDImport( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
-            if path in self._paths_to_tags:
-                
-                service_keys_to_tags = self._paths_to_tags[ path ]
-                
-            else:
-                
-                service_keys_to_tags = {}
-                
+            paths_to_service_keys_to_tags = { path : self._paths_to_tags[ path ] for path in paths if path in self._paths_to_tags }
             
         
-        try:
-            
-            ( status, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', path, import_file_options = self._import_file_options )
-            
-            self._paths_cache.UpdateSeedStatus( path, status )
+        file_import_jobs = [ FileImportJob( path, self._import_file_options ) for path in paths ]
+        
+        started = HydrusData.GetNowPrecise()
+        
+        results = ImportFiles( file_import_jobs, num_threads = num_threads )
+        
+        self._speed_tracker.AddWork( len( file_import_jobs ), sum( ( file_import_job.GetSize() for file_import_job in file_import_jobs if file_import_job.GetSize() is not None ) ), HydrusData.GetNowPrecise() - started )
+        
+        service_keys_to_content_updates = collections.defaultdict( list )
+        
+        hashes = []
+        
+        for ( path, ( status, hash, exception, exception_traceback ) ) in zip( paths, results ):
             
-            if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
+            if exception is None:
                 
-                service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+                self._paths_cache.UpdateSeedStatus( path, status )
                 
-                if len( service_keys_to_content_updates ) > 0:
+                if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
                     
-                    HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
-                    
-                
-                ( media_result, ) = HydrusGlobals.client_controller.Read( 'media_results', ( hash, ) )
-                
-                HydrusGlobals.client_controller.pub( 'add_media_results', page_key, ( media_result, ) )
-                
-                if self._delete_after_success:
+                    if path in paths_to_service_keys_to_tags:
+                        
+                        file_service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, paths_to_service_keys_to_tags[ path ] )
+                        
+                        for ( service_key, content_updates ) in file_service_keys_to_content_updates.items():
+                            
+                            service_keys_to_content_updates[ service_key ].extend( content_updates )
+                            
+                        
                     
-                    try:
+                    if hash not in hashes:
                         
-                        ClientData.DeletePath( path )
+                        hashes.append( hash )
                         
-                    except Exception as e:
+                    
+                    if self._delete_after_success:
                         
-                        HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
-                        HydrusData.ShowException( e )
+                        try:
+                            
+                            ClientData.DeletePath( path )
+                            
+                        except Exception as e:
+                            
+                            HydrusData.ShowText( 'While attempting to delete ' + path + ', the following error occured:' )
+                            HydrusData.ShowException( e )
+                            
                         
                     
                 
+            elif isinstance( exception, HydrusExceptions.MimeException ):
+                
+                self._paths_cache.UpdateSeedStatus( path, CC.STATUS_UNINTERESTING_MIME )
+                
+            else:
+                
+                self._paths_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = exception, exception_traceback = exception_traceback )
+                
             
-        except HydrusExceptions.MimeException as e:
-            
-            status = CC.STATUS_UNINTERESTING_MIME
+        
+        if len( service_keys_to_content_updates ) > 0:
             
-            self._paths_cache.UpdateSeedStatus( path, status )
+            HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
             
-        except Exception as e:
+        
+        if len( hashes ) > 0:
             
-            status = CC.STATUS_FAILED
+            media_results = HydrusGlobals.client_controller.Read( 'media_results', hashes )
             
-            self._paths_cache.UpdateSeedStatus( path, status, exception = e )
+            HydrusGlobals.client_controller.pub( 'add_media_results', page_key, media_results )
             
         
         with self._lock:
@@ -1059,33 +1433,40 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                 
                 successful_hashes = set()
                 
+                new_options = HydrusGlobals.client_controller.GetNewOptions()
+                
+                num_threads = new_options.GetInteger( 'num_import_worker_threads' )
+                
+                speed_tracker = FileImportSpeedTracker()
+                
                 while True:
                     
-                    path = self._path_cache.GetNextSeed( CC.STATUS_UNKNOWN )
+                    paths = self._path_cache.GetNextSeeds( CC.STATUS_UNKNOWN, num_threads * FILE_IMPORT_BATCH_SIZE_PER_THREAD )
                     
-                    if path is None or HydrusGlobals.view_shutdown:
+                    if len( paths ) == 0 or HydrusGlobals.view_shutdown:
                         
                         break
                         
                     
-                    try:
-                        
-                        mime = HydrusFileHandling.GetMime( path )
+                    file_import_jobs = [ FileImportJob( path, self._import_file_options ) for path in paths ]
+                    
+                    started = HydrusData.GetNowPrecise()
+                    
+                    results = ImportFiles( file_import_jobs, num_threads = num_threads, allowed_mimes = self._mimes )
+                    
+                    speed_tracker.AddWork( len( file_import_jobs ), sum( ( file_import_job.GetSize() for file_import_job in file_import_jobs if file_import_job.GetSize() is not None ) ), HydrusData.GetNowPrecise() - started )
+                    
+                    service_keys_to_content_updates = collections.defaultdict( list )
+                    
+                    for ( path, ( status, hash, exception, exception_traceback ) ) in zip( paths, results ):
                         
-                        if mime in self._mimes:
-                            
-                            ( status, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', path, import_file_options = self._import_file_options )
+                        if exception is None:
                             
                             self._path_cache.UpdateSeedStatus( path, status )
                             
                             if status in ( CC.STATUS_SUCCESSFUL, CC.STATUS_REDUNDANT ):
                                 
-                                service_keys_to_content_updates = self._import_tag_options.GetServiceKeysToContentUpdates( hash, set() )
-                                
-                                if len( service_keys_to_content_updates ) > 0:
-                                    
-                                    HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
-                                    
+                                file_service_keys_to_content_updates = self._import_tag_options.GetServiceKeysToContentUpdates( hash, set() )
                                 
                                 txt_path = path + '.txt'
                                 
@@ -1104,11 +1485,11 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                                         
                                         service_keys_to_tags = { service_key : txt_tags for service_key in self._txt_parse_tag_service_keys }
                                         
-                                        service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
+                                        txt_service_keys_to_content_updates = ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags )
                                         
-                                        if len( service_keys_to_content_updates ) > 0:
+                                        for ( service_key, content_updates ) in txt_service_keys_to_content_updates.items():
                                             
-                                            HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
+                                            file_service_keys_to_content_updates.setdefault( service_key, [] ).extend( content_updates )
                                             
                                         
                                     except Exception as e:
@@ -1119,30 +1500,38 @@ class ImportFolder( HydrusSerialisable.SerialisableBaseNamed ):
                                         
                                     
                                 
+                                for ( service_key, content_updates ) in file_service_keys_to_content_updates.items():
+                                    
+                                    service_keys_to_content_updates[ service_key ].extend( content_updates )
+                                    
+                                
                             
                             if status == CC.STATUS_SUCCESSFUL:
                                 
                                 successful_hashes.add( hash )
                                 
                             
-                        else:
+                        elif isinstance( exception, HydrusExceptions.MimeException ):
                             
                             self._path_cache.UpdateSeedStatus( path, CC.STATUS_UNINTERESTING_MIME )
                             
+                        else:
+                            
+                            HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+                            
+                            self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = exception, exception_traceback = exception_traceback )
+                            
                         
-                    except Exception as e:
-                        
-                        error_text = traceback.format_exc()
-                        
-                        HydrusData.Print( 'A file failed to import from import folder ' + self._name + ':' )
+                    
+                    if len( service_keys_to_content_updates ) > 0:
                         
-                        self._path_cache.UpdateSeedStatus( path, CC.STATUS_FAILED, exception = e )
+                        HydrusGlobals.client_controller.WriteSynchronous( 'content_updates', service_keys_to_content_updates )
                         
                     
                 
                 if len( successful_hashes ) > 0:
                     
-                    HydrusData.Print( 'Import folder ' + self._name + ' imported ' + HydrusData.ConvertIntToPrettyString( len( successful_hashes ) ) + ' files.' )
+                    HydrusData.Print( 'Import folder ' + self._name + ' imported ' + HydrusData.ConvertIntToPrettyString( len( successful_hashes ) ) + ' files at ' + speed_tracker.GetSpeedText() + '.' )
                     
                     if self._open_popup:
                         
@@ -1315,7 +1704,13 @@ class PageOfImagesImport( HydrusSerialisable.SerialisableBase ):
                     
                     HydrusGlobals.client_controller.DoHTTP( HC.GET, file_url, report_hooks = report_hooks, temp_path = temp_path )
                     
-                    ( status, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', temp_path, import_file_options = self._import_file_options, url = file_url )
+                    os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+                    
+                    file_import_job = FileImportJob( temp_path, self._import_file_options, is_temporary = True )
+                    
+                    client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+                    
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job, url = file_url )
                     
                 finally:
                     
@@ -1810,6 +2205,31 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         return None
         
     
+    def GetNextSeeds( self, status, num_seeds ):
+        
+        seeds = []
+        
+        with self._lock:
+            
+            for seed in self._seeds_ordered:
+                
+                seed_info = self._seeds_to_info[ seed ]
+                
+                if seed_info[ 'status' ] == status:
+                    
+                    seeds.append( seed )
+                    
+                    if len( seeds ) == num_seeds:
+                        
+                        break
+                        
+                    
+                
+            
+        
+        return seeds
+        
+    
     def GetSeedCount( self, status = None ):
         
         result = 0
@@ -1954,20 +2374,25 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
             
         
     
-    def UpdateSeedStatus( self, seed, status, note = '', exception = None ):
+    def UpdateSeedStatus( self, seed, status, note = '', exception = None, exception_traceback = None ):
         
         with self._lock:
             
             if exception is not None:
                 
+                if exception_traceback is None:
+                    
+                    exception_traceback = traceback.format_exc()
+                    
+                
                 first_line = HydrusData.ToUnicode( exception ).split( os.linesep )[0]
                 
                 note = first_line + u'\u2026 (Copy note to see full error)'
                 note += os.linesep
-                note += traceback.format_exc()
+                note += exception_traceback
                 
                 HydrusData.Print( 'Error when processing ' + seed + '!' )
-                HydrusData.Print( traceback.format_exc() )
+                HydrusData.Print( exception_traceback )
                 
             
             note = HydrusData.ToUnicode( note )
@@ -2152,7 +2577,13 @@ class Subscription( HydrusSerialisable.SerialisableBaseNamed ):
                         
                         job_key.SetVariable( 'popup_text_1', x_out_of_y + 'importing file' )
                         
-                        ( status, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', temp_path, import_file_options = self._import_file_options, url = url )
+                        os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+                        
+                        file_import_job = FileImportJob( temp_path, self._import_file_options, is_temporary = True )
+                        
+                        client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+                        
+                        ( status, hash ) = client_files_manager.ImportFile( file_import_job, url = url )
                         
                         if status == CC.STATUS_SUCCESSFUL:
                             
@@ -2623,7 +3054,13 @@ class ThreadWatcherImport( HydrusSerialisable.SerialisableBase ):
                     
                     HydrusGlobals.client_controller.DoHTTP( HC.GET, file_url, report_hooks = report_hooks, temp_path = temp_path )
                     
-                    ( status, hash ) = HydrusGlobals.client_controller.WriteSynchronous( 'import_file', temp_path, import_file_options = self._import_file_options, url = file_url )
+                    os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+                    
+                    file_import_job = FileImportJob( temp_path, self._import_file_options, is_temporary = True )
+                    
+                    client_files_manager = HydrusGlobals.client_controller.GetClientFilesManager()
+                    
+                    ( status, hash ) = client_files_manager.ImportFile( file_import_job, url = file_url )
                     
                 finally:
                     
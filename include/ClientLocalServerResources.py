@@ -28,7 +28,7 @@ class HydrusResourceCommandBooru( HydrusServerResources.HydrusResourceCommand ):
     
     def _callbackCheckRestrictions( self, request ):
         
-        self._checkServerBusy()
+        self._checkServerBusy( request )
         
         self._checkUserAgent( request )
         
@@ -52,7 +52,7 @@ class HydrusResourceCommandBooruFile( HydrusResourceCommandBooru ):
         
         path = client_files_manager.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -270,7 +270,7 @@ class HydrusResourceCommandLocalFile( HydrusServerResources.HydrusResourceComman
         
         path = client_files_manager.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -9,6 +9,7 @@ import HydrusConstants as HC
 import HydrusTags
 import os
 import random
+import threading
 import time
 import traceback
 import wx
@@ -1466,6 +1467,246 @@ class MediaResult( object ):
     
     def ToTuple( self ): return self._tuple
 
+class MediaResultCache( object ):
+    
+    def __init__( self, cache_size ):
+        
+        self._cache_size = cache_size
+        
+        # hash -> media_result, least recently used first
+        # these are our own copies--everyone else gets a duplicate, so updates are only ever applied to them once
+        
+        self._hashes_to_media_results = collections.OrderedDict()
+        
+        # commit_number -> hashes, for the commits since _last_full_update_commit_number, so a read that started before them does not cache what it saw
+        
+        self._commit_numbers_to_updated_hashes = collections.OrderedDict()
+        self._last_full_update_commit_number = 0
+        
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        self._num_rejections = 0
+        
+        self._lock = threading.Lock()
+        
+    
+    def _NotifyFullUpdate( self, commit_number ):
+        
+        self._commit_numbers_to_updated_hashes = collections.OrderedDict()
+        self._last_full_update_commit_number = commit_number
+        
+    
+    def _NotifyUpdatedHashes( self, commit_number, hashes ):
+        
+        if commit_number not in self._commit_numbers_to_updated_hashes:
+            
+            self._commit_numbers_to_updated_hashes[ commit_number ] = set()
+            
+        
+        self._commit_numbers_to_updated_hashes[ commit_number ].update( hashes )
+        
+        if len( self._commit_numbers_to_updated_hashes ) > 256:
+            
+            ( forgotten_commit_number, forgotten_hashes ) = self._commit_numbers_to_updated_hashes.popitem( last = False )
+            
+            self._last_full_update_commit_number = max( self._last_full_update_commit_number, forgotten_commit_number )
+            
+        
+    
+    def AddMediaResults( self, media_results, snapshot_commit_number ):
+        
+        with self._lock:
+            
+            if snapshot_commit_number is None or snapshot_commit_number < self._last_full_update_commit_number:
+                
+                self._num_rejections += len( media_results )
+                
+                return
+                
+            
+            stale_hashes = set()
+            
+            for ( commit_number, hashes ) in self._commit_numbers_to_updated_hashes.items():
+                
+                if commit_number > snapshot_commit_number:
+                    
+                    stale_hashes.update( hashes )
+                    
+                
+            
+            for media_result in media_results:
+                
+                hash = media_result.GetHash()
+                
+                if hash in stale_hashes:
+                    
+                    self._num_rejections += 1
+                    
+                    continue
+                    
+                
+                if hash not in self._hashes_to_media_results:
+                    
+                    self._hashes_to_media_results[ hash ] = media_result.Duplicate()
+                    
+                
+            
+            while len( self._hashes_to_media_results ) > self._cache_size:
+                
+                self._hashes_to_media_results.popitem( last = False )
+                
+                self._num_evictions += 1
+                
+            
+        
+    
+    def Clear( self, commit_number ):
+        
+        with self._lock:
+            
+            self._hashes_to_media_results = collections.OrderedDict()
+            
+            self._NotifyFullUpdate( commit_number )
+            
+        
+    
+    def DropMediaResults( self, commit_number, hashes ):
+        
+        with self._lock:
+            
+            self._NotifyUpdatedHashes( commit_number, hashes )
+            
+            for hash in hashes:
+                
+                if hash in self._hashes_to_media_results:
+                    
+                    del self._hashes_to_media_results[ hash ]
+                    
+                
+            
+        
+    
+    def GetMediaResults( self, hashes ):
+        
+        hashes_to_media_results = {}
+        missing_hashes = set()
+        
+        with self._lock:
+            
+            for hash in hashes:
+                
+                if hash in hashes_to_media_results or hash in missing_hashes:
+                    
+                    continue
+                    
+                
+                if hash in self._hashes_to_media_results:
+                    
+                    media_result = self._hashes_to_media_results.pop( hash )
+                    
+                    self._hashes_to_media_results[ hash ] = media_result
+                    
+                    hashes_to_media_results[ hash ] = media_result.Duplicate()
+                    
+                    self._num_hits += 1
+                    
+                else:
+                    
+                    missing_hashes.add( hash )
+                    
+                    self._num_misses += 1
+                    
+                
+            
+        
+        return ( hashes_to_media_results, missing_hashes )
+        
+    
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            stats = {}
+            
+            stats[ 'num_items' ] = len( self._hashes_to_media_results )
+            stats[ 'cache_size' ] = self._cache_size
+            stats[ 'num_hits' ] = self._num_hits
+            stats[ 'num_misses' ] = self._num_misses
+            stats[ 'num_evictions' ] = self._num_evictions
+            stats[ 'num_rejections' ] = self._num_rejections
+            
+            return stats
+            
+        
+    
+    def ProcessContentUpdates( self, commit_number, service_keys_to_content_updates ):
+        
+        with self._lock:
+            
+            for ( service_key, content_updates ) in service_keys_to_content_updates.items():
+                
+                for content_update in content_updates:
+                    
+                    ( data_type, action, row ) = content_update.ToTuple()
+                    
+                    if action == HC.CONTENT_UPDATE_ADVANCED:
+                        
+                        # this can touch any number of files, so we can't keep up
+                        
+                        self._hashes_to_media_results = collections.OrderedDict()
+                        
+                        self._NotifyFullUpdate( commit_number )
+                        
+                        continue
+                        
+                    
+                    hashes = content_update.GetHashes()
+                    
+                    if len( hashes ) > 0:
+                        
+                        self._NotifyUpdatedHashes( commit_number, hashes )
+                        
+                        for hash in hashes:
+                            
+                            if hash in self._hashes_to_media_results:
+                                
+                                self._hashes_to_media_results[ hash ].ProcessContentUpdate( service_key, content_update )
+                                
+                            
+                        
+                    
+                
+            
+        
+    
+    def ProcessServiceUpdates( self, commit_number, service_keys_to_service_updates ):
+        
+        with self._lock:
+            
+            for ( service_key, service_updates ) in service_keys_to_service_updates.items():
+                
+                for service_update in service_updates:
+                    
+                    ( action, row ) = service_update.ToTuple()
+                    
+                    if action == HC.SERVICE_UPDATE_DELETE_PENDING:
+                        
+                        for media_result in self._hashes_to_media_results.values(): media_result.DeletePending( service_key )
+                        
+                        self._NotifyFullUpdate( commit_number )
+                        
+                    elif action == HC.SERVICE_UPDATE_RESET:
+                        
+                        for media_result in self._hashes_to_media_results.values(): media_result.ResetService( service_key )
+                        
+                        self._NotifyFullUpdate( commit_number )
+                        
+                    
+                
+            
+        
+    
 class SortedList( object ):
     
     def __init__( self, initial_items = None, sort_function = None ):
@@ -1585,7 +1826,7 @@ class SortedList( object ):
             self._sort_function = f
             
         
-        self._sorted_list.sort( key = f )
+        self._sorted_list.sort( key = self._sort_function )
         
         self._DirtyIndices()
         
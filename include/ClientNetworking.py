@@ -218,9 +218,11 @@ def SetProxy( proxytype, host, port, username = None, password = None ):
     
 class HTTPConnectionManager( object ):
     
-    def __init__( self ):
+    def __init__( self, max_connections_per_host = 4 ):
         
-        self._connections = {}
+        self._max_connections_per_host = max_connections_per_host
+        
+        self._locations_to_connection_pools = {}
         
         self._lock = threading.Lock()
         
@@ -231,7 +233,7 @@ class HTTPConnectionManager( object ):
         
         if report_hooks is None: report_hooks = []
         
-        connection = self._GetConnection( location )
+        connection_pool = self._GetConnectionPool( location )
         
         try:
             
@@ -244,10 +246,22 @@ class HTTPConnectionManager( object ):
                 path_and_query = path + '?' + query
                 
             
-            with connection.lock:
+            connection = connection_pool.GetConnection()
+            
+            try:
                 
                 ( parsed_response, redirect_info, size_of_response, response_headers, cookies ) = connection.Request( method, path_and_query, request_headers, body, report_hooks = report_hooks, temp_path = temp_path )
                 
+            except:
+                
+                # we don't know what state the socket is in, so don't let anyone else use it
+                
+                connection_pool.ReleaseConnection( connection, reusable = False )
+                
+                raise
+                
+            
+            connection_pool.ReleaseConnection( connection, size_of_response = size_of_response )
             
             if redirect_info is None or not follow_redirects:
                 
@@ -272,20 +286,54 @@ class HTTPConnectionManager( object ):
             
             raise
             
+        finally:
+            
+            connection_pool.RemoveUser()
+            
         
     
-    def _GetConnection( self, location ):
+    def _GetConnectionPool( self, location ):
         
         with self._lock:
             
-            if location not in self._connections:
+            if location not in self._locations_to_connection_pools:
                 
-                connection = HTTPConnection( location )
+                connection_pool = HTTPConnectionPool( location, self._max_connections_per_host )
                 
-                self._connections[ location ] = connection
+                self._locations_to_connection_pools[ location ] = connection_pool
                 
             
-            return self._connections[ location ]
+            connection_pool = self._locations_to_connection_pools[ location ]
+            
+            # the pool is marked in use before the lock is released, or maintenance could throw it away before we get a connection from it
+            
+            connection_pool.AddUser()
+            
+            return connection_pool
+            
+        
+    
+    def _MaintainConnectionPools( self ):
+        
+        with self._lock:
+            
+            for ( location, connection_pool ) in self._locations_to_connection_pools.items():
+                
+                connection_pool.MaintainConnections()
+                
+                if connection_pool.IsEmpty():
+                    
+                    del self._locations_to_connection_pools[ location ]
+                    
+                
+            
+        
+    
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            return { location : connection_pool.GetStats() for ( location, connection_pool ) in self._locations_to_connection_pools.items() }
             
         
     
@@ -313,8 +361,23 @@ class HTTPConnectionManager( object ):
             
         
     
+    def SetMaxConnectionsPerHost( self, max_connections_per_host ):
+        
+        with self._lock:
+            
+            self._max_connections_per_host = max_connections_per_host
+            
+            for connection_pool in self._locations_to_connection_pools.values():
+                
+                connection_pool.SetMaxConnections( max_connections_per_host )
+                
+            
+        
+    
     def DAEMONMaintainConnections( self ):
         
+        last_checked = 0
+        
         while True:
             
             if HydrusGlobals.model_shutdown:
@@ -322,29 +385,265 @@ class HTTPConnectionManager( object ):
                 break
                 
             
-            last_checked = 0
+            if HydrusData.TimeHasPassed( last_checked + 30 ):
+                
+                self._MaintainConnectionPools()
+                
+                last_checked = HydrusData.GetNow()
+                
+            
+            time.sleep( 1 )
+            
+        
+        with self._lock:
             
-            if HydrusData.GetNow() - last_checked > 30:
+            for connection_pool in self._locations_to_connection_pools.values():
+                
+                connection_pool.Close()
                 
-                with self._lock:
+            
+        
+    
+class HTTPConnectionPool( object ):
+    
+    def __init__( self, location, max_connections ):
+        
+        self._location = location
+        self._max_connections = max_connections
+        
+        # most recently used at the end, so we reuse the warmest keep-alive socket and the coldest ones age out
+        self._idle_connections = []
+        
+        self._num_connections = 0
+        self._num_in_flight = 0
+        self._num_waiting = 0
+        self._num_users = 0
+        
+        self._num_requests = 0
+        self._num_connections_made = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._total_bytes = 0
+        
+        self._condition = threading.Condition()
+        
+    
+    def AddUser( self ):
+        
+        with self._condition:
+            
+            self._num_users += 1
+            
+        
+    
+    def Close( self ):
+        
+        with self._condition:
+            
+            for connection in self._idle_connections:
+                
+                connection.Close()
+                
+            
+            self._num_connections -= len( self._idle_connections )
+            
+            self._idle_connections = []
+            
+        
+    
+    def GetConnection( self ):
+        
+        start_time = HydrusData.GetNowPrecise()
+        
+        connection = None
+        
+        with self._condition:
+            
+            self._num_waiting += 1
+            
+            try:
+                
+                while True:
                     
-                    connections_copy = dict( self._connections )
+                    if HydrusGlobals.model_shutdown:
+                        
+                        raise HydrusExceptions.ShutdownException( 'Application is shutting down!' )
+                        
                     
-                    for ( location, connection ) in connections_copy.items():
+                    if len( self._idle_connections ) > 0:
                         
-                        with connection.lock:
-                            
-                            if connection.IsStale():
-                                
-                                del self._connections[ location ]
-                            
+                        connection = self._idle_connections.pop()
+                        
+                        break
+                        
+                    
+                    if self._num_connections < self._max_connections:
+                        
+                        # reserve the slot now and connect outside the lock, as that can take a while
+                        self._num_connections += 1
+                        
+                        break
                         
                     
+                    self._condition.wait( 1.0 )
+                    
                 
-                last_checked = HydrusData.GetNow()
+            finally:
+                
+                self._num_waiting -= 1
                 
             
-            time.sleep( 1 )
+            wait_time = HydrusData.GetNowPrecise() - start_time
+            
+            self._num_requests += 1
+            self._num_in_flight += 1
+            self._total_wait_time += wait_time
+            self._max_wait_time = max( self._max_wait_time, wait_time )
+            
+        
+        if connection is None:
+            
+            try:
+                
+                connection = HTTPConnection( self._location )
+                
+            except:
+                
+                with self._condition:
+                    
+                    self._num_connections -= 1
+                    self._num_in_flight -= 1
+                    
+                    self._condition.notify()
+                    
+                
+                raise
+                
+            
+            with self._condition:
+                
+                self._num_connections_made += 1
+                
+            
+        
+        return connection
+        
+    
+    def GetStats( self ):
+        
+        with self._condition:
+            
+            stats = {}
+            
+            stats[ 'max_connections' ] = self._max_connections
+            stats[ 'num_connections' ] = self._num_connections
+            stats[ 'num_idle' ] = len( self._idle_connections )
+            stats[ 'num_in_flight' ] = self._num_in_flight
+            stats[ 'num_waiting' ] = self._num_waiting
+            stats[ 'num_requests' ] = self._num_requests
+            stats[ 'num_connections_made' ] = self._num_connections_made
+            stats[ 'total_wait_time' ] = self._total_wait_time
+            stats[ 'max_wait_time' ] = self._max_wait_time
+            stats[ 'total_bytes' ] = self._total_bytes
+            
+            return stats
+            
+        
+    
+    def IsEmpty( self ):
+        
+        with self._condition:
+            
+            return self._num_connections == 0 and self._num_waiting == 0 and self._num_users == 0
+            
+        
+    
+    def MaintainConnections( self ):
+        
+        with self._condition:
+            
+            stale_connections = []
+            fresh_connections = []
+            
+            for connection in self._idle_connections:
+                
+                if connection.IsStale():
+                    
+                    stale_connections.append( connection )
+                    
+                else:
+                    
+                    fresh_connections.append( connection )
+                    
+                
+            
+            if len( stale_connections ) > 0:
+                
+                self._idle_connections = fresh_connections
+                
+                self._num_connections -= len( stale_connections )
+                
+                self._condition.notify_all()
+                
+            
+        
+        for connection in stale_connections:
+            
+            connection.Close()
+            
+        
+    
+    def ReleaseConnection( self, connection, size_of_response = 0, reusable = True ):
+        
+        with self._condition:
+            
+            self._num_in_flight -= 1
+            self._total_bytes += size_of_response
+            
+            if reusable and self._num_connections <= self._max_connections:
+                
+                self._idle_connections.append( connection )
+                
+                connection = None
+                
+            else:
+                
+                self._num_connections -= 1
+                
+            
+            self._condition.notify()
+            
+        
+        if connection is not None:
+            
+            connection.Close()
+            
+        
+    
+    def RemoveUser( self ):
+        
+        with self._condition:
+            
+            self._num_users -= 1
+            
+        
+    
+    def SetMaxConnections( self, max_connections ):
+        
+        with self._condition:
+            
+            self._max_connections = max_connections
+            
+            while self._num_connections > self._max_connections and len( self._idle_connections ) > 0:
+                
+                connection = self._idle_connections.pop( 0 )
+                
+                connection.Close()
+                
+                self._num_connections -= 1
+                
+            
+            self._condition.notify_all()
             
         
     
@@ -356,8 +655,6 @@ class HTTPConnection( object ):
         
         self._timeout = 30
         
-        self.lock = threading.Lock()
-        
         self._last_request_time = HydrusData.GetNow()
         
         self._RefreshConnection()
@@ -542,6 +839,17 @@ class HTTPConnection( object ):
                     parsed_response = data
                     
                 
+            elif content_type == 'application/hydrus-update-content':
+                
+                if hydrus_service:
+                    
+                    parsed_response = HydrusData.CreateContentUpdatePackageFromNetworkString( data )
+                    
+                else:
+                    
+                    parsed_response = data
+                    
+                
             elif content_type == 'text/html':
                 
                 try: parsed_response = data.decode( 'utf-8' )
@@ -572,45 +880,132 @@ class HTTPConnection( object ):
             
         
     
-    def _WriteResponseToPath( self, response, temp_path, report_hooks ):
+    def _WriteResponseToPath( self, response, method_string, path_and_query, request_headers, temp_path, report_hooks ):
         
-        content_length = response.getheader( 'Content-Length' )
+        def get_resume_info( response ):
+            
+            content_length = response.getheader( 'Content-Length' )
+            
+            if content_length is not None: content_length = int( content_length )
+            
+            # we can only pick up where we left off if the server does ranges and can tell us if the file has changed since
+            
+            validator = response.getheader( 'ETag' )
+            
+            if validator is None: validator = response.getheader( 'Last-Modified' )
+            
+            can_resume = response.getheader( 'Accept-Ranges' ) == 'bytes' and content_length is not None and validator is not None
+            
+            return ( content_length, validator, can_resume )
+            
         
-        if content_length is not None: content_length = int( content_length )
+        ( content_length, validator, can_resume ) = get_resume_info( response )
         
         size_of_response = 0
+        num_resumes = 0
         
         with open( temp_path, 'wb' ) as f:
             
-            for block in HydrusPaths.ReadFileLikeAsBlocks( response ):
+            while True:
                 
-                if HydrusGlobals.model_shutdown:
+                try:
+                    
+                    for block in HydrusPaths.ReadFileLikeAsBlocks( response ):
+                        
+                        if HydrusGlobals.model_shutdown:
+                            
+                            raise HydrusExceptions.ShutdownException( 'Application is shutting down!' )
+                            
+                        
+                        size_of_response += len( block )
+                        
+                        if content_length is not None and f.tell() + len( block ) > content_length:
+                            
+                            raise Exception( 'Response was longer than suggested!' )
+                            
+                        
+                        f.write( block )
+                        
+                        for hook in report_hooks:
+                            
+                            if content_length is not None:
+                                
+                                hook( content_length, f.tell() )
+                                
+                            
+                        
                     
-                    raise HydrusExceptions.ShutdownException( 'Application is shutting down!' )
+                except ( socket.error, httplib.HTTPException ):
+                    
+                    if not can_resume or num_resumes >= 3:
+                        
+                        raise
+                        
                     
                 
-                size_of_response += len( block )
+                if not can_resume or f.tell() == content_length:
+                    
+                    break
+                    
                 
-                if content_length is not None and size_of_response > content_length:
+                if num_resumes >= 3:
                     
-                    raise Exception( 'Response was longer than suggested!' )
+                    raise HydrusExceptions.NetworkException( 'The download from ' + HydrusData.ToUnicode( self._host ) + ' kept on being cut short, so the attempt was abandoned.' )
                     
                 
-                f.write( block )
+                num_resumes += 1
                 
-                for hook in report_hooks:
+                resume_from = f.tell()
+                
+                resume_headers = dict( request_headers )
+                
+                resume_headers[ 'Range' ] = 'bytes=' + str( resume_from ) + '-'
+                resume_headers[ 'If-Range' ] = validator
+                
+                self._RefreshConnection()
+                
+                response = self._GetResponse( method_string, path_and_query, resume_headers, None )
+                
+                if response.status == 206:
+                    
+                    content_range = response.getheader( 'Content-Range' )
                     
-                    if content_length is not None:
+                    if content_range is None or not content_range.startswith( 'bytes ' + str( resume_from ) + '-' ):
                         
-                        hook( content_length, size_of_response )
+                        raise HydrusExceptions.NetworkException( 'Could not resume the download from ' + HydrusData.ToUnicode( self._host ) + '!' )
                         
                     
+                elif response.status == 200:
+                    
+                    # the file changed since we started, so start again
+                    
+                    f.seek( 0 )
+                    f.truncate()
+                    
+                    ( content_length, validator, can_resume ) = get_resume_info( response )
+                    
+                else:
+                    
+                    raise HydrusExceptions.NetworkException( 'Could not resume the download from ' + HydrusData.ToUnicode( self._host ) + '! The server responded with ' + HydrusData.ToUnicode( response.status ) + '.' )
+                    
                 
             
         
         return size_of_response
         
     
+    def Close( self ):
+        
+        try:
+            
+            self._connection.close()
+            
+        except:
+            
+            pass
+            
+        
+    
     def IsStale( self ):
         
         time_since_last_request = HydrusData.GetNow() - self._last_request_time
@@ -638,7 +1033,7 @@ class HTTPConnection( object ):
         
         if response.status == 200 and temp_path is not None:
             
-            size_of_response = self._WriteResponseToPath( response, temp_path, report_hooks )
+            size_of_response = self._WriteResponseToPath( response, method_string, path_and_query, request_headers, temp_path, report_hooks )
             
             parsed_response = 'response written to temporary file'
             
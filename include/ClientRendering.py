@@ -19,6 +19,12 @@ def GenerateHydrusBitmap( path, compressed = True ):
     
     return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
     
+def GenerateHydrusBitmapFromData( data, compressed = True ):
+    
+    numpy_image = ClientImageHandling.GenerateNumpyImageFromData( data )
+    
+    return GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = compressed )
+    
 def GenerateHydrusBitmapFromNumPyImage( numpy_image, compressed = True ):
     
     ( y, x, depth ) = numpy_image.shape
@@ -107,6 +107,28 @@ def FilterTagsBySearchEntry( search_entry, tags, search_siblings = True ):
     
     return result
     
+def GetSearchEntryPrefix( search_entry ):
+    
+    # every tag FilterTagsBySearchEntry matches has this at the start of one of its GetTagSearchSuffixes
+    
+    if ':' in search_entry:
+        
+        ( namespace_entry, search_entry ) = search_entry.split( ':', 1 )
+        
+    
+    return search_entry.split( '*', 1 )[0]
+    
+def GetTagSearchSuffixes( tag ):
+    
+    # FilterTagsBySearchEntry matches from the start of any word of the subtag
+    
+    if ':' in tag:
+        
+        ( namespace, tag ) = tag.split( ':', 1 )
+        
+    
+    return [ tag[ i : ] for i in range( len( tag ) ) if i == 0 or tag[ i - 1 ].isspace() ]
+    
 def SortPredicates( predicates ):
     
     def cmp_func( x, y ): return cmp( x.GetCount(), y.GetCount() )
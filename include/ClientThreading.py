@@ -259,4 +259,68 @@ class JobKey( object ):
         
         return ( i_paused, should_quit )
         
-    
\ No newline at end of file
+    
+class FileMaintenanceThrottle( object ):
+    
+    def __init__( self, controller ):
+        
+        self._controller = controller
+        
+        self._lock = threading.Lock()
+        
+        self._next_free_time = 0.0
+        
+    
+    def Consume( self, num_bytes, job_key = None ):
+        
+        # while the user is about, all the file maintenance workers share a budget of so many MB/s so the drives stay responsive
+        # when the client is idle, they go as fast as they can
+        
+        if self._controller.CurrentlyIdle():
+            
+            return
+            
+        
+        new_options = self._controller.GetNewOptions()
+        
+        throttle_mb = new_options.GetNoneableInteger( 'file_maintenance_throttle_mb' )
+        
+        if throttle_mb is None:
+            
+            return
+            
+        
+        with self._lock:
+            
+            now = time.time()
+            
+            self._next_free_time = max( self._next_free_time, now ) + num_bytes / float( throttle_mb * 1048576 )
+            
+            time_to_wait = self._next_free_time - now
+            
+        
+        wait_until = now + time_to_wait
+        
+        while True:
+            
+            time_to_wait = wait_until - time.time()
+            
+            if time_to_wait <= 0:
+                
+                return
+                
+            
+            if self._controller.CurrentlyIdle() or HydrusThreading.IsThreadShuttingDown():
+                
+                return
+                
+            
+            if job_key is not None and job_key.IsCancelled():
+                
+                return
+                
+            
+            time.sleep( min( 0.25, time_to_wait ) )
+            
+        
+    
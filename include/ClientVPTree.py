@@ -1,62 +1,126 @@
-import random
 import HydrusData
+import numpy
+import random
 
-class VPTreeNode( object ):
+def SplitPHashes( phashes ):
     
-    def __init__( self, phashes ):
+    # we want to choose a good node.
+    # a good node is one that doesn't overlap with other circles much
+    
+    # get a random sample with big lists, to keep cpu costs down
+    if len( phashes ) > 50: phashes_sample = random.sample( phashes, 50 )
+    else: phashes_sample = phashes
+    
+    packed_phashes_sample = HydrusData.ConvertPHashesToNumPyArray( phashes_sample )
+    
+    all_nodes_radii = []
+    
+    for phash in phashes_sample:
         
-        ghd = HydrusData.GetHammingDistance
+        # the smallest is the comparison to itself, so skip it
         
-        if len( phashes ) == 1:
+        comparisons = numpy.sort( HydrusData.GetHammingDistances( phash, packed_phashes_sample ) )[ 1 : ]
+        
+        # the median of the sorted hamming distances makes a decent radius
+        
+        all_nodes_radii.append( ( comparisons[ len( comparisons ) / 2 ], phash ) )
+        
+    
+    all_nodes_radii.sort()
+    
+    # let's make our node the phash with the smallest predicted radius
+    
+    ( predicted_radius, vantage_phash ) = all_nodes_radii[ 0 ]
+    
+    packed_phashes = HydrusData.ConvertPHashesToNumPyArray( phashes )
+    
+    my_hammings = HydrusData.GetHammingDistances( vantage_phash, packed_phashes )
+    
+    others_mask = numpy.ones( len( phashes ), dtype = numpy.bool_ )
+    
+    others_mask[ phashes.index( vantage_phash ) ] = False
+    
+    other_hammings = numpy.sort( my_hammings[ others_mask ] )
+    
+    radius = int( other_hammings[ len( other_hammings ) / 2 ] )
+    
+    # now separate my phashes into inside and outside that radius
+    
+    inner_phashes = [ phashes[ i ] for i in numpy.flatnonzero( others_mask & ( my_hammings <= radius ) ) ]
+    outer_phashes = [ phashes[ i ] for i in numpy.flatnonzero( others_mask & ( my_hammings > radius ) ) ]
+    
+    return ( vantage_phash, radius, inner_phashes, outer_phashes )
+    
+def GenerateVPTreeRows( phashes, parent_phash = None ):
+    
+    # the db stores the tree flat, as ( phash, parent_phash, radius, inner_phash, inner_population, outer_phash, outer_population )
+    # this does the same job as VPTreeNode, but without recursion, so it is safe for millions of phashes
+    
+    rows = []
+    
+    if len( phashes ) == 0:
+        
+        return ( None, rows )
+        
+    
+    root_phash = None
+    
+    # ( parent_phash, phashes, is_inner )
+    branches_to_do = [ ( parent_phash, list( phashes ), None ) ]
+    
+    # phash -> [ radius, inner_phash, inner_population, outer_phash, outer_population ]
+    nodes = {}
+    parents = {}
+    
+    while len( branches_to_do ) > 0:
+        
+        ( branch_parent_phash, branch_phashes, is_inner ) = branches_to_do.pop()
+        
+        if len( branch_phashes ) == 1:
             
-            ( self._phash, ) = phashes
-            self._radius = 0
+            ( vantage_phash, ) = branch_phashes
             
-            inner_phashes = []
-            outer_phashes = []
+            nodes[ vantage_phash ] = [ None, None, 0, None, 0 ]
             
         else:
             
-            # we want to choose a good node.
-            # a good node is one that doesn't overlap with other circles much
-            
-            # get a random sample with big lists, to keep cpu costs down
-            if len( phashes ) > 50: phashes_sample = random.sample( phashes, 50 )
-            else: phashes_sample = phashes
+            ( vantage_phash, radius, inner_phashes, outer_phashes ) = SplitPHashes( branch_phashes )
             
-            all_nodes_comparisons = { phash1 : [ ( ghd( phash1, phash2 ), phash2 ) for phash2 in phashes_sample if phash2 != phash1 ] for phash1 in phashes_sample }
+            nodes[ vantage_phash ] = [ radius, None, len( inner_phashes ), None, len( outer_phashes ) ]
             
-            for comparisons in all_nodes_comparisons.values(): comparisons.sort()
+            if len( inner_phashes ) > 0: branches_to_do.append( ( vantage_phash, inner_phashes, True ) )
+            if len( outer_phashes ) > 0: branches_to_do.append( ( vantage_phash, outer_phashes, False ) )
             
-            # the median of the sorted hamming distances makes a decent radius
-            
-            all_nodes_radii = [ ( comparisons[ len( comparisons ) / 2 ], phash ) for ( phash, comparisons ) in all_nodes_comparisons.items() ]
-            
-            all_nodes_radii.sort()
-            
-            # let's make our node the phash with the smallest predicted radius
-            
-            ( ( predicted_radius, whatever ), self._phash ) = all_nodes_radii[ 0 ]
-            
-            if len( phashes ) > 50:
-                
-                my_hammings = [ ( ghd( self._phash, phash ), phash ) for phash in phashes if phash != self._phash ]
-                
-                my_hammings.sort()
-                
-            else: my_hammings = all_nodes_comparisons[ self._phash ]
-            
-            median_index = len( my_hammings ) / 2
+        
+        parents[ vantage_phash ] = branch_parent_phash
+        
+        if is_inner is None: root_phash = vantage_phash
+        elif is_inner: nodes[ branch_parent_phash ][ 1 ] = vantage_phash
+        else: nodes[ branch_parent_phash ][ 3 ] = vantage_phash
+        
+    
+    for ( phash, ( radius, inner_phash, inner_population, outer_phash, outer_population ) ) in nodes.items():
+        
+        rows.append( ( phash, parents[ phash ], radius, inner_phash, inner_population, outer_phash, outer_population ) )
+        
+    
+    return ( root_phash, rows )
+    
+class VPTreeNode( object ):
+    
+    def __init__( self, phashes ):
+        
+        if len( phashes ) == 1:
             
-            ( self._radius, whatever ) = my_hammings[ median_index ]
+            ( self._phash, ) = phashes
+            self._radius = 0
             
-            # lets bump our index up until we actually get outside the radius
-            while median_index + 1 < len( my_hammings ) and my_hammings[ median_index + 1 ][0] == self._radius: median_index += 1
+            inner_phashes = []
+            outer_phashes = []
             
-            # now separate my phashes into inside and outside that radius
+        else:
             
-            inner_phashes = [ phash for ( hamming, phash ) in my_hammings[ : median_index + 1 ] ]
-            outer_phashes = [ phash for ( hamming, phash ) in my_hammings[ median_index + 1 : ] ]
+            ( self._phash, self._radius, inner_phashes, outer_phashes ) = SplitPHashes( phashes )
             
         
         if len( inner_phashes ) == 0: self._inner_node = VPTreeNodeEmpty()
@@ -89,4 +153,3 @@ class VPTreeNodeEmpty( object ):
     def __len__( self ): return 0
     
     def GetMatches( self, phash, max_hamming ): return []
-    
\ No newline at end of file
@@ -47,8 +47,8 @@ options = {}
 
 # Misc
 
-NETWORK_VERSION = 17
-SOFTWARE_VERSION = 217
+NETWORK_VERSION = 18
+SOFTWARE_VERSION = 218
 
 UNSCALED_THUMBNAIL_DIMENSIONS = ( 200, 200 )
 
@@ -274,6 +274,7 @@ VIDEO_WEBM = 21
 APPLICATION_JSON = 22
 VIDEO_APNG = 23
 UNDETERMINED_PNG = 24
+APPLICATION_HYDRUS_UPDATE_CONTENT = 25
 APPLICATION_OCTET_STREAM = 100
 APPLICATION_UNKNOWN = 101
 
@@ -318,6 +319,7 @@ mime_enum_lookup[ 'application/pdf' ] = APPLICATION_PDF
 mime_enum_lookup[ 'application/zip' ] = APPLICATION_ZIP
 mime_enum_lookup[ 'application/json' ] = APPLICATION_JSON
 mime_enum_lookup[ 'application/hydrus-encrypted-zip' ] = APPLICATION_HYDRUS_ENCRYPTED_ZIP
+mime_enum_lookup[ 'application/hydrus-update-content' ] = APPLICATION_HYDRUS_UPDATE_CONTENT
 mime_enum_lookup[ 'application' ] = APPLICATIONS
 mime_enum_lookup[ 'audio/mp3' ] = AUDIO_MP3
 mime_enum_lookup[ 'audio/ogg' ] = AUDIO_OGG
@@ -349,6 +351,7 @@ mime_string_lookup[ APPLICATION_JSON ] = 'application/json'
 mime_string_lookup[ APPLICATION_PDF ] = 'application/pdf'
 mime_string_lookup[ APPLICATION_ZIP ] = 'application/zip'
 mime_string_lookup[ APPLICATION_HYDRUS_ENCRYPTED_ZIP ] = 'application/hydrus-encrypted-zip'
+mime_string_lookup[ APPLICATION_HYDRUS_UPDATE_CONTENT ] = 'application/hydrus-update-content'
 mime_string_lookup[ APPLICATIONS ] = 'application'
 mime_string_lookup[ AUDIO_MP3 ] = 'audio/mp3'
 mime_string_lookup[ AUDIO_OGG ] = 'audio/ogg'
@@ -381,6 +384,7 @@ mime_ext_lookup[ APPLICATION_JSON ] = '.json'
 mime_ext_lookup[ APPLICATION_PDF ] = '.pdf'
 mime_ext_lookup[ APPLICATION_ZIP ] = '.zip'
 mime_ext_lookup[ APPLICATION_HYDRUS_ENCRYPTED_ZIP ] = '.zip.encrypted'
+mime_ext_lookup[ APPLICATION_HYDRUS_UPDATE_CONTENT ] = '.update'
 mime_ext_lookup[ AUDIO_MP3 ] = '.mp3'
 mime_ext_lookup[ AUDIO_OGG ] = '.ogg'
 mime_ext_lookup[ AUDIO_FLAC ] = '.flac'
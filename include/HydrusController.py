@@ -182,6 +182,8 @@ class HydrusController( object ):
     
     def GetCache( self, name ): return self._caches[ name ]
     
+    def GetDB( self ): return self._db
+    
     def GetManager( self, name ): return self._managers[ name ]
     
     def GoodTimeToDoBackgroundWork( self ):
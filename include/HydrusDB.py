@@ -6,6 +6,7 @@ import HydrusData
 import HydrusExceptions
 import HydrusGlobals
 import HydrusPaths
+import math
 import os
 import psutil
 import Queue
@@ -19,6 +20,16 @@ import time
 
 CONNECTION_REFRESH_TIME = 60 * 30
 
+GROUP_COMMIT_MAX_JOBS = 250
+
+JOB_PROFILE_MEASURES = ( 'queue_wait', 'execution', 'commit', 'rows' )
+JOB_PROFILE_NUM_BUCKETS = 24
+
+READ_CONNECTION_FORBIDDEN_ACTIONS = { sqlite3.SQLITE_ALTER_TABLE, sqlite3.SQLITE_ANALYZE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_CREATE_TRIGGER, sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_DROP_INDEX, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_DROP_TRIGGER, sqlite3.SQLITE_DROP_VIEW, sqlite3.SQLITE_INSERT, sqlite3.SQLITE_REINDEX, sqlite3.SQLITE_UPDATE }
+READ_CONNECTION_WRITABLE_DB_NAMES = { 'mem', 'temp' }
+
+SLOW_JOB_MAX_STATEMENTS = 100
+
 def CanVacuum( db_path, stop_time = None ):
     
     try:
@@ -88,6 +99,32 @@ def CanVacuum( db_path, stop_time = None ):
         return False
         
     
+def ConvertJobProfileBucketToString( bucket ):
+    
+    if bucket == 0:
+        
+        return '<1'
+        
+    elif bucket == JOB_PROFILE_NUM_BUCKETS - 1:
+        
+        return '>=' + str( 2 ** ( bucket - 1 ) )
+        
+    else:
+        
+        return str( 2 ** ( bucket - 1 ) ) + '-' + str( 2 ** bucket )
+        
+    
+def GetJobProfileBucket( value ):
+    
+    # bucket 0 is everything under 1, and bucket n covers [ 2^(n-1), 2^n )
+    
+    if value < 1:
+        
+        return 0
+        
+    
+    return min( int( math.log( value, 2 ) ) + 1, JOB_PROFILE_NUM_BUCKETS - 1 )
+    
 def SetupDBCreatePragma( c, no_wal = False ):
     
     c.execute( 'PRAGMA auto_vacuum = 0;' ) # none
@@ -145,11 +182,15 @@ def VacuumDB( db_path ):
     
 class HydrusDB( object ):
     
+    GROUP_COMMIT_ACTIONS = []
     READ_WRITE_ACTIONS = []
     UPDATE_WAIT = 2
     
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
+        # every thread that talks to the db--the main loop and any read connections--gets its own sqlite connection, cursor and pubsubs
+        self._thread_local = threading.local()
+        
         self._controller = controller
         self._db_dir = db_dir
         self._db_name = db_name
@@ -189,6 +230,28 @@ class HydrusDB( object ):
         
         self._currently_doing_job = False
         
+        self._read_jobs = Queue.PriorityQueue()
+        self._read_connection_threads = []
+        self._num_read_connections = 0
+        self._num_read_jobs_in_progress = 0
+        self._num_open_read_connections = 0
+        self._read_connections_paused = False
+        self._read_connections_generation = 0
+        self._read_connections_condition = threading.Condition()
+        
+        self._committed_caches = {}
+        self._committed_caches_dirty = False
+        self._committed_caches_lock = threading.Lock()
+        
+        self._group_commit_window = None
+        
+        self._commit_stats_start_time = HydrusData.GetNowPrecise()
+        self._num_commits = 0
+        self._num_jobs_committed = 0
+        
+        self._job_profiler = JobProfiler()
+        self._slow_job_threshold = None
+        
         self._db = None
         self._c = None
         
@@ -290,8 +353,25 @@ class HydrusDB( object ):
         pass
         
     
+    def _CanGroupCommit( self, job ):
+        
+        if self._group_commit_window is None:
+            
+            return False
+            
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        return job.GetType() == 'write' and not job.IsSynchronous() and action in self.GROUP_COMMIT_ACTIONS
+        
+    
     def _CloseDBCursor( self ):
         
+        if not self._IsReadConnection():
+            
+            self._PauseReadConnections()
+            
+        
         if self._db is not None:
             
             self._c.close()
@@ -303,6 +383,55 @@ class HydrusDB( object ):
             self._db = None
             self._c = None
             
+            if self._IsReadConnection():
+                
+                with self._read_connections_condition:
+                    
+                    self._num_open_read_connections -= 1
+                    
+                    self._read_connections_condition.notify_all()
+                    
+                
+            
+        
+    
+    def _Commit( self, num_jobs = 1, pubsubs = None ):
+        
+        if pubsubs is None:
+            
+            pubsubs = self._pubsubs
+            
+        
+        if self._num_read_connections > 0:
+            
+            # the read connections must see the new caches at exactly the same time they see the new data
+            
+            with self._committed_caches_lock:
+                
+                self._c.execute( 'COMMIT;' )
+                
+                self._num_commits += 1
+                
+                if self._committed_caches_dirty:
+                    
+                    self._committed_caches = self._GetCommittedCaches()
+                    
+                    self._committed_caches_dirty = False
+                    
+                
+                self._UpdateCachesAfterCommit( pubsubs )
+                
+            
+        else:
+            
+            self._c.execute( 'COMMIT;' )
+            
+            self._num_commits += 1
+            
+            self._UpdateCachesAfterCommit( pubsubs )
+            
+        
+        self._num_jobs_committed += num_jobs
         
     
     def _CreateDB( self ):
@@ -310,6 +439,79 @@ class HydrusDB( object ):
         raise NotImplementedError()
         
     
+    def _GetCommittedCaches( self ):
+        
+        return {}
+        
+    
+    def _GetGroupCommitJobs( self, job ):
+        
+        jobs = [ job ]
+        
+        stop_time = HydrusData.GetNowPrecise() + self._group_commit_window
+        
+        while len( jobs ) < GROUP_COMMIT_MAX_JOBS:
+            
+            time_left = stop_time - HydrusData.GetNowPrecise()
+            
+            if time_left <= 0:
+                
+                break
+                
+            
+            try:
+                
+                ( priority, job ) = self._jobs.get( timeout = time_left )
+                
+            except Queue.Empty:
+                
+                break
+                
+            
+            if self._CanGroupCommit( job ):
+                
+                jobs.append( job )
+                
+            else:
+                
+                # something that can't wait has turned up, so commit what we have now
+                
+                self._jobs.put( ( priority, job ) )
+                
+                break
+                
+            
+        
+        return jobs
+        
+    
+    def _GetGroupCommitWindow( self ):
+        
+        return None
+        
+    
+    def _GetNumReadConnections( self ):
+        
+        return 0
+        
+    
+    def _GetSnapshotCommitNumber( self ):
+        
+        # the commit a plain read is seeing, or None if we are inside a write
+        
+        return getattr( self._thread_local, 'snapshot_commit_number', None )
+        
+    
+    def _GetSlowJobThreshold( self ):
+        
+        return None
+        
+    
+    def _GetReadConnectionCaches( self ):
+        
+        return getattr( self._thread_local, 'committed_caches', None )
+        
+    
     def _GetRowCount( self ):
         
         row_count = self._c.rowcount
@@ -363,7 +565,7 @@ class HydrusDB( object ):
         
         self._db.create_function( 'hydrus_hamming', 2, HydrusData.GetHammingDistance )
         
-        self._c = self._db.cursor()
+        self._c = TracingCursor( self._db.cursor() )
         
         self._c.execute( 'PRAGMA main.cache_size = -100000;' )
         
@@ -431,17 +633,104 @@ class HydrusDB( object ):
                 
             
         
+        self._ResumeReadConnections()
+        
     
     def _InitExternalDatabases( self ):
         
         pass
         
     
+    def _InitReadConnection( self ):
+        
+        self._CloseDBCursor()
+        
+        db_path = os.path.join( self._db_dir, self._db_filenames[ 'main' ] )
+        
+        self._db = sqlite3.connect( db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+        
+        with self._read_connections_condition:
+            
+            self._num_open_read_connections += 1
+            
+        
+        self._db.create_function( 'hydrus_hamming', 2, HydrusData.GetHammingDistance )
+        
+        self._c = TracingCursor( self._db.cursor() )
+        
+        self._c.execute( 'ATTACH ":memory:" AS mem;' )
+        
+        self._AttachExternalDatabases()
+        
+        db_names = [ name for ( index, name, path ) in self._c.execute( 'PRAGMA database_list;' ) if name not in ( 'mem', 'temp' ) ]
+        
+        for db_name in db_names:
+            
+            self._c.execute( 'PRAGMA ' + db_name + '.cache_size = -25000;' )
+            
+        
+        self._thread_local.db_names = db_names
+        
+        # reads that turn out to need to write are caught here and sent back to the main loop
+        self._db.set_authorizer( self._ReadConnectionAuthoriser )
+        
+    
+    def _InitReadConnections( self ):
+        
+        if self._no_wal:
+            
+            # without wal, readers and the writer lock each other out
+            
+            return
+            
+        
+        self._num_read_connections = self._GetNumReadConnections()
+        
+        if self._num_read_connections > 0:
+            
+            self._committed_caches = self._GetCommittedCaches()
+            
+        
+        for i in range( self._num_read_connections ):
+            
+            thread = threading.Thread( target = self.ReadConnectionLoop, name = 'Database Read Connection ' + str( i + 1 ) )
+            
+            self._read_connection_threads.append( thread )
+            
+            thread.start()
+            
+        
+    
+    def _InvalidateCommittedCaches( self ):
+        
+        self._committed_caches_dirty = True
+        
+    
+    def _IsReadConnection( self ):
+        
+        return getattr( self._thread_local, 'is_read_connection', False )
+        
+    
     def _ManageDBError( self, job, e ):
         
         raise NotImplementedError()
         
     
+    def _PauseReadConnections( self ):
+        
+        # sqlite only checkpoints the wal into the main file when the last connection closes, so a vacuum or a backup that copies the db files needs every read connection closed, not just idle
+        
+        with self._read_connections_condition:
+            
+            self._read_connections_paused = True
+            
+            while self._num_read_jobs_in_progress > 0 or self._num_open_read_connections > 0:
+                
+                self._read_connections_condition.wait( 0.5 )
+                
+            
+        
+    
     def _ProcessJob( self, job ):
         
         job_type = job.GetType()
@@ -450,8 +739,19 @@ class HydrusDB( object ):
         
         in_transaction = False
         
+        if job_type == 'read':
+            
+            self._thread_local.snapshot_commit_number = self._num_commits
+            
+        else:
+            
+            self._thread_local.snapshot_commit_number = None
+            
+        
         try:
             
+            job_profile_start = self._StartJobProfile()
+            
             if job_type in ( 'read_write', 'write' ):
                 
                 self._c.execute( 'BEGIN IMMEDIATE;' )
@@ -462,13 +762,23 @@ class HydrusDB( object ):
             if job_type in ( 'read', 'read_write' ): result = self._Read( action, *args, **kwargs )
             elif job_type in ( 'write' ): result = self._Write( action, *args, **kwargs )
             
+            job_profile = self._StopJobProfile( job, job_profile_start )
+            
+            commit_time = 0.0
+            
             if in_transaction:
                 
-                self._c.execute( 'COMMIT;' )
+                commit_started = HydrusData.GetNowPrecise()
+                
+                self._Commit()
+                
+                commit_time = HydrusData.GetNowPrecise() - commit_started
                 
                 in_transaction = False
                 
             
+            self._RecordJobProfile( job_profile, commit_time )
+            
             for ( topic, args, kwargs ) in self._pubsubs:
                 
                 self._controller.pub( topic, *args, **kwargs )
@@ -499,106 +809,495 @@ class HydrusDB( object ):
             
         
     
-    def _Read( self, action, *args, **kwargs ):
-        
-        raise NotImplementedError()
-        
-    
-    def _ReportStatus( self, text ):
-        
-        HydrusData.Print( text )
-        
-    
-    def _UpdateDB( self, version ):
-        
-        raise NotImplementedError()
-        
-    
-    def _Write( self, action, *args, **kwargs ):
-        
-        raise NotImplementedError()
-        
-    
-    def pub_after_commit( self, topic, *args, **kwargs ):
-        
-        self._pubsubs.append( ( topic, args, kwargs ) )
-        
-    
-    def CurrentlyDoingJob( self ):
+    def _ProcessGroupCommitJobs( self, jobs ):
         
-        return self._currently_doing_job
-        
-    
-    def GetDBDir( self ):
-        
-        return self._db_dir
-        
-    
-    def LoopIsFinished( self ):
-        
-        return self._loop_finished
-        
-    
-    def JobsQueueEmpty( self ):
-        
-        return self._jobs.empty()
+        in_transaction = False
         
-    
-    def MainLoop( self ):
+        self._thread_local.snapshot_commit_number = None
         
         try:
             
-            self._InitDBCursor() # have to reinitialise because the thread id has changed
-            
-            self._InitCaches()
-            
-        except:
-            
-            HydrusData.Print( traceback.format_exc() )
-            
-            self._could_not_initialise = True
+            self._c.execute( 'BEGIN IMMEDIATE;' )
             
-            return
+            in_transaction = True
             
-        
-        self._ready_to_serve_requests = True
-        
-        error_count = 0
-        
-        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._jobs.empty() ):
+            pubsubs = []
+            job_profiles = []
             
-            try:
+            for job in jobs:
                 
-                ( priority, job ) = self._jobs.get( timeout = 0.5 )
+                ( action, args, kwargs ) = job.GetCallableTuple()
                 
-                self._currently_doing_job = True
+                self._pubsubs = []
                 
-                self._controller.pub( 'refresh_status' )
+                # each job gets a savepoint, so one that fails does not take the others down with it
                 
-                self._pubsubs = []
+                self._c.execute( 'SAVEPOINT group_commit_job;' )
                 
                 try:
                     
-                    if HydrusGlobals.db_profile_mode:
-                        
-                        HydrusData.ShowText( 'Profiling ' + job.ToString() )
-                        
-                        HydrusData.Profile( 'self._ProcessJob( job )', globals(), locals() )
-                        
-                    else:
-                        
-                        self._ProcessJob( job )
-                        
+                    job_profile_start = self._StartJobProfile()
                     
-                    error_count = 0
+                    self._Write( action, *args, **kwargs )
                     
-                except:
+                    job_profiles.append( self._StopJobProfile( job, job_profile_start ) )
                     
-                    error_count += 1
+                    self._c.execute( 'RELEASE SAVEPOINT group_commit_job;' )
+                    
+                    pubsubs.extend( self._pubsubs )
+                    
+                except Exception as e:
+                    
+                    self._c.execute( 'ROLLBACK TO SAVEPOINT group_commit_job;' )
+                    self._c.execute( 'RELEASE SAVEPOINT group_commit_job;' )
+                    
+                    self._ManageDBError( job, e )
+                    
+                
+            
+            commit_started = HydrusData.GetNowPrecise()
+            
+            self._Commit( num_jobs = len( jobs ), pubsubs = pubsubs )
+            
+            commit_time = HydrusData.GetNowPrecise() - commit_started
+            
+            in_transaction = False
+            
+            # the jobs shared the one commit, so they share its cost
+            
+            for job_profile in job_profiles:
+                
+                self._RecordJobProfile( job_profile, commit_time / len( jobs ) )
+                
+            
+            for ( topic, args, kwargs ) in pubsubs:
+                
+                self._controller.pub( topic, *args, **kwargs )
+                
+            
+        except Exception as e:
+            
+            if in_transaction:
+                
+                try:
+                    
+                    self._c.execute( 'ROLLBACK;' )
+                    
+                except Exception as rollback_e:
+                    
+                    HydrusData.Print( 'When the transaction failed, attempting to rollback the database failed.' )
+                    
+                    HydrusData.PrintException( rollback_e )
+                    
+                
+            
+            self._ManageDBError( jobs[0], e )
+            
+        
+    
+    def _ProcessReadJob( self, job, priority ):
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        self._thread_local.write_attempted = False
+        
+        in_transaction = False
+        
+        try:
+            
+            with self._committed_caches_lock:
+                
+                self._c.execute( 'BEGIN DEFERRED;' )
+                
+                in_transaction = True
+                
+                # a deferred transaction only takes its snapshot of each db when it first reads from it, so touch them all now
+                
+                for db_name in self._thread_local.db_names:
+                    
+                    self._c.execute( 'SELECT 1 FROM ' + db_name + '.sqlite_master;' ).fetchone()
+                    
+                
+                self._thread_local.committed_caches = self._committed_caches
+                self._thread_local.snapshot_commit_number = self._num_commits
+                
+            
+            job_profile_start = self._StartJobProfile()
+            
+            result = self._Read( action, *args, **kwargs )
+            
+            job_profile = self._StopJobProfile( job, job_profile_start )
+            
+            self._c.execute( 'COMMIT;' )
+            
+            in_transaction = False
+            
+            if self._thread_local.write_attempted:
+                
+                # the read swallowed the error itself, so we can't trust what it produced
+                
+                raise HydrusExceptions.DBAccessException( 'A read tried to write!' )
+                
+            
+            self._RecordJobProfile( job_profile, 0.0 )
+            
+            for ( topic, args, kwargs ) in self._pubsubs:
+                
+                self._controller.pub( topic, *args, **kwargs )
+                
+            
+            job.PutResult( result )
+            
+        except Exception as e:
+            
+            if in_transaction:
+                
+                try:
+                    
+                    self._c.execute( 'ROLLBACK;' )
+                    
+                except Exception as rollback_e:
+                    
+                    HydrusData.Print( 'When the read failed, attempting to rollback the database failed.' )
+                    
+                    HydrusData.PrintException( rollback_e )
+                    
+                
+            
+            if self._thread_local.write_attempted:
+                
+                self._jobs.put( ( priority, job ) )
+                
+            else:
+                
+                self._ManageDBError( job, e )
+                
+            
+        finally:
+            
+            self._thread_local.committed_caches = None
+            self._thread_local.snapshot_commit_number = None
+            
+        
+    
+    def _Read( self, action, *args, **kwargs ):
+        
+        raise NotImplementedError()
+        
+    
+    def _ReadConnectionAuthoriser( self, action_code, arg_1, arg_2, db_name, trigger_name ):
+        
+        # fts4 asks to update sqlite_master whenever it runs a MATCH, so we let that through--real schema changes are caught by the create/drop codes
+        
+        if action_code in READ_CONNECTION_FORBIDDEN_ACTIONS and db_name not in READ_CONNECTION_WRITABLE_DB_NAMES and arg_1 != 'sqlite_master':
+            
+            self._thread_local.write_attempted = True
+            
+            return sqlite3.SQLITE_DENY
+            
+        
+        return sqlite3.SQLITE_OK
+        
+    
+    def _RecordJobProfile( self, job_profile, commit_time ):
+        
+        ( job, started, execution_time, num_rows, statements ) = job_profile
+        
+        queue_wait = started - job.GetCreationTime()
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        self._job_profiler.AddJob( job.GetType(), action, queue_wait, execution_time, commit_time, num_rows )
+        
+        if statements is not None and execution_time + commit_time >= self._slow_job_threshold:
+            
+            self._ReportSlowJob( job, queue_wait, execution_time, commit_time, num_rows, statements )
+            
+        
+    
+    def _ReportSlowJob( self, job, queue_wait, execution_time, commit_time, num_rows, statements ):
+        
+        ( num_statements, statements ) = statements
+        
+        lines = []
+        
+        lines.append( 'Slow db job on ' + self._db_name + ': ' + job.ToString() )
+        lines.append( 'queue wait %.1fms, execution %.1fms, commit %.1fms, ' % ( queue_wait * 1000, execution_time * 1000, commit_time * 1000 ) + HydrusData.ConvertIntToPrettyString( num_rows ) + ' rows changed' )
+        
+        text = HydrusData.ConvertIntToPrettyString( num_statements ) + ' statements'
+        
+        if num_statements > len( statements ):
+            
+            text += ', the first ' + HydrusData.ConvertIntToPrettyString( len( statements ) ) + ' of which are'
+            
+        
+        lines.append( text + ':' )
+        
+        for ( sql, duration ) in statements:
+            
+            lines.append( '%.1fms: ' % ( duration * 1000 ) + HydrusData.ToUnicode( sql ) )
+            
+        
+        HydrusData.Print( os.linesep.join( lines ) )
+        
+    
+    def _ReportStatus( self, text ):
+        
+        HydrusData.Print( text )
+        
+    
+    def _ResumeReadConnections( self ):
+        
+        with self._read_connections_condition:
+            
+            self._read_connections_paused = False
+            
+            self._read_connections_generation += 1
+            
+            self._read_connections_condition.notify_all()
+            
+        
+    
+    def _StartJobProfile( self ):
+        
+        if self._slow_job_threshold is not None:
+            
+            self._c.StartTracing()
+            
+        
+        return ( HydrusData.GetNowPrecise(), self._db.total_changes )
+        
+    
+    def _StopJobProfile( self, job, job_profile_start ):
+        
+        ( started, total_changes ) = job_profile_start
+        
+        execution_time = HydrusData.GetNowPrecise() - started
+        
+        num_rows = self._db.total_changes - total_changes
+        
+        statements = self._c.StopTracing()
+        
+        return ( job, started, execution_time, num_rows, statements )
+        
+    
+    def _UpdateCachesAfterCommit( self, pubsubs ):
+        
+        pass
+        
+    
+    def _UpdateDB( self, version ):
+        
+        raise NotImplementedError()
+        
+    
+    def _WaitWhileReadConnectionsPaused( self ):
+        
+        # the main loop has closed its connection for a vacuum, backup or similar, so we close ours too and wait for it to reopen
+        
+        while self._read_connections_paused:
+            
+            if self._db is not None:
+                
+                self._CloseDBCursor()
+                
+            
+            self._read_connections_condition.wait( 0.5 )
+            
+        
+    
+    def _Write( self, action, *args, **kwargs ):
+        
+        raise NotImplementedError()
+        
+    
+    def _GetThreadCursor( self ):
+        
+        return getattr( self._thread_local, 'c', None )
+        
+    
+    def _SetThreadCursor( self, c ):
+        
+        self._thread_local.c = c
+        
+    
+    def _DelThreadCursor( self ):
+        
+        del self._thread_local.c
+        
+    
+    def _GetThreadDB( self ):
+        
+        return getattr( self._thread_local, 'db', None )
+        
+    
+    def _SetThreadDB( self, db ):
+        
+        self._thread_local.db = db
+        
+    
+    def _DelThreadDB( self ):
+        
+        del self._thread_local.db
+        
+    
+    def _GetThreadPubSubs( self ):
+        
+        if not hasattr( self._thread_local, 'pubsubs' ):
+            
+            self._thread_local.pubsubs = []
+            
+        
+        return self._thread_local.pubsubs
+        
+    
+    def _SetThreadPubSubs( self, pubsubs ):
+        
+        self._thread_local.pubsubs = pubsubs
+        
+    
+    _c = property( _GetThreadCursor, _SetThreadCursor, _DelThreadCursor )
+    _db = property( _GetThreadDB, _SetThreadDB, _DelThreadDB )
+    _pubsubs = property( _GetThreadPubSubs, _SetThreadPubSubs )
+    
+    def pub_after_commit( self, topic, *args, **kwargs ):
+        
+        self._pubsubs.append( ( topic, args, kwargs ) )
+        
+    
+    def CurrentlyDoingJob( self ):
+        
+        return self._currently_doing_job
+        
+    
+    def GetCommitStats( self ):
+        
+        stats = {}
+        
+        stats[ 'num_commits' ] = self._num_commits
+        stats[ 'num_jobs_committed' ] = self._num_jobs_committed
+        stats[ 'time_running' ] = HydrusData.GetNowPrecise() - self._commit_stats_start_time
+        
+        return stats
+        
+    
+    def GetDBDir( self ):
+        
+        return self._db_dir
+        
+    
+    def GetJobStats( self ):
+        
+        return self._job_profiler.GetStats()
+        
+    
+    def GetJobStatsReport( self ):
+        
+        return self._job_profiler.GetReport()
+        
+    
+    def LoopIsFinished( self ):
+        
+        return self._loop_finished
+        
+    
+    def JobsQueueEmpty( self ):
+        
+        with self._read_connections_condition:
+            
+            return self._jobs.empty() and self._read_jobs.empty() and self._num_read_jobs_in_progress == 0
+            
+        
+    
+    def MainLoop( self ):
+        
+        try:
+            
+            self._InitDBCursor() # have to reinitialise because the thread id has changed
+            
+            self._InitCaches()
+            
+            self._InitReadConnections()
+            
+            self._group_commit_window = self._GetGroupCommitWindow()
+            
+            self._slow_job_threshold = self._GetSlowJobThreshold()
+            
+        except:
+            
+            HydrusData.Print( traceback.format_exc() )
+            
+            self._could_not_initialise = True
+            
+            return
+            
+        
+        self._ready_to_serve_requests = True
+        
+        error_count = 0
+        
+        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self.JobsQueueEmpty() ):
+            
+            try:
+                
+                ( priority, job ) = self._jobs.get( timeout = 0.5 )
+                
+                self._currently_doing_job = True
+                
+                self._controller.pub( 'refresh_status' )
+                
+                self._pubsubs = []
+                
+                if self._CanGroupCommit( job ):
+                    
+                    jobs = self._GetGroupCommitJobs( job )
+                    
+                else:
+                    
+                    jobs = [ job ]
+                    
+                
+                try:
+                    
+                    if len( jobs ) == 1:
+                        
+                        if HydrusGlobals.db_profile_mode:
+                            
+                            HydrusData.ShowText( 'Profiling ' + job.ToString() )
+                            
+                            HydrusData.Profile( 'self._ProcessJob( job )', globals(), locals() )
+                            
+                        else:
+                            
+                            self._ProcessJob( job )
+                            
+                        
+                    else:
+                        
+                        if HydrusGlobals.db_profile_mode:
+                            
+                            HydrusData.ShowText( 'Profiling group commit of ' + ', '.join( job.ToString() for job in jobs ) )
+                            
+                            HydrusData.Profile( 'self._ProcessGroupCommitJobs( jobs )', globals(), locals() )
+                            
+                        else:
+                            
+                            self._ProcessGroupCommitJobs( jobs )
+                            
+                        
+                    
+                    error_count = 0
+                    
+                except:
+                    
+                    error_count += 1
                     
                     if error_count > 5: raise
                     
-                    self._jobs.put( ( priority, job ) ) # couldn't lock db; put job back on queue
+                    for job in jobs:
+                        
+                        self._jobs.put( ( priority, job ) ) # couldn't lock db; put job back on queue
+                        
                     
                     time.sleep( 5 )
                     
@@ -618,6 +1317,11 @@ class HydrusDB( object ):
                 
             
         
+        for thread in self._read_connection_threads:
+            
+            thread.join()
+            
+        
         self._CleanUpCaches()
         
         self._CloseDBCursor()
@@ -639,11 +1343,95 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
-        self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+        if job_type == 'read' and self._num_read_connections > 0:
+            
+            self._read_jobs.put( ( priority + 1, job ) )
+            
+        else:
+            
+            self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+            
         
         return job.GetResult()
         
     
+    def ReadConnectionLoop( self ):
+        
+        self._thread_local.is_read_connection = True
+        
+        generation = None
+        
+        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._read_jobs.empty() ):
+            
+            with self._read_connections_condition:
+                
+                self._WaitWhileReadConnectionsPaused()
+                
+            
+            try:
+                
+                ( priority, job ) = self._read_jobs.get( timeout = 0.5 )
+                
+            except Queue.Empty:
+                
+                continue
+                
+            
+            with self._read_connections_condition:
+                
+                self._WaitWhileReadConnectionsPaused()
+                
+                self._num_read_jobs_in_progress += 1
+                
+                current_generation = self._read_connections_generation
+                
+            
+            try:
+                
+                if generation != current_generation or self._db is None:
+                    
+                    self._InitReadConnection()
+                    
+                    generation = current_generation
+                    
+                
+                self._pubsubs = []
+                
+                if HydrusGlobals.db_profile_mode:
+                    
+                    HydrusData.ShowText( 'Profiling ' + job.ToString() )
+                    
+                    HydrusData.Profile( 'self._ProcessReadJob( job, priority )', globals(), locals() )
+                    
+                else:
+                    
+                    self._ProcessReadJob( job, priority )
+                    
+                
+            except Exception as e:
+                
+                # could not even connect, so let the main loop have it
+                
+                HydrusData.PrintException( e )
+                
+                self._jobs.put( ( priority, job ) )
+                
+                generation = None
+                
+            finally:
+                
+                with self._read_connections_condition:
+                    
+                    self._num_read_jobs_in_progress -= 1
+                    
+                    self._read_connections_condition.notify_all()
+                    
+                
+            
+        
+        self._CloseDBCursor()
+        
+    
     def ReadyToServeRequests( self ):
         
         return self._ready_to_serve_requests
@@ -684,4 +1472,220 @@ class HydrusDB( object ):
         
         if synchronous: return job.GetResult()
         
-    
\ No newline at end of file
+    
+class JobProfiler( object ):
+    
+    def __init__( self ):
+        
+        self._lock = threading.Lock()
+        
+        self._start_time = HydrusData.GetNowPrecise()
+        
+        self._keys_to_profiles = {}
+        
+    
+    def AddJob( self, job_type, action, queue_wait, execution_time, commit_time, num_rows ):
+        
+        values = ( queue_wait * 1000, execution_time * 1000, commit_time * 1000, num_rows )
+        
+        key = ( job_type, action )
+        
+        with self._lock:
+            
+            if key not in self._keys_to_profiles:
+                
+                profile = {}
+                
+                profile[ 'num_jobs' ] = 0
+                
+                for measure in JOB_PROFILE_MEASURES:
+                    
+                    profile[ measure ] = { 'total' : 0, 'max' : 0, 'histogram' : [ 0 ] * JOB_PROFILE_NUM_BUCKETS }
+                    
+                
+                self._keys_to_profiles[ key ] = profile
+                
+            
+            profile = self._keys_to_profiles[ key ]
+            
+            profile[ 'num_jobs' ] += 1
+            
+            for ( measure, value ) in zip( JOB_PROFILE_MEASURES, values ):
+                
+                measure_stats = profile[ measure ]
+                
+                measure_stats[ 'total' ] += value
+                measure_stats[ 'max' ] = max( measure_stats[ 'max' ], value )
+                measure_stats[ 'histogram' ][ GetJobProfileBucket( value ) ] += 1
+                
+            
+        
+    
+    def GetReport( self ):
+        
+        stats = self.GetStats()
+        
+        lines = []
+        
+        lines.append( 'db job stats over ' + HydrusData.ConvertTimeDeltaToPrettyString( stats[ 'time_running' ] ) + ', times in ms, slowest actions first:' )
+        
+        for profile in stats[ 'actions' ]:
+            
+            num_jobs = profile[ 'num_jobs' ]
+            
+            lines.append( '' )
+            lines.append( profile[ 'job_type' ] + ' ' + profile[ 'action' ] + ': ' + HydrusData.ConvertIntToPrettyString( num_jobs ) + ' jobs' )
+            
+            for measure in JOB_PROFILE_MEASURES:
+                
+                measure_stats = profile[ measure ]
+                
+                buckets = [ ConvertJobProfileBucketToString( bucket ) + ': ' + HydrusData.ConvertIntToPrettyString( count ) for ( bucket, count ) in enumerate( measure_stats[ 'histogram' ] ) if count > 0 ]
+                
+                lines.append( '    %s: avg %.1f, max %.1f | ' % ( measure, float( measure_stats[ 'total' ] ) / num_jobs, measure_stats[ 'max' ] ) + ', '.join( buckets ) )
+                
+            
+        
+        return os.linesep.join( lines )
+        
+    
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            actions = []
+            
+            for ( ( job_type, action ), profile ) in self._keys_to_profiles.items():
+                
+                action_stats = { 'job_type' : job_type, 'action' : action, 'num_jobs' : profile[ 'num_jobs' ] }
+                
+                for measure in JOB_PROFILE_MEASURES:
+                    
+                    measure_stats = profile[ measure ]
+                    
+                    action_stats[ measure ] = { 'total' : measure_stats[ 'total' ], 'max' : measure_stats[ 'max' ], 'histogram' : list( measure_stats[ 'histogram' ] ) }
+                    
+                
+                actions.append( action_stats )
+                
+            
+        
+        actions.sort( key = lambda action_stats: action_stats[ 'execution' ][ 'total' ] + action_stats[ 'commit' ][ 'total' ], reverse = True )
+        
+        stats = {}
+        
+        stats[ 'time_running' ] = HydrusData.GetNowPrecise() - self._start_time
+        stats[ 'actions' ] = actions
+        
+        return stats
+        
+    
+class TracingCursor( object ):
+    
+    # a thin wrapper that can remember what sql a job ran, for the slow job log
+    
+    def __init__( self, c ):
+        
+        self._c = c
+        
+        self._statements = None
+        self._num_statements = 0
+        
+    
+    def __getattr__( self, name ):
+        
+        return getattr( self._c, name )
+        
+    
+    def __iter__( self ):
+        
+        return iter( self._c )
+        
+    
+    def _RecordStatement( self, sql, started ):
+        
+        self._num_statements += 1
+        
+        if len( self._statements ) < SLOW_JOB_MAX_STATEMENTS:
+            
+            self._statements.append( ( sql, HydrusData.GetNowPrecise() - started ) )
+            
+        
+    
+    def execute( self, sql, *args ):
+        
+        if self._statements is None:
+            
+            return self._c.execute( sql, *args )
+            
+        
+        started = HydrusData.GetNowPrecise()
+        
+        try:
+            
+            return self._c.execute( sql, *args )
+            
+        finally:
+            
+            self._RecordStatement( sql, started )
+            
+        
+    
+    def executemany( self, sql, *args ):
+        
+        if self._statements is None:
+            
+            return self._c.executemany( sql, *args )
+            
+        
+        started = HydrusData.GetNowPrecise()
+        
+        try:
+            
+            return self._c.executemany( sql, *args )
+            
+        finally:
+            
+            self._RecordStatement( sql, started )
+            
+        
+    
+    def executescript( self, sql ):
+        
+        if self._statements is None:
+            
+            return self._c.executescript( sql )
+            
+        
+        started = HydrusData.GetNowPrecise()
+        
+        try:
+            
+            return self._c.executescript( sql )
+            
+        finally:
+            
+            self._RecordStatement( sql, started )
+            
+        
+    
+    def StartTracing( self ):
+        
+        self._statements = []
+        self._num_statements = 0
+        
+    
+    def StopTracing( self ):
+        
+        if self._statements is None:
+            
+            return None
+            
+        
+        result = ( self._num_statements, self._statements )
+        
+        self._statements = None
+        
+        return result
+        
+    
@@ -7,11 +7,14 @@ import HydrusExceptions
 import HydrusGlobals
 import HydrusSerialisable
 import locale
+import lz4
+import numpy
 import os
 import pstats
 import psutil
 import shutil
 import sqlite3
+import struct
 import subprocess
 import sys
 import threading
@@ -20,6 +23,15 @@ import traceback
 import yaml
 import itertools
 
+# binary content update packages are this magic, then a version byte, then an lz4 compressed body of packed little-endian columns
+CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_MAGIC = 'hydrus binary client to server content update'
+CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_VERSION = 1
+
+CONTENT_UPDATE_PACKAGE_BINARY_MAGIC = 'hydrus binary content update'
+CONTENT_UPDATE_PACKAGE_BINARY_VERSION = 1
+
+POPCOUNT_LOOKUP = numpy.array( [ bin( i ).count( '1' ) for i in range( 256 ) ], dtype = numpy.uint8 )
+
 def default_dict_list(): return collections.defaultdict( list )
 
 def default_dict_set(): return collections.defaultdict( set )
@@ -259,6 +271,12 @@ def ConvertNumericalRatingToPrettyString( lower, upper, rating, rounded_result =
     
     return s
     
+def ConvertPHashesToNumPyArray( phashes ):
+    
+    # phashes are 64-bit, so we can pack them into one uint64 each
+    
+    return numpy.fromstring( ''.join( phashes ), dtype = numpy.uint64 )
+    
 def ConvertPixelsToInt( unit ):
     
     if unit == 'pixels': return 1
@@ -597,6 +615,52 @@ def ConvertValueRangeToPrettyString( value, range ):
     
     return ConvertIntToPrettyString( value ) + '/' + ConvertIntToPrettyString( range )
     
+def CreateClientToServerContentUpdatePackageFromNetworkString( network_string ):
+    
+    if network_string.startswith( CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_MAGIC ):
+        
+        iterator = IterateBinaryClientToServerContentUpdatePackage( network_string )
+        
+        ( data_type, action, rows, hash_ids_to_hashes ) = iterator.next()
+        
+        content_update_package = ClientToServerContentUpdatePackage( {}, hash_ids_to_hashes )
+        
+        for ( data_type, action, rows, no_hashes ) in iterator:
+            
+            content_update_package.AddContentData( data_type, action, rows, no_hashes )
+            
+        
+        return content_update_package
+        
+    else:
+        
+        return HydrusSerialisable.CreateFromNetworkString( network_string )
+        
+    
+def CreateContentUpdatePackageFromNetworkString( network_string ):
+    
+    if network_string.startswith( CONTENT_UPDATE_PACKAGE_BINARY_MAGIC ):
+        
+        content_update_package = ServerToClientContentUpdatePackage()
+        
+        iterator = IterateBinaryContentUpdatePackage( network_string )
+        
+        ( data_type, action, rows, hash_ids_to_hashes ) = iterator.next()
+        
+        for ( data_type, action, rows, no_hashes ) in iterator:
+            
+            content_update_package.AddContentData( data_type, action, rows, hash_ids_to_hashes )
+            
+            hash_ids_to_hashes = {}
+            
+        
+        return content_update_package
+        
+    else:
+        
+        return HydrusSerialisable.CreateFromNetworkString( network_string )
+        
+    
 def DebugPrint( debug_info ):
     
     Print( debug_info )
@@ -624,23 +688,24 @@ def GetEmptyDataDict():
     
 def GetHammingDistance( phash1, phash2 ):
     
-    distance = 0
+    # sqlite hands us buffers, so str() them first
     
-    phash1 = bytearray( phash1 )
-    phash2 = bytearray( phash2 )
+    xor = int( str( phash1 ).encode( 'hex' ), 16 ) ^ int( str( phash2 ).encode( 'hex' ), 16 )
     
-    for i in range( len( phash1 ) ):
-        
-        xor = phash1[i] ^ phash2[i]
-        
-        while xor > 0:
-            
-            distance += 1
-            xor &= xor - 1
-            
-        
+    return bin( xor ).count( '1' )
+    
+def GetHammingDistances( phash, packed_phashes ):
+    
+    # packed_phashes is a uint64 array from ConvertPHashesToNumPyArray
+    # xor everything against the search phash in one go, then count the set bits with a byte lookup table
     
-    return distance
+    search_phash = numpy.fromstring( phash, dtype = numpy.uint64 )
+    
+    xors = numpy.bitwise_xor( packed_phashes, search_phash )
+    
+    set_bits_per_byte = POPCOUNT_LOOKUP[ xors.view( numpy.uint8 ) ]
+    
+    return set_bits_per_byte.reshape( ( len( packed_phashes ), 8 ) ).sum( axis = 1 )
     
 def GetNow(): return int( time.time() )
 
@@ -793,6 +858,181 @@ def IsAlreadyRunning( db_path, instance ):
     
     return False
     
+def IterateBinaryClientToServerContentUpdatePackage( network_string ):
+    
+    # yields ( data_type, action, rows, hash_ids_to_hashes ) one section at a time, the first yield carrying all the hashes and no rows
+    
+    magic_length = len( CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_MAGIC )
+    
+    version = ord( network_string[ magic_length ] )
+    
+    if version > CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_VERSION:
+        
+        raise HydrusExceptions.NetworkVersionException( 'This binary content update package is version ' + str( version ) + ', which is newer than this software understands!' )
+        
+    
+    reader = BinaryContentReader( lz4.loads( network_string[ magic_length + 1 : ] ) )
+    
+    ( num_hashes, ) = reader.ReadStruct( '<I' )
+    
+    hash_ids = reader.ReadArray( '<u4', num_hashes ).tolist()
+    
+    hash_ids_to_hashes = dict( zip( hash_ids, reader.ReadHashes( num_hashes ) ) )
+    
+    yield ( None, None, [], hash_ids_to_hashes )
+    
+    ( num_sections, ) = reader.ReadStruct( '<I' )
+    
+    for i in range( num_sections ):
+        
+        ( data_type, action, has_reasons, num_rows ) = reader.ReadStruct( '<BBBI' )
+        
+        if data_type == HC.CONTENT_TYPE_FILES:
+            
+            rows = reader.ReadHashIdLists( num_rows )
+            
+        elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+            
+            tags = reader.ReadStrings( num_rows )
+            
+            rows = zip( tags, reader.ReadHashIdLists( num_rows ) )
+            
+        else:
+            
+            tags = reader.ReadStrings( num_rows * 2 )
+            
+            rows = zip( tags[ 0 : : 2 ], tags[ 1 : : 2 ] )
+            
+        
+        if has_reasons:
+            
+            reasons = reader.ReadStrings( num_rows )
+            
+            if data_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                rows = [ ( tag, hash_ids, reason ) for ( ( tag, hash_ids ), reason ) in zip( rows, reasons ) ]
+                
+            else:
+                
+                rows = zip( rows, reasons )
+                
+            
+        
+        yield ( data_type, action, rows, {} )
+        
+    
+def IterateBinaryContentUpdatePackage( network_string ):
+    
+    # yields ( data_type, action, rows, hash_ids_to_hashes ) one section at a time, so a caller can process a big package without building the whole object
+    # the first yield carries all the hashes and no rows
+    
+    magic_length = len( CONTENT_UPDATE_PACKAGE_BINARY_MAGIC )
+    
+    version = ord( network_string[ magic_length ] )
+    
+    if version > CONTENT_UPDATE_PACKAGE_BINARY_VERSION:
+        
+        raise HydrusExceptions.NetworkVersionException( 'This binary content update package is version ' + str( version ) + ', which is newer than this software understands!' )
+        
+    
+    reader = BinaryContentReader( lz4.loads( network_string[ magic_length + 1 : ] ) )
+    
+    ( num_hashes, ) = reader.ReadStruct( '<I' )
+    
+    hash_ids = reader.ReadArray( '<u4', num_hashes ).tolist()
+    
+    hash_ids_to_hashes = dict( zip( hash_ids, reader.ReadHashes( num_hashes ) ) )
+    
+    yield ( None, None, [], hash_ids_to_hashes )
+    
+    ( num_sections, ) = reader.ReadStruct( '<I' )
+    
+    for i in range( num_sections ):
+        
+        ( data_type, action, num_rows ) = reader.ReadStruct( '<BBI' )
+        
+        if data_type == HC.CONTENT_TYPE_FILES:
+            
+            if action == HC.CONTENT_UPDATE_ADD:
+                
+                columns = [ [ None if value == -1 else value for value in reader.ReadArray( '<i8', num_rows ).tolist() ] for j in range( 9 ) ]
+                
+                rows = zip( *columns )
+                
+            else:
+                
+                rows = reader.ReadArray( '<u4', num_rows ).tolist()
+                
+            
+        elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+            
+            tags = reader.ReadStrings( num_rows )
+            
+            rows = zip( tags, reader.ReadHashIdLists( num_rows ) )
+            
+        else:
+            
+            tags = reader.ReadStrings( num_rows * 2 )
+            
+            rows = zip( tags[ 0 : : 2 ], tags[ 1 : : 2 ] )
+            
+        
+        yield ( data_type, action, rows, {} )
+        
+    
+def IterateContentUpdatePackagesFromNetworkString( network_string ):
+    
+    # a binary package comes out one section at a time, each carrying only the hashes it needs, so processing it never holds the whole thing as objects
+    # the lz4 body is a single block, so that part is still decompressed in one go
+    # older json packages have to be loaded whole
+    
+    if network_string.startswith( CONTENT_UPDATE_PACKAGE_BINARY_MAGIC ):
+        
+        iterator = IterateBinaryContentUpdatePackage( network_string )
+        
+        ( data_type, action, rows, hash_ids_to_hashes ) = iterator.next()
+        
+        for ( data_type, action, rows, no_hashes ) in iterator:
+            
+            if data_type == HC.CONTENT_TYPE_FILES:
+                
+                if action == HC.CONTENT_UPDATE_ADD:
+                    
+                    hash_ids = { row[0] for row in rows }
+                    
+                else:
+                    
+                    hash_ids = set( rows )
+                    
+                
+            elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                hash_ids = set( itertools.chain.from_iterable( ( row_hash_ids for ( tag, row_hash_ids ) in rows ) ) )
+                
+            else:
+                
+                hash_ids = set()
+                
+            
+            content_update_package = ServerToClientContentUpdatePackage()
+            
+            content_update_package.AddContentData( data_type, action, rows, { hash_id : hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids } )
+            
+            yield content_update_package
+            
+        
+    else:
+        
+        content_update_package = HydrusSerialisable.CreateFromNetworkString( network_string )
+        
+        if not isinstance( content_update_package, ServerToClientContentUpdatePackage ):
+            
+            raise Exception( 'That was not a content update package!' )
+            
+        
+        yield content_update_package
+        
+    
 def IterateHexPrefixes():
     
     hex_chars = '0123456789abcdef'
@@ -1052,6 +1292,18 @@ def WaitForProcessToFinish( p, timeout ):
         time.sleep( 2 )
         
     
+def WriteBinaryHashIdLists( body, hash_id_lists ):
+    
+    body.write( numpy.array( [ len( hash_ids ) for hash_ids in hash_id_lists ], dtype = '<u4' ).tostring() )
+    body.write( numpy.array( list( itertools.chain.from_iterable( hash_id_lists ) ), dtype = '<u4' ).tostring() )
+    
+def WriteBinaryStrings( body, strings ):
+    
+    encoded_strings = [ string.encode( 'utf-8' ) for string in strings ]
+    
+    body.write( numpy.array( [ len( encoded_string ) for encoded_string in encoded_strings ], dtype = '<u4' ).tostring() )
+    body.write( ''.join( encoded_strings ) )
+    
 class HydrusYAMLBase( yaml.YAMLObject ):
     
     yaml_loader = yaml.SafeLoader
@@ -1381,15 +1633,93 @@ class BigJobPauser( object ):
             
         
     
-class ClientToServerContentUpdatePackage( HydrusYAMLBase ):
+class BinaryContentReader( object ):
     
+    def __init__( self, body ):
+        
+        self._body = body
+        self._position = 0
+        
+    
+    def ReadArray( self, dtype, num ):
+        
+        array = numpy.frombuffer( self._body, dtype = dtype, count = num, offset = self._position )
+        
+        self._position += array.nbytes
+        
+        return array
+        
+    
+    def ReadHashes( self, num ):
+        
+        start = self._position
+        
+        self._position += num * 32
+        
+        return [ self._body[ start + i * 32 : start + ( i + 1 ) * 32 ] for i in range( num ) ]
+        
+    
+    def ReadHashIdLists( self, num ):
+        
+        counts = self.ReadArray( '<u4', num ).tolist()
+        
+        all_hash_ids = self.ReadArray( '<u4', sum( counts ) ).tolist()
+        
+        hash_id_lists = []
+        
+        start = 0
+        
+        for count in counts:
+            
+            hash_id_lists.append( all_hash_ids[ start : start + count ] )
+            
+            start += count
+            
+        
+        return hash_id_lists
+        
+    
+    def ReadStrings( self, num ):
+        
+        lengths = self.ReadArray( '<u4', num ).tolist()
+        
+        strings = []
+        
+        for length in lengths:
+            
+            strings.append( self._body[ self._position : self._position + length ].decode( 'utf-8' ) )
+            
+            self._position += length
+            
+        
+        return strings
+        
+    
+    def ReadStruct( self, fmt ):
+        
+        result = struct.unpack_from( fmt, self._body, self._position )
+        
+        self._position += struct.calcsize( fmt )
+        
+        return result
+        
+    
+class ClientToServerContentUpdatePackage( HydrusSerialisable.SerialisableBase, HydrusYAMLBase ):
+    
+    SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE
+    SERIALISABLE_VERSION = 1
+    
+    # older clients still upload this as yaml
     yaml_tag = u'!ClientToServerContentUpdatePackage'
     
-    def __init__( self, content_data, hash_ids_to_hashes ):
+    def __init__( self, content_data = None, hash_ids_to_hashes = None ):
         
-        HydrusYAMLBase.__init__( self )
+        if content_data is None: content_data = {}
+        if hash_ids_to_hashes is None: hash_ids_to_hashes = {}
+        
+        HydrusSerialisable.SerialisableBase.__init__( self )
         
-        # we need to flatten it from a collections.defaultdict to just a normal dict so it can be YAMLised
+        # we need to flatten it from a collections.defaultdict to just a normal dict so it can be serialised
         
         self._content_data = {}
         
@@ -1403,6 +1733,124 @@ class ClientToServerContentUpdatePackage( HydrusYAMLBase ):
         self._hash_ids_to_hashes = hash_ids_to_hashes
         
     
+    def _GetSerialisableInfo( self ):
+        
+        serialisable_content_data = []
+        
+        for ( data_type, actions_dict ) in self._content_data.items():
+            
+            serialisable_actions_dict = []
+            
+            for ( action, rows ) in actions_dict.items():
+                
+                serialisable_actions_dict.append( ( action, rows ) )
+                
+            
+            serialisable_content_data.append( ( data_type, serialisable_actions_dict ) )
+            
+        
+        serialisable_hashes = [ ( hash_id, hash.encode( 'hex' ) ) for ( hash_id, hash ) in self._hash_ids_to_hashes.items() ]
+        
+        return ( serialisable_content_data, serialisable_hashes )
+        
+    
+    def _InitialiseFromSerialisableInfo( self, serialisable_info ):
+        
+        ( serialisable_content_data, serialisable_hashes ) = serialisable_info
+        
+        self._content_data = {}
+        
+        for ( data_type, serialisable_actions_dict ) in serialisable_content_data:
+            
+            actions_dict = {}
+            
+            for ( action, rows ) in serialisable_actions_dict:
+                
+                actions_dict[ action ] = rows
+                
+            
+            self._content_data[ data_type ] = actions_dict
+            
+        
+        self._hash_ids_to_hashes = { hash_id : hash.decode( 'hex' ) for ( hash_id, hash ) in serialisable_hashes }
+        
+    
+    def AddContentData( self, data_type, action, rows, hash_ids_to_hashes ):
+        
+        if data_type not in self._content_data:
+            
+            self._content_data[ data_type ] = {}
+            
+        
+        if action not in self._content_data[ data_type ]:
+            
+            self._content_data[ data_type ][ action ] = []
+            
+        
+        self._content_data[ data_type ][ action ].extend( rows )
+        
+        self._hash_ids_to_hashes.update( hash_ids_to_hashes )
+        
+    
+    def DumpToBinaryNetworkString( self ):
+        
+        body = cStringIO.StringIO()
+        
+        hash_ids = self._hash_ids_to_hashes.keys()
+        
+        body.write( struct.pack( '<I', len( hash_ids ) ) )
+        body.write( numpy.array( hash_ids, dtype = '<u4' ).tostring() )
+        body.write( ''.join( ( self._hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids ) ) )
+        
+        sections = [ ( data_type, action, rows ) for ( data_type, actions_dict ) in self._content_data.items() for ( action, rows ) in actions_dict.items() ]
+        
+        body.write( struct.pack( '<I', len( sections ) ) )
+        
+        for ( data_type, action, rows ) in sections:
+            
+            # petitions carry a reason, as do pended siblings and parents
+            
+            has_reasons = action == HC.CONTENT_UPDATE_PETITION or ( action == HC.CONTENT_UPDATE_PEND and data_type in ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ) )
+            
+            body.write( struct.pack( '<BBBI', data_type, action, has_reasons, len( rows ) ) )
+            
+            if has_reasons:
+                
+                if data_type == HC.CONTENT_TYPE_MAPPINGS:
+                    
+                    reasons = [ reason for ( tag, hash_ids, reason ) in rows ]
+                    rows = [ ( tag, hash_ids ) for ( tag, hash_ids, reason ) in rows ]
+                    
+                else:
+                    
+                    reasons = [ reason for ( row, reason ) in rows ]
+                    rows = [ row for ( row, reason ) in rows ]
+                    
+                
+            
+            if data_type == HC.CONTENT_TYPE_FILES:
+                
+                WriteBinaryHashIdLists( body, rows )
+                
+            elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                WriteBinaryStrings( body, [ tag for ( tag, hash_ids ) in rows ] )
+                WriteBinaryHashIdLists( body, [ hash_ids for ( tag, hash_ids ) in rows ] )
+                
+            else:
+                
+                WriteBinaryStrings( body, list( itertools.chain.from_iterable( rows ) ) )
+                
+            
+            if has_reasons:
+                
+                WriteBinaryStrings( body, reasons )
+                
+            
+        
+        return CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_MAGIC + chr( CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE_BINARY_VERSION ) + lz4.dumps( body.getvalue() )
+        
+    
     def GetContentUpdates( self, for_client = False ):
         
         data_types = [ HC.CONTENT_TYPE_FILES, HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ]
@@ -1502,6 +1950,8 @@ class ClientToServerContentUpdatePackage( HydrusYAMLBase ):
         return num_total == 0
         
     
+HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE ] = ClientToServerContentUpdatePackage
+
 class Content( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_CONTENT
@@ -1822,6 +2272,8 @@ class JobDatabase( object ):
         self._args = args
         self._kwargs = kwargs
         
+        self._creation_time = GetNowPrecise()
+        
         self._result = None
         self._result_ready = threading.Event()
         
@@ -1831,6 +2283,11 @@ class JobDatabase( object ):
         return ( self._action, self._args, self._kwargs )
         
     
+    def GetCreationTime( self ):
+        
+        return self._creation_time
+        
+    
     def GetResult( self ):
         
         while True:
@@ -1938,6 +2395,54 @@ class ServerToClientContentUpdatePackage( HydrusSerialisable.SerialisableBase ):
         self._hash_ids_to_hashes.update( hash_ids_to_hashes )
         
     
+    def DumpToBinaryNetworkString( self ):
+        
+        body = cStringIO.StringIO()
+        
+        hash_ids = self._hash_ids_to_hashes.keys()
+        
+        body.write( struct.pack( '<I', len( hash_ids ) ) )
+        body.write( numpy.array( hash_ids, dtype = '<u4' ).tostring() )
+        body.write( ''.join( ( self._hash_ids_to_hashes[ hash_id ] for hash_id in hash_ids ) ) )
+        
+        sections = [ ( data_type, action, rows ) for ( data_type, actions_dict ) in self._content_data.items() for ( action, rows ) in actions_dict.items() ]
+        
+        body.write( struct.pack( '<I', len( sections ) ) )
+        
+        for ( data_type, action, rows ) in sections:
+            
+            body.write( struct.pack( '<BBI', data_type, action, len( rows ) ) )
+            
+            if data_type == HC.CONTENT_TYPE_FILES:
+                
+                if action == HC.CONTENT_UPDATE_ADD:
+                    
+                    columns = zip( *rows ) if len( rows ) > 0 else [ () ] * 9
+                    
+                    for column in columns:
+                        
+                        body.write( numpy.array( [ -1 if value is None else value for value in column ], dtype = '<i8' ).tostring() )
+                        
+                    
+                else:
+                    
+                    body.write( numpy.array( rows, dtype = '<u4' ).tostring() )
+                    
+                
+            elif data_type == HC.CONTENT_TYPE_MAPPINGS:
+                
+                WriteBinaryStrings( body, [ tag for ( tag, hash_ids ) in rows ] )
+                WriteBinaryHashIdLists( body, [ hash_ids for ( tag, hash_ids ) in rows ] )
+                
+            else:
+                
+                WriteBinaryStrings( body, list( itertools.chain.from_iterable( rows ) ) )
+                
+            
+        
+        return CONTENT_UPDATE_PACKAGE_BINARY_MAGIC + chr( CONTENT_UPDATE_PACKAGE_BINARY_VERSION ) + lz4.dumps( body.getvalue() )
+        
+    
     def GetContentDataIterator( self, data_type, action ):
         
         if data_type not in self._content_data or action not in self._content_data[ data_type ]: return ()
@@ -60,9 +60,12 @@ def SaveThumbnailToStream( pil_image, dimensions, f ):
         pil_image.save( f, 'JPEG', quality = 92 )
         
     
-def GenerateThumbnail( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS ):
+def GenerateThumbnail( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, mime = None ):
     
-    mime = GetMime( path )
+    if mime is None:
+        
+        mime = GetMime( path )
+        
     
     f = cStringIO.StringIO()
     
@@ -101,7 +104,7 @@ def GenerateThumbnail( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS ):
         
     else:
         
-        ( size, mime, width, height, duration, num_frames, num_words ) = GetFileInfo( path )
+        ( size, mime, width, height, duration, num_frames, num_words ) = GetFileInfo( path, mime = mime )
         
         cropped_dimensions = HydrusImageHandling.GetThumbnailResolution( ( width, height ), dimensions )
         
@@ -144,13 +147,16 @@ def GetExtraHashesFromPath( path ):
     
     return ( md5, sha1, sha512 )
     
-def GetFileInfo( path ):
+def GetFileInfo( path, mime = None ):
     
     size = os.path.getsize( path )
     
     if size == 0: raise HydrusExceptions.SizeException( 'File is of zero length!' )
     
-    mime = GetMime( path )
+    if mime is None:
+        
+        mime = GetMime( path )
+        
     
     if mime not in HC.ALLOWED_MIMES: raise HydrusExceptions.MimeException( 'Filetype is not permitted!' )
     
@@ -191,13 +197,52 @@ def GetHashFromPath( path ):
     
     return h.digest()
     
-def GetMime( path ):
+def GetHashesAndMimeFromPath( path ):
+    
+    # a single read of the file feeds every digest and the mime sniffing, which matters a lot for big files on slow drives
+    
+    h_sha256 = hashlib.sha256()
+    h_md5 = hashlib.md5()
+    h_sha1 = hashlib.sha1()
+    h_sha512 = hashlib.sha512()
+    
+    bit_to_check = None
     
     with open( path, 'rb' ) as f:
         
-        f.seek( 0 )
+        for block in HydrusPaths.ReadFileLikeAsBlocks( f ):
+            
+            if bit_to_check is None:
+                
+                bit_to_check = block[ : 256 ]
+                
+            
+            h_sha256.update( block )
+            h_md5.update( block )
+            h_sha1.update( block )
+            h_sha512.update( block )
+            
+        
+    
+    if bit_to_check is None:
+        
+        bit_to_check = ''
         
-        bit_to_check = f.read( 256 )
+    
+    mime = GetMime( path, bit_to_check = bit_to_check )
+    
+    return ( h_sha256.digest(), h_md5.digest(), h_sha1.digest(), h_sha512.digest(), mime )
+    
+def GetMime( path, bit_to_check = None ):
+    
+    if bit_to_check is None:
+        
+        with open( path, 'rb' ) as f:
+            
+            f.seek( 0 )
+            
+            bit_to_check = f.read( 256 )
+            
         
     
     for ( offset, header, mime ) in header_and_mime:
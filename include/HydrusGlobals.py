@@ -10,8 +10,10 @@ is_db_updated = False
 
 db_profile_mode = False
 pubsub_profile_mode = False
+query_planner_mode = False
 force_idle_mode = False
 server_busy = False
+server_generating_updates = False
 
 do_idle_shutdown_work = False
 shutdown_complete = False
@@ -31,9 +31,28 @@ def AppendPathUntilNoConflicts( path ):
     
 def CleanUpTempPath( os_file_handle, temp_path ):
     
+    # a handle of None means the caller already closed it
+    
+    if os_file_handle is not None:
+        
+        os_file_handle = CloseTempPathHandle( os_file_handle, temp_path )
+        
+        if os_file_handle is not None:
+            
+            return
+            
+        
+    
+    if not os.path.exists( temp_path ):
+        
+        # it was moved somewhere permanent
+        
+        return
+        
+    
     try:
         
-        os.close( os_file_handle )
+        os.remove( temp_path )
         
     except OSError:
         
@@ -41,19 +60,22 @@ def CleanUpTempPath( os_file_handle, temp_path ):
         
         try:
             
-            os.close( os_file_handle )
+            os.remove( temp_path )
             
         except OSError:
             
-            HydrusData.Print( 'Could not close the temporary file ' + temp_path )
-            
-            return
+            HydrusData.Print( 'Could not delete the temporary file ' + temp_path )
             
         
     
+def CloseTempPathHandle( os_file_handle, temp_path ):
+    
+    # windows will not move or delete a file that still has an open handle, so a temp file has to be let go of before it is imported
+    # this returns None if the handle closed, or the handle back if it did not, so callers can just keep what it gives them
+    
     try:
         
-        os.remove( temp_path )
+        os.close( os_file_handle )
         
     except OSError:
         
@@ -61,14 +83,18 @@ def CleanUpTempPath( os_file_handle, temp_path ):
         
         try:
             
-            os.remove( temp_path )
+            os.close( os_file_handle )
             
         except OSError:
             
-            HydrusData.Print( 'Could not delete the temporary file ' + temp_path )
+            HydrusData.Print( 'Could not close the temporary file ' + temp_path )
+            
+            return os_file_handle
             
         
     
+    return None
+    
 def ConvertAbsPathToPortablePath( abs_path ):
     
     try:
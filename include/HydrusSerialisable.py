@@ -29,6 +29,7 @@ SERIALISABLE_TYPE_SERVER_TO_CLIENT_PETITION = 24
 SERIALISABLE_TYPE_ACCOUNT_IDENTIFIER = 25
 SERIALISABLE_TYPE_LIST = 26
 SERIALISABLE_TYPE_HTML_PARSE_FORMULA = 27
+SERIALISABLE_TYPE_CLIENT_TO_SERVER_CONTENT_UPDATE_PACKAGE = 28
 
 SERIALISABLE_TYPES_TO_OBJECT_TYPES = {}
 
@@ -4,15 +4,18 @@ import HydrusFileHandling
 import HydrusImageHandling
 import HydrusPaths
 import HydrusSerialisable
+import collections
 import os
+import threading
 import time
 import traceback
 import yaml
 from twisted.internet import reactor, defer
 from twisted.internet.threads import deferToThread
+from twisted.web import http
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.resource import Resource
-from twisted.web.static import File as FileResource, NoRangeStaticProducer
+from twisted.web.static import File as FileResource, NoRangeStaticProducer, SingleRangeStaticProducer
 import HydrusData
 import HydrusGlobals
 
@@ -92,6 +95,71 @@ def ParseFileArguments( path ):
     
     return args
     
+def ParseRangeHeader( range_header, size ):
+    
+    # we only do single byte ranges. anything else, or anything malformed, gets the whole file
+    
+    if not range_header.startswith( 'bytes=' ):
+        
+        return None
+        
+    
+    range_spec = range_header[ 6 : ].strip()
+    
+    if ',' in range_spec or '-' not in range_spec:
+        
+        return None
+        
+    
+    ( start_string, end_string ) = range_spec.split( '-', 1 )
+    
+    try:
+        
+        if start_string == '':
+            
+            suffix_length = int( end_string )
+            
+            if suffix_length == 0:
+                
+                return ( size, size )
+                
+            
+            start = max( 0, size - suffix_length )
+            end = size - 1
+            
+        else:
+            
+            start = int( start_string )
+            
+            if end_string == '':
+                
+                end = size - 1
+                
+            else:
+                
+                end = int( end_string )
+                
+                if end < start:
+                    
+                    return None
+                    
+                
+                end = min( end, size - 1 )
+                
+            
+        
+    except ValueError:
+        
+        return None
+        
+    
+    if start < 0:
+        
+        return None
+        
+    
+    return ( start, end )
+    
 hydrus_favicon = FileResource( os.path.join( HC.STATIC_DIR, 'hydrus.ico' ), defaultType = 'image/x-icon' )
 
 class HydrusDomain( object ):
@@ -142,17 +210,31 @@ class HydrusResourceCommand( Resource ):
         self._server_version_string = HC.service_string_lookup[ service_type ] + '/' + str( HC.NETWORK_VERSION )
         
     
-    def _checkServerBusy( self ):
+    def _checkServerBusy( self, request ):
         
         if HydrusGlobals.server_busy:
             
-            raise HydrusExceptions.ServerBusyException( 'This server is busy, please try again later.' )
+            reason = 'server busy'
+            
+        elif HydrusGlobals.server_generating_updates and request.method == 'POST':
+            
+            # update generation holds the db writer, but reads have their own connections, so only writes need to be turned away
+            
+            reason = 'generating updates'
+            
+        else:
+            
+            return
             
         
+        SERVER_BUSY_STATS.ReportRequestRefused( reason )
+        
+        raise HydrusExceptions.ServerBusyException( 'This server is busy, please try again later.' )
+        
     
     def _callbackCheckRestrictions( self, request ):
         
-        self._checkServerBusy()
+        self._checkServerBusy( request )
         
         self._checkUserAgent( request )
         
@@ -243,6 +325,14 @@ class HydrusResourceCommand( Resource ):
                 
                 hydrus_args = HydrusSerialisable.CreateFromNetworkString( json_string )
                 
+            elif mime == HC.APPLICATION_HYDRUS_UPDATE_CONTENT:
+                
+                network_string = request.content.read()
+                
+                request.hydrus_request_data_usage += len( network_string )
+                
+                hydrus_args = { 'update' : HydrusData.CreateClientToServerContentUpdatePackageFromNetworkString( network_string ) }
+                
             else:
                 
                 
@@ -302,6 +392,8 @@ class HydrusResourceCommand( Resource ):
             
             size = os.path.getsize( path )
             
+            ( mime, body ) = response_context.GetMimeBody()
+            
             if response_context.IsJSON():
                 
                 mime = HC.APPLICATION_JSON
@@ -310,6 +402,12 @@ class HydrusResourceCommand( Resource ):
                 
                 content_disposition = 'inline'
                 
+            elif mime == HC.APPLICATION_HYDRUS_UPDATE_CONTENT:
+                
+                content_type = HC.mime_string_lookup[ mime ]
+                
+                content_disposition = 'inline'
+                
             else:
                 
                 mime = HydrusFileHandling.GetMime( path )
@@ -321,23 +419,97 @@ class HydrusResourceCommand( Resource ):
                 content_disposition = 'inline; filename="' + filename + '"'
                 
             
-            content_length = size
-            
             # can't be unicode!
             request.setHeader( 'Content-Type', str( content_type ) )
-            request.setHeader( 'Content-Length', str( content_length ) )
             request.setHeader( 'Content-Disposition', str( content_disposition ) )
             
             request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
             request.setHeader( 'Cache-Control', str( 86400 * 365  ) )
             
-            fileObject = open( path, 'rb' )
+            last_modified = time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( os.path.getmtime( path ) ) )
             
-            producer = NoRangeStaticProducer( request, fileObject )
+            request.setHeader( 'Accept-Ranges', 'bytes' )
+            request.setHeader( 'Last-Modified', last_modified )
             
-            producer.start()
+            etag = response_context.GetETag()
+            
+            if etag is not None:
+                
+                etag = '"' + str( etag ) + '"'
+                
+                request.setHeader( 'ETag', etag )
+                
             
-            do_finish = False
+            if self._clientHasCurrentCopy( request, etag, path ):
+                
+                request.setResponseCode( 304 )
+                
+                content_length = 0
+                
+            else:
+                
+                byte_range = None
+                
+                range_header = request.getHeader( 'Range' )
+                
+                if range_header is not None:
+                    
+                    if_range = request.getHeader( 'If-Range' )
+                    
+                    # if the client's copy is out of date, it has to start again
+                    
+                    if if_range is None or if_range in ( etag, last_modified ):
+                        
+                        byte_range = ParseRangeHeader( range_header, size )
+                        
+                    
+                
+                if byte_range is None:
+                    
+                    content_length = size
+                    
+                    request.setHeader( 'Content-Length', str( content_length ) )
+                    
+                    fileObject = open( path, 'rb' )
+                    
+                    producer = NoRangeStaticProducer( request, fileObject )
+                    
+                    producer.start()
+                    
+                    do_finish = False
+                    
+                else:
+                    
+                    ( start, end ) = byte_range
+                    
+                    if start >= size:
+                        
+                        request.setResponseCode( 416 )
+                        
+                        content_length = 0
+                        
+                        request.setHeader( 'Content-Range', 'bytes */' + str( size ) )
+                        request.setHeader( 'Content-Length', str( content_length ) )
+                        
+                    else:
+                        
+                        request.setResponseCode( 206 )
+                        
+                        content_length = end - start + 1
+                        
+                        request.setHeader( 'Content-Range', 'bytes ' + str( start ) + '-' + str( end ) + '/' + str( size ) )
+                        request.setHeader( 'Content-Length', str( content_length ) )
+                        
+                        fileObject = open( path, 'rb' )
+                        
+                        producer = SingleRangeStaticProducer( request, fileObject, start, content_length )
+                        
+                        producer.start()
+                        
+                        do_finish = False
+                        
+                    
+                
             
         else:
             
@@ -388,6 +560,53 @@ class HydrusResourceCommand( Resource ):
         return d
         
     
+    def _clientAcceptsBinaryContentUpdates( self, request ):
+        
+        if not request.requestHeaders.hasHeader( 'Accept' ):
+            
+            return False
+            
+        
+        accept = ', '.join( request.requestHeaders.getRawHeaders( 'Accept' ) )
+        
+        return HC.mime_string_lookup[ HC.APPLICATION_HYDRUS_UPDATE_CONTENT ] in accept
+        
+    
+    def _clientHasCurrentCopy( self, request, etag, path ):
+        
+        if_none_match = request.getHeader( 'If-None-Match' )
+        
+        if if_none_match is not None:
+            
+            if etag is None:
+                
+                return False
+                
+            
+            client_etags = [ client_etag.strip() for client_etag in if_none_match.split( ',' ) ]
+            
+            return '*' in client_etags or etag in client_etags or 'W/' + etag in client_etags
+            
+        
+        if_modified_since = request.getHeader( 'If-Modified-Since' )
+        
+        if if_modified_since is not None:
+            
+            try:
+                
+                client_timestamp = http.stringToDatetime( if_modified_since )
+                
+            except ValueError:
+                
+                return False
+                
+            
+            return int( os.path.getmtime( path ) ) <= client_timestamp
+            
+        
+        return False
+        
+    
     def _checkUserAgent( self, request ):
         
         request.is_hydrus_user_agent = False
@@ -577,7 +796,7 @@ class HydrusResourceCommand( Resource ):
     
 class ResponseContext( object ):
     
-    def __init__( self, status_code, mime = HC.APPLICATION_YAML, body = None, path = None, is_json = False, cookies = None ):
+    def __init__( self, status_code, mime = HC.APPLICATION_YAML, body = None, path = None, is_json = False, cookies = None, etag = None ):
         
         if cookies is None: cookies = []
         
@@ -587,10 +806,13 @@ class ResponseContext( object ):
         self._path = path
         self._is_json = is_json
         self._cookies = cookies
+        self._etag = etag
         
     
     def GetCookies( self ): return self._cookies
     
+    def GetETag( self ): return self._etag
+    
     def GetLength( self ): return len( self._body )
     
     def GetMimeBody( self ): return ( self._mime, self._body )
@@ -604,4 +826,42 @@ class ResponseContext( object ):
     def HasPath( self ): return self._path is not None
     
     def IsJSON( self ): return self._is_json
+    
+class ServerBusyStats( object ):
+    
+    def __init__( self ):
+        
+        self._lock = threading.Lock()
+        
+        self._reasons_to_stats = collections.defaultdict( lambda: { 'num_busy_periods' : 0, 'time_busy' : 0.0, 'num_requests_refused' : 0 } )
+        
+    
+    def GetStats( self ):
+        
+        with self._lock:
+            
+            return { reason : dict( stats ) for ( reason, stats ) in self._reasons_to_stats.items() }
+            
+        
+    
+    def ReportBusyPeriod( self, reason, time_busy ):
+        
+        with self._lock:
+            
+            stats = self._reasons_to_stats[ reason ]
+            
+            stats[ 'num_busy_periods' ] += 1
+            stats[ 'time_busy' ] += time_busy
+            
+        
+    
+    def ReportRequestRefused( self, reason ):
+        
+        with self._lock:
+            
+            self._reasons_to_stats[ reason ][ 'num_requests_refused' ] += 1
+            
+        
+    
+SERVER_BUSY_STATS = ServerBusyStats()
     
\ No newline at end of file
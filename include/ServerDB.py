@@ -98,6 +98,218 @@ class MessageDB( object ):
         return public_key
         
     '''
+MAX_PENDING_UPDATE_CONTENT_ROWS = 2000000
+
+class PendingUpdateContent( object ):
+    
+    # this holds the content a repository has accepted since its last update, so generating the next update does not have to search the big content tables
+    # each piece of content only remembers its latest action, so an add then delete in the same period just sends the delete, as the db would have
+    
+    def __init__( self, begin ):
+        
+        self._begin = begin
+        
+        self._files = {}
+        self._mappings = collections.defaultdict( dict )
+        self._tag_siblings = {}
+        self._tag_parents = {}
+        
+        self._num_rows = 0
+        
+        self._full = False
+        
+    
+    def _SetRows( self, rows_dict, keys, value ):
+        
+        if self._full:
+            
+            return
+            
+        
+        for key in keys:
+            
+            if key not in rows_dict:
+                
+                self._num_rows += 1
+                
+            
+            rows_dict[ key ] = value
+            
+        
+        if self._num_rows > MAX_PENDING_UPDATE_CONTENT_ROWS:
+            
+            # too big to hold in memory, so give up until the next update is made
+            
+            self._files = {}
+            self._mappings = collections.defaultdict( dict )
+            self._tag_siblings = {}
+            self._tag_parents = {}
+            
+            self._num_rows = 0
+            
+            self._full = True
+            
+        
+    
+    def AddFile( self, file_info, timestamp ):
+        
+        hash_id = file_info[0]
+        
+        self._SetRows( self._files, ( hash_id, ), ( HC.CONTENT_UPDATE_ADD, timestamp, file_info ) )
+        
+    
+    def AddMappings( self, tag_id, hash_ids, timestamp ):
+        
+        if self._full:
+            
+            return
+            
+        
+        self._SetRows( self._mappings[ tag_id ], hash_ids, ( HC.CONTENT_UPDATE_ADD, timestamp ) )
+        
+    
+    def ClearContentData( self, end ):
+        
+        # drops everything that has gone into an update that ended at end
+        
+        self._begin = max( self._begin, end + 1 )
+        
+        for rows_dict in [ self._files, self._tag_siblings, self._tag_parents ] + self._mappings.values():
+            
+            for ( key, value ) in rows_dict.items():
+                
+                timestamp = value[1]
+                
+                if timestamp <= end:
+                    
+                    del rows_dict[ key ]
+                    
+                    self._num_rows -= 1
+                    
+                
+            
+        
+        for ( tag_id, hash_ids_to_values ) in self._mappings.items():
+            
+            if len( hash_ids_to_values ) == 0:
+                
+                del self._mappings[ tag_id ]
+                
+            
+        
+    
+    def DeleteFiles( self, hash_ids, timestamp ):
+        
+        self._SetRows( self._files, hash_ids, ( HC.CONTENT_UPDATE_DELETE, timestamp, None ) )
+        
+    
+    def DeleteMappings( self, tag_id, hash_ids, timestamp ):
+        
+        if self._full:
+            
+            return
+            
+        
+        self._SetRows( self._mappings[ tag_id ], hash_ids, ( HC.CONTENT_UPDATE_DELETE, timestamp ) )
+        
+    
+    def CanGenerate( self, begin ):
+        
+        return not self._full and begin >= self._begin
+        
+    
+    def GetFileRows( self, action, begin, end ):
+        
+        if action == HC.CONTENT_UPDATE_ADD:
+            
+            return [ file_info for ( hash_id, ( file_action, timestamp, file_info ) ) in self._files.items() if file_action == action and begin <= timestamp <= end ]
+            
+        else:
+            
+            return [ hash_id for ( hash_id, ( file_action, timestamp, file_info ) ) in self._files.items() if file_action == action and begin <= timestamp <= end ]
+            
+        
+    
+    def GetMappingRows( self, action, begin, end ):
+        
+        rows = []
+        
+        for ( tag_id, hash_ids_to_values ) in self._mappings.items():
+            
+            hash_ids = [ hash_id for ( hash_id, ( mapping_action, timestamp ) ) in hash_ids_to_values.items() if mapping_action == action and begin <= timestamp <= end ]
+            
+            if len( hash_ids ) > 0:
+                
+                rows.append( ( tag_id, hash_ids ) )
+                
+            
+        
+        return rows
+        
+    
+    def GetNumRows( self ):
+        
+        return self._num_rows
+        
+    
+    def GetTagParentRows( self, action, begin, end ):
+        
+        return [ pair for ( pair, ( pair_action, timestamp ) ) in self._tag_parents.items() if pair_action == action and begin <= timestamp <= end ]
+        
+    
+    def GetTagSiblingRows( self, action, begin, end ):
+        
+        return [ pair for ( pair, ( pair_action, timestamp ) ) in self._tag_siblings.items() if pair_action == action and begin <= timestamp <= end ]
+        
+    
+    def IsFull( self ):
+        
+        return self._full
+        
+    
+    def RescindFiles( self, hash_ids ):
+        
+        for hash_id in hash_ids:
+            
+            if hash_id in self._files:
+                
+                del self._files[ hash_id ]
+                
+                self._num_rows -= 1
+                
+            
+        
+    
+    def RescindMappings( self, tag_id, hash_ids ):
+        
+        if tag_id not in self._mappings:
+            
+            return
+            
+        
+        hash_ids_to_values = self._mappings[ tag_id ]
+        
+        for hash_id in hash_ids:
+            
+            if hash_id in hash_ids_to_values:
+                
+                del hash_ids_to_values[ hash_id ]
+                
+                self._num_rows -= 1
+                
+            
+        
+    
+    def SetTagParent( self, old_tag_id, new_tag_id, action, timestamp ):
+        
+        self._SetRows( self._tag_parents, ( ( old_tag_id, new_tag_id ), ), ( action, timestamp ) )
+        
+    
+    def SetTagSibling( self, old_tag_id, new_tag_id, action, timestamp ):
+        
+        self._SetRows( self._tag_siblings, ( ( old_tag_id, new_tag_id ), ), ( action, timestamp ) )
+        
+    
 class DB( HydrusDB.HydrusDB ):
     
     READ_WRITE_ACTIONS = [ 'access_key', 'immediate_content_update', 'init', 'registration_keys' ]
@@ -173,6 +385,11 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'INSERT OR IGNORE INTO file_map ( service_id, hash_id, account_id, timestamp ) VALUES ( ?, ?, ?, ? );', ( service_id, hash_id, account_id, now ) )
             
+            if self._c.rowcount > 0 and service_id in self._service_ids_to_pending_update_content:
+                
+                self._service_ids_to_pending_update_content[ service_id ].AddFile( ( hash_id, size, mime, now, width, height, duration, num_frames, num_words ), now )
+                
+            
             if options[ 'log_uploader_ips' ]:
                 
                 ip = file_dict[ 'ip' ]
@@ -220,10 +437,21 @@ class DB( HydrusDB.HydrusDB ):
             hash_ids = set( hash_ids ).difference( already_deleted )
             
         
+        # only new rows get the new timestamp, so only they go in the next update
+        
+        already_current = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM mappings WHERE service_id = ? AND tag_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';', ( service_id, tag_id ) ) ]
+        
+        hash_ids = set( hash_ids ).difference( already_current )
+        
         now = HydrusData.GetNow()
         
         self._c.executemany( 'INSERT OR IGNORE INTO mappings ( service_id, tag_id, hash_id, account_id, timestamp ) VALUES ( ?, ?, ?, ?, ? );', [ ( service_id, tag_id, hash_id, account_id, now ) for hash_id in hash_ids ] )
         
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            self._service_ids_to_pending_update_content[ service_id ].AddMappings( tag_id, hash_ids, now )
+            
+        
     
     def _AddMappingPetition( self, service_id, account_id, tag_id, hash_ids, reason_id ):
         
@@ -369,6 +597,13 @@ class DB( HydrusDB.HydrusDB ):
         
         ( biggest_end, ) = self._c.execute( 'SELECT end FROM update_cache WHERE service_id = ? ORDER BY end DESC LIMIT 1;', ( service_id, ) ).fetchone()
         
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            rescinded_hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_map WHERE service_id = ? AND account_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ' AND timestamp > ?;', ( service_id, account_id, biggest_end ) ) ]
+            
+            self._service_ids_to_pending_update_content[ service_id ].RescindFiles( rescinded_hash_ids )
+            
+        
         self._c.execute( 'DELETE FROM file_map WHERE service_id = ? AND account_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ' AND timestamp > ?;', ( service_id, account_id, biggest_end ) )
         
     
@@ -387,6 +622,13 @@ class DB( HydrusDB.HydrusDB ):
         
         ( biggest_end, ) = self._c.execute( 'SELECT end FROM update_cache WHERE service_id = ? ORDER BY end DESC LIMIT 1;', ( service_id, ) ).fetchone()
         
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            rescinded_hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM mappings WHERE service_id = ? AND account_id = ? AND tag_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ' AND timestamp > ?;', ( service_id, account_id, tag_id, biggest_end ) ) ]
+            
+            self._service_ids_to_pending_update_content[ service_id ].RescindMappings( tag_id, rescinded_hash_ids )
+            
+        
         self._c.execute( 'DELETE FROM mappings WHERE service_id = ? AND account_id = ? AND tag_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ' AND timestamp > ?;', ( service_id, account_id, tag_id, biggest_end ) )
         
     
@@ -416,6 +658,14 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'INSERT OR IGNORE INTO tag_parents ( service_id, account_id, old_tag_id, new_tag_id, reason_id, status, timestamp ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( service_id, account_id, old_tag_id, new_tag_id, reason_id, new_status, now ) )
         
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            if new_status == HC.CURRENT: action = HC.CONTENT_UPDATE_ADD
+            elif new_status == HC.DELETED: action = HC.CONTENT_UPDATE_DELETE
+            
+            self._service_ids_to_pending_update_content[ service_id ].SetTagParent( old_tag_id, new_tag_id, action, now )
+            
+        
         if new_status == HC.CURRENT:
             
             child_hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM mappings WHERE service_id = ? AND tag_id = ?;', ( service_id, old_tag_id ) ) ]
@@ -450,6 +700,14 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'INSERT OR IGNORE INTO tag_siblings ( service_id, account_id, old_tag_id, new_tag_id, reason_id, status, timestamp ) VALUES ( ?, ?, ?, ?, ?, ?, ? );', ( service_id, account_id, old_tag_id, new_tag_id, reason_id, new_status, now ) )
         
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            if new_status == HC.CURRENT: action = HC.CONTENT_UPDATE_ADD
+            elif new_status == HC.DELETED: action = HC.CONTENT_UPDATE_DELETE
+            
+            self._service_ids_to_pending_update_content[ service_id ].SetTagSibling( old_tag_id, new_tag_id, action, now )
+            
+        
     
     def _Backup( self ):
         
@@ -611,6 +869,19 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'DELETE FROM bans WHERE expires < ?;', ( now, ) )
         
     
+    def _ConvertPendingMappingRows( self, action, block_of_rows ):
+        
+        tag_ids_to_tags = self._GetTagIdsToTags( [ tag_id for ( tag_id, hash_ids ) in block_of_rows ] )
+        
+        hash_ids_to_hashes = self._GetHashIdsToHashes( set( itertools.chain.from_iterable( ( hash_ids for ( tag_id, hash_ids ) in block_of_rows ) ) ) )
+        
+        rows = [ ( tag_ids_to_tags[ tag_id ], hash_ids ) for ( tag_id, hash_ids ) in block_of_rows ]
+        
+        weight = sum( ( len( hash_ids ) for ( tag_id, hash_ids ) in block_of_rows ) )
+        
+        return ( HC.CONTENT_TYPE_MAPPINGS, action, rows, hash_ids_to_hashes, weight )
+        
+    
     def _CreateDB( self ):
         
         dirs = ( HC.SERVER_FILES_DIR, HC.SERVER_UPDATES_DIR )
@@ -780,10 +1051,19 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'DELETE FROM file_map WHERE service_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( service_id, ) )
         self._c.execute( 'DELETE FROM file_petitions WHERE service_id = ? AND hash_id IN ' + splayed_hash_ids + ' AND status = ?;', ( service_id, HC.PETITIONED ) )
         
+        already_deleted = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM file_petitions WHERE service_id = ? AND account_id = ? AND hash_id IN ' + splayed_hash_ids + ' AND status = ?;', ( service_id, account_id, HC.DELETED ) ) ]
+        
+        hash_ids = set( hash_ids ).difference( already_deleted )
+        
         now = HydrusData.GetNow()
         
         self._c.executemany( 'INSERT OR IGNORE INTO file_petitions ( service_id, account_id, hash_id, reason_id, timestamp, status ) VALUES ( ?, ?, ?, ?, ?, ? );', ( ( service_id, account_id, hash_id, reason_id, now, HC.DELETED ) for hash_id in hash_ids ) )
         
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            self._service_ids_to_pending_update_content[ service_id ].DeleteFiles( hash_ids, now )
+            
+        
     
     def _DeleteMappings( self, service_id, account_id, tag_id, hash_ids, reason_id ):
         
@@ -792,7 +1072,18 @@ class DB( HydrusDB.HydrusDB ):
         self._c.execute( 'DELETE FROM mappings WHERE service_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( service_id, tag_id ) )
         self._c.execute( 'DELETE FROM petitioned_mappings WHERE service_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( service_id, tag_id ) )
         
-        self._c.executemany( 'INSERT OR IGNORE INTO deleted_mappings ( service_id, tag_id, hash_id, account_id, reason_id, timestamp ) VALUES ( ?, ?, ?, ?, ?, ? );', ( ( service_id, tag_id, hash_id, account_id, reason_id, HydrusData.GetNow() ) for hash_id in hash_ids ) )
+        already_deleted = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM deleted_mappings WHERE service_id = ? AND tag_id = ? AND hash_id IN ' + splayed_hash_ids + ';', ( service_id, tag_id ) ) ]
+        
+        hash_ids = set( hash_ids ).difference( already_deleted )
+        
+        now = HydrusData.GetNow()
+        
+        self._c.executemany( 'INSERT OR IGNORE INTO deleted_mappings ( service_id, tag_id, hash_id, account_id, reason_id, timestamp ) VALUES ( ?, ?, ?, ?, ?, ? );', ( ( service_id, tag_id, hash_id, account_id, reason_id, now ) for hash_id in hash_ids ) )
+        
+        if service_id in self._service_ids_to_pending_update_content:
+            
+            self._service_ids_to_pending_update_content[ service_id ].DeleteMappings( tag_id, hash_ids, now )
+            
         
     
     def _DeleteOrphans( self ):
@@ -897,36 +1188,24 @@ class DB( HydrusDB.HydrusDB ):
         
         service_id = self._GetServiceId( service_key )
         
-        service_type = self._GetServiceType( service_id )
+        content_update_package = HydrusData.ServerToClientContentUpdatePackage()
         
-        if service_type == HC.FILE_REPOSITORY:
-            
-            iterator = self._IterateFileUpdateContentData
+        pending = self._GetPendingUpdateContent( service_id )
+        
+        if not pending.CanGenerate( begin ):
             
-        elif service_type == HC.TAG_REPOSITORY:
+            smaller_time_step = max( 10, ( end - begin ) / 100 )
             
-            iterator = self._IterateTagUpdateContentData
+            iterator = self._IterateUpdateContentData( service_id, begin, end, smaller_time_step )
             
-        
-        subindex = 0
-        weight = 0
-        
-        content_update_package = HydrusData.ServerToClientContentUpdatePackage()
-        
-        smaller_time_step = max( 10, ( end - begin ) / 100 )
-        
-        sub_begin = begin
-        
-        while sub_begin <= end:
+        else:
             
-            sub_end = min( ( sub_begin + smaller_time_step ) - 1, end )
+            iterator = self._IteratePendingUpdateContentData( service_id, pending, begin, end )
             
-            for ( data_type, action, rows, hash_ids_to_hashes, rows_weight ) in iterator( service_id, sub_begin, sub_end ):
-                
-                content_update_package.AddContentData( data_type, action, rows, hash_ids_to_hashes )
-                
+        
+        for ( data_type, action, rows, hash_ids_to_hashes, rows_weight ) in iterator:
             
-            sub_begin += smaller_time_step
+            content_update_package.AddContentData( data_type, action, rows, hash_ids_to_hashes )
             
         
         return content_update_package
@@ -936,62 +1215,64 @@ class DB( HydrusDB.HydrusDB ):
         
         service_id = self._GetServiceId( service_key )
         
-        service_type = self._GetServiceType( service_id )
-        
-        if service_type == HC.FILE_REPOSITORY:
-            
-            iterator = self._IterateFileUpdateContentData
-            
-        elif service_type == HC.TAG_REPOSITORY:
-            
-            iterator = self._IterateTagUpdateContentData
-            
-        
         subindex = 0
         weight = 0
         
         content_update_package = HydrusData.ServerToClientContentUpdatePackage()
         
-        smaller_time_step = ( end - begin ) / 100
+        pending = self._GetPendingUpdateContent( service_id )
         
-        sub_begin = begin
+        if not pending.CanGenerate( begin ):
+            
+            smaller_time_step = max( 1, ( end - begin ) / 100 )
+            
+            iterator = self._IterateUpdateContentData( service_id, begin, end, smaller_time_step )
+            
+        else:
+            
+            iterator = self._IteratePendingUpdateContentData( service_id, pending, begin, end )
+            
         
-        while sub_begin <= end:
+        for ( data_type, action, rows, hash_ids_to_hashes, rows_weight ) in iterator:
             
-            sub_end = min( ( sub_begin + smaller_time_step ) - 1, end )
+            content_update_package.AddContentData( data_type, action, rows, hash_ids_to_hashes )
             
-            for ( data_type, action, rows, hash_ids_to_hashes, rows_weight ) in iterator( service_id, sub_begin, sub_end ):
+            weight += rows_weight
+            
+            if weight >= 100000:
                 
-                content_update_package.AddContentData( data_type, action, rows, hash_ids_to_hashes )
+                path = ServerFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex )
                 
-                weight += rows_weight
+                network_string = content_update_package.DumpToBinaryNetworkString()
                 
-                if weight >= 100000:
-                    
-                    path = ServerFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex )
-                    
-                    network_string = content_update_package.DumpToNetworkString()
-                    
-                    with open( path, 'wb' ) as f:
-                        
-                        f.write( network_string )
-                        
-                    
-                    subindex += 1
-                    weight = 0
+                with open( path, 'wb' ) as f:
                     
-                    content_update_package = HydrusData.ServerToClientContentUpdatePackage()
+                    f.write( network_string )
                     
                 
+                subindex += 1
+                weight = 0
+                
+                content_update_package = HydrusData.ServerToClientContentUpdatePackage()
+                
+            
+        
+        if pending.IsFull():
+            
+            # it will be refilled from the db when next needed, which should be a smaller job now this period is done
+            
+            del self._service_ids_to_pending_update_content[ service_id ]
+            
+        else:
             
-            sub_begin += smaller_time_step
+            pending.ClearContentData( end )
             
         
         if weight > 0:
             
             path = ServerFiles.GetExpectedContentUpdatePackagePath( service_key, begin, subindex )
             
-            network_string = content_update_package.DumpToNetworkString()
+            network_string = content_update_package.DumpToBinaryNetworkString()
             
             with open( path, 'wb' ) as f:
                 
@@ -1424,6 +1705,13 @@ class DB( HydrusDB.HydrusDB ):
         return num_petitions
         
     
+    def _GetNumReadConnections( self ):
+        
+        # update generation holds the writer for a long time, so reads get their own snapshots of the db rather than queueing behind it
+        
+        return 2
+        
+    
     def _GetOptions( self, service_key ):
         
         service_id = self._GetServiceId( service_key )
@@ -1433,6 +1721,67 @@ class DB( HydrusDB.HydrusDB ):
         return options
         
     
+    def _GetPendingUpdateContent( self, service_id ):
+        
+        if service_id not in self._service_ids_to_pending_update_content:
+            
+            result = self._c.execute( 'SELECT end FROM update_cache WHERE service_id = ? ORDER BY end DESC LIMIT 1;', ( service_id, ) ).fetchone()
+            
+            if result is None: begin = 0
+            else:
+                
+                ( biggest_end, ) = result
+                
+                begin = biggest_end + 1
+                
+            
+            pending = PendingUpdateContent( begin )
+            
+            service_type = self._GetServiceType( service_id )
+            
+            if service_type == HC.FILE_REPOSITORY:
+                
+                for ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words FROM file_map, files_info USING ( hash_id ) WHERE service_id = ? AND timestamp >= ? ORDER BY timestamp ASC;', ( service_id, begin ) ):
+                    
+                    pending.AddFile( ( hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ), timestamp )
+                    
+                
+                for ( timestamp, hash_ids ) in HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT timestamp, hash_id FROM file_petitions WHERE service_id = ? AND timestamp >= ? AND status = ?;', ( service_id, begin, HC.DELETED ) ) ).items():
+                    
+                    pending.DeleteFiles( hash_ids, timestamp )
+                    
+                
+            elif service_type == HC.TAG_REPOSITORY:
+                
+                for ( ( tag_id, timestamp ), hash_ids ) in HydrusData.BuildKeyToListDict( ( ( ( tag_id, timestamp ), hash_id ) for ( tag_id, hash_id, timestamp ) in self._c.execute( 'SELECT tag_id, hash_id, timestamp FROM mappings WHERE service_id = ? AND timestamp >= ?;', ( service_id, begin ) ) ) ).items():
+                    
+                    pending.AddMappings( tag_id, hash_ids, timestamp )
+                    
+                
+                for ( ( tag_id, timestamp ), hash_ids ) in HydrusData.BuildKeyToListDict( ( ( ( tag_id, timestamp ), hash_id ) for ( tag_id, hash_id, timestamp ) in self._c.execute( 'SELECT tag_id, hash_id, timestamp FROM deleted_mappings WHERE service_id = ? AND timestamp >= ?;', ( service_id, begin ) ) ) ).items():
+                    
+                    pending.DeleteMappings( tag_id, hash_ids, timestamp )
+                    
+                
+                statuses_to_actions = { HC.CURRENT : HC.CONTENT_UPDATE_ADD, HC.DELETED : HC.CONTENT_UPDATE_DELETE }
+                
+                for ( old_tag_id, new_tag_id, status, timestamp ) in self._c.execute( 'SELECT old_tag_id, new_tag_id, status, timestamp FROM tag_siblings WHERE service_id = ? AND timestamp >= ? AND status IN ( ?, ? ) ORDER BY timestamp ASC;', ( service_id, begin, HC.CURRENT, HC.DELETED ) ):
+                    
+                    pending.SetTagSibling( old_tag_id, new_tag_id, statuses_to_actions[ status ], timestamp )
+                    
+                
+                for ( old_tag_id, new_tag_id, status, timestamp ) in self._c.execute( 'SELECT old_tag_id, new_tag_id, status, timestamp FROM tag_parents WHERE service_id = ? AND timestamp >= ? AND status IN ( ?, ? ) ORDER BY timestamp ASC;', ( service_id, begin, HC.CURRENT, HC.DELETED ) ):
+                    
+                    pending.SetTagParent( old_tag_id, new_tag_id, statuses_to_actions[ status ], timestamp )
+                    
+                
+            
+            self._service_ids_to_pending_update_content[ service_id ] = pending
+            
+        
+        return self._service_ids_to_pending_update_content[ service_id ]
+        
+    
     def _GetPetition( self, service_key ):
         
         service_id = self._GetServiceId( service_key )
@@ -1598,6 +1947,8 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _GetTagIdsToTags( self, tag_ids ): return { tag_id : tag for ( tag_id, tag ) in self._c.execute( 'SELECT tag_id, tag FROM tags WHERE tag_id IN ' + HydrusData.SplayListForDB( tag_ids ) + ';' ) }
+    
     def _GetTagPetition( self, service_id ):
         
         content_types = [ HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_TYPE_TAG_PARENTS ]
@@ -1717,6 +2068,8 @@ class DB( HydrusDB.HydrusDB ):
         self._over_monthly_data = False
         self._services_over_monthly_data = set()
         
+        self._service_ids_to_pending_update_content = {}
+        
     
     def _InitExternalDatabases( self ):
         
@@ -1724,6 +2077,76 @@ class DB( HydrusDB.HydrusDB ):
         self._db_filenames[ 'external_master' ] = 'server.master.db'
         
     
+    def _IteratePendingUpdateContentData( self, service_id, pending, begin, end ):
+        
+        service_type = self._GetServiceType( service_id )
+        
+        if service_type == HC.FILE_REPOSITORY:
+            
+            for action in ( HC.CONTENT_UPDATE_ADD, HC.CONTENT_UPDATE_DELETE ):
+                
+                rows = pending.GetFileRows( action, begin, end )
+                
+                for block_of_rows in HydrusData.SplitListIntoChunks( rows, 10000 ):
+                    
+                    if action == HC.CONTENT_UPDATE_ADD: hash_ids = [ file_info[0] for file_info in block_of_rows ]
+                    else: hash_ids = block_of_rows
+                    
+                    hash_ids_to_hashes = self._GetHashIdsToHashes( hash_ids )
+                    
+                    yield ( HC.CONTENT_TYPE_FILES, action, block_of_rows, hash_ids_to_hashes, len( hash_ids ) )
+                    
+                
+            
+        elif service_type == HC.TAG_REPOSITORY:
+            
+            for action in ( HC.CONTENT_UPDATE_ADD, HC.CONTENT_UPDATE_DELETE ):
+                
+                # many small tags are batched together, so a busy period does not produce thousands of tiny sections
+                
+                block_of_rows = []
+                block_weight = 0
+                
+                for ( tag_id, hash_ids ) in pending.GetMappingRows( action, begin, end ):
+                    
+                    for block_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 10000 ):
+                        
+                        block_of_rows.append( ( tag_id, block_of_hash_ids ) )
+                        block_weight += len( block_of_hash_ids )
+                        
+                        if block_weight >= 10000:
+                            
+                            yield self._ConvertPendingMappingRows( action, block_of_rows )
+                            
+                            block_of_rows = []
+                            block_weight = 0
+                            
+                        
+                    
+                
+                if len( block_of_rows ) > 0:
+                    
+                    yield self._ConvertPendingMappingRows( action, block_of_rows )
+                    
+                
+            
+            for ( data_type, pair_rows ) in ( ( HC.CONTENT_TYPE_TAG_SIBLINGS, pending.GetTagSiblingRows ), ( HC.CONTENT_TYPE_TAG_PARENTS, pending.GetTagParentRows ) ):
+                
+                for action in ( HC.CONTENT_UPDATE_ADD, HC.CONTENT_UPDATE_DELETE ):
+                    
+                    for block_of_pair_ids in HydrusData.SplitListIntoChunks( pair_rows( action, begin, end ), 10000 ):
+                        
+                        tag_ids_to_tags = self._GetTagIdsToTags( set( itertools.chain.from_iterable( block_of_pair_ids ) ) )
+                        
+                        pairs = [ ( tag_ids_to_tags[ old_tag_id ], tag_ids_to_tags[ new_tag_id ] ) for ( old_tag_id, new_tag_id ) in block_of_pair_ids ]
+                        
+                        yield ( data_type, action, pairs, {}, len( pairs ) )
+                        
+                    
+                
+            
+        
+    
     def _IterateFileUpdateContentData( self, service_id, begin, end ):
         
         #
@@ -1753,6 +2176,34 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _IterateUpdateContentData( self, service_id, begin, end, time_step ):
+        
+        service_type = self._GetServiceType( service_id )
+        
+        if service_type == HC.FILE_REPOSITORY:
+            
+            iterator = self._IterateFileUpdateContentData
+            
+        elif service_type == HC.TAG_REPOSITORY:
+            
+            iterator = self._IterateTagUpdateContentData
+            
+        
+        sub_begin = begin
+        
+        while sub_begin <= end:
+            
+            sub_end = min( ( sub_begin + time_step ) - 1, end )
+            
+            for result in iterator( service_id, sub_begin, sub_end ):
+                
+                yield result
+                
+            
+            sub_begin += time_step
+            
+        
+    
     def _IterateTagUpdateContentData( self, service_id, begin, end ):
         
         # mappings
@@ -1838,6 +2289,14 @@ class DB( HydrusDB.HydrusDB ):
     
     def _ManageDBError( self, job, e ):
         
+        # the transaction was rolled back, so the pending update content may hold rows that never made it to the db
+        # a failed read on a read connection has nothing to roll back, and the pending content belongs to the writer
+        
+        if not self._IsReadConnection():
+            
+            self._service_ids_to_pending_update_content = {}
+            
+        
         ( exception_type, value, tb ) = sys.exc_info()
         
         new_e = type( e )( os.linesep.join( traceback.format_exception( exception_type, value, tb ) ) )
@@ -2001,6 +2460,12 @@ class DB( HydrusDB.HydrusDB ):
                 
                 self._c.execute( 'DELETE FROM services WHERE service_id = ?;', ( service_id, ) )
                 self._c.execute( 'DELETE FROM mappings WHERE service_id = ?;', ( service_id, ) )
+                
+                if service_id in self._service_ids_to_pending_update_content:
+                    
+                    del self._service_ids_to_pending_update_content[ service_id ]
+                    
+                
                 self._c.execute( 'DELETE FROM petitioned_mappings WHERE service_id = ?;', ( service_id, ) )
                 self._c.execute( 'DELETE FROM deleted_mappings WHERE service_id = ?;', ( service_id, ) )
                 
@@ -7,6 +7,7 @@ import HydrusExceptions
 import HydrusGlobals
 import HydrusNATPunch
 import HydrusServer
+import HydrusServerResources
 import itertools
 import os
 import Queue
@@ -58,22 +59,36 @@ def DAEMONGenerateUpdates( controller ):
             next_begin = biggest_end + 1
             next_end = biggest_end + HC.UPDATE_DURATION
             
-            HydrusGlobals.server_busy = True
-            
-            while next_end < now:
+            if next_end < now:
                 
-                controller.WriteSynchronous( 'create_update', service_key, next_begin, next_end )
+                # read-only traffic carries on against its own db connections, so only writes are refused while we do this
                 
-                biggest_end = next_end
+                started = HydrusData.GetNowPrecise()
                 
-                now = HydrusData.GetNow()
+                HydrusGlobals.server_generating_updates = True
                 
-                next_begin = biggest_end + 1
-                next_end = biggest_end + HC.UPDATE_DURATION
+                try:
+                    
+                    while next_end < now:
+                        
+                        controller.WriteSynchronous( 'create_update', service_key, next_begin, next_end )
+                        
+                        biggest_end = next_end
+                        
+                        now = HydrusData.GetNow()
+                        
+                        next_begin = biggest_end + 1
+                        next_end = biggest_end + HC.UPDATE_DURATION
+                        
+                    
+                finally:
+                    
+                    HydrusGlobals.server_generating_updates = False
+                    
+                    HydrusServerResources.SERVER_BUSY_STATS.ReportBusyPeriod( 'generating updates', HydrusData.GetNowPrecise() - started )
+                    
                 
             
-            HydrusGlobals.server_busy = False
-            
             time.sleep( 1 )
             
         
@@ -44,6 +44,8 @@ class HydrusServiceAdmin( HydrusServiceRestricted ):
         
         root.putChild( 'busy', ServerServerResources.HydrusResourceBusyCheck() )
         root.putChild( 'backup', ServerServerResources.HydrusResourceCommandRestrictedBackup( self._service_key, self._service_type, HydrusServer.REMOTE_DOMAIN ) )
+        root.putChild( 'busy_stats', ServerServerResources.HydrusResourceCommandRestrictedBusyStats( self._service_key, self._service_type, HydrusServer.REMOTE_DOMAIN ) )
+        root.putChild( 'db_job_stats', ServerServerResources.HydrusResourceCommandRestrictedDBJobStats( self._service_key, self._service_type, HydrusServer.REMOTE_DOMAIN ) )
         root.putChild( 'init', ServerServerResources.HydrusResourceCommandInit( self._service_key, self._service_type, HydrusServer.REMOTE_DOMAIN ) )
         root.putChild( 'services', ServerServerResources.HydrusResourceCommandRestrictedServices( self._service_key, self._service_type, HydrusServer.REMOTE_DOMAIN ) )
         root.putChild( 'services_info', ServerServerResources.HydrusResourceCommandRestrictedServicesInfo( self._service_key, self._service_type, HydrusServer.REMOTE_DOMAIN ) )
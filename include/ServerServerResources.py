@@ -108,7 +108,7 @@ class HydrusResourceCommandRestricted( HydrusServerResources.HydrusResourceComma
     
     def _callbackCheckRestrictions( self, request ):
         
-        self._checkServerBusy()
+        self._checkServerBusy( request )
         
         self._checkUserAgent( request )
         
@@ -284,11 +284,20 @@ class HydrusResourceCommandRestrictedBackup( HydrusResourceCommandRestricted ):
         
         def do_it():
             
-            HydrusGlobals.server_busy = True
+            started = HydrusData.GetNowPrecise()
             
-            HydrusGlobals.server_controller.WriteSynchronous( 'backup' )
+            HydrusGlobals.server_busy = True
             
-            HydrusGlobals.server_busy = False
+            try:
+                
+                HydrusGlobals.server_controller.WriteSynchronous( 'backup' )
+                
+            finally:
+                
+                HydrusGlobals.server_busy = False
+                
+                HydrusServerResources.SERVER_BUSY_STATS.ReportBusyPeriod( 'server busy', HydrusData.GetNowPrecise() - started )
+                
             
         
         HydrusGlobals.server_controller.CallToThread( do_it )
@@ -298,6 +307,36 @@ class HydrusResourceCommandRestrictedBackup( HydrusResourceCommandRestricted ):
         return response_context
         
     
+class HydrusResourceCommandRestrictedBusyStats( HydrusResourceCommandRestricted ):
+    
+    GET_PERMISSION = HC.GENERAL_ADMIN
+    
+    def _threadDoGETJob( self, request ):
+        
+        busy_stats = HydrusServerResources.SERVER_BUSY_STATS.GetStats()
+        
+        body = yaml.safe_dump( { 'busy_stats' : busy_stats } )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, body = body )
+        
+        return response_context
+        
+    
+class HydrusResourceCommandRestrictedDBJobStats( HydrusResourceCommandRestricted ):
+    
+    GET_PERMISSION = HC.GENERAL_ADMIN
+    
+    def _threadDoGETJob( self, request ):
+        
+        db_job_stats = HydrusGlobals.server_controller.GetDB().GetJobStats()
+        
+        body = yaml.safe_dump( { 'db_job_stats' : db_job_stats } )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, body = body )
+        
+        return response_context
+        
+    
 class HydrusResourceCommandRestrictedIP( HydrusResourceCommandRestricted ):
     
     GET_PERMISSION = HC.GENERAL_ADMIN
@@ -394,7 +433,7 @@ class HydrusResourceCommandRestrictedRepositoryFile( HydrusResourceCommandRestri
         
         path = ServerFiles.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path )
+        response_context = HydrusServerResources.ResponseContext( 200, path = path, etag = hash.encode( 'hex' ) )
         
         return response_context
         
@@ -498,7 +537,29 @@ class HydrusResourceCommandRestrictedContentUpdate( HydrusResourceCommandRestric
         
         path = ServerFiles.GetContentUpdatePackagePath( self._service_key, begin, subindex )
         
-        response_context = HydrusServerResources.ResponseContext( 200, path = path, is_json = True )
+        with open( path, 'rb' ) as f:
+            
+            is_binary = f.read( len( HydrusData.CONTENT_UPDATE_PACKAGE_BINARY_MAGIC ) ) == HydrusData.CONTENT_UPDATE_PACKAGE_BINARY_MAGIC
+            
+        
+        if not is_binary:
+            
+            response_context = HydrusServerResources.ResponseContext( 200, path = path, is_json = True )
+            
+        elif self._clientAcceptsBinaryContentUpdates( request ):
+            
+            response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_HYDRUS_UPDATE_CONTENT, path = path )
+            
+        else:
+            
+            # an older client, so convert it back for them
+            
+            with open( path, 'rb' ) as f: network_string = f.read()
+            
+            content_update_package = HydrusData.CreateContentUpdatePackageFromNetworkString( network_string )
+            
+            response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_JSON, body = content_update_package.DumpToNetworkString() )
+            
         
         return response_context
         
@@ -526,9 +587,14 @@ class HydrusResourceCommandRestrictedImmediateContentUpdate( HydrusResourceComma
         
         content_update = HydrusGlobals.server_controller.Read( 'immediate_content_update', self._service_key )
         
-        network_string = content_update.DumpToNetworkString()
-        
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_JSON, body = network_string )
+        if self._clientAcceptsBinaryContentUpdates( request ):
+            
+            response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_HYDRUS_UPDATE_CONTENT, body = content_update.DumpToBinaryNetworkString() )
+            
+        else:
+            
+            response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_JSON, body = content_update.DumpToNetworkString() )
+            
         
         return response_context
         
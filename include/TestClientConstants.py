@@ -3,9 +3,13 @@ import ClientData
 import ClientGUIManagement
 import ClientGUIDialogsManage
 import ClientCaches
+import ClientFiles
 import collections
 import HydrusConstants as HC
+import HydrusExceptions
+import HydrusPaths
 import os
+import tempfile
 import TestConstants
 import unittest
 import HydrusData
@@ -52,6 +56,58 @@ class TestFunctions( unittest.TestCase ):
     
 class TestManagers( unittest.TestCase ):
     
+    def test_data_cache( self ):
+        
+        class FakeController( object ):
+            
+            def GetOptions( self ): return { 'test_cache_size' : 100 }
+            
+        
+        class FakeData( object ):
+            
+            def __init__( self, footprint ): self._footprint = footprint
+            
+            def GetEstimatedMemoryFootprint( self ): return self._footprint
+            
+        
+        data_cache = ClientCaches.DataCache( FakeController(), 'test_cache_size', max_item_fraction = 0.5 )
+        
+        data_cache.AddData( 'a', FakeData( 40 ) )
+        data_cache.AddData( 'b', FakeData( 40 ) )
+        
+        self.assertEqual( data_cache.GetIfHasData( 'a' ).GetEstimatedMemoryFootprint(), 40 )
+        
+        # b is now the least recently used, so it goes first
+        
+        data_cache.AddData( 'c', FakeData( 40 ) )
+        
+        self.assertTrue( data_cache.HasData( 'a' ) )
+        self.assertFalse( data_cache.HasData( 'b' ) )
+        self.assertTrue( data_cache.HasData( 'c' ) )
+        
+        self.assertEqual( data_cache.GetIfHasData( 'b' ), None )
+        
+        # too big for the fraction
+        
+        data_cache.AddData( 'd', FakeData( 60 ) )
+        
+        self.assertFalse( data_cache.HasData( 'd' ) )
+        
+        stats = data_cache.GetStats()
+        
+        self.assertEqual( stats[ 'num_items' ], 2 )
+        self.assertEqual( stats[ 'estimated_memory_footprint' ], 80 )
+        self.assertEqual( stats[ 'cache_size' ], 100 )
+        self.assertEqual( stats[ 'num_hits' ], 1 )
+        self.assertEqual( stats[ 'num_misses' ], 1 )
+        self.assertEqual( stats[ 'num_evictions' ], 1 )
+        self.assertEqual( stats[ 'num_rejections' ], 1 )
+        
+        data_cache.Clear()
+        
+        self.assertEqual( data_cache.GetStats()[ 'estimated_memory_footprint' ], 0 )
+        
+    
     def test_services( self ):
         
         def test_service( service, key, service_type, name, info ):
@@ -162,4 +218,67 @@ class TestManagers( unittest.TestCase ):
         
         self.assertEqual( ( u'undo local files->archive 2 files', None ), undo_manager.GetUndoRedoStrings() )
         
+    
+class TestThumbnailPack( unittest.TestCase ):
+    
+    def test_thumbnail_pack( self ):
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            hash_1 = HydrusData.GenerateKey()
+            hash_2 = HydrusData.GenerateKey()
+            hash_3 = HydrusData.GenerateKey()
+            
+            pack = ClientFiles.ThumbnailPack( test_dir )
+            
+            self.assertTrue( pack.IsEmpty() )
+            
+            pack.AddThumbnail( hash_1, 'thumbnail 1' )
+            pack.AddThumbnail( hash_2, 'thumbnail 2' )
+            
+            self.assertEqual( pack.GetThumbnail( hash_1 ), 'thumbnail 1' )
+            
+            # the pack grows after it has been mapped
+            
+            pack.AddThumbnail( hash_3, 'thumbnail 3' )
+            pack.AddThumbnail( hash_1, 'thumbnail 1 regenerated' )
+            
+            self.assertEqual( pack.GetThumbnail( hash_3 ), 'thumbnail 3' )
+            self.assertEqual( pack.GetThumbnail( hash_1 ), 'thumbnail 1 regenerated' )
+            
+            pack.DeleteThumbnail( hash_2 )
+            
+            self.assertFalse( pack.HasThumbnail( hash_2 ) )
+            self.assertRaises( HydrusExceptions.FileMissingException, pack.GetThumbnail, hash_2 )
+            
+            pack.Close()
+            
+            # a crash halfway through a write leaves a partial record
+            
+            with open( os.path.join( test_dir, ClientFiles.THUMBNAIL_PACK_FILENAME ), 'ab' ) as f:
+                
+                f.write( HydrusData.GenerateKey() + '\x00\x00' )
+                
+            
+            pack = ClientFiles.ThumbnailPack( test_dir )
+            
+            self.assertEqual( set( pack.GetHashes() ), { hash_1, hash_3 } )
+            self.assertEqual( pack.GetThumbnail( hash_1 ), 'thumbnail 1 regenerated' )
+            
+            pack.Compact()
+            
+            self.assertEqual( os.path.getsize( os.path.join( test_dir, ClientFiles.THUMBNAIL_PACK_FILENAME ) ), 2 * ClientFiles.THUMBNAIL_PACK_HEADER_LENGTH + len( 'thumbnail 1 regenerated' ) + len( 'thumbnail 3' ) )
+            
+            self.assertEqual( pack.GetThumbnail( hash_1 ), 'thumbnail 1 regenerated' )
+            self.assertEqual( pack.GetThumbnail( hash_3 ), 'thumbnail 3' )
+            
+            pack.Close()
+            
+        finally:
+            
+            HydrusPaths.DeletePath( test_dir )
+            
+        
     
\ No newline at end of file
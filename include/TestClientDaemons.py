@@ -1,4 +1,5 @@
 import ClientDaemons
+import ClientDefaults
 import ClientImporting
 import collections
 import HydrusConstants as HC
@@ -33,6 +34,7 @@ class TestDaemons( unittest.TestCase ):
             import_folder = ClientImporting.ImportFolder( 'imp', path = test_dir )
             
             HydrusGlobals.test_controller.SetRead( 'serialisable_named', [ import_folder ] )
+            HydrusGlobals.test_controller.SetRead( 'hash_status', ( CC.STATUS_REDUNDANT, None ) )
             
             ClientDaemons.DAEMONCheckImportFolders( HydrusGlobals.test_controller )
             
@@ -40,9 +42,9 @@ class TestDaemons( unittest.TestCase ):
             #(('C:\\code\\Hydrus\\temp\\e0dbdcb1a13c0565ffb73f2f497528adbe1703ca1dfc69680202487187b9fcfa',), {'service_keys_to_tags': {HC.LOCAL_TAG_SERVICE_KEY: set(['local tag'])}})
             #(('C:\\code\\Hydrus\\temp\\182c4eecf2a5b4dfc8b74813bcff5d967ed53d92a982d8ae18520e1504fa5902',), {'service_keys_to_tags': {HC.LOCAL_TAG_SERVICE_KEY: set(['local tag'])}})
             
-            import_file = HydrusGlobals.test_controller.GetWrite( 'import_file' )
+            [ ( ( file_import_jobs, ), empty_dict ) ] = HydrusGlobals.test_controller.GetWrite( 'import_files' )
             
-            self.assertEqual( len( import_file ), 3 )
+            self.assertEqual( len( file_import_jobs ), 3 )
             
             # I need to expand tests here with the new file system
             
@@ -61,4 +63,80 @@ class TestDaemons( unittest.TestCase ):
             shutil.rmtree( test_dir )
             
         
-    
\ No newline at end of file
+    
+class TestImporters( unittest.TestCase ):
+    
+    def test_gallery_import( self ):
+        
+        page_key = HydrusData.GenerateKey()
+        
+        gallery_import = ClientImporting.GalleryImport()
+        
+        gallery_import.SetGetTagsIfRedundant( False )
+        
+        url = 'http://example.com/already_have_it.jpg'
+        
+        gallery_import.GetSeedCache().AddSeed( url )
+        
+        HydrusGlobals.test_controller.SetRead( 'url_status', ( CC.STATUS_REDUNDANT, os.urandom( 32 ) ) )
+        HydrusGlobals.test_controller.SetRead( 'media_results', [ None ] )
+        
+        gallery_import._WorkOnGallery( page_key )
+        gallery_import._WorkOnFiles( page_key )
+        
+        ( seed, status, added_timestamp, last_modified_timestamp, note ) = gallery_import.GetSeedCache().GetSeedInfo( url )
+        
+        self.assertEqual( status, CC.STATUS_REDUNDANT )
+        
+        ( pending_queries, gallery_status, seed_cache_status, files_paused, gallery_paused, cancellable ) = gallery_import.GetStatus()
+        
+        self.assertEqual( gallery_status, '' )
+        
+    
+    def test_hdd_import( self ):
+        
+        test_dir = tempfile.mkdtemp()
+        
+        try:
+            
+            paths = [ os.path.join( test_dir, str( i ) ) for i in range( 3 ) ]
+            
+            shutil.copy( os.path.join( HC.STATIC_DIR, 'testing', 'muh_jpg.jpg' ), paths[0] )
+            shutil.copy( os.path.join( HC.STATIC_DIR, 'hydrus.png' ), paths[1] )
+            with open( paths[2], 'wb' ) as f: f.write( 'blarg' ) # broken
+            
+            paths_to_tags = { paths[0] : { CC.LOCAL_TAG_SERVICE_KEY : [ 'hdd tag' ] } }
+            
+            hdd_import = ClientImporting.HDDImport( paths = paths, import_file_options = ClientDefaults.GetDefaultImportFileOptions(), paths_to_tags = paths_to_tags, delete_after_success = True )
+            
+            HydrusGlobals.test_controller.SetRead( 'hash_status', ( CC.STATUS_NEW, None ) )
+            HydrusGlobals.test_controller.SetRead( 'media_results', [ None, None ] )
+            
+            hdd_import._WorkOnFiles( HydrusData.GenerateKey() )
+            
+            # all three paths go through in one batch and one db write
+            
+            [ ( ( file_import_jobs, ), empty_dict ) ] = HydrusGlobals.test_controller.GetWrite( 'import_files' )
+            
+            self.assertEqual( len( file_import_jobs ), 2 )
+            
+            [ ( ( service_keys_to_content_updates, ), empty_dict ) ] = HydrusGlobals.test_controller.GetWrite( 'content_updates' )
+            
+            self.assertEqual( service_keys_to_content_updates.keys(), [ CC.LOCAL_TAG_SERVICE_KEY ] )
+            
+            seed_cache = hdd_import.GetSeedCache()
+            
+            self.assertEqual( seed_cache.GetSeedInfo( paths[0] )[1], CC.STATUS_SUCCESSFUL )
+            self.assertEqual( seed_cache.GetSeedInfo( paths[1] )[1], CC.STATUS_SUCCESSFUL )
+            self.assertNotEqual( seed_cache.GetSeedInfo( paths[2] )[1], CC.STATUS_SUCCESSFUL )
+            
+            self.assertFalse( os.path.exists( paths[0] ) )
+            self.assertFalse( os.path.exists( paths[1] ) )
+            self.assertTrue( os.path.exists( paths[2] ) )
+            
+        finally:
+            
+            shutil.rmtree( test_dir )
+            
+        
+    
@@ -1,7 +1,10 @@
 import ClientImageHandling
+import ClientVPTree
 import collections
 import HydrusConstants as HC
+import HydrusData
 import os
+import random
 import TestConstants
 import unittest
 
@@ -13,3 +16,45 @@ class TestImageHandling( unittest.TestCase ):
         
         self.assertEqual( phash, '\xb0\x08\x83\xb2\x08\x0b8\x08' )
         
+    
+    def test_vptree( self ):
+        
+        phashes = { os.urandom( 8 ) for i in range( 500 ) }
+        
+        ( root_phash, rows ) = ClientVPTree.GenerateVPTreeRows( phashes )
+        
+        self.assertEqual( len( rows ), len( phashes ) )
+        
+        nodes = { phash : ( radius, inner_phash, outer_phash ) for ( phash, parent_phash, radius, inner_phash, inner_population, outer_phash, outer_population ) in rows }
+        
+        for ( search_phash, max_hamming ) in [ ( random.choice( list( phashes ) ), 8 ), ( os.urandom( 8 ), 16 ), ( os.urandom( 8 ), 24 ) ]:
+            
+            expected = { phash for phash in phashes if HydrusData.GetHammingDistance( search_phash, phash ) <= max_hamming }
+            
+            matches = set()
+            
+            next_potentials = [ root_phash ]
+            
+            while len( next_potentials ) > 0:
+                
+                node_phash = next_potentials.pop()
+                
+                ( radius, inner_phash, outer_phash ) = nodes[ node_phash ]
+                
+                d = HydrusData.GetHammingDistance( search_phash, node_phash )
+                
+                if d <= max_hamming: matches.add( node_phash )
+                
+                if radius is not None:
+                    
+                    if inner_phash is not None and d <= radius + max_hamming: next_potentials.append( inner_phash )
+                    if outer_phash is not None and d + max_hamming > radius: next_potentials.append( outer_phash )
+                    
+                
+            
+            self.assertEqual( matches, expected )
+            
+            self.assertEqual( set( ClientVPTree.VPTreeNode( list( phashes ) ).GetMatches( search_phash, max_hamming ) ), expected )
+            
+        
+    
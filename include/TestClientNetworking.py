@@ -0,0 +1,266 @@
+import BaseHTTPServer
+import ClientNetworking
+import HydrusConstants as HC
+import HydrusPaths
+import SocketServer
+import threading
+import time
+import unittest
+
+class SlowHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET( self ):
+        
+        time.sleep( 0.5 )
+        
+        body = 'hello'
+        
+        self.send_response( 200 )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        
+        self.wfile.write( body )
+        
+    
+    def log_message( self, *args ): pass
+    
+class ResumableHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+    
+    protocol_version = 'HTTP/1.1'
+    
+    body = '0123456789' * 10000
+    etag = '"abcd"'
+    
+    requested_ranges = []
+    
+    def do_GET( self ):
+        
+        range_header = self.headers.getheader( 'Range' )
+        
+        ResumableHandler.requested_ranges.append( ( range_header, self.headers.getheader( 'If-Range' ) ) )
+        
+        if self.path == '/changed':
+            
+            etag = '"efgh"'
+            
+        else:
+            
+            etag = self.etag
+            
+        
+        if range_header is not None and self.headers.getheader( 'If-Range' ) == etag:
+            
+            start = int( range_header[ 6 : -1 ] )
+            
+            data = self.body[ start : ]
+            
+            self.send_response( 206 )
+            self.send_header( 'Content-Range', 'bytes ' + str( start ) + '-' + str( len( self.body ) - 1 ) + '/' + str( len( self.body ) ) )
+            
+            cut_short = False
+            
+        else:
+            
+            data = self.body
+            
+            self.send_response( 200 )
+            
+            # the first full response of each path is cut off halfway through
+            
+            cut_short = len( ResumableHandler.requested_ranges ) == 1
+            
+        
+        self.send_header( 'Accept-Ranges', 'bytes' )
+        self.send_header( 'ETag', self.etag )
+        self.send_header( 'Content-Length', str( len( data ) ) )
+        self.end_headers()
+        
+        if cut_short:
+            
+            self.wfile.write( data[ : len( data ) / 2 ] )
+            
+            self.close_connection = 1
+            
+        else:
+            
+            self.wfile.write( data )
+            
+        
+    
+    def log_message( self, *args ): pass
+    
+class ThreadedHTTPServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    
+    daemon_threads = True
+    
+class TestHTTPConnectionManager( unittest.TestCase ):
+    
+    @classmethod
+    def setUpClass( self ):
+        
+        self._server = ThreadedHTTPServer( ( '127.0.0.1', 0 ), SlowHandler )
+        
+        ( host, port ) = self._server.server_address
+        
+        self._url = 'http://127.0.0.1:' + str( port ) + '/'
+        self._location = ( 'http', '127.0.0.1', port )
+        
+        threading.Thread( target = self._server.serve_forever ).start()
+        
+    
+    @classmethod
+    def tearDownClass( self ):
+        
+        self._server.shutdown()
+        self._server.server_close()
+        
+    
+    def _DoConcurrentRequests( self, http, num_requests ):
+        
+        results = []
+        
+        def THREADRequest():
+            
+            results.append( http.Request( HC.GET, self._url ) )
+            
+        
+        threads = [ threading.Thread( target = THREADRequest ) for i in range( num_requests ) ]
+        
+        started = time.time()
+        
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        
+        self.assertEqual( results, [ 'hello' ] * num_requests )
+        
+        return time.time() - started
+        
+    
+    def test_connection_pool( self ):
+        
+        http = ClientNetworking.HTTPConnectionManager( max_connections_per_host = 1 )
+        
+        time_taken = self._DoConcurrentRequests( http, 2 )
+        
+        self.assertGreater( time_taken, 0.9 )
+        
+        stats = http.GetStats()[ self._location ]
+        
+        self.assertEqual( stats[ 'num_requests' ], 2 )
+        self.assertEqual( stats[ 'num_connections_made' ], 1 )
+        self.assertEqual( stats[ 'num_connections' ], 1 )
+        self.assertEqual( stats[ 'num_idle' ], 1 )
+        self.assertEqual( stats[ 'num_in_flight' ], 0 )
+        self.assertEqual( stats[ 'total_bytes' ], 10 )
+        self.assertGreater( stats[ 'max_wait_time' ], 0.3 )
+        
+        #
+        
+        http.SetMaxConnectionsPerHost( 3 )
+        
+        time_taken = self._DoConcurrentRequests( http, 3 )
+        
+        self.assertLess( time_taken, 0.9 )
+        
+        stats = http.GetStats()[ self._location ]
+        
+        self.assertEqual( stats[ 'num_requests' ], 5 )
+        self.assertEqual( stats[ 'num_connections_made' ], 3 )
+        self.assertEqual( stats[ 'num_idle' ], 3 )
+        
+        #
+        
+        http.SetMaxConnectionsPerHost( 1 )
+        
+        stats = http.GetStats()[ self._location ]
+        
+        self.assertEqual( stats[ 'num_connections' ], 1 )
+        self.assertEqual( stats[ 'num_idle' ], 1 )
+        
+    
+    def test_connection_pool_maintenance( self ):
+        
+        http = ClientNetworking.HTTPConnectionManager()
+        
+        # a request that has its pool but no connection yet must not have the pool thrown away from under it
+        
+        connection_pool = http._GetConnectionPool( self._location )
+        
+        http._MaintainConnectionPools()
+        
+        self.assertIn( self._location, http.GetStats() )
+        
+        connection_pool.RemoveUser()
+        
+        http._MaintainConnectionPools()
+        
+        self.assertNotIn( self._location, http.GetStats() )
+        
+    
+class TestResumeDownload( unittest.TestCase ):
+    
+    @classmethod
+    def setUpClass( self ):
+        
+        self._server = ThreadedHTTPServer( ( '127.0.0.1', 0 ), ResumableHandler )
+        
+        ( host, port ) = self._server.server_address
+        
+        self._url = 'http://127.0.0.1:' + str( port ) + '/'
+        
+        threading.Thread( target = self._server.serve_forever ).start()
+        
+    
+    @classmethod
+    def tearDownClass( self ):
+        
+        self._server.shutdown()
+        self._server.server_close()
+        
+    
+    def _DownloadAndRead( self, url ):
+        
+        http = ClientNetworking.HTTPConnectionManager()
+        
+        ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        try:
+            
+            http.Request( HC.GET, url, temp_path = temp_path )
+            
+            with open( temp_path, 'rb' ) as f: data = f.read()
+            
+        finally:
+            
+            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+            
+        
+        return data
+        
+    
+    def test_resume( self ):
+        
+        ResumableHandler.requested_ranges = []
+        
+        data = self._DownloadAndRead( self._url + 'file' )
+        
+        self.assertEqual( data, ResumableHandler.body )
+        
+        self.assertEqual( ResumableHandler.requested_ranges, [ ( None, None ), ( 'bytes=50000-', '"abcd"' ) ] )
+        
+    
+    def test_resume_changed( self ):
+        
+        # the server's copy no longer matches what we got the first half of, so we get the whole thing again
+        
+        ResumableHandler.requested_ranges = []
+        
+        data = self._DownloadAndRead( self._url + 'changed' )
+        
+        self.assertEqual( data, ResumableHandler.body )
+        
+        self.assertEqual( ResumableHandler.requested_ranges, [ ( None, None ), ( 'bytes=50000-', '"abcd"' ) ] )
+        
+    
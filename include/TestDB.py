@@ -14,6 +14,7 @@ import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
 import HydrusGlobals
+import HydrusPaths
 import HydrusSerialisable
 import itertools
 import os
@@ -58,6 +59,29 @@ class TestClientDB( unittest.TestCase ):
             c.execute( 'DELETE FROM ' + name + ';' )
             
         
+        del c
+        del db
+        
+        caches_db_path = os.path.join( self._db._db_dir, self._db._db_filenames[ 'external_caches' ] )
+        
+        db = sqlite3.connect( caches_db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
+        
+        c = db.cursor()
+        
+        table_names = [ name for ( name, ) in c.execute( 'SELECT name FROM sqlite_master WHERE type = "table" AND name LIKE "combined_files_tag_counts_cache_%";' ).fetchall() ]
+        
+        for name in table_names:
+            
+            c.execute( 'DELETE FROM ' + name + ';' )
+            
+        
+        del c
+        del db
+        
+        # we just changed the db behind its back
+        
+        self._db._media_result_cache.Clear( self._db._num_commits )
+        
     
     def _read( self, action, *args, **kwargs ): return self._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
     def _write( self, action, *args, **kwargs ): return self._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
@@ -99,7 +123,9 @@ class TestClientDB( unittest.TestCase ):
         
         path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        self._write( 'import_file', path )
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        self._write( 'import_file', file_import_job )
         
         #
         
@@ -177,6 +203,79 @@ class TestClientDB( unittest.TestCase ):
         
         self.assertEqual( result, [] )
         
+        # punctuation and wildcards go through the trigram index
+        
+        service_keys_to_content_updates = {}
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'mk.ii gt40', ( hash, ) ) ) )
+        
+        service_keys_to_content_updates[ CC.LOCAL_TAG_SERVICE_KEY ] = content_updates
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        pred = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'mk.ii gt40', min_current_count = 1 )
+        
+        for search_text in ( 'mk.i', '*gt4*', '*ii*gt*', 'gt4*', '*t*' ):
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = search_text )
+            
+            self.assertIn( pred, result )
+            
+        
+        for search_text in ( 'k.ii', '*gt*ii*', '*40*x*' ):
+            
+            result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = search_text )
+            
+            self.assertEqual( result, [] )
+            
+        
+        result = self._read( 'autocomplete_predicates', tag_service_key = CC.LOCAL_TAG_SERVICE_KEY, search_text = 'ma*er:f' )
+        
+        pred = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'maker:ford', min_current_count = 1 )
+        
+        self.assertEqual( result, [ pred ] )
+        
+    
+    def test_backup( self ):
+        
+        self._write( 'serialisable_simple', 'backup_test', 'fresh data' )
+        
+        # make sure the read connections have the db open, as they would in a running client
+        
+        self.assertEqual( self._read( 'serialisable_simple', 'backup_test' ), 'fresh data' )
+        
+        backup_path = tempfile.mkdtemp( prefix = 'hydrus_backup_test' )
+        
+        try:
+            
+            self._write( 'backup', backup_path )
+            
+            # the backup only copies the db files, so what was just committed has to have left the wal
+            
+            db = sqlite3.connect( os.path.join( backup_path, 'client.db' ) )
+            
+            try:
+                
+                ( dump, ) = db.execute( 'SELECT dump FROM json_dict WHERE name = ?;', ( 'backup_test', ) ).fetchone()
+                
+            finally:
+                
+                db.close()
+                
+            
+            self.assertEqual( str( dump ), '"fresh data"' )
+            
+        finally:
+            
+            shutil.rmtree( backup_path )
+            
+        
+        self.assertEqual( self._read( 'serialisable_simple', 'backup_test' ), 'fresh data' )
+        
+        self._write( 'serialisable_simple', 'backup_test', None )
+        
     
     def test_booru( self ):
         
@@ -237,6 +336,93 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result.GetName(), export_folder.GetName() )
         
     
+    def test_file_integrity( self ):
+        
+        self._clear_db()
+        
+        hashes = []
+        
+        for filename in ( 'muh_jpg.jpg', 'muh_png.png', 'muh_gif.gif' ):
+            
+            path = os.path.join( HC.STATIC_DIR, 'testing', filename )
+            
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            ( written_result, written_hash ) = self._write( 'import_file', file_import_job )
+            
+            hashes.append( written_hash )
+            
+        
+        self.assertEqual( self._read( 'file_integrity_count', -1 ), 3 )
+        
+        # the file maintenance jobs walk client_files, which may have junk the os put there
+        
+        client_files_manager = HydrusGlobals.test_controller.GetClientFilesManager()
+        
+        dir = os.path.dirname( client_files_manager.GetFilePath( hashes[0] ) )
+        
+        junk_paths = [ os.path.join( dir, filename ) for filename in ( 'Thumbs.db', 'desktop.ini' ) ]
+        
+        for junk_path in junk_paths:
+            
+            with open( junk_path, 'wb' ) as f: f.write( 'junk' )
+            
+        
+        try:
+            
+            iterated_hashes = [ hash for batch in client_files_manager._IterateFileHashBatches( '' ) for hash in batch ]
+            
+        finally:
+            
+            for junk_path in junk_paths:
+                
+                os.remove( junk_path )
+                
+            
+        
+        self.assertTrue( set( hashes ).issubset( iterated_hashes ) )
+        self.assertEqual( iterated_hashes, sorted( iterated_hashes ) )
+        
+        # batches come in hash_id order, so the check can pick up again after the last one it did
+        
+        rows = self._read( 'file_integrity_batch', -1, 2 )
+        
+        self.assertEqual( len( rows ), 2 )
+        self.assertTrue( { hash for ( hash_id, hash, mime ) in rows }.issubset( hashes ) )
+        self.assertTrue( { mime for ( hash_id, hash, mime ) in rows }.issubset( ( HC.IMAGE_JPEG, HC.IMAGE_PNG, HC.IMAGE_GIF ) ) )
+        
+        last_hash_id = rows[ -1 ][ 0 ]
+        
+        self.assertEqual( self._read( 'file_integrity_count', last_hash_id ), 1 )
+        
+        [ ( final_hash_id, final_hash, final_mime ) ] = self._read( 'file_integrity_batch', last_hash_id, 2 )
+        
+        self.assertGreater( final_hash_id, last_hash_id )
+        
+        self.assertEqual( set( hashes ), { hash for ( hash_id, hash, mime ) in rows } | { final_hash } )
+        
+        self._write( 'delete_file_records', [ final_hash_id ] )
+        
+        self.assertEqual( self._read( 'file_integrity_count', -1 ), 2 )
+        self.assertEqual( self._read( 'file_integrity_batch', last_hash_id, 2 ), [] )
+        
+        self._write( 'delete_file_records', [ hash_id for ( hash_id, hash, mime ) in rows ] )
+        
+        self.assertEqual( self._read( 'file_integrity_count', -1 ), 0 )
+        
+        # checkpoints are kept in the simple json store until the job is done
+        
+        checkpoint = { 'mode' : 'quick', 'move_location' : None, 'last_hash_id' : last_hash_id, 'num_done' : 2, 'num_missing' : 0, 'num_incorrect' : 0, 'num_errors' : 0 }
+        
+        self._write( 'serialisable_simple', 'file_integrity_checkpoint', checkpoint )
+        
+        self.assertEqual( self._read( 'serialisable_simple', 'file_integrity_checkpoint' ), checkpoint )
+        
+        self._write( 'serialisable_simple', 'file_integrity_checkpoint', None )
+        
+        self.assertEqual( self._read( 'serialisable_simple', 'file_integrity_checkpoint' ), None )
+        
+    
     def test_file_query_ids( self ):
         
         self._clear_db()
@@ -303,7 +489,9 @@ class TestClientDB( unittest.TestCase ):
         
         path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        ( written_result, written_hash ) = self._write( 'import_file', path )
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( written_result, written_hash ) = self._write( 'import_file', file_import_job )
         
         self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
         self.assertEqual( written_hash, hash )
@@ -525,6 +713,44 @@ class TestClientDB( unittest.TestCase ):
         run_system_predicate_tests( tests )
         
     
+    def test_file_query_plan( self ):
+        
+        self._clear_db()
+        
+        HC.options[ 'exclude_deleted_files' ] = False
+        
+        hashes = []
+        
+        for filename in ( 'hydrus.png', 'archive.png' ):
+            
+            file_import_job = ClientImporting.FileImportJob( os.path.join( HC.STATIC_DIR, filename ) )
+            
+            ( result, hash ) = self._write( 'import_file', file_import_job )
+            
+            hashes.append( hash )
+            
+        
+        service_keys_to_content_updates = { CC.LOCAL_TAG_SERVICE_KEY : ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:planner test', ( hashes[0], ) ) ), ) }
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_INBOX, None ), ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'series:planner test' ) ]
+        
+        search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+        
+        file_query_ids = self._read( 'file_query_ids', search_context )
+        
+        self.assertEqual( len( file_query_ids ), 1 )
+        
+        plan_lines = self._read( 'file_query_plan', search_context )
+        
+        # the tag only has one file, so it should go first, before the inbox or the whole file service
+        
+        self.assertEqual( plan_lines[0], 'start with files tagged "series:planner test" (estimated 1)' )
+        self.assertIn( 'keep only files in the inbox (estimated 2)', plan_lines )
+        self.assertEqual( plan_lines[-1], '  1 files' )
+        
+    
     def test_file_system_predicates( self ):
         
         self._clear_db()
@@ -533,7 +759,9 @@ class TestClientDB( unittest.TestCase ):
         
         path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
         
-        self._write( 'import_file', path )
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        self._write( 'import_file', file_import_job )
         
         #
         
@@ -551,6 +779,47 @@ class TestClientDB( unittest.TestCase ):
         for i in range( len( predicates ) ): self.assertEqual( result[i].GetCount(), predicates[i].GetCount() )
         
     
+    def test_group_commit( self ):
+        
+        self._clear_db()
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        HC.options[ 'exclude_deleted_files' ] = False
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, hash ) = self._write( 'import_file', file_import_job )
+        
+        stats = self._db.GetCommitStats()
+        
+        num_commits_before = stats[ 'num_commits' ]
+        num_jobs_committed_before = stats[ 'num_jobs_committed' ]
+        
+        for i in range( 10 ):
+            
+            if i % 2 == 0: action = HC.CONTENT_UPDATE_ARCHIVE
+            else: action = HC.CONTENT_UPDATE_INBOX
+            
+            service_keys_to_content_updates = { CC.LOCAL_FILE_SERVICE_KEY : ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, action, ( hash, ) ), ) }
+            
+            self._db.Write( 'content_updates', HC.HIGH_PRIORITY, False, service_keys_to_content_updates )
+            
+        
+        service_keys_to_content_updates = { CC.LOCAL_FILE_SERVICE_KEY : ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash, ) ), ) }
+        
+        self._db.Write( 'content_updates', HC.LOW_PRIORITY, True, service_keys_to_content_updates )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( media_result.GetInbox(), False )
+        
+        stats = self._db.GetCommitStats()
+        
+        self.assertEqual( stats[ 'num_jobs_committed' ] - num_jobs_committed_before, 11 )
+        self.assertLess( stats[ 'num_commits' ] - num_commits_before, 11 )
+        
+    
     def test_gui_sessions( self ):
         
         session = ClientGUIPages.GUISession( 'test_session' )
@@ -642,12 +911,16 @@ class TestClientDB( unittest.TestCase ):
             
             hash = hex_hash.decode( 'hex' )
             
-            ( written_result, written_hash ) = self._write( 'import_file', path )
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            ( written_result, written_hash ) = self._write( 'import_file', file_import_job )
             
             self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
             self.assertEqual( written_hash, hash )
             
-            ( written_result, written_hash ) = self._write( 'import_file', path )
+            file_import_job = ClientImporting.FileImportJob( path )
+            
+            ( written_result, written_hash ) = self._write( 'import_file', file_import_job )
             
             self.assertEqual( written_result, CC.STATUS_REDUNDANT )
             self.assertEqual( written_hash, hash )
@@ -679,6 +952,63 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_import_temporary( self ):
+        
+        self._clear_db()
+        
+        # some junk on the end makes sure this file is new to client_files
+        
+        with open( os.path.join( HC.STATIC_DIR, 'hydrus.png' ), 'rb' ) as f: file_data = f.read() + os.urandom( 16 )
+        
+        ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        try:
+            
+            with open( temp_path, 'wb' ) as f: f.write( file_data )
+            
+            os_file_handle = HydrusPaths.CloseTempPathHandle( os_file_handle, temp_path )
+            
+            self.assertIsNone( os_file_handle )
+            
+            file_import_job = ClientImporting.FileImportJob( temp_path, is_temporary = True )
+            
+            ( written_result, written_hash ) = self._write( 'import_file', file_import_job )
+            
+            self.assertEqual( written_result, CC.STATUS_SUCCESSFUL )
+            
+            # the test db and temp files are on the same drive, so the temp file was moved in
+            
+            self.assertFalse( os.path.exists( temp_path ) )
+            
+        finally:
+            
+            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+            
+        
+        client_files_manager = HydrusGlobals.test_controller.GetClientFilesManager()
+        
+        file_path = client_files_manager.GetFilePath( written_hash )
+        
+        self.assertTrue( file_path.endswith( '.png' ) )
+        
+        with open( file_path, 'rb' ) as f: self.assertEqual( f.read(), file_data )
+        
+        # if the file goes missing or moves, the remembered extension is not trusted
+        
+        moved_path = file_path[ : -4 ] + '.jpg'
+        
+        os.rename( file_path, moved_path )
+        
+        self.assertEqual( client_files_manager.GetFilePath( written_hash ), moved_path )
+        
+        os.remove( moved_path )
+        
+        with self.assertRaises( HydrusExceptions.FileMissingException ):
+            
+            client_files_manager.GetFilePath( written_hash )
+            
+        
+    
     def test_import_folders( self ):
         
         import_folder_1 = ClientImporting.ImportFolder( 'imp 1', path = HC.DB_DIR, mimes = HC.VIDEO, open_popup = False )
@@ -734,6 +1064,58 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_job_stats( self ):
+        
+        def get_action_stats( job_type, action ):
+            
+            stats = self._db.GetJobStats()
+            
+            for action_stats in stats[ 'actions' ]:
+                
+                if action_stats[ 'job_type' ] == job_type and action_stats[ 'action' ] == action:
+                    
+                    return action_stats
+                    
+                
+            
+            return None
+            
+        
+        before = get_action_stats( 'read', 'news' )
+        
+        if before is None: num_before = 0
+        else: num_before = before[ 'num_jobs' ]
+        
+        for i in range( 3 ):
+            
+            self._read( 'news', CC.LOCAL_TAG_SERVICE_KEY )
+            
+        
+        action_stats = get_action_stats( 'read', 'news' )
+        
+        self.assertEqual( action_stats[ 'num_jobs' ] - num_before, 3 )
+        
+        for measure in ( 'queue_wait', 'execution', 'commit', 'rows' ):
+            
+            self.assertEqual( sum( action_stats[ measure ][ 'histogram' ] ), action_stats[ 'num_jobs' ] )
+            self.assertLessEqual( action_stats[ measure ][ 'max' ], action_stats[ measure ][ 'total' ] )
+            
+        
+        self.assertEqual( action_stats[ 'commit' ][ 'total' ], 0 )
+        
+        self._write( 'serialisable_simple', 'job_stats_test', 'test' )
+        
+        action_stats = get_action_stats( 'write', 'serialisable_simple' )
+        
+        self.assertGreaterEqual( action_stats[ 'num_jobs' ], 1 )
+        self.assertGreaterEqual( action_stats[ 'rows' ][ 'max' ], 1 )
+        
+        report = self._db.GetJobStatsReport()
+        
+        self.assertIn( 'read news', report )
+        self.assertIn( 'write serialisable_simple', report )
+        
+    
     def test_md5_status( self ):
         
         self._clear_db()
@@ -752,7 +1134,9 @@ class TestClientDB( unittest.TestCase ):
         
         #
         
-        self._write( 'import_file', path )
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        self._write( 'import_file', file_import_job )
         
         #
         
@@ -777,6 +1161,77 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( result, ( CC.STATUS_DELETED, None ) )
         
     
+    def test_media_result_cache( self ):
+        
+        self._clear_db()
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        HC.options[ 'exclude_deleted_files' ] = False
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, hash ) = self._write( 'import_file', file_import_job )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( media_result.GetInbox(), True )
+        
+        stats = self._db.GetMediaResultCacheStats()
+        
+        ( num_hits_before, num_misses_before ) = ( stats[ 'num_hits' ], stats[ 'num_misses' ] )
+        
+        ( cached_media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( cached_media_result.GetInbox(), True )
+        
+        # we should get our own copy, not the cache's
+        
+        self.assertIsNot( cached_media_result, media_result )
+        
+        stats = self._db.GetMediaResultCacheStats()
+        
+        self.assertEqual( stats[ 'num_misses' ] - num_misses_before, 0 )
+        self.assertEqual( stats[ 'num_hits' ] - num_hits_before, 1 )
+        
+        service_keys_to_content_updates = { CC.LOCAL_FILE_SERVICE_KEY : ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash, ) ), ) }
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        service_keys_to_content_updates = { CC.LOCAL_TAG_SERVICE_KEY : ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'cached tag', ( hash, ) ) ), ) }
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( media_result.GetInbox(), False )
+        self.assertEqual( media_result.GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { 'cached tag' } )
+        
+        ( media_result, ) = self._read( 'media_results_from_ids', self._read( 'file_query_ids', ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY ) ) )
+        
+        self.assertEqual( media_result.GetHash(), hash )
+        self.assertEqual( media_result.GetInbox(), False )
+        
+        stats = self._db.GetMediaResultCacheStats()
+        
+        self.assertEqual( stats[ 'num_misses' ] - num_misses_before, 0 )
+        self.assertEqual( stats[ 'num_hits' ] - num_hits_before, 3 )
+        
+        # writes that do not send a content update, like a redundant import with a new url, have to knock the file out of the cache
+        
+        url = 'http://example.com/cached_file.png'
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, written_hash ) = self._write( 'import_file', file_import_job, url = url )
+        
+        self.assertEqual( result, CC.STATUS_REDUNDANT )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( list( media_result.GetLocationsManager().GetURLs() ), [ url ] )
+        
+    
     def test_media_results( self ):
         
         self._clear_db()
@@ -785,7 +1240,9 @@ class TestClientDB( unittest.TestCase ):
         
         HC.options[ 'exclude_deleted_files' ] = False
         
-        ( result, hash ) = self._write( 'import_file', path )
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, hash ) = self._write( 'import_file', file_import_job )
         
         #
         
@@ -823,6 +1280,30 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( mr_num_frames, None )
         self.assertEqual( mr_num_words, None )
         
+        #
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'car', ( hash, ) ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'series:cars', ( hash, ) ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        path = os.path.join( HC.STATIC_DIR, 'archive.png' )
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, small_hash ) = self._write( 'import_file', file_import_job )
+        
+        media_results = self._read( 'media_results', ( hash, small_hash ) )
+        
+        hashes_to_media_results = { media_result.GetHash() : media_result for media_result in media_results }
+        
+        self.assertEqual( set( hashes_to_media_results.keys() ), { hash, small_hash } )
+        
+        self.assertEqual( hashes_to_media_results[ hash ].GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), { 'car', 'series:cars' } )
+        self.assertEqual( hashes_to_media_results[ small_hash ].GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ), set() )
+        
     
     def test_tag_censorship( self ):
         
@@ -880,6 +1361,95 @@ class TestClientDB( unittest.TestCase ):
         self.assertItemsEqual( result, news )
         
     
+    def test_num_tags_cache( self ):
+        
+        self._clear_db()
+        
+        service_key = HydrusData.GenerateKey()
+        
+        info = {}
+        
+        info[ 'host' ] = 'example_host'
+        info[ 'port' ] = 80
+        info[ 'access_key' ] = HydrusData.GenerateKey()
+        
+        new_tag_repo = ( service_key, HC.TAG_REPOSITORY, 'new tag repo', info )
+        
+        edit_log = [ HydrusData.EditLogActionAdd( new_tag_repo ) ]
+        
+        self._write( 'update_services', edit_log )
+        
+        def run_num_tags_tests( tests ):
+            
+            for ( include_current_tags, include_pending_tags, info, result ) in tests:
+                
+                predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, info ) ]
+                
+                search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, tag_service_key = service_key, include_current_tags = include_current_tags, include_pending_tags = include_pending_tags, predicates = predicates )
+                
+                file_query_ids = self._read( 'file_query_ids', search_context )
+                
+                self.assertEqual( len( file_query_ids ), result )
+                
+            
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        HC.options[ 'exclude_deleted_files' ] = False
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, hash ) = self._write( 'import_file', file_import_job )
+        
+        #
+        
+        content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_PEND, ( tag, ( hash, ) ) ) for tag in ( 'pending', 'series:pending' ) ]
+        
+        self._write( 'content_updates', { service_key : content_updates } )
+        
+        tests = []
+        
+        tests.append( ( True, True, ( '=', 2 ), 1 ) )
+        tests.append( ( True, False, ( '=', 0 ), 1 ) )
+        tests.append( ( False, True, ( '>', 1 ), 1 ) )
+        tests.append( ( True, True, ( '<', 2 ), 0 ) )
+        
+        run_num_tags_tests( tests )
+        
+        #
+        
+        content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_RESCIND_PEND, ( 'series:pending', ( hash, ) ) ) ]
+        
+        self._write( 'content_updates', { service_key : content_updates } )
+        
+        tests = []
+        
+        tests.append( ( True, True, ( '=', 1 ), 1 ) )
+        tests.append( ( False, True, ( '=', 1 ), 1 ) )
+        tests.append( ( True, False, ( '>', 0 ), 0 ) )
+        
+        run_num_tags_tests( tests )
+        
+        #
+        
+        content_updates = [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_RESCIND_PEND, ( 'pending', ( hash, ) ) ) ]
+        
+        self._write( 'content_updates', { service_key : content_updates } )
+        
+        tests = []
+        
+        tests.append( ( True, True, ( '=', 0 ), 1 ) )
+        tests.append( ( True, True, ( '>', 0 ), 0 ) )
+        
+        run_num_tags_tests( tests )
+        
+        #
+        
+        edit_log = [ HydrusData.EditLogActionDelete( service_key ) ]
+        
+        self._write( 'update_services', edit_log )
+        
+    
     def test_nums_pending( self ):
         
         result = self._read( 'nums_pending' )
@@ -944,6 +1514,51 @@ class TestClientDB( unittest.TestCase ):
         self.assertTrue( result, ( pixiv_id, password ) )
         
     
+    def test_read_connections( self ):
+        
+        self._clear_db()
+        
+        self.assertGreater( self._db._num_read_connections, 0 )
+        
+        # this has to add a new hash_id, so a read connection should pass it back to the main loop
+        
+        result = self._read( 'known_urls', HydrusData.GenerateKey() )
+        
+        self.assertEqual( result, [] )
+        
+        #
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        HC.options[ 'exclude_deleted_files' ] = False
+        
+        file_import_job = ClientImporting.FileImportJob( path )
+        
+        ( result, hash ) = self._write( 'import_file', file_import_job )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( media_result.GetInbox(), True )
+        
+        service_keys_to_content_updates = {}
+        
+        service_keys_to_content_updates[ CC.LOCAL_FILE_SERVICE_KEY ] = ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ARCHIVE, ( hash, ) ), )
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( media_result.GetInbox(), False )
+        
+        service_keys_to_content_updates[ CC.LOCAL_FILE_SERVICE_KEY ] = ( HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_INBOX, ( hash, ) ), )
+        
+        self._write( 'content_updates', service_keys_to_content_updates )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertEqual( media_result.GetInbox(), True )
+        
+    
     def test_repo_downloads( self ):
         
         result = self._read( 'downloads' )
@@ -1270,13 +1885,106 @@ class TestServerDB( unittest.TestCase ):
         self.assertRaises( HydrusExceptions.ForbiddenException, self._read, 'access_key', r_key )
         
     
+    def _test_backup( self ):
+        
+        # the read connections have been used by now, so they will have the db open when the backup closes the main connection
+        
+        self._write( 'backup' )
+        
+        backup_path = os.path.join( HC.DB_DIR, 'server_backup' )
+        
+        db = sqlite3.connect( os.path.join( backup_path, 'server.master.db' ) )
+        
+        try:
+            
+            tags = { tag for ( tag, ) in db.execute( 'SELECT tag FROM tags;' ) }
+            
+        finally:
+            
+            db.close()
+            
+        
+        self.assertTrue( { 'car', 'bus' }.issubset( tags ) )
+        
+        db = sqlite3.connect( os.path.join( backup_path, 'server.mappings.db' ) )
+        
+        try:
+            
+            ( num_mappings, ) = db.execute( 'SELECT COUNT( * ) FROM mappings;' ).fetchone()
+            
+        finally:
+            
+            db.close()
+            
+        
+        self.assertGreater( num_mappings, 0 )
+        
+    
     def _test_content_creation( self ):
         
         # create some tag and hashes business, try uploading a file, and test that
         
-        # fetch content update, test it. I think that works
+        tag_admin_account_key = self._read( 'account_key_from_access_key', self._tag_service_key, self._tag_service_admin_access_key )
+        
+        time.sleep( 1 ) # the first update ended at service creation, so make sure this content falls after it
+        
+        hash_1 = HydrusData.GenerateKey()
+        hash_2 = HydrusData.GenerateKey()
+        
+        hash_ids_to_hashes = { 1 : hash_1, 2 : hash_2 }
+        
+        content_data = { HC.CONTENT_TYPE_MAPPINGS : { HC.CONTENT_UPDATE_PEND : [ ( 'car', [ 1, 2 ] ), ( 'bus', [ 1 ] ) ] } }
+        
+        update = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+        
+        self._write( 'update', self._tag_service_key, tag_admin_account_key, update )
         
-        pass
+        content_update_package = self._read( 'immediate_content_update', self._tag_service_key )
+        
+        mappings = { tag : set( hashes ) for ( tag, hashes ) in content_update_package.GetContentDataIterator( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD ) }
+        
+        self.assertEqual( mappings, { 'car' : { hash_1, hash_2 }, 'bus' : { hash_1 } } )
+        
+        #
+        
+        content_data = { HC.CONTENT_TYPE_MAPPINGS : { HC.CONTENT_UPDATE_PETITION : [ ( 'car', [ 2 ], 'bad tag' ) ] } }
+        
+        update = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+        
+        self._write( 'update', self._tag_service_key, tag_admin_account_key, update )
+        
+        content_update_package = self._read( 'immediate_content_update', self._tag_service_key )
+        
+        mappings = { tag : set( hashes ) for ( tag, hashes ) in content_update_package.GetContentDataIterator( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD ) }
+        
+        self.assertEqual( mappings, { 'car' : { hash_1 }, 'bus' : { hash_1 } } )
+        
+        #
+        
+        update_ends = self._read( 'update_ends' )
+        
+        begin = update_ends[ self._tag_service_key ] + 1
+        end = HydrusData.GetNow()
+        
+        self._write( 'create_update', self._tag_service_key, begin, end )
+        
+        content_update_package = self._read( 'immediate_content_update', self._tag_service_key )
+        
+        self.assertEqual( content_update_package.GetNumRows(), 0 )
+        
+        # submitting mappings the server already has changes nothing, so there is nothing new to send
+        
+        time.sleep( 1 )
+        
+        content_data = { HC.CONTENT_TYPE_MAPPINGS : { HC.CONTENT_UPDATE_PEND : [ ( 'car', [ 1 ] ), ( 'bus', [ 1 ] ) ] } }
+        
+        update = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+        
+        self._write( 'update', self._tag_service_key, tag_admin_account_key, update )
+        
+        content_update_package = self._read( 'immediate_content_update', self._tag_service_key )
+        
+        self.assertEqual( content_update_package.GetNumRows(), 0 )
         
     
     def _test_init_server_admin( self ):
@@ -1367,3 +2075,5 @@ class TestServerDB( unittest.TestCase ):
         
         self._test_content_creation()
         
+        self._test_backup()
+        
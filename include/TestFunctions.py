@@ -1,9 +1,12 @@
 import collections
 import HydrusConstants as HC
 import ClientData
+import HydrusFileHandling
+import itertools
 import os
 import TestConstants
 import unittest
+import yaml
 import HydrusData
 import ClientConstants as CC
 
@@ -41,6 +44,132 @@ class TestClientDownloadingFunctions( unittest.TestCase ):
         self.assertEqual( ClientData.ConvertServiceKeysToTagsToServiceKeysToContentUpdates( { hash }, service_keys_to_tags ), content_updates )
         
     
+    def test_binary_content_update_package( self ):
+        
+        hash_ids_to_hashes = { i : HydrusData.GenerateKey() for i in range( 1, 11 ) }
+        
+        update = HydrusData.ServerToClientContentUpdatePackage()
+        
+        update.AddContentData( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, [ ( 1, 65535, HC.IMAGE_JPEG, 1000000, 640, 480, None, None, None ) ], hash_ids_to_hashes )
+        update.AddContentData( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, [ 2, 3 ], {} )
+        update.AddContentData( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, [ ( u'series:blah', [ 1, 2, 3 ] ), ( u'\u30c6\u30b9\u30c8', [ 4 ] ) ], {} )
+        update.AddContentData( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, [ ( u'a', u'b' ) ], {} )
+        
+        network_string = update.DumpToBinaryNetworkString()
+        
+        loaded_update = HydrusData.CreateContentUpdatePackageFromNetworkString( network_string )
+        
+        self.assertEqual( loaded_update.GetHashes(), update.GetHashes() )
+        self.assertEqual( loaded_update.GetNumContentUpdates(), update.GetNumContentUpdates() )
+        
+        for ( data_type, action ) in [ ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD ), ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE ), ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD ), ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD ) ]:
+            
+            self.assertEqual( list( loaded_update.GetContentDataIterator( data_type, action ) ), list( update.GetContentDataIterator( data_type, action ) ) )
+            
+        
+        # processing goes a section at a time, and each section only carries the hashes it needs
+        
+        loaded_updates = list( HydrusData.IterateContentUpdatePackagesFromNetworkString( network_string ) )
+        
+        self.assertEqual( len( loaded_updates ), 4 )
+        self.assertEqual( sum( ( loaded_update.GetNumContentUpdates() for loaded_update in loaded_updates ) ), update.GetNumContentUpdates() )
+        self.assertEqual( set( itertools.chain.from_iterable( ( loaded_update.GetHashes() for loaded_update in loaded_updates ) ) ), { hash_ids_to_hashes[ hash_id ] for hash_id in ( 1, 2, 3, 4 ) } )
+        
+        for ( data_type, action ) in [ ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD ), ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE ), ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD ), ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD ) ]:
+            
+            self.assertEqual( list( itertools.chain.from_iterable( ( loaded_update.GetContentDataIterator( data_type, action ) for loaded_update in loaded_updates ) ) ), list( update.GetContentDataIterator( data_type, action ) ) )
+            
+        
+        [ loaded_update ] = list( HydrusData.IterateContentUpdatePackagesFromNetworkString( update.DumpToNetworkString() ) )
+        
+        self.assertEqual( loaded_update.GetHashes(), update.GetHashes() )
+        
+        loaded_update = HydrusData.CreateContentUpdatePackageFromNetworkString( update.DumpToNetworkString() )
+        
+        self.assertEqual( loaded_update.GetHashes(), update.GetHashes() )
+        
+    
+    def test_binary_client_to_server_content_update_package( self ):
+        
+        hash_ids_to_hashes = { i : HydrusData.GenerateKey() for i in range( 1, 11 ) }
+        
+        content_data = HydrusData.GetEmptyDataDict()
+        
+        content_data[ HC.CONTENT_TYPE_FILES ][ HC.CONTENT_UPDATE_PETITION ] = [ ( [ 1, 2 ], u'dupe' ) ]
+        content_data[ HC.CONTENT_TYPE_FILES ][ HC.CONTENT_UPDATE_DENY_PETITION ] = [ [ 3 ] ]
+        content_data[ HC.CONTENT_TYPE_MAPPINGS ][ HC.CONTENT_UPDATE_PEND ] = [ ( u'series:blah', [ 1, 2, 3 ] ), ( u'\u30c6\u30b9\u30c8', [ 4 ] ) ]
+        content_data[ HC.CONTENT_TYPE_MAPPINGS ][ HC.CONTENT_UPDATE_PETITION ] = [ ( u'bad tag', [ 5, 6 ], u'\u30c6\u30b9\u30c8' ) ]
+        content_data[ HC.CONTENT_TYPE_TAG_SIBLINGS ][ HC.CONTENT_UPDATE_PEND ] = [ ( ( u'a', u'b' ), u'typo' ) ]
+        content_data[ HC.CONTENT_TYPE_TAG_PARENTS ][ HC.CONTENT_UPDATE_DENY_PEND ] = [ ( u'c', u'd' ) ]
+        
+        update = HydrusData.ClientToServerContentUpdatePackage( content_data, hash_ids_to_hashes )
+        
+        data_types_and_actions = [ ( data_type, action ) for data_type in content_data for action in content_data[ data_type ] ]
+        
+        network_string = update.DumpToBinaryNetworkString()
+        
+        loaded_update = HydrusData.CreateClientToServerContentUpdatePackageFromNetworkString( network_string )
+        
+        self.assertEqual( set( loaded_update.GetHashes() ), set( update.GetHashes() ) )
+        self.assertEqual( loaded_update.GetTags(), update.GetTags() )
+        
+        for ( data_type, action ) in data_types_and_actions:
+            
+            self.assertEqual( list( loaded_update.GetContentDataIterator( data_type, action ) ), list( update.GetContentDataIterator( data_type, action ) ) )
+            
+        
+        # the json and old yaml formats still load
+        
+        loaded_update = HydrusData.CreateClientToServerContentUpdatePackageFromNetworkString( update.DumpToNetworkString() )
+        
+        self.assertEqual( set( loaded_update.GetHashes() ), set( update.GetHashes() ) )
+        self.assertEqual( loaded_update.GetTags(), update.GetTags() )
+        
+        loaded_update = yaml.safe_load( yaml.safe_dump( { 'update' : update } ) )[ 'update' ]
+        
+        self.assertEqual( set( loaded_update.GetHashes() ), set( update.GetHashes() ) )
+        
+        for ( data_type, action ) in data_types_and_actions:
+            
+            self.assertEqual( list( loaded_update.GetContentDataIterator( data_type, action ) ), list( update.GetContentDataIterator( data_type, action ) ) )
+            
+        
+    
+    def test_hamming_distance( self ):
+        
+        phashes = [ os.urandom( 8 ) for i in range( 100 ) ]
+        
+        phashes.append( '\x00' * 8 )
+        phashes.append( '\xff' * 8 )
+        
+        search_phash = '\x00' * 8
+        
+        distances = [ HydrusData.GetHammingDistance( search_phash, phash ) for phash in phashes ]
+        
+        self.assertEqual( distances[ -2 : ], [ 0, 64 ] )
+        
+        self.assertEqual( distances, [ sum( bin( ord( c ) ).count( '1' ) for c in phash ) for phash in phashes ] )
+        
+        packed_phashes = HydrusData.ConvertPHashesToNumPyArray( phashes )
+        
+        self.assertEqual( list( HydrusData.GetHammingDistances( search_phash, packed_phashes ) ), distances )
+        
+        search_phash = phashes[ 0 ]
+        
+        self.assertEqual( list( HydrusData.GetHammingDistances( search_phash, packed_phashes ) ), [ HydrusData.GetHammingDistance( search_phash, phash ) for phash in phashes ] )
+        
+    
+    def test_hashes_and_mime( self ):
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        ( hash, md5, sha1, sha512, mime ) = HydrusFileHandling.GetHashesAndMimeFromPath( path )
+        
+        self.assertEqual( hash, HydrusFileHandling.GetHashFromPath( path ) )
+        self.assertEqual( ( md5, sha1, sha512 ), HydrusFileHandling.GetExtraHashesFromPath( path ) )
+        self.assertEqual( mime, HC.IMAGE_PNG )
+        
+    
     def test_number_conversion( self ):
         
         i = 123456789
@@ -410,6 +410,16 @@ class TestServer( unittest.TestCase ):
         try: os.remove( path )
         except: pass
         
+        with open( path, 'wb' ) as f: f.write( update.DumpToBinaryNetworkString() )
+        
+        response = service.Request( HC.GET, 'content_update_package', { 'begin' : begin, 'subindex' : subindex } )
+        
+        self.assertEqual( response.GetNumContentUpdates(), update.GetNumContentUpdates() )
+        self.assertEqual( response.GetHashes(), update.GetHashes() )
+        
+        try: os.remove( path )
+        except: pass
+        
         update = HydrusData.ClientToServerContentUpdatePackage( {}, hash_ids_to_hashes )
         
         service.Request( HC.POST, 'content_update_package', { 'update' : update } )
@@ -579,6 +589,73 @@ class TestServer( unittest.TestCase ):
         pass
         
     
+    def test_server_busy( self ):
+        
+        host = '127.0.0.1'
+        port = HC.DEFAULT_LOCAL_BOORU_PORT
+        
+        share_key = HydrusData.GenerateKey()
+        
+        def get_status( method ):
+            
+            connection = httplib.HTTPConnection( host, port, timeout = 10 )
+            
+            connection.request( method, '/gallery?share_key=' + share_key.encode( 'hex' ) )
+            
+            response = connection.getresponse()
+            
+            response.read()
+            
+            return response.status
+            
+        
+        def get_num_refused( reason ):
+            
+            stats = HydrusServerResources.SERVER_BUSY_STATS.GetStats()
+            
+            if reason in stats: return stats[ reason ][ 'num_requests_refused' ]
+            else: return 0
+            
+        
+        num_busy_refused = get_num_refused( 'server busy' )
+        num_generating_refused = get_num_refused( 'generating updates' )
+        
+        not_busy_get_status = get_status( 'GET' )
+        not_busy_post_status = get_status( 'POST' )
+        
+        self.assertNotEqual( not_busy_get_status, 503 )
+        self.assertNotEqual( not_busy_post_status, 503 )
+        
+        # reads carry on while updates are generated, but writes have to wait
+        
+        HydrusGlobals.server_generating_updates = True
+        
+        try:
+            
+            self.assertEqual( get_status( 'GET' ), not_busy_get_status )
+            self.assertEqual( get_status( 'POST' ), 503 )
+            
+        finally:
+            
+            HydrusGlobals.server_generating_updates = False
+            
+        
+        HydrusGlobals.server_busy = True
+        
+        try:
+            
+            self.assertEqual( get_status( 'GET' ), 503 )
+            self.assertEqual( get_status( 'POST' ), 503 )
+            
+        finally:
+            
+            HydrusGlobals.server_busy = False
+            
+        
+        self.assertEqual( get_num_refused( 'server busy' ), num_busy_refused + 2 )
+        self.assertEqual( get_num_refused( 'generating updates' ), num_generating_refused + 1 )
+        
+    
     def test_local_service( self ):
         
         host = '127.0.0.1'
@@ -643,6 +720,113 @@ class TestServer( unittest.TestCase ):
         self._test_basics( host, port )
         self._test_local_booru( host, port )
         
+    
+    def test_ranges( self ):
+        
+        host = '127.0.0.1'
+        port = HC.DEFAULT_LOCAL_FILE_PORT
+        
+        hash = HydrusData.GenerateKey()
+        
+        hash_encoded = hash.encode( 'hex' )
+        
+        path = os.path.join( HC.DB_DIR, 'client_files', 'f' + hash_encoded[:2], hash_encoded + '.png' )
+        
+        shutil.copy( os.path.join( HC.STATIC_DIR, 'hydrus.png' ), path )
+        
+        with open( path, 'rb' ) as f: file_data = f.read()
+        
+        size = len( file_data )
+        
+        def get_response( headers ):
+            
+            connection = httplib.HTTPConnection( host, port, timeout = 10 )
+            
+            connection.request( 'GET', '/file?hash=' + hash_encoded, headers = headers )
+            
+            response = connection.getresponse()
+            
+            data = response.read()
+            
+            return ( response, data )
+            
+        
+        try:
+            
+            ( response, data ) = get_response( {} )
+            
+            self.assertEqual( response.status, 200 )
+            self.assertEqual( data, file_data )
+            self.assertEqual( response.getheader( 'Accept-Ranges' ), 'bytes' )
+            self.assertEqual( response.getheader( 'ETag' ), '"' + hash_encoded + '"' )
+            
+            last_modified = response.getheader( 'Last-Modified' )
+            
+            #
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=100-199' } )
+            
+            self.assertEqual( response.status, 206 )
+            self.assertEqual( response.getheader( 'Content-Range' ), 'bytes 100-199/' + str( size ) )
+            self.assertEqual( data, file_data[ 100 : 200 ] )
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=1000-' } )
+            
+            self.assertEqual( response.status, 206 )
+            self.assertEqual( data, file_data[ 1000 : ] )
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=-50' } )
+            
+            self.assertEqual( response.status, 206 )
+            self.assertEqual( response.getheader( 'Content-Range' ), 'bytes ' + str( size - 50 ) + '-' + str( size - 1 ) + '/' + str( size ) )
+            self.assertEqual( data, file_data[ -50 : ] )
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=' + str( size ) + '-' } )
+            
+            self.assertEqual( response.status, 416 )
+            self.assertEqual( response.getheader( 'Content-Range' ), 'bytes */' + str( size ) )
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=0-9,20-29' } )
+            
+            self.assertEqual( response.status, 200 )
+            self.assertEqual( data, file_data )
+            
+            #
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=100-', 'If-Range' : '"' + hash_encoded + '"' } )
+            
+            self.assertEqual( response.status, 206 )
+            self.assertEqual( data, file_data[ 100 : ] )
+            
+            ( response, data ) = get_response( { 'Range' : 'bytes=100-', 'If-Range' : '"' + HydrusData.GenerateKey().encode( 'hex' ) + '"' } )
+            
+            self.assertEqual( response.status, 200 )
+            self.assertEqual( data, file_data )
+            
+            #
+            
+            ( response, data ) = get_response( { 'If-None-Match' : '"' + hash_encoded + '"' } )
+            
+            self.assertEqual( response.status, 304 )
+            self.assertEqual( data, '' )
+            
+            ( response, data ) = get_response( { 'If-None-Match' : '"' + HydrusData.GenerateKey().encode( 'hex' ) + '"' } )
+            
+            self.assertEqual( response.status, 200 )
+            
+            ( response, data ) = get_response( { 'If-Modified-Since' : last_modified } )
+            
+            self.assertEqual( response.status, 304 )
+            
+            ( response, data ) = get_response( { 'If-Modified-Since' : 'Thu, 01 Jan 1970 00:00:00 GMT' } )
+            
+            self.assertEqual( response.status, 200 )
+            
+        finally:
+            
+            os.remove( path )
+            
+        
     '''
 class TestAMP( unittest.TestCase ):
     
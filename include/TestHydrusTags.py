@@ -738,6 +738,39 @@ class TestTagSiblings( unittest.TestCase ):
         self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'character:ayan' ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
         self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'character:rei' ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
         
+        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'ayanami rei', exact_match = True ) ), set() )
+        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'character:ayanami rei', exact_match = True ) ), set( [ 'character:rei ayanami', 'character:ayanami rei' ] ) )
+        
+        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'i*do' ) ), set( [ 'ishygddt', 'i sure hope you guys don\'t do that' ] ) )
+        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( '*ygd*' ) ), set( [ 'ishygddt', 'i sure hope you guys don\'t do that' ] ) )
+        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'series:ayan' ) ), set() )
+        self.assertEqual( set( self._tag_siblings_manager.GetAutocompleteSiblings( 'yan' ) ), set() )
+        
+    
+    def test_autocomplete_refresh( self ):
+        
+        tag_siblings = collections.defaultdict( HydrusData.default_dict_set )
+        
+        first_dict = HydrusData.default_dict_set()
+        
+        first_dict[ HC.CURRENT ] = { ( 'old_a', 'old_b' ), ( 'kept_a', 'kept_b' ) }
+        
+        tag_siblings[ self._first_key ] = first_dict
+        
+        HydrusGlobals.test_controller.SetRead( 'tag_siblings', tag_siblings )
+        
+        tag_siblings_manager = ClientCaches.TagSiblingsManager( HydrusGlobals.client_controller )
+        
+        self.assertEqual( set( tag_siblings_manager.GetAutocompleteSiblings( 'old' ) ), set( [ 'old_a', 'old_b' ] ) )
+        
+        first_dict[ HC.CURRENT ] = { ( 'new_a', 'new_b' ), ( 'kept_a', 'kept_b' ) }
+        
+        tag_siblings_manager.RefreshSiblings()
+        
+        self.assertEqual( set( tag_siblings_manager.GetAutocompleteSiblings( 'old' ) ), set() )
+        self.assertEqual( set( tag_siblings_manager.GetAutocompleteSiblings( 'new' ) ), set( [ 'new_a', 'new_b' ] ) )
+        self.assertEqual( set( tag_siblings_manager.GetAutocompleteSiblings( 'kept' ) ), set( [ 'kept_a', 'kept_b' ] ) )
+        
     
     def test_collapse_namespace( self ):
         
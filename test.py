@@ -17,6 +17,7 @@ from include import HydrusThreading
 from include import TestClientConstants
 from include import TestClientDaemons
 from include import TestClientDownloading
+from include import TestClientNetworking
 from include import TestConstants
 from include import TestDialogs
 from include import TestDB
@@ -243,6 +244,7 @@ class Controller( object ):
         if run_all or only_run == 'downloading': suites.append( unittest.TestLoader().loadTestsFromModule( TestClientDownloading ) )
         if run_all or only_run == 'functions': suites.append( unittest.TestLoader().loadTestsFromModule( TestFunctions ) )
         if run_all or only_run == 'image': suites.append( unittest.TestLoader().loadTestsFromModule( TestClientImageHandling ) )
+        if run_all or only_run == 'networking': suites.append( unittest.TestLoader().loadTestsFromModule( TestClientNetworking ) )
         if run_all or only_run == 'nat': suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusNATPunch ) )
         if run_all or only_run == 'server': suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusServer ) )
         if run_all or only_run == 'sessions': suites.append( unittest.TestLoader().loadTestsFromModule( TestHydrusSessions ) )
@@ -282,7 +284,9 @@ class Controller( object ):
         
         if name == 'import_file':
             
-            ( path, ) = args
+            ( file_import_job, ) = args
+            
+            path = file_import_job.GetTempPath()
             
             with open( path, 'rb' ) as f: file = f.read()
             
@@ -290,6 +294,13 @@ class Controller( object ):
             else: return ( CC.STATUS_SUCCESSFUL, '0123456789abcdef'.decode( 'hex' ) )
             
         
+        elif name == 'import_files':
+            
+            ( file_import_jobs, ) = args
+            
+            return [ ( CC.STATUS_SUCCESSFUL, file_import_job.GetHash() ) for file_import_job in file_import_jobs ]
+            
+        
     
 if __name__ == '__main__':
     